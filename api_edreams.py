@@ -0,0 +1,427 @@
+import hashlib
+import json
+import os
+import threading
+from time import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metricas import METRICAS
+from registros import Itinerario, equipaje_de_mano
+
+# Fragmento de la url que identifica la peticion de busqueda que lanza la pagina de resultados
+FILTRO_PETICION_BUSQUEDA = os.getenv("EDREAMS_FILTRO_BUSQUEDA", "graphql")
+
+# Fichero donde se guarda la ultima peticion de busqueda capturada, para reutilizarla entre ejecuciones
+FICHERO_PLANTILLA = "plantilla_busqueda.json"
+
+# Segundos que se reutiliza una plantilla guardada antes de volver a capturarla (la web cambia su peticion de vez en cuando)
+TTL_PLANTILLA = 24 * 3600
+
+# Codigos HTTP con los que la web rechaza la plantilla: se descarta para capturarla de nuevo
+CODIGOS_PLANTILLA_INVALIDA = {400, 401, 403, 404, 410, 422}
+
+# Campos de la ruta que se sustituyen en la peticion capturada, en el orden en el que aparecen en la busqueda
+CAMPOS_RUTA = ("origen", "destino", "inicio", "fin")
+
+# Cabeceras que no tiene sentido reenviar (las gestiona requests o dependen de la conexion)
+CABECERAS_IGNORADAS = {"content-length", "host", "connection", "accept-encoding"}
+
+
+# Funcion para extraer de los logs de rendimiento de Chrome la peticion de busqueda de un destino
+# El navegador tiene que haberse lanzado con la capability goog:loggingPrefs = {"performance": "ALL"}
+def capturar_peticion(browser, destino, filtro=FILTRO_PETICION_BUSQUEDA):
+    for entrada in browser.get_log("performance"):
+        mensaje = json.loads(entrada["message"])["message"]
+        if mensaje.get("method") != "Network.requestWillBeSent":
+            continue
+        peticion = mensaje["params"]["request"]
+        cuerpo = peticion.get("postData") or ""
+        if filtro in peticion["url"] and destino in cuerpo:
+            cabeceras = {
+                clave: valor
+                for clave, valor in peticion.get("headers", {}).items()
+                if clave.lower() not in CABECERAS_IGNORADAS
+            }
+            return {
+                "url": peticion["url"],
+                "metodo": peticion["method"],
+                "cabeceras": cabeceras,
+                "cuerpo": cuerpo,
+            }
+    return None
+
+
+class RespuestaInesperada(ValueError):
+    """
+    La respuesta de la busqueda no tiene el formato esperado (la web ha cambiado su api): el scraper vuelve al
+    navegador en lugar de dar la ruta por vacia.
+    """
+
+
+# Recorre las hojas de texto de un JSON en orden, con la ruta (claves e indices) de cada una
+def _hojas(valor, ruta=()):
+    if isinstance(valor, dict):
+        for clave, hijo in valor.items():
+            yield from _hojas(hijo, ruta + (clave,))
+    elif isinstance(valor, list):
+        for indice, hijo in enumerate(valor):
+            yield from _hojas(hijo, ruta + (indice,))
+    elif isinstance(valor, str):
+        yield ruta, valor
+
+
+def _asignar_campos(posiciones, valores):
+    """
+    Asigna a cada posicion (en orden de aparicion) el campo de la ruta cuyo valor tiene.
+    Si varios campos tienen el mismo valor (p.e. inicio == fin) se reparten por orden de aparicion: la primera
+    posicion es del primer campo, la segunda del segundo, y asi sucesivamente.
+    """
+    por_valor = {}
+    for campo in CAMPOS_RUTA:
+        por_valor.setdefault(valores[campo], []).append(campo)
+    vistas = {}
+    asignados = []
+    for posicion, valor in posiciones:
+        campos = por_valor.get(valor)
+        if not campos:
+            continue
+        orden = vistas.get(valor, 0)
+        vistas[valor] = orden + 1
+        asignados.append((posicion, campos[orden % len(campos)]))
+    return asignados
+
+
+def localizar_campos(plantilla, valores):
+    """
+    Localiza en una peticion capturada donde van el origen, el destino y las fechas de la ruta, por la ruta del campo
+    y no como texto: solo cuentan los valores completos de las hojas del cuerpo JSON, de los parametros de la query
+    y de los segmentos del path de la url.
+    :param plantilla: Peticion capturada con capturar_peticion().
+    :param valores: Valores de la ruta con la que se capturo (origen, destino, inicio, fin).
+    :return: Diccionario {"cuerpo": [(ruta, campo)], "query": [(indice, campo)], "path": [(indice, campo)]}.
+    """
+    partes = urlsplit(plantilla["url"])
+    campos = {
+        "query": _asignar_campos(
+            (
+                (indice, valor)
+                for indice, (_, valor) in enumerate(
+                    parse_qsl(partes.query, keep_blank_values=True)
+                )
+            ),
+            valores,
+        ),
+        "path": _asignar_campos(enumerate(partes.path.split("/")), valores),
+        "cuerpo": [],
+    }
+    try:
+        cuerpo = json.loads(plantilla["cuerpo"])
+    except (TypeError, ValueError):
+        cuerpo = None
+    if isinstance(cuerpo, (dict, list)):
+        campos["cuerpo"] = _asignar_campos(_hojas(cuerpo), valores)
+    return campos
+
+
+def _sustituir_en(contenedor, ruta, valor):
+    for clave in ruta[:-1]:
+        contenedor = contenedor[clave]
+    contenedor[ruta[-1]] = valor
+
+
+def preparar_peticion(plantilla, campos, valores_nuevos):
+    """
+    Peticion de una ruta nueva a partir de la plantilla: cambia cada campo localizado con localizar_campos() por el
+    valor de la nueva ruta. El resto de la peticion se queda igual.
+    """
+    partes = urlsplit(plantilla["url"])
+    query = parse_qsl(partes.query, keep_blank_values=True)
+    for indice, campo in campos["query"]:
+        query[indice] = (query[indice][0], valores_nuevos[campo])
+    segmentos = partes.path.split("/")
+    for indice, campo in campos["path"]:
+        segmentos[indice] = valores_nuevos[campo]
+    url = urlunsplit(
+        partes._replace(
+            path="/".join(segmentos),
+            query=urlencode(query) if campos["query"] else partes.query,
+        )
+    )
+
+    cuerpo = plantilla["cuerpo"]
+    if campos["cuerpo"]:
+        datos = json.loads(cuerpo)
+        for ruta, campo in campos["cuerpo"]:
+            _sustituir_en(datos, ruta, valores_nuevos[campo])
+        cuerpo = json.dumps(datos, ensure_ascii=False, separators=(",", ":"))
+
+    return {**plantilla, "url": url, "cuerpo": cuerpo}
+
+
+# Clave con la que se identifica una peticion grabada (la usa tambien el servidor simulado)
+def clave_peticion(metodo, ruta, cuerpo):
+    try:
+        cuerpo = json.dumps(json.loads(cuerpo), sort_keys=True)
+    except (TypeError, ValueError):
+        cuerpo = cuerpo or ""
+    return hashlib.sha1(f"{metodo.upper()} {ruta} {cuerpo}".encode("utf-8")).hexdigest()
+
+
+# Ruta (path + query) de una url, sin esquema ni host
+def ruta_url(url):
+    resto = url.split("://", 1)[-1]
+    return resto[resto.find("/") :] if "/" in resto else "/"
+
+
+# Funcion para formatear una duracion en minutos igual que la muestra la web (p.e. "1 h 35 min")
+def formatear_duracion(minutos):
+    horas, minutos = divmod(int(minutos), 60)
+    if horas and minutos:
+        return f"{horas} h {minutos} min"
+    if horas:
+        return f"{horas} h"
+    return f"{minutos} min"
+
+
+# Funcion para formatear el numero de escalas igual que la web ("directo", "1 escala", "2 escalas")
+def formatear_escalas(escalas):
+    escalas = int(escalas)
+    if escalas == 0:
+        return "directo"
+    return f"{escalas} escala" if escalas == 1 else f"{escalas} escalas"
+
+
+def itinerarios_desde_json(payload):
+    """
+    Convierte la respuesta JSON de la busqueda en los mismos itinerarios que devuelve datos_destino().
+    Formato esperado de cada itinerario en payload["itineraries"]:
+        {"legs": [{"departure": {"airport", "time"}, "arrival": {"airport", "time"},
+                   "duration": minutos, "stops": n, "carriers": [...]}, ...],
+         "price": {"amount", "currency"}, "baggage": [...]}
+    :param payload: Diccionario con la respuesta de la busqueda.
+    :return: Lista de Itinerario.
+    :raises RespuestaInesperada: Si la respuesta no tiene la lista de itinerarios, o no se puede mapear ninguno.
+    """
+    if not isinstance(payload, dict) or not isinstance(
+        payload.get("itineraries"), list
+    ):
+        claves = list(payload)[:10] if isinstance(payload, dict) else type(payload)
+        raise RespuestaInesperada(f"la respuesta no tiene 'itineraries': {claves}")
+
+    lista_datos_destino = []
+    for itinerario in payload["itineraries"]:
+        try:
+            ida, vuelta = itinerario["legs"][0], itinerario["legs"][1]
+            aeropuertos_data = [
+                ida["departure"]["airport"],
+                ida["arrival"]["airport"],
+                vuelta["departure"]["airport"],
+                vuelta["arrival"]["airport"],
+            ]
+            aerolineas = list(
+                {c for leg in (ida, vuelta) for c in leg.get("carriers", [])}
+            )
+            datos_horas = [
+                ida["departure"]["time"],
+                ida["arrival"]["time"],
+                vuelta["departure"]["time"],
+                vuelta["arrival"]["time"],
+            ]
+            duraciones = [formatear_duracion(leg["duration"]) for leg in (ida, vuelta)]
+            escalas = [formatear_escalas(leg.get("stops", 0)) for leg in (ida, vuelta)]
+            equipajes = list(itinerario.get("baggage", []))
+            unit_price = str(int(itinerario["price"]["amount"]))
+        except (KeyError, IndexError, TypeError, ValueError) as exception:
+            print(f"Ignorando vuelo por problemas al mapear la respuesta...{exception}")
+            METRICAS.contar("itinerarios_ignorados", backend="api")
+            continue
+
+        lista_datos_destino.append(
+            Itinerario(
+                aeropuertos_data,
+                aerolineas,
+                datos_horas,
+                duraciones,
+                escalas,
+                equipaje_de_mano(equipajes),
+                unit_price,
+            )
+        )
+    if payload["itineraries"] and not lista_datos_destino:
+        raise RespuestaInesperada(
+            f"no se ha podido mapear ninguno de los {len(payload['itineraries'])} itinerarios"
+        )
+    METRICAS.contar("itinerarios_parseados", len(lista_datos_destino), backend="api")
+    return lista_datos_destino
+
+
+class ClienteResultados:
+    """
+    Backend de busqueda sin navegador: reenvia la peticion de busqueda capturada sobre un requests.Session compartido.
+    :param plantilla: Peticion capturada con capturar_peticion() (url, metodo, cabeceras, cuerpo).
+        Si es None, hay que capturarla antes de buscar con capturar().
+    :param valores: Valores de la ruta con la que se capturo la plantilla (origen, destino, inicio, fin).
+    :param base_url: Si se indica, sustituye el esquema y host de la plantilla (p.e. un servidor local de pruebas).
+    :param conexiones: Tamaño del pool de conexiones HTTP.
+    :param timeout: Timeout de cada peticion, en segundos.
+    :param grabar_en: Si se indica, guarda en ese directorio cada peticion con su respuesta (para el servidor simulado).
+    :param fichero: Fichero donde se guarda la plantilla, y que se borra si la web la rechaza.
+    """
+
+    def __init__(
+        self,
+        plantilla=None,
+        valores=None,
+        base_url=None,
+        conexiones=10,
+        timeout=15,
+        grabar_en=None,
+        fichero=FICHERO_PLANTILLA,
+    ):
+        self.plantilla = plantilla
+        self.valores = valores
+        self.fichero = fichero
+        self._campos = (
+            localizar_campos(plantilla, valores) if plantilla is not None else None
+        )
+        self.base_url = base_url
+        self.timeout = timeout
+        self.grabar_en = grabar_en
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=conexiones, pool_maxsize=conexiones)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self.stats = {"peticiones": 0, "errores": 0, "plantillas_descartadas": 0}
+
+    @property
+    def preparado(self):
+        return self.plantilla is not None
+
+    # Captura la plantilla desde un navegador que acaba de cargar la pagina de resultados de la ruta indicada
+    # Solo se acepta si en la peticion aparecen todos los campos de la ruta, para poder cambiarlos en las demas rutas
+    def capturar(self, browser, origen, destino, inicio, fin):
+        plantilla = capturar_peticion(browser, destino=destino)
+        if plantilla is None:
+            return False
+        valores = {"origen": origen, "destino": destino, "inicio": inicio, "fin": fin}
+        campos = localizar_campos(plantilla, valores)
+        localizados = {campo for lista in campos.values() for _, campo in lista}
+        if localizados != set(CAMPOS_RUTA):
+            print(
+                f"La peticion capturada no tiene los campos {sorted(set(CAMPOS_RUTA) - localizados)}"
+            )
+            return False
+        with self._lock:
+            self.plantilla, self.valores, self._campos = plantilla, valores, campos
+        return True
+
+    # Guarda la plantilla (y los valores con los que se capturo) para reutilizarla en otra ejecucion
+    def guardar(self):
+        with open(self.fichero, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "plantilla": self.plantilla,
+                    "valores": self.valores,
+                    "capturada": time(),
+                },
+                f,
+            )
+
+    # Descarta la plantilla (la web la ha rechazado o ha cambiado su respuesta): el resto de rutas van por navegador
+    # y la siguiente ejecucion la vuelve a capturar
+    def invalidar(self, motivo):
+        with self._lock:
+            if self.plantilla is None:
+                return
+            self.plantilla = self.valores = self._campos = None
+            self.stats["plantillas_descartadas"] += 1
+        print(f"Se descarta la plantilla de busqueda... {motivo}")
+        try:
+            os.remove(self.fichero)
+        except FileNotFoundError:
+            pass
+
+    # Crea el cliente a partir de una plantilla guardada. Si no existe o ha caducado, el cliente queda pendiente de capturar
+    @classmethod
+    def cargar(cls, fichero=FICHERO_PLANTILLA, ttl=TTL_PLANTILLA, **kwargs):
+        if not os.path.exists(fichero):
+            return cls(fichero=fichero, **kwargs)
+        with open(fichero, encoding="utf-8") as f:
+            datos = json.load(f)
+        # Las plantillas sin fecha (guardadas por versiones anteriores) se dan por caducadas
+        if ttl and time() - datos.get("capturada", 0) > ttl:
+            print(
+                f"La plantilla de busqueda de {fichero} ha caducado, se vuelve a capturar"
+            )
+            return cls(fichero=fichero, **kwargs)
+        return cls(
+            plantilla=datos["plantilla"],
+            valores=datos["valores"],
+            fichero=fichero,
+            **kwargs,
+        )
+
+    def _url(self, url):
+        if not self.base_url:
+            return url
+        # Sustituimos esquema y host, manteniendo la ruta y la query
+        return self.base_url.rstrip("/") + ruta_url(url)
+
+    def _grabar(self, peticion, payload):
+        os.makedirs(self.grabar_en, exist_ok=True)
+        clave = clave_peticion(
+            peticion["metodo"], ruta_url(peticion["url"]), peticion["cuerpo"]
+        )
+        fichero = os.path.join(self.grabar_en, f"{clave}.json")
+        with open(fichero, "w", encoding="utf-8") as f:
+            json.dump({"peticion": peticion, "respuesta": payload}, f)
+
+    # Lanza la busqueda de una ruta y devuelve el JSON de la respuesta
+    def buscar(self, origen, destino, inicio, fin):
+        with self._lock:
+            plantilla, campos = self.plantilla, self._campos
+        if plantilla is None:
+            raise RespuestaInesperada("no hay plantilla de busqueda")
+        nuevos = {"origen": origen, "destino": destino, "inicio": inicio, "fin": fin}
+        peticion = preparar_peticion(plantilla, campos, nuevos)
+
+        with self._lock:
+            self.stats["peticiones"] += 1
+        try:
+            response = self.session.request(
+                method=peticion["metodo"],
+                url=self._url(peticion["url"]),
+                headers=peticion["cabeceras"],
+                data=peticion["cuerpo"].encode("utf-8") or None,
+                timeout=self.timeout,
+            )
+            if response.status_code in CODIGOS_PLANTILLA_INVALIDA:
+                self.invalidar(f"la web responde {response.status_code}")
+            response.raise_for_status()
+            payload = response.json()
+        except Exception:
+            with self._lock:
+                self.stats["errores"] += 1
+            raise
+
+        if self.grabar_en:
+            self._grabar(peticion, payload)
+        return payload
+
+    # Equivalente a datos_destino() pero sin navegador
+    def datos_destino(self, origen, destino, inicio, fin):
+        payload = self.buscar(origen, destino, inicio, fin)
+        try:
+            return itinerarios_desde_json(payload)
+        except RespuestaInesperada as exception:
+            self.invalidar(exception)
+            raise
+
+    def cerrar(self):
+        self.session.close()
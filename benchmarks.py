@@ -0,0 +1,1195 @@
+import argparse
+import glob
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter, sleep
+
+import numpy as np
+import pandas as pd
+import requests
+from bs4 import BeautifulSoup
+
+from normalizacion import COLUMNAS_DF, formatear_duracion, normalizar_df
+from parser_itinerarios import BACKENDS, lxml, parsear_itinerarios
+from registros import Itinerario, Ruta, df_rutas
+from servidor_simulado import (
+    AEROLINEAS,
+    AEROPUERTOS,
+    arrancar_airtable,
+    arrancar_edreams,
+    html_resultados,
+)
+from subida_airtable import SubidorAirtable, registros_airtable
+
+
+# Implementacion original de datos_destino() (varias pasadas con BeautifulSoup), como referencia de paridad y rendimiento
+def parsear_original(html):
+    lista_datos_destino = []
+    soup = BeautifulSoup(html, "html.parser")
+    results_container = soup.find(id="results_list_container")
+    for element in results_container.find_all(attrs={"data-testid": "itinerary"}):
+        duraciones, escalas, datos_horas, equipajes = [], [], [], []
+        try:
+            aeropuertos = element.find_all("div", {"type": "small"})
+            aeropuertos_data = [aeropuertos[i].text.strip() for i in (0, 2, 4, 6)]
+            aerolineas = list(
+                dict.fromkeys(
+                    a.attrs["alt"] for a in element.find_all("img") if "alt" in a.attrs
+                )
+            )
+            prices = [p.text for p in element.find_all("span", class_="money-integer")]
+            unit_price = element.select("a > span > span.money-integer")[0].text
+            for div_item in element.find_all("div"):
+                if len(div_item.attrs) == 1 and "class" in div_item.attrs:
+                    for attr_class in div_item.attrs["class"]:
+                        if attr_class.endswith("BaseText-Body") and re.match(
+                            r"^\d{2}:\d{2}$", div_item.text.strip()
+                        ):
+                            datos_horas.append(div_item.text)
+                elif len(div_item.attrs) > 1 and "orientation" in div_item.attrs:
+                    next_sibling = div_item.find_next_sibling()
+                    if next_sibling:
+                        span_items = next_sibling.find_all("span")
+                        duraciones.append(span_items[0].text)
+                        escalas.append(
+                            span_items[1].text if len(span_items) > 1 else "0"
+                        )
+            for path_item in element.find_all("path"):
+                if len(path_item.attrs) > 1 and "clip-rule" in path_item.attrs:
+                    tri_parent = path_item.parent.parent.parent
+                    if tri_parent:
+                        equipaje_div = tri_parent.find_next_sibling()
+                        if equipaje_div:
+                            equipajes.append(equipaje_div.text)
+        except Exception:
+            continue
+        lista_datos_destino.append(
+            [
+                aeropuertos_data,
+                aerolineas,
+                datos_horas,
+                duraciones,
+                escalas,
+                equipajes,
+                unit_price,
+                prices,
+            ]
+        )
+    return lista_datos_destino
+
+
+# Funcion para cargar las paginas guardadas de un directorio, o generar paginas sinteticas si no se indica
+def cargar_paginas(directorio=None, numero=200, paginas=5):
+    if directorio:
+        ficheros = sorted(glob.glob(os.path.join(directorio, "*.html")))
+        if not ficheros:
+            raise SystemExit(f"No hay ficheros .html en {directorio}")
+        contenido = []
+        for fichero in ficheros:
+            with open(fichero, encoding="utf-8") as f:
+                contenido.append(f.read())
+        return contenido
+    return [html_resultados(numero, semilla=i) for i in range(paginas)]
+
+
+# Benchmark del parser: comprueba la paridad de los backends con la implementacion original y mide itinerarios/segundo
+def benchmark_parser(paginas, repeticiones=3):
+    implementaciones = {"original": parsear_original}
+    for backend in BACKENDS:
+        if backend == "lxml" and lxml is None:
+            print("lxml no esta instalado, se omite su backend")
+            continue
+        implementaciones[backend] = lambda html, b=backend: parsear_itinerarios(
+            html, backend=b
+        )
+
+    # Paridad: todos los backends tienen que devolver exactamente los mismos itinerarios que la implementacion original
+    for i, html in enumerate(paginas):
+        referencia = [Itinerario.desde_lista(it) for it in parsear_original(html)]
+        for nombre, funcion in implementaciones.items():
+            resultado = funcion(html)
+            if nombre == "original":
+                resultado = [Itinerario.desde_lista(it) for it in resultado]
+            if resultado != referencia:
+                raise SystemExit(
+                    f"El backend {nombre} no coincide con el original en la pagina {i}"
+                )
+    print(f"Paridad OK en {len(paginas)} paginas")
+
+    resultados = {}
+    for nombre, funcion in implementaciones.items():
+        mejor = None
+        for _ in range(repeticiones):
+            inicio = perf_counter()
+            itinerarios = sum(len(funcion(html)) for html in paginas)
+            duracion = perf_counter() - inicio
+            mejor = duracion if mejor is None else min(mejor, duracion)
+        resultados[nombre] = itinerarios / mejor if mejor else 0.0
+        print(f"  {nombre:<10} {resultados[nombre]:>10.0f} itinerarios/s")
+    return resultados
+
+
+# Benchmark de los modos de captura: recorta el html como lo haria el navegador y mide bytes y tiempo de parseo
+def benchmark_captura(paginas, parser=None):
+    if lxml is None:
+        raise SystemExit("El benchmark de captura necesita tener instalado lxml")
+
+    recortes = {"pagina": [], "contenedor": [], "itinerarios": []}
+    for html in paginas:
+        doc = lxml.html.fromstring(html)
+        contenedor = doc.get_element_by_id("results_list_container")
+        itinerarios = contenedor.xpath('.//*[@data-testid="itinerary"]')
+        recortes["pagina"].append(html)
+        recortes["contenedor"].append(
+            lxml.html.tostring(contenedor, encoding="unicode")
+        )
+        recortes["itinerarios"].append(
+            "".join(lxml.html.tostring(i, encoding="unicode") for i in itinerarios)
+        )
+
+    resultados = {}
+    for modo, htmls in recortes.items():
+        num_bytes = sum(len(h.encode("utf-8")) for h in htmls)
+        inicio = perf_counter()
+        for h in htmls:
+            parsear_itinerarios(h, backend=parser)
+        duracion = perf_counter() - inicio
+        resultados[modo] = {
+            "kb_por_ruta": num_bytes / len(htmls) / 1024,
+            "parseo_por_ruta": duracion / len(htmls),
+        }
+        print(
+            f"  {modo:<12} {resultados[modo]['kb_por_ruta']:>8.1f} KB/ruta "
+            f"{resultados[modo]['parseo_por_ruta'] * 1000:>8.1f} ms/ruta"
+        )
+    return resultados
+
+
+# Funcion para generar un df sintetico con las columnas (y formatos de texto) que salen del scrapeo
+def df_sintetico(numero, semilla=0):
+    rnd = np.random.default_rng(semilla)
+    horas = np.array([f"{h:02d}:{m:02d}" for h in range(24) for m in range(0, 60, 5)])
+    escalas = np.array(["directo", "1 escala", "2 escalas"])
+    duraciones = np.array(
+        [f"{h} h {m} min" for h in range(1, 15) for m in range(1, 60)]
+        + [f"{h} h" for h in range(1, 15)]
+        + [f"{m} min" for m in range(30, 60)]
+    )
+    precios = np.array([f"{p:,}".replace(",", ".") for p in range(30, 2000)])
+    aerolineas = [[a] for a in AEROLINEAS] + [
+        [a, b] for a in AEROLINEAS for b in AEROLINEAS if a != b
+    ]
+    datos = {
+        "url": "https://www.edreams.es/travel/",
+        "origen": rnd.choice(AEROPUERTOS, numero),
+        "destino": rnd.choice(AEROPUERTOS, numero),
+        "fecha_inicio": "2025-01-03",
+        "fecha_fin": "2025-01-10",
+        "pasajeros": 1,
+        "inicio_ida": rnd.choice(horas, numero),
+        "fin_ida": rnd.choice(horas, numero),
+        "inicio_vuelta": rnd.choice(horas, numero),
+        "fin_vuelta": rnd.choice(horas, numero),
+        "escala_ida": rnd.choice(escalas, numero),
+        "escala_vuelta": rnd.choice(escalas, numero),
+        "duracion_ida": rnd.choice(duraciones, numero),
+        "duracion_vuelta": rnd.choice(duraciones, numero),
+        "aerolineas": [
+            aerolineas[i] for i in rnd.integers(len(aerolineas), size=numero)
+        ],
+        "equipaje_mano": rnd.integers(2, size=numero),
+        "equipaje_bodega": 0,
+        "precio": rnd.choice(precios, numero),
+        "clase": None,
+    }
+    return pd.DataFrame(datos, columns=COLUMNAS_DF)
+
+
+# Implementacion original de crear_df() (apply fila a fila), como referencia de paridad y rendimiento
+def normalizar_original(df):
+    df = df.copy()
+    df["escala_ida"] = df.apply(
+        lambda row: int(row["escala_ida"][:1] if row["escala_ida"] != "directo" else 0),
+        axis=1,
+    )
+    df["escala_vuelta"] = df.apply(
+        lambda row: int(
+            row["escala_vuelta"][:1] if row["escala_vuelta"] != "directo" else 0
+        ),
+        axis=1,
+    )
+    df["duracion_ida"] = df.apply(
+        lambda row: row["duracion_ida"].replace(" h", "h").replace(" min", "m"), axis=1
+    )
+    df["duracion_vuelta"] = df.apply(
+        lambda row: row["duracion_vuelta"].replace(" h", "h").replace(" min", "m"),
+        axis=1,
+    )
+    return df
+
+
+# Benchmark de la normalizacion: paridad con el apply original y filas/segundo de cada implementacion
+def benchmark_normalizacion(df):
+    inicio = perf_counter()
+    original = normalizar_original(df)
+    duracion_original = perf_counter() - inicio
+
+    inicio = perf_counter()
+    tipado = normalizar_df(df)
+    duracion_vectorizada = perf_counter() - inicio
+
+    # Paridad: mismas escalas y mismas duraciones (una vez formateados los minutos como en el original)
+    for columna in ("escala_ida", "escala_vuelta"):
+        if not (tipado[columna].astype("int64") == original[columna]).all():
+            raise SystemExit(f"La columna {columna} no coincide con el original")
+    for columna in ("duracion_ida", "duracion_vuelta"):
+        if not (formatear_duracion(tipado[columna]) == original[columna]).all():
+            raise SystemExit(f"La columna {columna} no coincide con el original")
+    print(f"Paridad OK en {len(df)} filas")
+
+    memoria = {
+        "original": original.memory_usage(deep=True).sum() / 1024**2,
+        "vectorizada": tipado.memory_usage(deep=True).sum() / 1024**2,
+    }
+    resultados = {
+        "original": len(df) / duracion_original,
+        "vectorizada": len(df) / duracion_vectorizada,
+    }
+    for nombre, filas_segundo in resultados.items():
+        print(
+            f"  {nombre:<12} {filas_segundo:>10.0f} filas/s {memoria[nombre]:>8.1f} MB"
+        )
+    print(f"  speedup x{resultados['vectorizada'] / resultados['original']:.1f}")
+    return resultados
+
+
+# Implementacion original de normalizar_fila() (datos fijos + lista anidada del itinerario -> fila del df), como referencia
+def fila_original(datos_obtenidos):
+    equipaje_mano_value = datos_obtenidos[10][0] if len(datos_obtenidos[10]) > 1 else ""
+    return [
+        datos_obtenidos[0],
+        datos_obtenidos[1],
+        datos_obtenidos[2],
+        datos_obtenidos[3],
+        datos_obtenidos[4],
+        1,
+        datos_obtenidos[7][0],
+        datos_obtenidos[7][1],
+        datos_obtenidos[7][2],
+        datos_obtenidos[7][3],
+        datos_obtenidos[9][0],
+        datos_obtenidos[9][1],
+        datos_obtenidos[8][0],
+        datos_obtenidos[8][1],
+        datos_obtenidos[6],
+        1 if equipaje_mano_value == "Equipaje de mano" else 0,
+        0,
+        datos_obtenidos[11],
+        None,
+    ]
+
+
+# Copia nueva de un texto, como la que devuelve el parser para cada itinerario (no comparte memoria con otros)
+def _copia(texto):
+    return (texto + " ")[:-1]
+
+
+# Generador de itinerarios sinteticos con el formato de lista anidada del parser (textos nuevos en cada itinerario)
+def _listas_sinteticas(numero, semilla=0):
+    rnd = random.Random(semilla)
+    horas = [f"{h:02d}:{m:02d}" for h in range(24) for m in range(0, 60, 5)]
+    duraciones = [f"{h} h {m} min" for h in range(1, 15) for m in range(0, 60, 5)]
+    escalas = ["directo", "1 escala", "2 escalas"]
+    for _ in range(numero):
+        precio = f"{rnd.randrange(30, 2000):,}".replace(",", ".")
+        yield [
+            [_copia(rnd.choice(AEROPUERTOS)) for _ in range(4)],
+            [_copia(rnd.choice(AEROLINEAS))],
+            [_copia(rnd.choice(horas)) for _ in range(4)],
+            [_copia(rnd.choice(duraciones)) for _ in range(2)],
+            [_copia(rnd.choice(escalas)) for _ in range(2)],
+            [_copia("Equipaje de mano"), _copia("Artículo personal")],
+            precio,
+            [precio, _copia(precio)],
+        ]
+
+
+def benchmark_memoria(registros=1_000_000, por_ruta=50):
+    """
+    Memoria de los itinerarios scrapeados hasta crear el df: las listas anidadas de antes (itinerario + datos fijos
+    de la ruta y fila de normalizar_fila(), vivas a la vez como en _scrap) frente a los registros compactos.
+    :param registros: Itinerarios sinteticos.
+    :param por_ruta: Itinerarios de cada ruta (las rutas comparten url, origen, destino y fechas).
+    :return: Diccionario con MB retenidos, segundos de conversion a df y MB del df de cada formato.
+    """
+
+    def fijos(i):
+        destino = AEROPUERTOS[i % len(AEROPUERTOS)]
+        url = f"https://www.edreams.es/travel/#results/type=R;dep=2025-01-03;from=MAD;to={destino};ret=2025-01-10"
+        return [url, "MAD", destino, "2025-01-03", "2025-01-10"]
+
+    def listas():
+        datos, filas = [], []
+        for i, itinerario in enumerate(_listas_sinteticas(registros)):
+            if i % por_ruta == 0:
+                fixed_data = fijos(i // por_ruta)
+            datos.append(fixed_data + itinerario)
+            filas.append(fila_original(datos[-1]))
+        return datos, filas
+
+    def compactos():
+        rutas = []
+        for i, itinerario in enumerate(_listas_sinteticas(registros)):
+            if i % por_ruta == 0:
+                rutas.append(Ruta(*fijos(i // por_ruta)))
+            rutas[-1].itinerarios.append(Itinerario.desde_lista(itinerario))
+        return rutas
+
+    conversiones = {
+        "listas": lambda datos: pd.DataFrame(datos[1], columns=COLUMNAS_DF),
+        "registros": df_rutas,
+    }
+    resultados = {}
+    for nombre, construir in (("listas", listas), ("registros", compactos)):
+        tracemalloc.start()
+        try:
+            datos = construir()
+            retenidos = tracemalloc.get_traced_memory()[0] / 1024**2
+        finally:
+            tracemalloc.stop()
+        inicio = perf_counter()
+        df = conversiones[nombre](datos)
+        duracion = perf_counter() - inicio
+        resultados[nombre] = {
+            "retenidos_mb": retenidos,
+            "conversion_s": duracion,
+            "df_mb": df.memory_usage(deep=True).sum() / 1024**2,
+        }
+        print(
+            f"  {nombre:<10} {retenidos:>8.1f} MB retenidos {duracion:>7.2f} s a df "
+            f"{resultados[nombre]['df_mb']:>8.1f} MB de df"
+        )
+        del datos, df
+    print(
+        f"  memoria x{resultados['listas']['retenidos_mb'] / resultados['registros']['retenidos_mb']:.1f} "
+        f"conversion x{resultados['listas']['conversion_s'] / resultados['registros']['conversion_s']:.1f}"
+    )
+    return resultados
+
+
+def benchmark_historico(filas=1_000_000, lotes=30, fichero=None):
+    """
+    Historico de precios: tarifas/segundo al ingerir lotes del df normalizado (como los que escribe crear_df(), uno
+    por dia de scrapeo) y latencia de las consultas sobre el historico resultante.
+    :param filas: Tarifas sinteticas en total.
+    :param lotes: Lotes (dias de scrapeo) en los que se reparten.
+    :param fichero: Fichero SQLite del historico. Por defecto uno temporal que se borra al terminar.
+    :return: Diccionario con las tarifas/segundo de la ingesta y los milisegundos de cada consulta.
+    """
+    import tempfile
+
+    from historico_precios import HistoricoPrecios
+
+    df = normalizar_df(df_sintetico(filas))
+    # Fechas de salida repartidas en los fines de semana de un trimestre, para que las consultas tengan que filtrar
+    rnd = np.random.default_rng(1)
+    salidas = pd.date_range("2025-10-03", "2025-12-26", freq="W-FRI")
+    df["fecha_inicio"] = salidas[rnd.integers(len(salidas), size=len(df))]
+    df["fecha_fin"] = df["fecha_inicio"] + pd.Timedelta(days=2)
+
+    directorio = tempfile.mkdtemp() if fichero is None else None
+    historico = HistoricoPrecios(
+        fichero or os.path.join(directorio, "historico.sqlite")
+    )
+    ahora = datetime.now().timestamp()
+    inicio = perf_counter()
+    for i, lote in enumerate(np.array_split(np.arange(len(df)), lotes)):
+        historico.ingerir(df.iloc[lote], scrapeo=ahora - (lotes - i) * 24 * 3600)
+    duracion = perf_counter() - inicio
+    resultados = {"ingesta_tarifas_s": len(df) / duracion}
+    print(
+        f"  ingesta {resultados['ingesta_tarifas_s']:>10.0f} tarifas/s ({len(df)} en {lotes} lotes)"
+    )
+
+    consultas = {
+        "mas_baratas_fin_de_semana": lambda: historico.mas_baratas(
+            origen="MAD",
+            salida_desde="2025-12-01",
+            salida_hasta="2025-12-31",
+            dias_semana=[4],
+            dias=lotes // 2,
+        ),
+        "mas_baratas_por_ruta": lambda: historico.mas_baratas(agrupar="ruta"),
+        "tendencia": lambda: historico.tendencia(
+            "MAD", "BCN", salida="2025-12-05", regreso="2025-12-07"
+        ),
+        "rutas_nuevas": lambda: historico.rutas_nuevas(dias=lotes // 2),
+    }
+    for nombre, consulta in consultas.items():
+        inicio = perf_counter()
+        filas_consulta = len(consulta())
+        resultados[f"{nombre}_ms"] = (perf_counter() - inicio) * 1000
+        print(
+            f"  {nombre:<26} {resultados[f'{nombre}_ms']:>8.1f} ms {filas_consulta:>6} filas"
+        )
+    historico.cerrar()
+    if directorio is not None:
+        for nombre in os.listdir(directorio):
+            os.remove(os.path.join(directorio, nombre))
+        os.rmdir(directorio)
+    return resultados
+
+
+# Pool falso para los benchmarks sin navegador: cada sesion es None (datos_destino y el descubrimiento van simulados)
+class _PoolSimulado:
+    @contextmanager
+    def sesion(self):
+        yield None
+
+    def estadisticas(self):
+        return {}
+
+
+def benchmark_flex(
+    origenes=("MAD",),
+    inicio="2025-10-03",
+    fin="2025-10-05",
+    dias_flex=3,
+    estancia_min=None,
+    estancia_max=None,
+    destinos=10,
+    itinerarios=20,
+    espera_rejilla=0.2,
+    espera_ruta=0.05,
+    workers=4,
+):
+    """
+    Fechas flexibles: la matriz de fechas alrededor de un rango, scrapeada como hasta ahora (un scrap() por par de
+    fechas, cada uno con su descubrimiento y esperando a que termine el par anterior) frente a --flex-days (un
+    descubrimiento por matriz y un unico pipeline para todas las celdas). Sin navegador: la rejilla de destinos y
+    cada pagina de resultados se simulan con una espera.
+    :param espera_rejilla: Segundos que tarda cada descubrimiento de destinos.
+    :param espera_ruta: Segundos que tarda cada ruta (origen, destino, fechas).
+    :return: Diccionario con las llamadas a la rejilla, las rutas scrapeadas y el tiempo de cada modo.
+    """
+    import contextlib
+    import io
+    import tempfile
+
+    import scraper_edreams
+    from diario_trabajo import DiarioTrabajo
+    from fechas_flexibles import celdas_flexibles
+
+    llamadas = {"rejilla": 0, "rutas": 0}
+    rnd = random.Random(0)
+
+    def descubrimiento(url, origen, inicio, fin, pool, cache=None):
+        llamadas["rejilla"] += 1
+        sleep(espera_rejilla)
+        return [AEROPUERTOS[i % len(AEROPUERTOS)] for i in range(1, destinos + 1)]
+
+    def ruta(url, browser, **opciones):
+        llamadas["rutas"] += 1
+        sleep(espera_ruta)
+        return [
+            Itinerario(
+                ["MAD", "BCN", "BCN", "MAD"],
+                [rnd.choice(AEROLINEAS)],
+                ["07:05", "08:20", "19:40", "20:55"],
+                ["1 h 15 min", "1 h 15 min"],
+                ["directo", "directo"],
+                1,
+                str(rnd.randint(40, 400)),
+            )
+            for _ in range(itinerarios)
+        ]
+
+    celdas = celdas_flexibles(inicio, fin, dias_flex, estancia_min, estancia_max)
+    modos = {
+        "por_par": lambda directorio, diario: scraper_edreams._scrap(
+            fechas=[{"from": salida, "to": regreso} for salida, regreso in celdas],
+            origenes=list(origenes),
+            pool=_PoolSimulado(),
+            workers=workers,
+            directorio_datos=os.path.join(directorio, "datos"),
+            diario=diario,
+        ),
+        "flex": lambda directorio, diario: scraper_edreams._scrap_flex(
+            fechas=[{"from": inicio, "to": fin}],
+            origenes=list(origenes),
+            pool=_PoolSimulado(),
+            workers=workers,
+            diario=diario,
+            dias_flex=dias_flex,
+            estancia_min=estancia_min,
+            estancia_max=estancia_max,
+            directorio_matrices=os.path.join(directorio, "matrices"),
+            directorio_datos=os.path.join(directorio, "datos"),
+        ),
+    }
+
+    originales = (
+        scraper_edreams.obtener_posibles_destinos,
+        scraper_edreams.datos_destino,
+    )
+    scraper_edreams.obtener_posibles_destinos = descubrimiento
+    scraper_edreams.datos_destino = ruta
+    resultados = {"celdas": len(celdas)}
+    print(
+        f"  {len(celdas)} pares de fechas x {len(origenes)} origenes x {destinos} destinos"
+    )
+    try:
+        for modo, ejecutar in modos.items():
+            llamadas.update(rejilla=0, rutas=0)
+            with tempfile.TemporaryDirectory() as directorio:
+                diario = DiarioTrabajo(os.path.join(directorio, "diario.sqlite"))
+                inicio_modo = perf_counter()
+                with contextlib.redirect_stdout(
+                    io.StringIO()
+                ), contextlib.redirect_stderr(io.StringIO()):
+                    ejecutar(directorio, diario)
+                duracion = perf_counter() - inicio_modo
+                diario.cerrar()
+            resultados[modo] = dict(llamadas, segundos=duracion)
+            print(
+                f"  {modo:<8} rejilla={llamadas['rejilla']:<4} rutas={llamadas['rutas']:<5} {duracion:>7.2f} s"
+            )
+    finally:
+        scraper_edreams.obtener_posibles_destinos, scraper_edreams.datos_destino = (
+            originales
+        )
+    print(
+        f"  speedup x{resultados['por_par']['segundos'] / resultados['flex']['segundos']:.1f}"
+    )
+    return resultados
+
+
+# Implementacion original de subir_datos_airtable() (lotes de 10 en serie con una pausa fija), como referencia
+def subir_original(df, endpoint):
+    datos_df = registros_airtable(df)
+    counter = 0
+    while counter < len(datos_df):
+        datos_subir = {"records": datos_df[counter : counter + 10], "typecast": True}
+        requests.post(url=endpoint, json=datos_subir)
+        counter += 10
+        sleep(1)
+
+
+# Benchmark de la subida a airtable contra un airtable simulado con el limite real de peticiones por segundo
+def benchmark_airtable(filas, en_vuelo=3, tasa_errores=0.0, original=True):
+    df = normalizar_df(df_sintetico(filas))
+    servidor = arrancar_airtable(tasa_errores=tasa_errores)
+    base_url = f"http://127.0.0.1:{servidor.server_port}/v0"
+
+    resultados = {}
+    if original:
+        inicio = perf_counter()
+        subir_original(df, f"{base_url}/base/original")
+        resultados["original"] = filas / (perf_counter() - inicio)
+
+    subidor = SubidorAirtable(
+        base_url, "base", "tabla", "clave", en_vuelo=en_vuelo, upsert=True
+    )
+    inicio = perf_counter()
+    subidor.subir(df)
+    resultados["upsert"] = filas / (perf_counter() - inicio)
+    # Segunda pasada con las mismas filas: todas tienen que ser actualizaciones, sin duplicados
+    subidor.subir(df)
+    subidor.imprimir_informe()
+
+    tabla = servidor.RequestHandlerClass.tablas.get("/v0/base/tabla", {})
+    print(
+        f"Airtable simulado: {servidor.RequestHandlerClass.contadores}, {len(tabla)} registros en la tabla"
+    )
+    for nombre, registros_segundo in resultados.items():
+        print(f"  {nombre:<10} {registros_segundo:>8.1f} registros/s")
+    servidor.shutdown()
+    subidor.cerrar()
+    return resultados
+
+
+# Dependencias que no deben cargarse al arrancar el scraper (solo en las etapas que las usan)
+MODULOS_PESADOS = (
+    "pandas",
+    "numpy",
+    "selenium",
+    "bs4",
+    "lxml",
+    "pyarrow",
+    "requests",
+    "tqdm",
+)
+
+
+# Ejecuta python con -X importtime y devuelve (segundos de reloj, modulos importados)
+def _arrancar(argumentos):
+    inicio = perf_counter()
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", *argumentos],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    duracion = perf_counter() - inicio
+    modulos = set()
+    for linea in proceso.stderr.splitlines():
+        if linea.startswith("import time:") and "|" in linea:
+            modulos.add(linea.rsplit("|", 1)[1].strip().split(".")[0])
+    return duracion, modulos
+
+
+# Benchmark del arranque del scraper: tiempo de importarlo, de --help y de rechazar unas fechas mal formadas,
+# comparado con importar las dependencias pesadas como hacia el modulo original. Falla si se cuela alguna
+def benchmark_arranque(repeticiones=5, limite_ms=None):
+    casos = {
+        "import": ["-c", "import scraper_edreams"],
+        "--help": ["scraper_edreams.py", "--help"],
+        "bad --dates": [
+            "scraper_edreams.py",
+            "--dates",
+            '[{"from": "2025-13-01", "to": "2025-01-02"}]',
+            "--sources",
+            '["MAD"]',
+        ],
+        "original": [
+            "-c",
+            "import numpy, pandas, requests, tqdm, bs4, selenium.webdriver",
+        ],
+    }
+
+    resultados = {}
+    errores = []
+    for nombre, argumentos in casos.items():
+        duraciones = []
+        for _ in range(repeticiones):
+            duracion, modulos = _arrancar(argumentos)
+            duraciones.append(duracion)
+        resultados[nombre] = statistics.median(duraciones) * 1000
+        if nombre != "original":
+            cargados = sorted(modulos.intersection(MODULOS_PESADOS))
+            if cargados:
+                errores.append(f"{nombre} importa {', '.join(cargados)}")
+            if limite_ms is not None and resultados[nombre] > limite_ms:
+                errores.append(
+                    f"{nombre} tarda {resultados[nombre]:.0f} ms (limite {limite_ms} ms)"
+                )
+
+    for nombre, milisegundos in resultados.items():
+        print(f"  {nombre:<12} {milisegundos:>8.0f} ms")
+    print(f"  speedup x{resultados['original'] / resultados['--help']:.1f} en --help")
+    if errores:
+        raise SystemExit("Regresion en el arranque: " + "; ".join(errores))
+    print(f"Arranque OK: ninguna de {', '.join(MODULOS_PESADOS)} se importa")
+    return resultados
+
+
+FICHERO_RESULTADOS = "resultados_benchmarks.jsonl"
+
+
+# Pico de memoria de python (tracemalloc, incluye los arrays de numpy/pandas) al ejecutar la funcion, en MB
+def _pico_memoria(funcion, *args):
+    tracemalloc.start()
+    try:
+        funcion(*args)
+        return tracemalloc.get_traced_memory()[1] / 1024**2
+    finally:
+        tracemalloc.stop()
+
+
+# Memoria maxima (RSS) del proceso hasta ahora en MB, o None si el sistema no lo permite
+def _rss_maximo():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # En Linux ru_maxrss va en KB y en macOS en bytes
+    return rss / 1024**2 if sys.platform == "darwin" else rss / 1024
+
+
+# Commit actual (con -dirty si hay cambios sin commitear), para poder comparar ejecuciones entre commits
+def _commit():
+    try:
+        proceso = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    except OSError:
+        return None
+    return proceso.stdout.strip() or None
+
+
+def benchmark_extremo_a_extremo(
+    origenes=("MAD",),
+    inicio="2025-01-03",
+    fin="2025-01-10",
+    workers=2,
+    perfil="ligero",
+    **opciones_servidor,
+):
+    """
+    Mide el scraper completo (descubrimiento, carga de resultados, "Mostrar más", alerta de sesion y parseo) con
+    Chrome contra la web de eDreams simulada.
+    :param origenes: Origenes a scrapear (cada uno con los destinos que sirva la web simulada).
+    :param workers: Rutas en paralelo (y tamaño del pool de navegadores).
+    :param perfil: Perfil de Chrome (ver crear_chrome).
+    :param opciones_servidor: Parametros de arrancar_edreams() (destinos, por_pagina, paginas, alerta_cada...).
+    :return: Diccionario con las metricas, o None si no se puede lanzar Chrome.
+    """
+    import scraper_edreams
+    from browser_pool import BrowserPool, crear_chrome
+
+    servidor = arrancar_edreams(**opciones_servidor)
+    manejador = servidor.RequestHandlerClass
+    url = f"http://127.0.0.1:{servidor.server_port}"
+    pool = BrowserPool(
+        tamano=workers,
+        url=url,
+        crear_navegador=lambda: crear_chrome(perfil=perfil),
+    )
+
+    # Latencia de cada ruta: se cronometra cada llamada a datos_destino() del scraper
+    latencias = []
+    original = scraper_edreams.datos_destino
+
+    def cronometrado(**kwargs):
+        inicio_ruta = perf_counter()
+        try:
+            return original(**kwargs)
+        finally:
+            latencias.append(perf_counter() - inicio_ruta)
+
+    url_original = scraper_edreams.URL_EDREAMS
+    scraper_edreams.URL_EDREAMS = url
+    scraper_edreams.datos_destino = cronometrado
+    try:
+        try:
+            with pool.sesion():
+                pass
+        except Exception as exception:
+            print(
+                f"No se puede lanzar Chrome, se omite el extremo a extremo... {exception}"
+            )
+            return None
+
+        filas = 0
+        inicio_total = perf_counter()
+        for origen in origenes:
+            rutas = scraper_edreams.scrapping_edreams(
+                origen, inicio, fin, pool, workers=workers
+            )
+            filas += sum(len(ruta) for ruta in rutas)
+        duracion = perf_counter() - inicio_total
+    finally:
+        scraper_edreams.datos_destino = original
+        scraper_edreams.URL_EDREAMS = url_original
+        pool.cerrar()
+        servidor.shutdown()
+
+    # Cada ruta tiene que traer todas sus paginas: si faltan itinerarios, el bucle de "Mostrar más" se corto antes
+    esperadas = len(latencias) * manejador.por_pagina * manejador.paginas
+    latencias.sort()
+    resultados = {
+        "rutas": len(latencias),
+        "itinerarios": filas,
+        "itinerarios_perdidos": esperadas - filas,
+        "latencia_ruta_media_s": statistics.mean(latencias) if latencias else None,
+        "latencia_ruta_p50_s": statistics.median(latencias) if latencias else None,
+        "latencia_ruta_p95_s": (
+            latencias[int(0.95 * (len(latencias) - 1))] if latencias else None
+        ),
+        "itinerarios_s": filas / duracion if duracion else 0.0,
+    }
+    print(f"Web simulada: {manejador.contadores}")
+    for nombre, valor in resultados.items():
+        print(f"  {nombre:<24} {valor if valor is None else round(valor, 3)}")
+    if resultados["itinerarios_perdidos"]:
+        print(f"Aviso: faltan {resultados['itinerarios_perdidos']} itinerarios")
+    return resultados
+
+
+# Busca en el fichero de resultados la ultima ejecucion (o la ultima del commit indicado) para comparar
+def _ejecucion_anterior(fichero, commit=None):
+    if not os.path.exists(fichero):
+        return None
+    anterior = None
+    with open(fichero, encoding="utf-8") as f:
+        for linea in f:
+            if not linea.strip():
+                continue
+            ejecucion = json.loads(linea)
+            if commit is None or (ejecucion.get("commit") or "").startswith(commit):
+                anterior = ejecucion
+    return anterior
+
+
+def benchmark_suite(
+    directorio_paginas=None,
+    itinerarios=200,
+    filas=200_000,
+    extremo_a_extremo=True,
+    fichero=FICHERO_RESULTADOS,
+    comparar=None,
+    **opciones_extremo,
+):
+    """
+    Suite completa sin red: throughput del parser y de la normalizacion, pico de memoria de cada etapa y latencia
+    por ruta del scraper contra la web simulada. Guarda las metricas (con el commit) en un fichero JSON lines y
+    las compara con la ejecucion anterior, o con la ultima del commit `comparar`.
+    :param opciones_extremo: Parametros de benchmark_extremo_a_extremo().
+    :return: Diccionario con las metricas.
+    """
+    metricas = {}
+
+    print("Parser:")
+    paginas = cargar_paginas(directorio_paginas, numero=itinerarios)
+    for nombre, valor in benchmark_parser(paginas).items():
+        metricas[f"parser.{nombre}.itinerarios_s"] = valor
+    metricas["parser.pico_memoria_mb"] = _pico_memoria(
+        lambda: [parsear_itinerarios(html) for html in paginas]
+    )
+
+    print("Normalizacion:")
+    df = df_sintetico(filas)
+    for nombre, valor in benchmark_normalizacion(df).items():
+        metricas[f"normalizacion.{nombre}.filas_s"] = valor
+    metricas["normalizacion.pico_memoria_mb"] = _pico_memoria(normalizar_df, df)
+    del df
+
+    if extremo_a_extremo:
+        print("Extremo a extremo:")
+        resultados = benchmark_extremo_a_extremo(**opciones_extremo)
+        for nombre, valor in (resultados or {}).items():
+            metricas[f"extremo.{nombre}"] = valor
+    metricas["proceso.rss_maximo_mb"] = _rss_maximo()
+
+    anterior = _ejecucion_anterior(fichero, comparar)
+    ejecucion = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "metricas": metricas,
+    }
+    with open(fichero, "a", encoding="utf-8") as f:
+        f.write(json.dumps(ejecucion) + "\n")
+
+    if anterior is None:
+        print(
+            f"Resultados guardados en {fichero} (sin ejecucion anterior con la que comparar)"
+        )
+    else:
+        print(f"Comparacion con {anterior['commit']} ({anterior['fecha']}):")
+    for nombre, valor in metricas.items():
+        previo = (anterior or {}).get("metricas", {}).get(nombre)
+        cambio = ""
+        if valor is not None and previo:
+            cambio = f"{(valor - previo) / previo * 100:+.1f}%"
+        print(
+            f"  {nombre:<40} {'-' if valor is None else f'{valor:.3f}':>14} "
+            f"{'' if previo is None else f'{previo:.3f}':>14} {cambio:>8}"
+        )
+    return metricas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="eDreams scraper benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parser_parser = subparsers.add_parser(
+        "parser", help="Itinerary parser parity check and throughput"
+    )
+    parser_parser.add_argument(
+        "--fixtures",
+        type=str,
+        default=None,
+        help="Directory with saved results pages (*.html). Default: synthetic pages",
+    )
+    parser_parser.add_argument(
+        "--itineraries",
+        type=int,
+        default=200,
+        help="Itineraries per synthetic page. Default: 200",
+    )
+    parser_parser.add_argument(
+        "--repeat", type=int, default=3, help="Timed repetitions. Default: 3"
+    )
+
+    parser_captura = subparsers.add_parser(
+        "capture", help="Bytes and parse time per route for each capture mode"
+    )
+    parser_captura.add_argument(
+        "--fixtures",
+        type=str,
+        default=None,
+        help="Directory with saved results pages (*.html). Default: synthetic pages",
+    )
+    parser_captura.add_argument(
+        "--itineraries",
+        type=int,
+        default=200,
+        help="Itineraries per synthetic page. Default: 200",
+    )
+    parser_captura.add_argument(
+        "--parser",
+        choices=["bs4", "lxml"],
+        default=None,
+        help="Parser backend. Default: lxml if installed, else bs4",
+    )
+
+    parser_normalizacion = subparsers.add_parser(
+        "normalize", help="Vectorized normalization vs the original row-wise apply"
+    )
+    parser_normalizacion.add_argument(
+        "--rows",
+        type=int,
+        default=1_000_000,
+        help="Synthetic rows. Default: 1000000",
+    )
+
+    parser_memoria = subparsers.add_parser(
+        "memory",
+        help="Memory of scraped itineraries and DataFrame conversion: nested lists vs compact records",
+    )
+    parser_memoria.add_argument(
+        "--records",
+        type=int,
+        default=1_000_000,
+        help="Synthetic itineraries. Default: 1000000",
+    )
+    parser_memoria.add_argument(
+        "--per-route",
+        type=int,
+        default=50,
+        help="Itineraries per route. Default: 50",
+    )
+
+    parser_historico = subparsers.add_parser(
+        "history",
+        help="Fare history ingestion throughput and query latency",
+    )
+    parser_historico.add_argument(
+        "--rows",
+        type=int,
+        default=1_000_000,
+        help="Synthetic fares. Default: 1000000",
+    )
+    parser_historico.add_argument(
+        "--batches",
+        type=int,
+        default=30,
+        help="Ingestion batches, one per scrape day. Default: 30",
+    )
+    parser_historico.add_argument(
+        "--history",
+        type=str,
+        default=None,
+        help="Fare history file to fill. Default: a temporary file",
+    )
+
+    parser_flex = subparsers.add_parser(
+        "flex",
+        help="Flexible-date matrix: one scrape per date pair vs --flex-days, with simulated discovery and results pages",
+    )
+    parser_flex.add_argument(
+        "--flex-days",
+        type=int,
+        default=3,
+        help="Days each date moves around the requested range. Default: 3",
+    )
+    parser_flex.add_argument(
+        "--min-stay", type=int, default=None, help="Minimum nights. Default: none"
+    )
+    parser_flex.add_argument(
+        "--max-stay", type=int, default=None, help="Maximum nights. Default: none"
+    )
+    parser_flex.add_argument(
+        "--destinations",
+        type=int,
+        default=10,
+        help="Destinations per origin. Default: 10",
+    )
+    parser_flex.add_argument(
+        "--grid-delay",
+        type=float,
+        default=0.2,
+        help="Seconds each destination discovery takes. Default: 0.2",
+    )
+    parser_flex.add_argument(
+        "--route-delay",
+        type=float,
+        default=0.05,
+        help="Seconds each route takes. Default: 0.05",
+    )
+    parser_flex.add_argument(
+        "--workers", type=int, default=4, help="Routes in parallel. Default: 4"
+    )
+
+    parser_airtable = subparsers.add_parser(
+        "airtable", help="Airtable upload throughput against a local fake Airtable"
+    )
+    parser_airtable.add_argument(
+        "--rows", type=int, default=300, help="Synthetic rows. Default: 300"
+    )
+    parser_airtable.add_argument(
+        "--in-flight", type=int, default=3, help="Concurrent batches. Default: 3"
+    )
+    parser_airtable.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests the fake Airtable answers with 503. Default: 0",
+    )
+    parser_airtable.add_argument(
+        "--skip-original",
+        action="store_true",
+        help="Do not time the original sequential uploader",
+    )
+
+    parser_arranque = subparsers.add_parser(
+        "startup",
+        help="Scraper startup time and check that no heavy dependency is imported",
+    )
+    parser_arranque.add_argument(
+        "--repeat", type=int, default=5, help="Runs per case (median). Default: 5"
+    )
+    parser_arranque.add_argument(
+        "--max-ms",
+        type=float,
+        default=None,
+        help="Fail if a case takes longer than this (milliseconds). Default: no limit",
+    )
+
+    parser_suite = subparsers.add_parser(
+        "suite",
+        help="Offline suite: parser and normalization throughput, peak memory and per-route latency against the fake eDreams site; results are stored to compare across commits",
+    )
+    parser_suite.add_argument(
+        "--fixtures",
+        type=str,
+        default=None,
+        help="Directory with saved results pages (*.html), used by the parser stage and served by the fake site. Default: synthetic pages",
+    )
+    parser_suite.add_argument(
+        "--rows",
+        type=int,
+        default=200_000,
+        help="Synthetic rows for the normalization stage. Default: 200000",
+    )
+    parser_suite.add_argument(
+        "--sources",
+        type=str,
+        default='["MAD"]',
+        help='Origins scraped end to end. Default: ["MAD"]',
+    )
+    parser_suite.add_argument(
+        "--destinations",
+        type=int,
+        default=8,
+        help="Destinations per origin on the fake site. Default: 8",
+    )
+    parser_suite.add_argument(
+        "--result-pages",
+        type=int,
+        default=5,
+        help="Results pages ('Mostrar más' clicks + 1) per route. Default: 5",
+    )
+    parser_suite.add_argument(
+        "--per-page",
+        type=int,
+        default=10,
+        help="Itineraries per results page. Default: 10",
+    )
+    parser_suite.add_argument(
+        "--alert-every",
+        type=int,
+        default=3,
+        help="Show the session-expiry alert every N 'Mostrar más' clicks (0: never). Default: 3",
+    )
+    parser_suite.add_argument(
+        "--delay",
+        type=float,
+        default=0.05,
+        help="Seconds the fake site takes to answer each grid/results request. Default: 0.05",
+    )
+    parser_suite.add_argument(
+        "--workers", type=int, default=2, help="Routes in parallel. Default: 2"
+    )
+    parser_suite.add_argument(
+        "--skip-e2e",
+        action="store_true",
+        help="Skip the end-to-end stage (needs Chrome)",
+    )
+    parser_suite.add_argument(
+        "--results",
+        type=str,
+        default=FICHERO_RESULTADOS,
+        help=f"JSON lines file where every run is appended. Default: {FICHERO_RESULTADOS}",
+    )
+    parser_suite.add_argument(
+        "--compare",
+        type=str,
+        default=None,
+        help="Compare with the last run of this commit (hash prefix). Default: the previous run",
+    )
+
+    args = parser.parse_args()
+
+    if args.benchmark == "parser":
+        benchmark_parser(
+            cargar_paginas(args.fixtures, numero=args.itineraries),
+            repeticiones=args.repeat,
+        )
+    elif args.benchmark == "capture":
+        benchmark_captura(
+            cargar_paginas(args.fixtures, numero=args.itineraries), parser=args.parser
+        )
+    elif args.benchmark == "normalize":
+        benchmark_normalizacion(df_sintetico(args.rows))
+    elif args.benchmark == "memory":
+        benchmark_memoria(args.records, por_ruta=args.per_route)
+    elif args.benchmark == "history":
+        benchmark_historico(args.rows, lotes=args.batches, fichero=args.history)
+    elif args.benchmark == "flex":
+        benchmark_flex(
+            dias_flex=args.flex_days,
+            estancia_min=args.min_stay,
+            estancia_max=args.max_stay,
+            destinos=args.destinations,
+            espera_rejilla=args.grid_delay,
+            espera_ruta=args.route_delay,
+            workers=args.workers,
+        )
+    elif args.benchmark == "airtable":
+        benchmark_airtable(
+            args.rows,
+            en_vuelo=args.in_flight,
+            tasa_errores=args.error_rate,
+            original=not args.skip_original,
+        )
+    elif args.benchmark == "startup":
+        benchmark_arranque(repeticiones=args.repeat, limite_ms=args.max_ms)
+    elif args.benchmark == "suite":
+        benchmark_suite(
+            directorio_paginas=args.fixtures,
+            filas=args.rows,
+            extremo_a_extremo=not args.skip_e2e,
+            fichero=args.results,
+            comparar=args.compare,
+            origenes=json.loads(args.sources),
+            workers=args.workers,
+            destinos=args.destinations,
+            por_pagina=args.per_page,
+            paginas=args.result_pages,
+            alerta_cada=args.alert_every,
+            retardo=args.delay,
+            directorio_grabadas=args.fixtures,
+        )
@@ -0,0 +1,274 @@
+import os
+import threading
+from contextlib import contextmanager
+from functools import partial
+from time import perf_counter
+
+from esperas import MOTOR
+from metricas import METRICAS
+from perfil_navegador import (
+    DIRECTORIO_CACHE,
+    PREFERENCIAS_LIGERAS,
+    argumentos_ligeros,
+    bloquear_peticiones,
+    liberar_cache,
+    reservar_cache,
+)
+
+# Url base de la web (EDREAMS_URL permite apuntar a la web simulada de servidor_simulado.py)
+URL_EDREAMS = os.getenv("EDREAMS_URL", "https://www.edreams.es")
+
+
+# Funcion para aceptar el banner de cookies (Didomi) si aparece. Devuelve True si se ha hecho click
+def aceptar_cookies(browser):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
+    # El banner es opcional: si no aparece dentro del tiempo aprendido asumimos que ya estan aceptadas
+    boton = MOTOR.clicable(
+        browser, "cookies.banner", By.ID, "didomi-notice-agree-button", opcional=True
+    )
+    if boton is None:
+        return False
+    try:
+        boton.click()
+        MOTOR.esperar(
+            browser, "cookies.cerrar", EC.invisibility_of_element(boton), opcional=True
+        )
+        return True
+    except Exception:
+        return False
+
+
+# Funcion por defecto para lanzar un navegador nuevo
+# Con registrar_red=True se activan los logs de rendimiento, necesarios para capturar las peticiones de la pagina
+# Con perfil="ligero" se lanza en headless, con ventana fija, sin extensiones, sin imagenes/fuentes/media ni trackers
+# y con una cache en disco que se reutiliza entre ejecuciones
+def crear_chrome(
+    registrar_red=False, perfil="completo", directorio_cache=DIRECTORIO_CACHE
+):
+    from selenium import webdriver
+
+    options = webdriver.ChromeOptions()
+    if registrar_red:
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+    if perfil != "ligero":
+        browser = webdriver.Chrome(options=options)
+        browser.maximize_window()
+        return browser
+
+    slot, ruta_cache = reservar_cache(directorio_cache)
+    for argumento in argumentos_ligeros(ruta_cache):
+        options.add_argument(argumento)
+    options.add_experimental_option("prefs", PREFERENCIAS_LIGERAS)
+    try:
+        browser = webdriver.Chrome(options=options)
+        bloquear_peticiones(browser)
+    except Exception:
+        liberar_cache(slot)
+        raise
+
+    # El pool llama a al_cerrar despues de cerrar el navegador, para dejar libre su directorio de cache
+    browser.al_cerrar = partial(liberar_cache, slot)
+    return browser
+
+
+# Excepciones que dejan el navegador inservible: las del driver (WebDriverException, sesion invalida...) y las de la
+# conexion con el proceso del driver si se ha caido
+def _navegador_roto(exception):
+    from selenium.common.exceptions import WebDriverException
+    from urllib3.exceptions import HTTPError
+
+    return isinstance(exception, (WebDriverException, HTTPError, ConnectionError))
+
+
+class BrowserPool:
+    """
+    Pool de sesiones de navegador (selenium) reutilizables entre destinos.
+    :param tamano: Numero maximo de navegadores abiertos a la vez.
+    :param max_paginas: Numero de paginas tras el cual se recicla (cierra y relanza) un navegador.
+    :param url: URL base sobre la que se aceptan las cookies al lanzar cada navegador.
+    :param crear_navegador: Funcion que lanza un navegador nuevo (por defecto Chrome).
+    """
+
+    def __init__(self, tamano=1, max_paginas=50, url=URL_EDREAMS, crear_navegador=None):
+        if tamano < 1:
+            raise ValueError("El tamaño del pool debe ser al menos 1")
+
+        self.tamano = tamano
+        self.max_paginas = max_paginas
+        self.url = url
+        self.crear_navegador = crear_navegador or crear_chrome
+
+        self._libres = []
+        self._paginas = {}
+        self._cookies = []
+        self._abiertos = 0
+        self._cerrado = False
+        self._condicion = threading.Condition()
+
+        self.stats = {
+            "hits": 0,
+            "lanzamientos": 0,
+            "reciclados": 0,
+            "descartados": 0,
+            "tiempo_lanzamiento": 0.0,
+        }
+
+    # Lanza un navegador nuevo, le aplica las cookies guardadas (o las acepta si es el primero) y mide el tiempo
+    def _lanzar(self):
+        inicio = perf_counter()
+        with METRICAS.tramo("navegador.lanzamiento"):
+            browser = self.crear_navegador()
+            # Si falla algo despues de crearlo hay que cerrarlo: si no, el proceso de Chrome y su cache se quedan abiertos
+            try:
+                browser.get(self.url)
+
+                if self._cookies:
+                    # Reutilizamos el estado de cookies de sesiones anteriores para no volver a pasar por el banner
+                    for cookie in self._cookies:
+                        try:
+                            browser.add_cookie(cookie)
+                        except Exception:
+                            continue
+                elif aceptar_cookies(browser):
+                    self._cookies = browser.get_cookies()
+            except Exception:
+                self._cerrar_navegador(browser)
+                raise
+
+        with self._condicion:
+            self.stats["lanzamientos"] += 1
+            self.stats["tiempo_lanzamiento"] += perf_counter() - inicio
+            self._paginas[id(browser)] = 0
+        return browser
+
+    # Comprueba que el navegador sigue vivo (driver respondiendo)
+    def _sano(self, browser):
+        try:
+            browser.current_url
+            return True
+        except Exception:
+            return False
+
+    def _cerrar_navegador(self, browser):
+        with self._condicion:
+            self._paginas.pop(id(browser), None)
+        try:
+            browser.quit()
+        except Exception:
+            pass
+        al_cerrar = getattr(browser, "al_cerrar", None)
+        if al_cerrar is not None:
+            al_cerrar()
+
+    # Cierra un navegador que ya ha salido del pool y libera su hueco (fuera del lock: quit() puede tardar)
+    def _descartar(self, browser):
+        self._cerrar_navegador(browser)
+        with self._condicion:
+            self._abiertos -= 1
+            self._condicion.notify()
+
+    # Pide un navegador al pool. Si hay uno libre y sano se reutiliza, si no se lanza uno nuevo (o se espera)
+    # Con el lock solo se saca el navegador de la lista: comprobarlo y cerrarlo habla con el driver, y un driver
+    # colgado no puede bloquear al resto de workers
+    def obtener(self):
+        while True:
+            browser = None
+            with self._condicion:
+                while True:
+                    if self._cerrado:
+                        raise RuntimeError("El pool de navegadores esta cerrado")
+                    if self._libres:
+                        browser = self._libres.pop()
+                        break
+                    if self._abiertos < self.tamano:
+                        self._abiertos += 1
+                        break
+                    self._condicion.wait()
+
+            if browser is None:
+                break
+            if self._sano(browser):
+                with self._condicion:
+                    self.stats["hits"] += 1
+                return browser
+            # Navegador caido: lo descartamos y liberamos su hueco
+            with self._condicion:
+                self.stats["descartados"] += 1
+            self._descartar(browser)
+
+        try:
+            return self._lanzar()
+        except Exception:
+            with self._condicion:
+                self._abiertos -= 1
+                self._condicion.notify()
+            raise
+
+    # Devuelve un navegador al pool. Si esta roto o ha llegado al maximo de paginas, se cierra
+    def devolver(self, browser, roto=False):
+        with self._condicion:
+            paginas = self._paginas.get(id(browser), 0) + 1
+            self._paginas[id(browser)] = paginas
+
+        if not roto:
+            try:
+                # Guardamos las cookies mas recientes para los navegadores que se lancen despues
+                self._cookies = browser.get_cookies() or self._cookies
+            except Exception:
+                roto = True
+
+        with self._condicion:
+            cerrar = roto or self._cerrado or paginas >= self.max_paginas
+            if not cerrar:
+                self._libres.append(browser)
+                self._condicion.notify()
+                return
+            if roto:
+                self.stats["descartados"] += 1
+            elif not self._cerrado:
+                self.stats["reciclados"] += 1
+        self._descartar(browser)
+
+    # Context manager para usar un navegador del pool y devolverlo siempre. Solo se descarta si la excepcion es del
+    # driver o de la sesion: un error del codigo que lo usa (p.e. al parsear) no estropea el navegador
+    @contextmanager
+    def sesion(self):
+        browser = self.obtener()
+        roto = False
+        try:
+            yield browser
+        except Exception as exception:
+            roto = _navegador_roto(exception)
+            raise
+        finally:
+            self.devolver(browser, roto=roto)
+
+    # Cierra todos los navegadores libres. Los que esten en uso se cerraran al devolverse
+    def cerrar(self):
+        with self._condicion:
+            self._cerrado = True
+            libres, self._libres = self._libres, []
+            self._condicion.notify_all()
+        for browser in libres:
+            self._descartar(browser)
+
+    # Estadisticas del pool, incluyendo el tiempo de lanzamiento ahorrado gracias a las reutilizaciones
+    def estadisticas(self):
+        with self._condicion:
+            stats = dict(self.stats)
+        lanzamiento_medio = (
+            stats["tiempo_lanzamiento"] / stats["lanzamientos"]
+            if stats["lanzamientos"]
+            else 0.0
+        )
+        stats["tiempo_ahorrado"] = stats["hits"] * lanzamiento_medio
+        return stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
@@ -0,0 +1,60 @@
+import json
+import os
+import threading
+from time import time
+
+FICHERO_CACHE_DESTINOS = "destinos_cache.json"
+
+
+class CacheDestinos:
+    """
+    Cache en disco de los destinos descubiertos para cada (origen, fecha inicio, fecha fin).
+    :param fichero: Fichero JSON donde se guarda la cache.
+    :param ttl: Segundos que una lista de destinos se considera valida. None para no caducar nunca.
+    """
+
+    def __init__(self, fichero=FICHERO_CACHE_DESTINOS, ttl=24 * 3600):
+        self.fichero = fichero
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._datos = {}
+        if os.path.exists(fichero):
+            try:
+                with open(fichero, encoding="utf-8") as f:
+                    self._datos = json.load(f)
+            except (OSError, ValueError) as exception:
+                print(f"Ignorando cache de destinos corrupta... {exception}")
+
+    @staticmethod
+    def _clave(origen, inicio, fin):
+        return f"{origen}|{inicio}|{fin}"
+
+    def _caducada(self, entrada, ahora):
+        return self.ttl is not None and ahora - entrada["fecha"] > self.ttl
+
+    # Devuelve la lista de destinos cacheada, o None si no existe o ha caducado
+    def obtener(self, origen, inicio, fin):
+        with self._lock:
+            entrada = self._datos.get(self._clave(origen, inicio, fin))
+        if entrada is None or self._caducada(entrada, time()):
+            return None
+        return list(entrada["destinos"])
+
+    # Guarda la lista de destinos y persiste el fichero (escritura atomica via fichero temporal).
+    # Las entradas caducadas se descartan al guardar, para que el fichero no crezca sin limite
+    def guardar(self, origen, inicio, fin, destinos):
+        ahora = time()
+        with self._lock:
+            self._datos = {
+                clave: entrada
+                for clave, entrada in self._datos.items()
+                if not self._caducada(entrada, ahora)
+            }
+            self._datos[self._clave(origen, inicio, fin)] = {
+                "fecha": ahora,
+                "destinos": list(destinos),
+            }
+            temporal = f"{self.fichero}.tmp"
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump(self._datos, f)
+            os.replace(temporal, self.fichero)
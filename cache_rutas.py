@@ -0,0 +1,232 @@
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+from registros import deserializar, serializar
+
+FICHERO_CACHE_RUTAS = "rutas_cache.sqlite"
+
+# Opciones de la cosecha incremental que recortan los resultados: forman parte de la clave para no mezclar listas parciales
+OPCIONES_VARIANTE = ("max_resultados", "precio_maximo", "pasos_sin_mejora")
+
+
+# Variante de una ruta segun las opciones con las que se scrapea ("" si se scrapea completa)
+def variante_opciones(opciones_destino):
+    if not opciones_destino.get("incremental"):
+        return ""
+    return ",".join(
+        f"{opcion}={opciones_destino[opcion]}"
+        for opcion in OPCIONES_VARIANTE
+        if opciones_destino.get(opcion) is not None
+    )
+
+
+class ItinerariosCacheados(list):
+    """
+    Lista de itinerarios servida desde la cache. Ya se volcaron al dataset y al historico cuando se scrapearon,
+    asi que crear_df() no los vuelve a escribir con la fecha de hoy. Los de un refresco en segundo plano aun no se
+    han volcado: la primera vez que se sirven salen como una lista normal, para que se escriban.
+    """
+
+
+class CacheRutas:
+    """
+    Cache persistente (SQLite) de los itinerarios scrapeados de cada ruta, por (origen, destino, ida, vuelta, pasajeros).
+    Las entradas caducan a los `ttl` segundos y, si hay mas de `max_entradas`, se expulsan las menos usadas (LRU).
+    Con `stale` > 0, durante esos segundos tras caducar se sigue devolviendo el resultado viejo mientras se
+    vuelve a scrapear la ruta en segundo plano (stale-while-revalidate). Cada entrada apunta si sus itinerarios
+    ya se han servido para escribirlos: los refrescados se guardan sin escribir hasta que se vuelven a pedir.
+    :param fichero: Fichero SQLite de la cache.
+    :param ttl: Segundos que un resultado se considera fresco.
+    :param max_entradas: Numero maximo de rutas guardadas.
+    :param stale: Segundos tras caducar en los que se sirve el resultado viejo mientras se refresca.
+    """
+
+    def __init__(
+        self, fichero=FICHERO_CACHE_RUTAS, ttl=1800, max_entradas=5000, stale=0
+    ):
+        self.fichero = fichero
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.stale = stale
+
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(fichero, check_same_thread=False)
+        # WAL para que varios procesos (lotes solapados) puedan leer mientras otro escribe
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS rutas ("
+            "clave TEXT PRIMARY KEY, itinerarios TEXT NOT NULL, "
+            "guardado REAL NOT NULL, usado REAL NOT NULL, escrito INTEGER NOT NULL DEFAULT 1)"
+        )
+        # Caches creadas antes de apuntar si cada entrada se ha escrito (lo guardado entonces ya se escribio)
+        columnas = {
+            fila[1]
+            for fila in self._conexion.execute("PRAGMA table_info(rutas)").fetchall()
+        }
+        if "escrito" not in columnas:
+            self._conexion.execute(
+                "ALTER TABLE rutas ADD COLUMN escrito INTEGER NOT NULL DEFAULT 1"
+            )
+        self._conexion.execute(
+            "CREATE INDEX IF NOT EXISTS rutas_usado ON rutas (usado)"
+        )
+        self._conexion.commit()
+
+        # Refrescos en segundo plano (uno a la vez, para no quitarle navegadores al scrapeo principal)
+        self._refrescos = ThreadPoolExecutor(max_workers=1)
+        self._refrescando = set()
+
+        self.stats = {
+            "aciertos": 0,
+            "aciertos_caducados": 0,
+            "fallos": 0,
+            "refrescos": 0,
+            "guardados": 0,
+            "expulsados": 0,
+        }
+
+    @staticmethod
+    def clave(origen, destino, inicio, fin, pasajeros=1, variante=""):
+        return f"{origen}|{destino}|{inicio}|{fin}|{pasajeros}|{variante}"
+
+    def _contar(self, clave_stat):
+        with self._lock:
+            self.stats[clave_stat] += 1
+
+    def obtener(self, clave):
+        """
+        Busca una ruta en la cache.
+        :param clave: Clave de la ruta (CacheRutas.clave).
+        :return: (itinerarios, caducado), o (None, False) si no esta o ha caducado del todo. Los itinerarios son
+            ItinerariosCacheados salvo que vengan de un refresco y aun no se hayan servido (quedan como servidos).
+        """
+        ahora = time()
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT itinerarios, guardado, escrito FROM rutas WHERE clave = ?",
+                (clave,),
+            ).fetchone()
+            if fila is None:
+                return None, False
+            edad = ahora - fila[1]
+            if edad > self.ttl + self.stale:
+                return None, False
+            self._conexion.execute(
+                "UPDATE rutas SET usado = ?, escrito = 1 WHERE clave = ?",
+                (ahora, clave),
+            )
+            self._conexion.commit()
+        itinerarios = deserializar(json.loads(fila[0]))
+        if fila[2]:
+            itinerarios = ItinerariosCacheados(itinerarios)
+        return itinerarios, edad > self.ttl
+
+    # Guarda los itinerarios de una ruta y expulsa las rutas menos usadas si se pasa del tamaño maximo
+    # escrito=False: itinerarios que nadie ha escrito en el dataset (refrescos en segundo plano)
+    def guardar(self, clave, itinerarios, escrito=True):
+        ahora = time()
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO rutas VALUES (?, ?, ?, ?, ?)",
+                (
+                    clave,
+                    json.dumps(itinerarios, default=serializar),
+                    ahora,
+                    ahora,
+                    1 if escrito else 0,
+                ),
+            )
+            expulsados = self._conexion.execute(
+                "DELETE FROM rutas WHERE clave IN ("
+                "SELECT clave FROM rutas ORDER BY usado DESC LIMIT -1 OFFSET ?)",
+                (self.max_entradas,),
+            ).rowcount
+            self._conexion.commit()
+            self.stats["guardados"] += 1
+            self.stats["expulsados"] += expulsados
+
+    def _refrescar(self, clave, scrapear):
+        try:
+            itinerarios = scrapear()
+            if itinerarios:
+                self.guardar(clave, itinerarios, escrito=False)
+        except Exception as exception:
+            print(f"Fallo refrescando la ruta {clave} en segundo plano... {exception}")
+        finally:
+            with self._lock:
+                self._refrescando.discard(clave)
+
+    # Lanza el refresco de una ruta en segundo plano, salvo que ya se este refrescando
+    def _lanzar_refresco(self, clave, scrapear):
+        with self._lock:
+            if clave in self._refrescando:
+                return
+            self._refrescando.add(clave)
+            self.stats["refrescos"] += 1
+        self._refrescos.submit(self._refrescar, clave, scrapear)
+
+    def obtener_o_scrapear(self, clave, scrapear):
+        """
+        Devuelve los itinerarios de la ruta desde la cache o, si no estan, los scrapea y los guarda.
+        :param clave: Clave de la ruta (CacheRutas.clave).
+        :param scrapear: Funcion sin argumentos que scrapea la ruta y devuelve la lista de itinerarios.
+        :return: Lista de itinerarios.
+        """
+        itinerarios, caducado = self.obtener(clave)
+        if itinerarios is not None and not caducado:
+            self._contar("aciertos")
+            return itinerarios
+
+        if itinerarios is not None:
+            # Caducado pero dentro de la ventana stale: se sirve y se refresca en segundo plano
+            self._contar("aciertos_caducados")
+            self._lanzar_refresco(clave, scrapear)
+            return itinerarios
+
+        self._contar("fallos")
+        itinerarios = scrapear()
+        # Una lista vacia suele ser un fallo del scrapeo: no la cacheamos
+        if itinerarios:
+            self.guardar(clave, itinerarios)
+        return itinerarios
+
+    # Version para generadores (cosecha incremental): solo se guarda la ruta si se ha recorrido entera.
+    # al_acertar se llama antes de servir una ruta desde la cache (los generadores no pueden llevar la marca)
+    def iterar_o_scrapear(self, clave, scrapear, al_acertar=None):
+        itinerarios, caducado = self.obtener(clave)
+        if itinerarios is not None:
+            self._contar("aciertos_caducados" if caducado else "aciertos")
+            if al_acertar is not None and isinstance(itinerarios, ItinerariosCacheados):
+                al_acertar()
+            if caducado:
+                self._lanzar_refresco(clave, lambda: list(scrapear()))
+            yield from itinerarios
+            return
+
+        self._contar("fallos")
+        obtenidos = []
+        for itinerario in scrapear():
+            obtenidos.append(itinerario)
+            yield itinerario
+        if obtenidos:
+            self.guardar(clave, obtenidos)
+
+    def informe(self):
+        with self._lock:
+            stats = dict(self.stats)
+        consultas = stats["aciertos"] + stats["aciertos_caducados"] + stats["fallos"]
+        stats["tasa_aciertos"] = (
+            round((stats["aciertos"] + stats["aciertos_caducados"]) / consultas, 3)
+            if consultas
+            else 0.0
+        )
+        return stats
+
+    # Espera a los refrescos pendientes (para que queden guardados) y cierra la base de datos
+    def cerrar(self):
+        self._refrescos.shutdown(wait=True)
+        with self._lock:
+            self._conexion.close()
@@ -0,0 +1,222 @@
+import re
+import threading
+from time import perf_counter
+
+from parser_itinerarios import ID_CONTENEDOR, parsear_itinerarios
+
+# Modos de captura del html de resultados:
+#   pagina: browser.page_source completo (scripts, estilos, cabecera, pie...)
+#   contenedor: solo el outerHTML del contenedor de resultados
+#   itinerarios: solo el outerHTML de los itinerarios (opcionalmente a partir de uno dado)
+MODOS_CAPTURA = ("pagina", "contenedor", "itinerarios")
+
+SCRIPT_CONTENEDOR = (
+    f"var c = document.getElementById('{ID_CONTENEDOR}');"
+    "return c ? c.outerHTML : null;"
+)
+
+SCRIPT_ITINERARIOS = (
+    f"var c = document.getElementById('{ID_CONTENEDOR}');"
+    "if (!c) { return null; }"
+    "var items = c.querySelectorAll('[data-testid=\"itinerary\"]');"
+    "var html = [];"
+    "for (var i = arguments[0]; i < items.length; i++) { html.push(items[i].outerHTML); }"
+    "return [items.length, html.join('')];"
+)
+
+
+# Devuelve el html de los itinerarios a partir de la posicion `desde`, y el numero total de itinerarios de la pagina
+def capturar_itinerarios(browser, desde=0):
+    resultado = browser.execute_script(SCRIPT_ITINERARIOS, desde)
+    if resultado is None:
+        return 0, ""
+    return resultado[0], resultado[1]
+
+
+# Devuelve el html a parsear segun el modo de captura. Si no encuentra el contenedor, usa la pagina completa
+def capturar_html(browser, modo="contenedor"):
+    if modo == "contenedor":
+        html = browser.execute_script(SCRIPT_CONTENEDOR)
+        if html is not None:
+            return html
+    elif modo == "itinerarios":
+        total, html = capturar_itinerarios(browser)
+        if total:
+            return html
+    return browser.page_source
+
+
+class EstadisticasCaptura:
+    """
+    Acumula por modo de captura los bytes traidos del navegador y el tiempo de parseo de cada ruta.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._modos = {}
+
+    def registrar(self, modo, num_bytes, segundos_captura, segundos_parseo):
+        with self._lock:
+            datos = self._modos.setdefault(
+                modo, {"rutas": 0, "bytes": 0, "captura": 0.0, "parseo": 0.0}
+            )
+            datos["rutas"] += 1
+            datos["bytes"] += num_bytes
+            datos["captura"] += segundos_captura
+            datos["parseo"] += segundos_parseo
+
+    # Medias por ruta de cada modo
+    def informe(self):
+        with self._lock:
+            modos = {modo: dict(datos) for modo, datos in self._modos.items()}
+        return {
+            modo: {
+                "rutas": datos["rutas"],
+                "kb_por_ruta": round(datos["bytes"] / datos["rutas"] / 1024, 1),
+                "captura_por_ruta": round(datos["captura"] / datos["rutas"], 3),
+                "parseo_por_ruta": round(datos["parseo"] / datos["rutas"], 3),
+            }
+            for modo, datos in modos.items()
+        }
+
+    def imprimir_informe(self):
+        for modo, datos in self.informe().items():
+            print(
+                f"Captura {modo}: {datos['rutas']} rutas, {datos['kb_por_ruta']} KB/ruta, "
+                f"captura {datos['captura_por_ruta']}s/ruta, parseo {datos['parseo_por_ruta']}s/ruta"
+            )
+
+
+# Estadisticas compartidas por todo el proceso (y por todos los workers)
+ESTADISTICAS = EstadisticasCaptura()
+
+
+def extraer_itinerarios(browser, modo="contenedor", parser=None, comparar=False):
+    """
+    Captura el html de resultados del navegador segun el modo y lo parsea, midiendo bytes y tiempos.
+    :param modo: Modo de captura (pagina, contenedor o itinerarios).
+    :param parser: Backend del parser (bs4 o lxml).
+    :param comparar: Si es True, mide tambien la captura de la pagina completa para comparar (el resultado no se usa).
+    :return: Lista de itinerarios.
+    """
+    inicio = perf_counter()
+    html = browser.page_source if modo == "pagina" else capturar_html(browser, modo)
+    capturado = perf_counter()
+    lista_datos_destino = parsear_itinerarios(html, backend=parser)
+    ESTADISTICAS.registrar(
+        modo, len(html.encode("utf-8")), capturado - inicio, perf_counter() - capturado
+    )
+
+    if comparar and modo != "pagina":
+        inicio = perf_counter()
+        html = browser.page_source
+        capturado = perf_counter()
+        parsear_itinerarios(html, backend=parser)
+        ESTADISTICAS.registrar(
+            "pagina",
+            len(html.encode("utf-8")),
+            capturado - inicio,
+            perf_counter() - capturado,
+        )
+
+    return lista_datos_destino
+
+
+# Precio del vuelo como entero ("1.234" -> 1234). None si no se puede interpretar
+def precio_numerico(precio):
+    digitos = re.sub(r"\D", "", precio or "")
+    return int(digitos) if digitos else None
+
+
+class Cosechador:
+    """
+    Cosecha incremental de itinerarios: en cada llamada trae del navegador solo los itinerarios nuevos,
+    descarta los repetidos y decide si merece la pena seguir cargando resultados.
+    :param parser: Backend del parser (bs4 o lxml).
+    :param max_resultados: Numero maximo de itinerarios a devolver.
+    :param precio_maximo: Precio a partir del cual se descartan los vuelos.
+    :param pasos_sin_mejora: Tandas seguidas sin un precio mas barato tras las que se deja de cargar.
+    """
+
+    def __init__(
+        self,
+        parser=None,
+        max_resultados=None,
+        precio_maximo=None,
+        pasos_sin_mejora=None,
+    ):
+        self.parser = parser
+        self.max_resultados = max_resultados
+        self.precio_maximo = precio_maximo
+        self.pasos_sin_mejora = pasos_sin_mejora
+
+        self.vistos = set()
+        self.desde = 0
+        self.devueltos = 0
+        self.mejor_precio = None
+        self.tandas_sin_mejora = 0
+        self.motivo = None
+
+    @property
+    def terminado(self):
+        return self.motivo is not None
+
+    # Generador con los itinerarios nuevos que han aparecido desde la ultima llamada
+    def cosechar(self, browser):
+        if self.terminado:
+            return
+
+        inicio = perf_counter()
+        total, html = capturar_itinerarios(browser, desde=self.desde)
+        if total < self.desde:
+            # La lista se ha vuelto a pintar desde cero: la recorremos entera y la deduplicacion hace el resto
+            total, html = capturar_itinerarios(browser, desde=0)
+        capturado = perf_counter()
+        self.desde = total
+        nuevos = parsear_itinerarios(html, backend=self.parser) if html else []
+        ESTADISTICAS.registrar(
+            "incremental",
+            len(html.encode("utf-8")),
+            capturado - inicio,
+            perf_counter() - capturado,
+        )
+
+        precios_tanda = []
+        mejora = False
+        for itinerario in nuevos:
+            # El precio va en la clave: el mismo vuelo con otra tarifa es otro resultado (si no, se podria perder
+            # la mas barata). Solo se descartan las tarjetas repetidas al volver a pintarse la lista
+            clave = (itinerario.identidad(), itinerario.precio)
+            if clave in self.vistos:
+                continue
+            self.vistos.add(clave)
+
+            precio = precio_numerico(itinerario.precio)
+            if precio is not None:
+                precios_tanda.append(precio)
+                if self.precio_maximo is not None and precio > self.precio_maximo:
+                    continue
+                if self.mejor_precio is None or precio < self.mejor_precio:
+                    self.mejor_precio = precio
+                    mejora = True
+
+            yield itinerario
+            self.devueltos += 1
+            if (
+                self.max_resultados is not None
+                and self.devueltos >= self.max_resultados
+            ):
+                self.motivo = f"alcanzados {self.max_resultados} resultados"
+                return
+
+        if not precios_tanda:
+            return
+
+        if self.precio_maximo is not None and min(precios_tanda) > self.precio_maximo:
+            self.motivo = f"toda la tanda supera el precio maximo {self.precio_maximo}"
+        elif self.pasos_sin_mejora is not None:
+            self.tandas_sin_mejora = 0 if mejora else self.tandas_sin_mejora + 1
+            if self.tandas_sin_mejora >= self.pasos_sin_mejora:
+                self.motivo = (
+                    f"{self.tandas_sin_mejora} tandas seguidas sin precios mas baratos"
+                )
@@ -0,0 +1,443 @@
+import ipaddress
+import json
+import sqlite3
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+
+from metricas import METRICAS
+
+FICHERO_COLA = "cola_tareas.sqlite"
+
+# Segundos que un trabajador tiene arrendada una tarea sin dar señales de vida antes de que vuelva a la cola
+PLAZO_ARRIENDO = 300
+
+# Veces que se entrega una tarea (arriendos caducados incluidos) antes de darla por fallida
+MAX_INTENTOS = 3
+
+# Estados de una tarea:
+# pendiente -> arrendada (un trabajador la esta haciendo) -> hecha (resultado guardado) -> volcada (filas en el dataset)
+# fallida: ha agotado los intentos
+ESTADOS = ("pendiente", "arrendada", "hecha", "volcada", "fallida")
+
+COLUMNAS_TAREA = ("id", "tipo", "origen", "inicio", "fin", "destino")
+
+
+class ColaTareas:
+    """
+    Cola de tareas con arriendo (SQLite) para repartir un scrapeo entre varios procesos y maquinas.
+    Hay dos tipos de tarea: "descubrir" (destinos de un origen + fechas) y "ruta" (itinerarios de un destino).
+    Al completar una tarea de descubrir se encolan las rutas de sus destinos. Un trabajador arrienda una tarea por
+    `plazo` segundos y la renueva con latidos; si muere, el arriendo caduca y la tarea vuelve a la cola.
+    :param fichero: Fichero SQLite de la cola.
+    :param plazo: Segundos de cada arriendo.
+    :param max_intentos: Entregas de una tarea antes de darla por fallida.
+    :param reanudar: Si es False se vacia la cola al abrirla.
+    """
+
+    def __init__(
+        self,
+        fichero=FICHERO_COLA,
+        plazo=PLAZO_ARRIENDO,
+        max_intentos=MAX_INTENTOS,
+        reanudar=False,
+    ):
+        self.fichero = fichero
+        self.plazo = plazo
+        self.max_intentos = max_intentos
+        self._lock = threading.Lock()
+        # isolation_level=None: las transacciones se abren a mano con BEGIN IMMEDIATE (varios procesos sobre el mismo fichero)
+        self._conexion = sqlite3.connect(
+            fichero, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS tareas ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, tipo TEXT NOT NULL, "
+            "origen TEXT NOT NULL, inicio TEXT NOT NULL, fin TEXT NOT NULL, destino TEXT NOT NULL, "
+            "estado TEXT NOT NULL DEFAULT 'pendiente', trabajador TEXT, vence REAL, "
+            "intentos INTEGER NOT NULL DEFAULT 0, resultado TEXT, error TEXT, "
+            "UNIQUE (tipo, origen, inicio, fin, destino))"
+        )
+        self._conexion.execute(
+            "CREATE INDEX IF NOT EXISTS tareas_estado ON tareas (estado, tipo)"
+        )
+        # Volcados empezados y sin marcar: donde se escribieron, para poder borrarlos al reanudar
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS volcados ("
+            "lote TEXT PRIMARY KEY, directorio TEXT NOT NULL, historico TEXT, empezado REAL NOT NULL)"
+        )
+        if not reanudar:
+            self._conexion.execute("DELETE FROM tareas")
+            self._conexion.execute("DELETE FROM volcados")
+
+        self.stats = {"arriendos": 0, "caducados": 0, "reintentos": 0}
+
+    # Ejecuta una funcion (cursor -> valor) dentro de una transaccion de escritura
+    def _transaccion(self, funcion):
+        with self._lock:
+            self._conexion.execute("BEGIN IMMEDIATE")
+            try:
+                valor = funcion(self._conexion)
+            except BaseException:
+                self._conexion.execute("ROLLBACK")
+                raise
+            self._conexion.execute("COMMIT")
+            return valor
+
+    # Encola una tarea de descubrir por cada (origen, inicio, fin); las que ya existan no se tocan
+    def encolar_pares(self, pares):
+        def encolar(conexion):
+            conexion.executemany(
+                "INSERT OR IGNORE INTO tareas (tipo, origen, inicio, fin, destino) "
+                "VALUES ('descubrir', ?, ?, ?, '')",
+                list(pares),
+            )
+
+        self._transaccion(encolar)
+
+    # Devuelve a la cola las tareas con el arriendo caducado (o las da por fallidas si ya no les quedan intentos)
+    def _liberar_caducadas(self, conexion, ahora):
+        conexion.execute(
+            "UPDATE tareas SET estado = 'fallida', error = 'arriendo caducado' "
+            "WHERE estado = 'arrendada' AND vence < ? AND intentos >= ?",
+            (ahora, self.max_intentos),
+        )
+        caducadas = conexion.execute(
+            "UPDATE tareas SET estado = 'pendiente', trabajador = NULL, vence = NULL "
+            "WHERE estado = 'arrendada' AND vence < ?",
+            (ahora,),
+        ).rowcount
+        self.stats["caducados"] += caducadas
+
+    def arrendar(self, trabajador):
+        """
+        Entrega la siguiente tarea pendiente (primero las de descubrir, que generan mas trabajo).
+        :param trabajador: Identificador del trabajador.
+        :return: Dict con la tarea y el plazo del arriendo, o None si no hay ninguna pendiente.
+        """
+
+        def arrendar(conexion):
+            ahora = time()
+            self._liberar_caducadas(conexion, ahora)
+            fila = conexion.execute(
+                f"SELECT {', '.join(COLUMNAS_TAREA)} FROM tareas WHERE estado = 'pendiente' "
+                "ORDER BY tipo = 'ruta', id LIMIT 1"
+            ).fetchone()
+            if fila is None:
+                return None
+            conexion.execute(
+                "UPDATE tareas SET estado = 'arrendada', trabajador = ?, vence = ?, intentos = intentos + 1 "
+                "WHERE id = ?",
+                (trabajador, ahora + self.plazo, fila[0]),
+            )
+            self.stats["arriendos"] += 1
+            return dict(zip(COLUMNAS_TAREA, fila), plazo=self.plazo)
+
+        return self._transaccion(arrendar)
+
+    # Renueva el arriendo de una tarea. Devuelve False si el trabajador ya no la tiene (ha caducado y es de otro)
+    def latido(self, id_tarea, trabajador):
+        return self._transaccion(
+            lambda conexion: conexion.execute(
+                "UPDATE tareas SET vence = ? "
+                "WHERE id = ? AND trabajador = ? AND estado = 'arrendada'",
+                (time() + self.plazo, id_tarea, trabajador),
+            ).rowcount
+            == 1
+        )
+
+    def completar(self, id_tarea, trabajador, resultado):
+        """
+        Guarda el resultado de una tarea: la lista de destinos (descubrir) o de itinerarios (ruta).
+        Si la tarea ya la ha completado otro trabajador (arriendo caducado y repetido) se descarta el resultado.
+        :return: True si se ha aceptado el resultado.
+        """
+
+        def completar(conexion):
+            fila = conexion.execute(
+                "SELECT tipo, origen, inicio, fin FROM tareas "
+                "WHERE id = ? AND estado IN ('pendiente', 'arrendada')",
+                (id_tarea,),
+            ).fetchone()
+            if fila is None:
+                return False
+            tipo, origen, inicio, fin = fila
+            conexion.execute(
+                "UPDATE tareas SET estado = 'hecha', trabajador = ?, resultado = ?, error = NULL "
+                "WHERE id = ?",
+                (trabajador, json.dumps(resultado), id_tarea),
+            )
+            if tipo == "descubrir":
+                conexion.executemany(
+                    "INSERT OR IGNORE INTO tareas (tipo, origen, inicio, fin, destino) "
+                    "VALUES ('ruta', ?, ?, ?, ?)",
+                    [(origen, inicio, fin, destino) for destino in resultado],
+                )
+            return True
+
+        return self._transaccion(completar)
+
+    # Apunta el fallo de una tarea: vuelve a la cola si le quedan intentos y si no queda fallida
+    def fallar(self, id_tarea, trabajador, error):
+        def fallar(conexion):
+            fila = conexion.execute(
+                "SELECT intentos FROM tareas WHERE id = ? AND trabajador = ? AND estado = 'arrendada'",
+                (id_tarea, trabajador),
+            ).fetchone()
+            if fila is None:
+                return False
+            estado = "fallida" if fila[0] >= self.max_intentos else "pendiente"
+            if estado == "pendiente":
+                self.stats["reintentos"] += 1
+                METRICAS.contar("reintentos", componente="cola")
+            conexion.execute(
+                "UPDATE tareas SET estado = ?, trabajador = NULL, vence = NULL, error = ? WHERE id = ?",
+                (estado, str(error), id_tarea),
+            )
+            return True
+
+        return self._transaccion(fallar)
+
+    def recoger(self, limite=1000):
+        """
+        Rutas completadas pendientes de volcar al dataset.
+        :return: Lista de (tarea, itinerarios).
+        """
+        with self._lock:
+            filas = self._conexion.execute(
+                f"SELECT {', '.join(COLUMNAS_TAREA)}, resultado FROM tareas "
+                "WHERE tipo = 'ruta' AND estado = 'hecha' ORDER BY id LIMIT ?",
+                (limite,),
+            ).fetchall()
+        return [
+            (dict(zip(COLUMNAS_TAREA, fila)), json.loads(fila[-1])) for fila in filas
+        ]
+
+    # Apunta un volcado antes de escribirlo (ver scraper_edreams.volcar_lote). Devuelve el identificador del lote
+    def iniciar_volcado(self, directorio, fichero_historico=None):
+        lote = uuid.uuid4().hex
+        self._transaccion(
+            lambda conexion: conexion.execute(
+                "INSERT INTO volcados VALUES (?, ?, ?, ?)",
+                (lote, directorio, fichero_historico, time()),
+            )
+        )
+        return lote
+
+    # Volcados que se empezaron y no se marcaron: (lote, directorio, fichero_historico)
+    def volcados_pendientes(self):
+        with self._lock:
+            return self._conexion.execute(
+                "SELECT lote, directorio, historico FROM volcados ORDER BY empezado"
+            ).fetchall()
+
+    def descartar_volcado(self, lote):
+        self._transaccion(
+            lambda conexion: conexion.execute(
+                "DELETE FROM volcados WHERE lote = ?", (lote,)
+            )
+        )
+
+    # Marca las tareas como volcadas y cierra su volcado en la misma transaccion
+    def marcar_volcadas(self, ids, lote=None):
+        def marcar(conexion):
+            conexion.executemany(
+                "UPDATE tareas SET estado = 'volcada', resultado = NULL WHERE id = ?",
+                [(id_tarea,) for id_tarea in ids],
+            )
+            if lote is not None:
+                conexion.execute("DELETE FROM volcados WHERE lote = ?", (lote,))
+
+        self._transaccion(marcar)
+
+    # True cuando ya no queda nada pendiente ni arrendado (lo hecho puede estar aun sin volcar)
+    def terminada(self):
+        with self._lock:
+            return (
+                self._conexion.execute(
+                    "SELECT COUNT(*) FROM tareas WHERE estado IN ('pendiente', 'arrendada')"
+                ).fetchone()[0]
+                == 0
+            )
+
+    def informe(self):
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT tipo, estado, COUNT(*) FROM tareas GROUP BY tipo, estado"
+            ).fetchall()
+            stats = dict(self.stats)
+        for tipo in ("descubrir", "ruta"):
+            stats[tipo] = {estado: 0 for estado in ESTADOS}
+        for tipo, estado, cantidad in filas:
+            stats[tipo][estado] = cantidad
+        return stats
+
+    def fallidas(self):
+        with self._lock:
+            return self._conexion.execute(
+                "SELECT tipo, origen, inicio, fin, destino, intentos, error FROM tareas "
+                "WHERE estado = 'fallida' ORDER BY id"
+            ).fetchall()
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+
+class ManejadorCola(BaseHTTPRequestHandler):
+    """
+    Api http de la cola para los trabajadores de otras maquinas: POST /<operacion> con los argumentos en json.
+    Operaciones: arrendar, latido, completar, fallar, estado.
+    """
+
+    cola = None
+    token = None
+
+    def _enviar_json(self, codigo, datos):
+        contenido = json.dumps(datos).encode("utf-8")
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(contenido)))
+        self.end_headers()
+        self.wfile.write(contenido)
+
+    def do_POST(self):
+        if self.token and self.headers.get("Authorization") != f"Bearer {self.token}":
+            self._enviar_json(401, {"error": "unauthorized"})
+            return
+        # Un cuerpo que no es json o al que le faltan argumentos es un error del cliente, no del coordinador
+        try:
+            longitud = int(self.headers.get("Content-Length") or 0)
+            argumentos = json.loads(self.rfile.read(longitud) or b"{}")
+            if not isinstance(argumentos, dict):
+                raise ValueError("el cuerpo tiene que ser un objeto json")
+            respuesta = self._operar(self.path.strip("/"), argumentos)
+        except (ValueError, KeyError, TypeError) as exception:
+            self._enviar_json(400, {"error": f"bad request: {exception}"})
+            return
+        if respuesta is None:
+            self._enviar_json(404, {"error": f"unknown operation {self.path}"})
+            return
+        self._enviar_json(200, respuesta)
+
+    # Ejecuta una operacion de la cola. Devuelve None si no existe
+    def _operar(self, operacion, argumentos):
+        if operacion == "arrendar":
+            respuesta = {"tarea": self.cola.arrendar(argumentos["trabajador"])}
+        elif operacion == "latido":
+            respuesta = {
+                "ok": self.cola.latido(argumentos["id"], argumentos["trabajador"])
+            }
+        elif operacion == "completar":
+            respuesta = {
+                "ok": self.cola.completar(
+                    argumentos["id"], argumentos["trabajador"], argumentos["resultado"]
+                )
+            }
+        elif operacion == "fallar":
+            respuesta = {
+                "ok": self.cola.fallar(
+                    argumentos["id"], argumentos["trabajador"], argumentos["error"]
+                )
+            }
+        elif operacion == "estado":
+            respuesta = {"terminada": self.cola.terminada(), **self.cola.informe()}
+        else:
+            return None
+        return respuesta
+
+    def log_message(self, format, *args):
+        return
+
+
+# True si el host solo es accesible desde la propia maquina
+def es_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def arrancar_cola(cola, host="127.0.0.1", puerto=0, token=None):
+    """
+    Arranca en segundo plano la api http de una cola.
+    :param cola: ColaTareas a servir.
+    :param host: Interfaz donde escuchar ("0.0.0.0" para trabajadores de otras maquinas).
+    :param puerto: Puerto donde escuchar. Con 0 se elige uno libre.
+    :param token: Los trabajadores tienen que enviarlo como "Authorization: Bearer <token>". Obligatorio si se
+        escucha fuera de loopback: cualquiera que llegue al puerto podria completar tareas con datos falsos.
+    :return: El servidor; su url es f"http://{host}:{servidor.server_port}".
+    """
+    if not token and not es_loopback(host):
+        raise ValueError(f"hace falta un token para escuchar en {host}")
+    manejador = type("Manejador", (ManejadorCola,), {"cola": cola, "token": token})
+    servidor = ThreadingHTTPServer((host, puerto), manejador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+class ClienteCola:
+    """
+    Cliente de la api http de la cola, con las mismas operaciones que ColaTareas que usan los trabajadores.
+    Cada hilo usa su propia sesion http (requests.Session no es segura entre hilos).
+    :param url: Url del coordinador (p.e. http://10.0.0.5:8770).
+    :param token: Token del coordinador, si lo tiene.
+    """
+
+    def __init__(self, url, token=None, timeout=30):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.token = token
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sesiones = []
+
+    # Sesion http del hilo actual (se crea la primera vez que la pide)
+    def _sesion(self):
+        import requests
+
+        sesion = getattr(self._local, "sesion", None)
+        if sesion is None:
+            sesion = requests.Session()
+            if self.token:
+                sesion.headers["Authorization"] = f"Bearer {self.token}"
+            self._local.sesion = sesion
+            with self._lock:
+                self._sesiones.append(sesion)
+        return sesion
+
+    def _llamar(self, operacion, **argumentos):
+        response = self._sesion().post(
+            f"{self.url}/{operacion}", json=argumentos, timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def arrendar(self, trabajador):
+        return self._llamar("arrendar", trabajador=trabajador)["tarea"]
+
+    def latido(self, id_tarea, trabajador):
+        return self._llamar("latido", id=id_tarea, trabajador=trabajador)["ok"]
+
+    def completar(self, id_tarea, trabajador, resultado):
+        return self._llamar(
+            "completar", id=id_tarea, trabajador=trabajador, resultado=resultado
+        )["ok"]
+
+    def fallar(self, id_tarea, trabajador, error):
+        return self._llamar(
+            "fallar", id=id_tarea, trabajador=trabajador, error=str(error)
+        )["ok"]
+
+    def terminada(self):
+        return self._llamar("estado")["terminada"]
+
+    def cerrar(self):
+        with self._lock:
+            sesiones, self._sesiones = self._sesiones, []
+        for sesion in sesiones:
+            sesion.close()
@@ -0,0 +1,185 @@
+import argparse
+import glob
+import os
+import uuid
+from datetime import date
+
+# Directorio por defecto del dataset de vuelos scrapeados
+DIRECTORIO_DATOS = "datos"
+
+# Columnas de particion: dia del scrapeo, origen y mes de salida (datos/fecha_scrapeo=.../origen=MAD/mes_salida=2025-12/)
+PARTICIONES = ["fecha_scrapeo", "origen", "mes_salida"]
+
+COMPRESION = "zstd"
+
+
+# pyarrow se importa dentro de cada funcion: importar el modulo (p.e. desde el scraper) no debe cargarlo
+def _esquema_particiones():
+    import pyarrow as pa
+
+    return pa.schema([(columna, pa.string()) for columna in PARTICIONES])
+
+
+def _particionado():
+    import pyarrow.dataset as ds
+
+    return ds.partitioning(_esquema_particiones(), flavor="hive")
+
+
+def escribir_dataset(df, directorio=DIRECTORIO_DATOS, fecha_scrapeo=None, lote=None):
+    """
+    Añade las filas del df (tipado con normalizar_df) al dataset Parquet particionado.
+    Cada llamada escribe ficheros nuevos, asi que se puede llamar tantas veces como lotes haya sin reescribir nada.
+    :param df: DataFrame tipado.
+    :param directorio: Directorio raiz del dataset.
+    :param fecha_scrapeo: Dia del scrapeo (YYYY-MM-DD). Por defecto hoy.
+    :param lote: Identificador de la escritura (va en el nombre de sus ficheros, ver borrar_lote). Por defecto uno nuevo.
+    :return: Numero de filas escritas.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    if df.empty:
+        return 0
+
+    df = df.copy()
+    df["fecha_scrapeo"] = fecha_scrapeo or date.today().isoformat()
+    df["origen"] = df["origen"].astype(str)
+    df["mes_salida"] = df["fecha_inicio"].dt.strftime("%Y-%m").fillna("desconocido")
+
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    ds.write_dataset(
+        tabla,
+        directorio,
+        format="parquet",
+        partitioning=_particionado(),
+        # Nombre unico por escritura: se añaden ficheros a las particiones existentes en vez de pisarlos
+        basename_template=f"parte-{lote or uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        file_options=ds.ParquetFileFormat().make_write_options(compression=COMPRESION),
+    )
+    return len(df)
+
+
+# Borra los ficheros de una escritura que no llego a terminar (o a apuntarse). Devuelve el numero de ficheros borrados
+def borrar_lote(directorio, lote):
+    ficheros = glob.glob(
+        os.path.join(glob.escape(directorio), "**", f"parte-{lote}-*.parquet"),
+        recursive=True,
+    )
+    for fichero in ficheros:
+        os.remove(fichero)
+    return len(ficheros)
+
+
+# Esquema comun de todos los ficheros del dataset: admite columnas nuevas (nulas en los ficheros antiguos) y tipos ampliados.
+# Los tipos de pandas se toman del fichero mas reciente: los de uno antiguo volverian a estrechar un tipo ampliado
+def _esquema_unificado(directorio):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(directorio, format="parquet", partitioning=_particionado())
+    fragmentos = sorted(dataset.get_fragments(), key=lambda f: os.path.getmtime(f.path))
+    esquemas = [fragmento.physical_schema for fragmento in fragmentos]
+    esquema = pa.unify_schemas(
+        esquemas + [_esquema_particiones()], promote_options="permissive"
+    )
+    return esquema.with_metadata(esquemas[-1].metadata) if esquemas else esquema
+
+
+# Filtro sobre las columnas de particion (None si no hay ninguna condicion)
+def _filtro(origenes=None, meses=None, desde=None, hasta=None):
+    import pyarrow.dataset as ds
+
+    condiciones = []
+    if origenes:
+        condiciones.append(ds.field("origen").isin(list(origenes)))
+    if meses:
+        condiciones.append(ds.field("mes_salida").isin(list(meses)))
+    if desde:
+        condiciones.append(ds.field("fecha_scrapeo") >= desde)
+    if hasta:
+        condiciones.append(ds.field("fecha_scrapeo") <= hasta)
+    filtro = None
+    for condicion in condiciones:
+        filtro = condicion if filtro is None else filtro & condicion
+    return filtro
+
+
+def leer_dataset(
+    directorio=DIRECTORIO_DATOS,
+    columnas=None,
+    origenes=None,
+    meses=None,
+    desde=None,
+    hasta=None,
+):
+    """
+    Lee el dataset como DataFrame, leyendo solo las particiones y columnas necesarias.
+    :param columnas: Columnas a leer. Por defecto todas.
+    :param origenes: Codigos IATA de origen (poda particiones origen=).
+    :param meses: Meses de salida YYYY-MM (poda particiones mes_salida=).
+    :param desde: Primer dia de scrapeo YYYY-MM-DD (poda particiones fecha_scrapeo=).
+    :param hasta: Ultimo dia de scrapeo YYYY-MM-DD.
+    :return: DataFrame con las filas que cumplen los filtros.
+    """
+    import pyarrow.dataset as ds
+
+    if not os.path.isdir(directorio):
+        raise FileNotFoundError(f"No existe el dataset {directorio}")
+
+    dataset = ds.dataset(
+        directorio,
+        format="parquet",
+        partitioning=_particionado(),
+        schema=_esquema_unificado(directorio),
+    )
+
+    filtro = _filtro(origenes=origenes, meses=meses, desde=desde, hasta=hasta)
+    return dataset.to_table(columns=columnas, filter=filtro).to_pandas()
+
+
+# Ficheros que habria que leer para unos filtros (para comprobar la poda de particiones)
+def ficheros_dataset(directorio=DIRECTORIO_DATOS, **filtros):
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(directorio, format="parquet", partitioning=_particionado())
+    return [
+        fragmento.path for fragmento in dataset.get_fragments(filter=_filtro(**filtros))
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Query the partitioned flights dataset"
+    )
+    parser.add_argument(
+        "--dir",
+        type=str,
+        default=DIRECTORIO_DATOS,
+        help=f"Dataset directory. Default: {DIRECTORIO_DATOS}",
+    )
+    parser.add_argument(
+        "--sources", type=str, nargs="*", help="Origin IATA codes, e.g. MAD BCN"
+    )
+    parser.add_argument(
+        "--months", type=str, nargs="*", help="Departure months, e.g. 2025-12"
+    )
+    parser.add_argument(
+        "--since", type=str, default=None, help="First scrape day (YYYY-MM-DD)"
+    )
+    parser.add_argument(
+        "--until", type=str, default=None, help="Last scrape day (YYYY-MM-DD)"
+    )
+    parser.add_argument(
+        "--columns", type=str, nargs="*", help="Columns to read. Default: all"
+    )
+    args = parser.parse_args()
+
+    filtros = dict(
+        origenes=args.sources, meses=args.months, desde=args.since, hasta=args.until
+    )
+    ficheros = ficheros_dataset(args.dir, **filtros)
+    df = leer_dataset(args.dir, columnas=args.columns, **filtros)
+    print(f"{len(ficheros)} ficheros leidos, {len(df)} filas")
+    print(df)
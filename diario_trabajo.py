@@ -0,0 +1,316 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from collections import Counter
+from time import time
+
+from registros import deserializar, serializar
+
+FICHERO_DIARIO = "diario_trabajo.sqlite"
+
+# Estados de una unidad (origen, fechas, destino):
+# pendiente -> scrapeada (itinerarios guardados en el diario) -> volcada (filas escritas en el dataset)
+# fallida: el scrapeo ha fallado y se reintenta al reanudar
+# De cada unidad scrapeada se van escribiendo sus filas en orden (volcadas = las primeras que ya estan en el dataset)
+ESTADOS = ("pendiente", "scrapeada", "volcada", "fallida")
+
+
+# Generador con los itinerarios que no estan entre los ya escritos (cada escrito descuenta una sola aparicion)
+def descontar(escritos, itinerarios):
+    cuenta = Counter(json.dumps(serializar(itinerario)) for itinerario in escritos)
+    for itinerario in itinerarios:
+        if cuenta:
+            clave = json.dumps(serializar(itinerario))
+            if cuenta[clave] > 0:
+                cuenta[clave] -= 1
+                if not cuenta[clave]:
+                    del cuenta[clave]
+                continue
+        yield itinerario
+
+
+class DiarioTrabajo:
+    """
+    Diario (SQLite) de un trabajo de scrapeo: apunta los destinos descubiertos de cada origen + fechas, el estado de
+    cada unidad (origen, fechas, destino) y los itinerarios ya scrapeados, para poder reanudar un trabajo interrumpido
+    sin repetir lo hecho: las unidades volcadas se saltan, las scrapeadas se vuelcan desde el diario (solo las filas
+    que faltan) y las pendientes o fallidas se vuelven a scrapear.
+    Cada volcado se apunta antes de escribir (iniciar_volcado) y se cierra al apuntar sus filas (registrar_volcado):
+    si el trabajo se corta en medio, al reanudar se deshace lo que llegara a escribir y no se duplican filas.
+    :param fichero: Fichero SQLite del diario.
+    :param reanudar: Si es False se empieza un trabajo nuevo y se descarta lo que hubiera en el diario.
+    """
+
+    def __init__(self, fichero=FICHERO_DIARIO, reanudar=False):
+        self.fichero = fichero
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(fichero, check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS pares ("
+            "origen TEXT, inicio TEXT, fin TEXT, destinos TEXT, error TEXT, actualizado REAL NOT NULL, "
+            "PRIMARY KEY (origen, inicio, fin))"
+        )
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS unidades ("
+            "origen TEXT, inicio TEXT, fin TEXT, destino TEXT, estado TEXT NOT NULL, "
+            "intentos INTEGER NOT NULL DEFAULT 0, itinerarios TEXT, filas INTEGER, "
+            "volcadas INTEGER NOT NULL DEFAULT 0, error TEXT, actualizado REAL NOT NULL, "
+            "PRIMARY KEY (origen, inicio, fin, destino))"
+        )
+        # Volcados empezados y sin apuntar: donde se escribieron, para poder borrarlos
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS volcados ("
+            "lote TEXT PRIMARY KEY, directorio TEXT NOT NULL, historico TEXT, empezado REAL NOT NULL)"
+        )
+        if not reanudar:
+            self._conexion.execute("DELETE FROM unidades")
+            self._conexion.execute("DELETE FROM pares")
+            self._conexion.execute("DELETE FROM volcados")
+        self._conexion.commit()
+
+    def iniciar_volcado(self, directorio, fichero_historico=None):
+        """
+        Apunta un volcado antes de escribirlo.
+        :param directorio: Dataset donde se van a escribir las filas.
+        :param fichero_historico: Historico de precios donde se van a añadir, si hay.
+        :return: Identificador del lote, con el que se escriben las filas y se cierra el volcado.
+        """
+        lote = uuid.uuid4().hex
+        with self._lock:
+            self._conexion.execute(
+                "INSERT INTO volcados VALUES (?, ?, ?, ?)",
+                (lote, directorio, fichero_historico, time()),
+            )
+            self._conexion.commit()
+        return lote
+
+    # Volcados que se empezaron y no se apuntaron: (lote, directorio, fichero_historico)
+    def volcados_pendientes(self):
+        with self._lock:
+            return self._conexion.execute(
+                "SELECT lote, directorio, historico FROM volcados ORDER BY empezado"
+            ).fetchall()
+
+    # Olvida un volcado ya deshecho
+    def descartar_volcado(self, lote):
+        with self._lock:
+            self._conexion.execute("DELETE FROM volcados WHERE lote = ?", (lote,))
+            self._conexion.commit()
+
+    def destinos(self, origen, inicio, fin):
+        """
+        Destinos apuntados para un origen + fechas.
+        :return: Lista de codigos IATA, o None si aun no se han descubierto (o el descubrimiento fallo).
+        """
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT destinos FROM pares WHERE origen = ? AND inicio = ? AND fin = ?",
+                (origen, inicio, fin),
+            ).fetchone()
+        if fila is None or fila[0] is None:
+            return None
+        return json.loads(fila[0])
+
+    # Apunta los destinos descubiertos y planifica una unidad pendiente por destino
+    def planificar(self, origen, inicio, fin, destinos):
+        ahora = time()
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO pares VALUES (?, ?, ?, ?, NULL, ?)",
+                (origen, inicio, fin, json.dumps(list(destinos)), ahora),
+            )
+            self._conexion.executemany(
+                "INSERT OR IGNORE INTO unidades (origen, inicio, fin, destino, estado, actualizado) "
+                "VALUES (?, ?, ?, ?, 'pendiente', ?)",
+                [(origen, inicio, fin, destino, ahora) for destino in destinos],
+            )
+            self._conexion.commit()
+
+    def fallar_descubrimiento(self, origen, inicio, fin, error):
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO pares VALUES (?, ?, ?, NULL, ?, ?)",
+                (origen, inicio, fin, str(error), time()),
+            )
+            self._conexion.commit()
+
+    def estado(self, origen, inicio, fin, destino):
+        """
+        Estado de una unidad.
+        :return: (estado, itinerarios). Los itinerarios solo se devuelven si la unidad esta scrapeada, y son los que
+            faltan por volcar (sin las primeras filas ya escritas en el dataset).
+        """
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT estado, itinerarios, volcadas FROM unidades "
+                "WHERE origen = ? AND inicio = ? AND fin = ? AND destino = ?",
+                (origen, inicio, fin, destino),
+            ).fetchone()
+        if fila is None:
+            return "pendiente", None
+        if fila[0] == "scrapeada":
+            return fila[0], deserializar(json.loads(fila[1])[fila[2] :])
+        return fila[0], None
+
+    def _marcar_volcadas(self):
+        self._conexion.execute(
+            "UPDATE unidades SET estado = 'volcada', itinerarios = NULL "
+            "WHERE estado = 'scrapeada' AND volcadas >= filas"
+        )
+
+    # Itinerarios de una unidad que ya estan en el dataset (las primeras filas apuntadas de un intento anterior)
+    def escritos(self, origen, inicio, fin, destino):
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT itinerarios, volcadas FROM unidades "
+                "WHERE origen = ? AND inicio = ? AND fin = ? AND destino = ?",
+                (origen, inicio, fin, destino),
+            ).fetchone()
+        if fila is None or fila[0] is None or not fila[1]:
+            return []
+        return deserializar(json.loads(fila[0])[: fila[1]])
+
+    def _guardar(self, estado, unidad, itinerarios, escritos, error=None):
+        if escritos is None:
+            escritos = self.escritos(*unidad)
+            nuevos = list(descontar(escritos, itinerarios))
+        else:
+            nuevos = list(itinerarios)
+        with self._lock:
+            self._conexion.execute(
+                "UPDATE unidades SET estado = ?, intentos = intentos + 1, itinerarios = ?, "
+                "filas = ?, error = ?, actualizado = ? "
+                "WHERE origen = ? AND inicio = ? AND fin = ? AND destino = ?",
+                (
+                    estado,
+                    json.dumps(escritos + nuevos, default=serializar),
+                    len(escritos) + len(nuevos),
+                    None if error is None else str(error),
+                    time(),
+                    *unidad,
+                ),
+            )
+            self._marcar_volcadas()
+            self._conexion.commit()
+        return nuevos
+
+    def completar(self, origen, inicio, fin, destino, itinerarios, escritos=None):
+        """
+        Guarda los itinerarios de una unidad scrapeada (si no tiene ninguno queda volcada directamente).
+        Si un intento anterior ya escribio parte de la unidad, esas filas se quedan como las primeras y de los
+        itinerarios nuevos solo se guardan los que no estaban escritos.
+        :param escritos: Itinerarios ya escritos de la unidad (escritos()), si se leyeron antes de scrapear. En ese
+            caso `itinerarios` ya vienen sin ellos (descontar()).
+        :return: Itinerarios que faltan por volcar.
+        """
+        return self._guardar(
+            "scrapeada", (origen, inicio, fin, destino), itinerarios, escritos
+        )
+
+    def fallar(
+        self, origen, inicio, fin, destino, error, itinerarios=None, escritos=None
+    ):
+        """
+        Apunta una unidad fallida, para reintentarla al reanudar.
+        :param itinerarios: Itinerarios que se llegaron a obtener (y a mandar al dataset) antes del fallo, para que
+            al reintentar no se vuelvan a escribir los que ya esten volcados.
+        :param escritos: Itinerarios ya escritos de la unidad antes de este intento (escritos()), ya descontados
+            de `itinerarios`.
+        """
+        if itinerarios is not None:
+            self._guardar(
+                "fallida",
+                (origen, inicio, fin, destino),
+                itinerarios,
+                escritos,
+                error=error,
+            )
+            return
+        with self._lock:
+            self._conexion.execute(
+                "UPDATE unidades SET estado = 'fallida', intentos = intentos + 1, error = ?, actualizado = ? "
+                "WHERE origen = ? AND inicio = ? AND fin = ? AND destino = ?",
+                (str(error), time(), origen, inicio, fin, destino),
+            )
+            self._conexion.commit()
+
+    def registrar_volcado(self, unidades, lote=None):
+        """
+        Apunta filas ya escritas en el dataset. Una unidad queda volcada cuando se han escrito todas sus filas.
+        Las filas de cada unidad tienen que escribirse en orden: son las siguientes a las ya volcadas.
+        :param unidades: Iterable con la unidad (origen, inicio, fin, destino) de cada fila escrita, o Counter con
+            las filas escritas de cada unidad (ver registros.unidades_rutas).
+        :param lote: Volcado de iniciar_volcado() al que pertenecen, que queda cerrado en la misma transaccion.
+        """
+        cuenta = Counter(unidades)
+        with self._lock:
+            self._conexion.executemany(
+                "UPDATE unidades SET volcadas = volcadas + ? "
+                "WHERE origen = ? AND inicio = ? AND fin = ? AND destino = ?",
+                [(filas, *unidad) for unidad, filas in cuenta.items()],
+            )
+            self._marcar_volcadas()
+            if lote is not None:
+                self._conexion.execute("DELETE FROM volcados WHERE lote = ?", (lote,))
+            self._conexion.commit()
+
+    def informe(self):
+        with self._lock:
+            estados = dict(
+                self._conexion.execute(
+                    "SELECT estado, COUNT(*) FROM unidades GROUP BY estado"
+                ).fetchall()
+            )
+            pares_fallidos = self._conexion.execute(
+                "SELECT COUNT(*) FROM pares WHERE destinos IS NULL"
+            ).fetchone()[0]
+        stats = {estado: estados.get(estado, 0) for estado in ESTADOS}
+        stats["descubrimientos_fallidos"] = pares_fallidos
+        return stats
+
+    # Unidades fallidas con su error, y origenes + fechas cuyos destinos no se han podido descubrir
+    def fallos(self):
+        with self._lock:
+            unidades = self._conexion.execute(
+                "SELECT origen, inicio, fin, destino, intentos, error FROM unidades "
+                "WHERE estado = 'fallida' ORDER BY origen, inicio, fin, destino"
+            ).fetchall()
+            pares = self._conexion.execute(
+                "SELECT origen, inicio, fin, error FROM pares WHERE destinos IS NULL "
+                "ORDER BY origen, inicio, fin"
+            ).fetchall()
+        return unidades, pares
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show the progress of a scrape job journal"
+    )
+    parser.add_argument(
+        "--journal",
+        type=str,
+        default=FICHERO_DIARIO,
+        help=f"Job journal file. Default: {FICHERO_DIARIO}",
+    )
+    args = parser.parse_args()
+    if not os.path.exists(args.journal):
+        parser.error(f"journal not found: {args.journal}")
+
+    diario = DiarioTrabajo(args.journal, reanudar=True)
+    print(diario.informe())
+    unidades, pares = diario.fallos()
+    for origen, inicio, fin, error in pares:
+        print(f"Descubrimiento fallido {origen} {inicio} {fin}: {error}")
+    for origen, inicio, fin, destino, intentos, error in unidades:
+        print(
+            f"Fallida {origen}-{destino} {inicio} {fin} ({intentos} intentos): {error}"
+        )
+    diario.cerrar()
@@ -0,0 +1,576 @@
+import argparse
+import json
+import os
+import socket
+import threading
+from time import sleep
+
+from cola_tareas import (
+    FICHERO_COLA,
+    MAX_INTENTOS,
+    PLAZO_ARRIENDO,
+    ClienteCola,
+    ColaTareas,
+    arrancar_cola,
+    es_loopback,
+)
+from dataset_vuelos import DIRECTORIO_DATOS
+from gobernador import GOBERNADOR
+from metricas import METRICAS, arrancar_servidor_metricas
+from registros import Ruta, deserializar
+from scraper_edreams import (
+    URL_EDREAMS,
+    URL_RESULTADOS,
+    cargar_codigos_iata_desde_url,
+    deshacer_volcados,
+    validar_codigos_iata,
+    validar_fechas,
+)
+
+PUERTO_COORDINADOR = 8770
+
+# Segundos entre volcados del coordinador y entre consultas de un trabajador sin tareas
+INTERVALO = 5
+
+# Fallos seguidos hablando con el coordinador antes de que un trabajador se rinda
+MAX_FALLOS_COORDINADOR = 12
+
+# Volcados fallidos seguidos con la cola ya terminada antes de que el coordinador lo deje para --resume
+MAX_FALLOS_VOLCADO = 3
+
+
+# Url de resultados de una tarea de ruta
+def url_tarea(tarea):
+    return URL_RESULTADOS.format(
+        url=URL_EDREAMS,
+        origen=tarea["origen"],
+        destino=tarea["destino"],
+        inicio=tarea["inicio"],
+        fin=tarea["fin"],
+    )
+
+
+# Vuelca al dataset (y a airtable) las rutas completadas por los trabajadores. Devuelve el numero de filas
+# El volcado se apunta en la cola antes de escribir: si el coordinador se corta antes de marcar las tareas como
+# volcadas, al reanudar se borra lo escrito y se vuelven a volcar sin duplicar filas
+def volcar(cola, directorio_datos=DIRECTORIO_DATOS, subidor=None, historico=None):
+    from scraper_edreams import enviar_df, volcar_lote
+
+    recogidas = cola.recoger()
+    rutas = [
+        Ruta(
+            url_tarea(tarea),
+            tarea["origen"],
+            tarea["destino"],
+            tarea["inicio"],
+            tarea["fin"],
+            deserializar(itinerarios),
+        )
+        for tarea, itinerarios in recogidas
+    ]
+    filas = sum(len(ruta) for ruta in rutas)
+    lote = None
+    if filas:
+        data_df, lote = volcar_lote(
+            rutas, cola, directorio=directorio_datos, historico=historico
+        )
+        if subidor is not None:
+            enviar_df(data_df, subidor)
+    cola.marcar_volcadas([tarea["id"] for tarea, _ in recogidas], lote=lote)
+    return filas
+
+
+def coordinar(
+    fechas,
+    origenes,
+    fichero_cola=FICHERO_COLA,
+    host="127.0.0.1",
+    puerto=PUERTO_COORDINADOR,
+    token=None,
+    plazo=PLAZO_ARRIENDO,
+    max_intentos=MAX_INTENTOS,
+    reanudar=False,
+    directorio_datos=DIRECTORIO_DATOS,
+    subir=False,
+    upsert=True,
+    intervalo=INTERVALO,
+    fichero_historico=None,
+):
+    """
+    Coordinador: encola una tarea de descubrir por origen + fechas, sirve la cola a los trabajadores y va volcando
+    al dataset las rutas que completan, hasta que no queda nada pendiente.
+    :param reanudar: Si es True se continua la cola de una ejecucion anterior en vez de empezar de cero.
+    :return: Informe final de la cola.
+    """
+    cola = ColaTareas(
+        fichero_cola, plazo=plazo, max_intentos=max_intentos, reanudar=reanudar
+    )
+    cola.encolar_pares(
+        (origen, date["from"], date["to"]) for origen in origenes for date in fechas
+    )
+
+    subidor = None
+    if subir:
+        from subida_airtable import SubidorAirtable
+
+        subidor = SubidorAirtable.desde_entorno(upsert=upsert)
+
+    historico = None
+    if fichero_historico:
+        from historico_precios import HistoricoPrecios
+
+        historico = HistoricoPrecios(fichero_historico)
+
+    if reanudar:
+        deshacer_volcados(cola, historico)
+
+    servidor = arrancar_cola(cola, host=host, puerto=puerto, token=token)
+    print(f"Coordinador escuchando en http://{host}:{servidor.server_port}")
+    fallos_volcado = 0
+    try:
+        while True:
+            terminada = cola.terminada()
+            try:
+                filas = volcar(
+                    cola,
+                    directorio_datos=directorio_datos,
+                    subidor=subidor,
+                    historico=historico,
+                )
+                fallos_volcado = 0
+            except Exception as exception:
+                # El volcado se apunto antes de escribir: se deshace lo que llegara a escribir y sus rutas siguen
+                # pendientes de volcar, para la siguiente vuelta (o para --resume si sigue fallando)
+                print(f"Fallo volcando las rutas completadas... {exception}")
+                METRICAS.contar("volcados_fallidos")
+                fallos_volcado += 1
+                try:
+                    deshacer_volcados(cola, historico)
+                except Exception as exception_deshacer:
+                    print(
+                        f"No se ha podido deshacer el volcado, se deshara con --resume... {exception_deshacer}"
+                    )
+                filas = 0
+            informe = cola.informe()
+            print(
+                f"Cola: descubrir {informe['descubrir']}, rutas {informe['ruta']}, {filas} filas volcadas"
+            )
+            # Se comprueba antes de volcar para no dejar sin volcar lo que se complete entre medias. Si el volcado
+            # ha fallado, se reintenta unas vueltas mas antes de terminar
+            if terminada and not 0 < fallos_volcado < MAX_FALLOS_VOLCADO:
+                if fallos_volcado:
+                    print(
+                        "Quedan rutas sin volcar: vuelve a lanzar el coordinador con --resume"
+                    )
+                # Se sigue escuchando un poco para que los trabajadores en espera se enteren y terminen
+                sleep(intervalo * 2)
+                break
+            sleep(intervalo)
+    finally:
+        servidor.shutdown()
+
+    informe = cola.informe()
+    for tipo, origen, inicio, fin, destino, intentos, error in cola.fallidas():
+        print(
+            f"Tarea fallida {tipo} {origen}-{destino or '*'} {inicio} {fin} ({intentos} intentos): {error}"
+        )
+    cola.cerrar()
+    if subidor is not None:
+        subidor.imprimir_informe()
+        subidor.cerrar()
+    if historico is not None:
+        print(f"Historico de precios: {historico.informe()}")
+        historico.cerrar()
+    print(f"Cola terminada: {informe}")
+    return informe
+
+
+# Hilo que renueva el arriendo de una tarea mientras se hace
+class Latido:
+    def __init__(self, cola, tarea, trabajador):
+        self.cola = cola
+        self.tarea = tarea
+        self.trabajador = trabajador
+        self._parar = threading.Event()
+        self._hilo = threading.Thread(target=self._latir, daemon=True)
+
+    def _latir(self):
+        while not self._parar.wait(self.tarea["plazo"] / 3):
+            try:
+                if not self.cola.latido(self.tarea["id"], self.trabajador):
+                    print(f"Perdido el arriendo de la tarea {self.tarea['id']}")
+                    return
+            except Exception as exception:
+                print(
+                    f"Fallo enviando el latido de la tarea {self.tarea['id']}... {exception}"
+                )
+
+    def __enter__(self):
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *excepcion):
+        self._parar.set()
+        self._hilo.join()
+
+
+# Hace una tarea con el pool de navegadores: devuelve la lista de destinos (descubrir) o de itinerarios (ruta)
+def hacer_tarea(tarea, pool, cache_destinos=None, opciones_destino=None):
+    from scraper_edreams import obtener_posibles_destinos, scrapear_destino
+
+    if tarea["tipo"] == "descubrir":
+        destinos = obtener_posibles_destinos(
+            url=URL_EDREAMS,
+            origen=tarea["origen"],
+            inicio=tarea["inicio"],
+            fin=tarea["fin"],
+            pool=pool,
+            cache=cache_destinos,
+        )
+        if destinos is None:
+            raise RuntimeError("no se ha podido cargar la rejilla de destinos")
+        return destinos
+
+    itinerarios = scrapear_destino(
+        url=url_tarea(tarea),
+        pool=pool,
+        ruta={k: tarea[k] for k in ("origen", "destino", "inicio", "fin")},
+        **(opciones_destino or {}),
+    )
+    # El resultado viaja en JSON hasta el coordinador
+    return [itinerario.a_lista() for itinerario in itinerarios]
+
+
+# Bucle de un hilo trabajador: arrienda tareas hasta que la cola termina
+def _trabajar(cola, trabajador, pool, cache_destinos, opciones_destino, intervalo):
+    fallos = 0
+    while True:
+        try:
+            tarea = cola.arrendar(trabajador)
+            if tarea is None and cola.terminada():
+                return
+            fallos = 0
+        except Exception as exception:
+            fallos += 1
+            if fallos >= MAX_FALLOS_COORDINADOR:
+                print(
+                    f"{trabajador}: el coordinador no responde, se para... {exception}"
+                )
+                return
+            sleep(intervalo)
+            continue
+        if tarea is None:
+            # Quedan tareas arrendadas por otros: si alguno muere, su tarea volvera a la cola
+            sleep(intervalo)
+            continue
+
+        with Latido(cola, tarea, trabajador):
+            try:
+                resultado = hacer_tarea(tarea, pool, cache_destinos, opciones_destino)
+            except Exception as exception:
+                print(
+                    f"{trabajador}: fallo en la tarea {tarea['tipo']} {tarea['origen']}-{tarea['destino'] or '*'}... {exception}"
+                )
+                try:
+                    cola.fallar(tarea["id"], trabajador, exception)
+                except Exception:
+                    pass
+                continue
+        try:
+            cola.completar(tarea["id"], trabajador, resultado)
+        except Exception as exception:
+            # El arriendo caducara y otro trabajador repetira la tarea
+            print(
+                f"{trabajador}: no se ha podido entregar la tarea {tarea['id']}... {exception}"
+            )
+
+
+def trabajar(
+    coordinador,
+    token=None,
+    workers=1,
+    pool_size=1,
+    max_paginas=50,
+    perfil="completo",
+    parser=None,
+    captura="contenedor",
+    ttl_destinos=24 * 3600,
+    intervalo=INTERVALO,
+    adaptativo=False,
+):
+    """
+    Trabajador: arrienda tareas del coordinador con `workers` hilos que comparten un pool de navegadores.
+    :param coordinador: Url del coordinador.
+    :param adaptativo: Si es True el gobernador adapta las rutas simultaneas (hasta `workers`) y el ritmo.
+    """
+    from functools import partial
+
+    from browser_pool import BrowserPool, crear_chrome
+    from cache_destinos import CacheDestinos
+
+    if adaptativo:
+        GOBERNADOR.configurar(maximo=workers)
+
+    cola = ClienteCola(coordinador, token=token)
+    nombre = f"{socket.gethostname()}-{os.getpid()}"
+    opciones_destino = {"parser": parser, "captura": captura}
+    cache_destinos = CacheDestinos(ttl=ttl_destinos) if ttl_destinos else None
+
+    with BrowserPool(
+        tamano=max(pool_size, workers),
+        max_paginas=max_paginas,
+        crear_navegador=partial(crear_chrome, perfil=perfil),
+    ) as pool:
+        hilos = [
+            threading.Thread(
+                target=_trabajar,
+                args=(
+                    cola,
+                    f"{nombre}-{i}",
+                    pool,
+                    cache_destinos,
+                    opciones_destino,
+                    intervalo,
+                ),
+            )
+            for i in range(workers)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        print(f"Pool de navegadores: {pool.estadisticas()}")
+    GOBERNADOR.imprimir_informe()
+    cola.cerrar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Distributed eDreams scraping: a coordinator with a leased task queue and any number of workers"
+    )
+    subparsers = parser.add_subparsers(dest="modo", required=True)
+
+    parser_coordinador = subparsers.add_parser(
+        "coordinator", help="Plan the job, serve the task queue and write the results"
+    )
+    parser_coordinador.add_argument(
+        "--dates",
+        type=str,
+        required=True,
+        help='Input dates dict (JSON). Example: \'[{"from": "2024-12-06", "to": "2025-01-10"}]\'',
+    )
+    parser_coordinador.add_argument(
+        "--sources",
+        type=str,
+        required=True,
+        help='Input sources list, IATA codes (JSON). Example: \'["MAD","VLC","BCN"]\'',
+    )
+    parser_coordinador.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Interface to listen on (0.0.0.0 for workers on other hosts). Default: 127.0.0.1",
+    )
+    parser_coordinador.add_argument(
+        "--port",
+        type=int,
+        default=PUERTO_COORDINADOR,
+        help=f"Port to listen on. Default: {PUERTO_COORDINADOR}",
+    )
+    parser_coordinador.add_argument(
+        "--queue",
+        type=str,
+        default=FICHERO_COLA,
+        help=f"SQLite task queue file. Default: {FICHERO_COLA}",
+    )
+    parser_coordinador.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue the queue of a previous coordinator instead of starting a new job",
+    )
+    parser_coordinador.add_argument(
+        "--lease",
+        type=float,
+        default=PLAZO_ARRIENDO,
+        help=f"Seconds a task stays leased without a heartbeat before it is re-queued. Default: {PLAZO_ARRIENDO}",
+    )
+    parser_coordinador.add_argument(
+        "--max-attempts",
+        type=int,
+        default=MAX_INTENTOS,
+        help=f"Leases of a task before it is marked as failed. Default: {MAX_INTENTOS}",
+    )
+    parser_coordinador.add_argument(
+        "--output-dir",
+        type=str,
+        default=DIRECTORIO_DATOS,
+        help=f"Parquet dataset the results are appended to. Default: {DIRECTORIO_DATOS}",
+    )
+    parser_coordinador.add_argument(
+        "--history",
+        type=str,
+        default=None,
+        help="Also append the results to this SQLite fare history (see historico_precios.py). Default: disabled",
+    )
+    parser_coordinador.add_argument(
+        "--upload-airtable",
+        action="store_true",
+        help="Upload the results to Airtable",
+    )
+    parser_coordinador.add_argument(
+        "--airtable-no-upsert",
+        action="store_true",
+        help="With --upload-airtable: create records instead of upserting on the 'clave' field (url + times + price), for tables without a 'clave' text field. Re-uploads then duplicate rows",
+    )
+
+    parser_trabajador = subparsers.add_parser(
+        "worker", help="Lease tasks from a coordinator and scrape them"
+    )
+    parser_trabajador.add_argument(
+        "--coordinator",
+        type=str,
+        default=f"http://127.0.0.1:{PUERTO_COORDINADOR}",
+        help=f"Coordinator url. Default: http://127.0.0.1:{PUERTO_COORDINADOR}",
+    )
+    parser_trabajador.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Tasks scraped in parallel by this process. Default: 1",
+    )
+    parser_trabajador.add_argument(
+        "--pool-size",
+        type=int,
+        default=1,
+        help="Number of browser sessions kept warm in the pool. Default: 1",
+    )
+    parser_trabajador.add_argument(
+        "--recycle-after",
+        type=int,
+        default=50,
+        help="Restart a pooled browser after this many pages. Default: 50",
+    )
+    parser_trabajador.add_argument(
+        "--browser-profile",
+        choices=["completo", "ligero"],
+        default="completo",
+        help="Browser profile (see scraper_edreams.py). Default: completo",
+    )
+    parser_trabajador.add_argument(
+        "--parser",
+        choices=["bs4", "lxml"],
+        default=None,
+        help="HTML parser backend for the results pages. Default: lxml if installed, else bs4",
+    )
+    parser_trabajador.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Adapt concurrency (up to --workers) and pacing to how the site responds, with a circuit breaker",
+    )
+    parser_trabajador.add_argument(
+        "--capture",
+        choices=["pagina", "contenedor", "itinerarios"],
+        default="contenedor",
+        help="HTML pulled from the browser. Default: contenedor",
+    )
+
+    for subparser in (parser_coordinador, parser_trabajador):
+        subparser.add_argument(
+            "--token",
+            type=str,
+            default=os.getenv("COLA_TOKEN"),
+            help="Shared secret between coordinator and workers (required for a coordinator listening beyond loopback). Default: COLA_TOKEN environment variable",
+        )
+        subparser.add_argument(
+            "--metrics-log",
+            type=str,
+            default=None,
+            help="Append a JSON line per finished stage span (and a final summary) to this file",
+        )
+        subparser.add_argument(
+            "--metrics-port",
+            type=int,
+            default=None,
+            help="Serve stage timings and counters in Prometheus text format on this port (/metrics)",
+        )
+        subparser.add_argument(
+            "--metrics-host",
+            type=str,
+            default="127.0.0.1",
+            help="Interface for --metrics-port. Default: 127.0.0.1",
+        )
+
+    args = parser.parse_args()
+
+    # Instrumentacion: log JSON de tramos y endpoint /metrics para Prometheus (coordinador o trabajador)
+    METRICAS.configurar(args.metrics_log)
+    if args.metrics_port is not None:
+        servidor_metricas = arrancar_servidor_metricas(
+            args.metrics_port, args.metrics_host
+        )
+        print(
+            f"Metricas en http://{args.metrics_host}:{servidor_metricas.server_port}/metrics"
+        )
+
+    if args.modo == "coordinator":
+        if not args.token and not es_loopback(args.host):
+            parser.error(
+                f"--token (or COLA_TOKEN) is required to listen on {args.host}"
+            )
+        try:
+            fechas = json.loads(args.dates)
+            origenes = json.loads(args.sources)
+        except ValueError as exception:
+            parser.error(f"--dates and --sources must be valid JSON: {exception}")
+        errores_fechas = validar_fechas(fechas)
+        if errores_fechas:
+            parser.error("invalid --dates: " + "; ".join(errores_fechas))
+        if not isinstance(origenes, list):
+            parser.error("--sources must be a JSON list of IATA codes")
+
+        resultados = validar_codigos_iata(origenes, cargar_codigos_iata_desde_url())
+        if len(resultados["ok"]) == 0:
+            print(
+                "No se han introducido códigos IATA válidos. Ejecute el script get_iata_codes.py para obtener la lista de codigos válidos"
+            )
+            exit(1)
+        if len(resultados["nok"]) > 0:
+            print(
+                f"Algunos origenes serán ignorados por no ser un código IATA válido: {', '.join(resultados['nok'])}"
+            )
+
+        coordinar(
+            fechas=fechas,
+            origenes=resultados["ok"],
+            fichero_cola=args.queue,
+            host=args.host,
+            puerto=args.port,
+            token=args.token,
+            plazo=args.lease,
+            max_intentos=args.max_attempts,
+            reanudar=args.resume,
+            directorio_datos=args.output_dir,
+            subir=args.upload_airtable,
+            upsert=not args.airtable_no_upsert,
+            fichero_historico=args.history,
+        )
+    else:
+        for opcion, valor in (
+            ("--workers", args.workers),
+            ("--pool-size", args.pool_size),
+            ("--recycle-after", args.recycle_after),
+        ):
+            if valor < 1:
+                parser.error(f"{opcion} must be at least 1")
+        trabajar(
+            coordinador=args.coordinator,
+            token=args.token,
+            workers=args.workers,
+            pool_size=args.pool_size,
+            max_paginas=args.recycle_after,
+            perfil=args.browser_profile,
+            parser=args.parser,
+            captura=args.capture,
+            adaptativo=args.adaptive,
+        )
+    METRICAS.imprimir_informe()
@@ -0,0 +1,184 @@
+import threading
+from time import perf_counter
+
+
+# Condicion que se cumple cuando el numero de elementos que casan con el selector deja de cambiar durante `ventana` segundos
+class ElementosEstables:
+    def __init__(self, by, selector, ventana=1.0, minimo=1):
+        self.by = by
+        self.selector = selector
+        self.ventana = ventana
+        self.minimo = minimo
+        self._ultimo = None
+        self._desde = None
+
+    def __call__(self, browser):
+        numero = len(browser.find_elements(self.by, self.selector))
+        ahora = perf_counter()
+        if numero != self._ultimo:
+            self._ultimo = numero
+            self._desde = ahora
+            return False
+        if numero >= self.minimo and ahora - self._desde >= self.ventana:
+            return numero
+        return False
+
+
+# Condicion de "red inactiva": documento cargado y sin nuevas peticiones de recursos durante `ventana` segundos
+class RedInactiva:
+    SCRIPT = (
+        "return [document.readyState, "
+        "performance.getEntriesByType('resource').length];"
+    )
+
+    def __init__(self, ventana=0.5):
+        self.ventana = ventana
+        self._ultimo = None
+        self._desde = None
+
+    def __call__(self, browser):
+        estado, recursos = browser.execute_script(self.SCRIPT)
+        ahora = perf_counter()
+        if estado != "complete" or recursos != self._ultimo:
+            self._ultimo = recursos
+            self._desde = ahora
+            return False
+        return ahora - self._desde >= self.ventana
+
+
+class MotorEsperas:
+    """
+    Esperas basadas en condiciones reales de la pagina en lugar de sleep() fijos.
+    :param timeout: Tiempo maximo por defecto de cada paso, en segundos.
+    :param intervalo: Cada cuanto se comprueba la condicion.
+    :param factor: Multiplicador sobre la latencia aprendida para los pasos opcionales.
+    :param minimo: Tiempo minimo de espera de un paso opcional.
+    :param suavizado: Peso de la ultima medida en la media movil de cada paso.
+    """
+
+    def __init__(
+        self, timeout=30, intervalo=0.25, factor=3.0, minimo=2.0, suavizado=0.3
+    ):
+        self.timeout = timeout
+        self.intervalo = intervalo
+        self.factor = factor
+        self.minimo = minimo
+        self.suavizado = suavizado
+        self._pasos = {}
+        self._lock = threading.Lock()
+
+    # Timeout adaptativo de un paso: multiplo de su latencia tipica, acotado entre el minimo y el timeout.
+    # Cada timeout seguido lo reduce a la mitad, para que una condicion que ya no se cumple no cueste siempre el maximo
+    def timeout_paso(self, paso, timeout=None):
+        maximo = timeout or self.timeout
+        with self._lock:
+            datos = self._pasos.get(paso) or {"media": None, "seguidos": 0}
+            media, seguidos = datos["media"], datos["seguidos"]
+        limite = maximo if media is None else min(maximo, self.factor * media)
+        return max(self.minimo, limite / 2**seguidos)
+
+    def _registrar(self, paso, duracion, ok):
+        with self._lock:
+            datos = self._pasos.setdefault(
+                paso,
+                {
+                    "veces": 0,
+                    "total": 0.0,
+                    "maximo": 0.0,
+                    "timeouts": 0,
+                    "seguidos": 0,
+                    "media": None,
+                },
+            )
+            datos["veces"] += 1
+            datos["total"] += duracion
+            datos["maximo"] = max(datos["maximo"], duracion)
+            if ok:
+                # La latencia solo se aprende de las esperas que han terminado bien
+                datos["seguidos"] = 0
+                if datos["media"] is None:
+                    datos["media"] = duracion
+                else:
+                    datos["media"] += self.suavizado * (duracion - datos["media"])
+            else:
+                datos["timeouts"] += 1
+                datos["seguidos"] += 1
+
+    def esperar(self, browser, paso, condicion, timeout=None, opcional=False):
+        """
+        Espera a que se cumpla una condicion y registra el tiempo empleado en el paso.
+        :param opcional: Si es True, usa el timeout adaptativo y devuelve None si no se cumple
+            (p.e. banners que pueden no aparecer). Si es False, usa el timeout completo y lanza TimeoutException.
+        :return: El valor devuelto por la condicion.
+        """
+        # selenium se importa al esperar de verdad, no al cargar el modulo (arranque rapido del script)
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        limite = (
+            self.timeout_paso(paso, timeout) if opcional else (timeout or self.timeout)
+        )
+        inicio = perf_counter()
+        try:
+            resultado = WebDriverWait(
+                browser, limite, poll_frequency=self.intervalo
+            ).until(condicion)
+        except TimeoutException:
+            self._registrar(paso, perf_counter() - inicio, ok=False)
+            if opcional:
+                return None
+            raise
+        self._registrar(paso, perf_counter() - inicio, ok=True)
+        return resultado
+
+    def presente(self, browser, paso, by, selector, **kwargs):
+        from selenium.webdriver.support import expected_conditions as EC
+
+        return self.esperar(
+            browser, paso, EC.presence_of_element_located((by, selector)), **kwargs
+        )
+
+    def clicable(self, browser, paso, by, selector, **kwargs):
+        from selenium.webdriver.support import expected_conditions as EC
+
+        return self.esperar(
+            browser, paso, EC.element_to_be_clickable((by, selector)), **kwargs
+        )
+
+    def estable(self, browser, paso, by, selector, ventana=1.0, minimo=1, **kwargs):
+        return self.esperar(
+            browser, paso, ElementosEstables(by, selector, ventana, minimo), **kwargs
+        )
+
+    def red_inactiva(self, browser, paso, ventana=0.5, **kwargs):
+        return self.esperar(browser, paso, RedInactiva(ventana), **kwargs)
+
+    # Informe del tiempo de espera por paso, ordenado por el tiempo total consumido
+    def informe(self):
+        with self._lock:
+            pasos = {paso: dict(datos) for paso, datos in self._pasos.items()}
+        filas = []
+        for paso, datos in sorted(pasos.items(), key=lambda p: -p[1]["total"]):
+            filas.append(
+                {
+                    "paso": paso,
+                    "veces": datos["veces"],
+                    "total": round(datos["total"], 2),
+                    "media": round(datos["total"] / datos["veces"], 2),
+                    "maximo": round(datos["maximo"], 2),
+                    "timeouts": datos["timeouts"],
+                }
+            )
+        return filas
+
+    def imprimir_informe(self):
+        print("Tiempo de espera por paso:")
+        for fila in self.informe():
+            print(
+                f"  {fila['paso']:<30} veces={fila['veces']:<5} total={fila['total']:>8}s "
+                f"media={fila['media']:>6}s max={fila['maximo']:>6}s timeouts={fila['timeouts']}"
+            )
+
+
+# Motor compartido por todo el proceso (y por todos los workers)
+MOTOR = MotorEsperas()
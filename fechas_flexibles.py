@@ -0,0 +1,146 @@
+import os
+from datetime import date, timedelta
+
+# Directorio por defecto donde se guarda la matriz de precios de cada ruta
+DIRECTORIO_MATRICES = "matrices"
+
+
+def celdas_flexibles(inicio, fin, dias_flex, estancia_min=None, estancia_max=None):
+    """
+    Celdas (salida, regreso) de la matriz de fechas flexibles alrededor de un rango de fechas.
+    Van ordenadas de las fechas pedidas hacia fuera, anillo a anillo: la primera celda es la de las fechas pedidas
+    (si cumple la estancia), que es donde se descubren los destinos que reutiliza el resto de la matriz.
+    :param inicio: Fecha de salida pedida (YYYY-MM-DD).
+    :param fin: Fecha de regreso pedida (YYYY-MM-DD).
+    :param dias_flex: Dias que se mueven la salida y el regreso hacia delante y hacia atras.
+    :param estancia_min: Noches minimas entre salida y regreso. Por defecto 0.
+    :param estancia_max: Noches maximas entre salida y regreso. Por defecto sin limite.
+    :return: Lista de (salida, regreso) en formato YYYY-MM-DD.
+    """
+    salida_pedida = date.fromisoformat(inicio)
+    regreso_pedido = date.fromisoformat(fin)
+    celdas = []
+    for dias_salida in range(-dias_flex, dias_flex + 1):
+        for dias_regreso in range(-dias_flex, dias_flex + 1):
+            salida = salida_pedida + timedelta(days=dias_salida)
+            regreso = regreso_pedido + timedelta(days=dias_regreso)
+            estancia = (regreso - salida).days
+            if estancia < (estancia_min or 0):
+                continue
+            if estancia_max is not None and estancia > estancia_max:
+                continue
+            distancia = (
+                max(abs(dias_salida), abs(dias_regreso)),
+                abs(dias_salida) + abs(dias_regreso),
+            )
+            celdas.append((distancia, salida.isoformat(), regreso.isoformat()))
+    return [(salida, regreso) for _, salida, regreso in sorted(celdas)]
+
+
+def planificar_matrices(fechas, dias_flex, estancia_min=None, estancia_max=None):
+    """
+    Matriz de fechas flexibles de cada rango de --dates, sin repetir las celdas que compartan rangos cercanos.
+    :param fechas: Lista de rangos ({"from": "YYYY-MM-DD", "to": "YYYY-MM-DD"}).
+    :return: Lista de (rango pedido, celdas ordenadas) con cada rango pedido como (salida, regreso).
+    """
+    vistas = set()
+    matrices = []
+    for rango in fechas:
+        celdas = []
+        for celda in celdas_flexibles(
+            rango["from"], rango["to"], dias_flex, estancia_min, estancia_max
+        ):
+            if celda not in vistas:
+                vistas.add(celda)
+                celdas.append(celda)
+        matrices.append(((rango["from"], rango["to"]), celdas))
+    return matrices
+
+
+class MatrizPrecios:
+    """
+    Precio mas barato de cada ruta (origen, destino) en cada celda (salida, regreso) de la matriz de fechas
+    flexibles. Se va alimentando con cada lote del df normalizado, sin guardar los itinerarios.
+    :param pedidas: Celdas (salida, regreso) de las fechas pedidas, para comparar con la mas barata de la matriz.
+    """
+
+    def __init__(self, pedidas=()):
+        self.pedidas = set(pedidas)
+        self._precios = {}
+
+    # Añade un lote del df tipado de normalizar_df() (lo que devuelve crear_df())
+    def agregar(self, df):
+        minimos = (
+            df.groupby(
+                ["origen", "destino", "fecha_inicio", "fecha_fin"],
+                observed=True,
+            )["precio"]
+            .min()
+            .dropna()
+        )
+        for (origen, destino, salida, regreso), precio in minimos.items():
+            celdas = self._precios.setdefault((str(origen), str(destino)), {})
+            celda = (salida.strftime("%Y-%m-%d"), regreso.strftime("%Y-%m-%d"))
+            if celda not in celdas or precio < celdas[celda]:
+                celdas[celda] = int(precio)
+
+    def rutas(self):
+        return sorted(self._precios)
+
+    def matriz(self, origen, destino):
+        """
+        Matriz de precios de una ruta: una fila por fecha de salida y una columna por fecha de regreso.
+        Las celdas sin precio (fuera de la estancia, sin vuelos o sin scrapear) quedan vacias.
+        """
+        import pandas as pd
+
+        celdas = self._precios.get((origen, destino), {})
+        serie = pd.Series(
+            list(celdas.values()),
+            index=pd.MultiIndex.from_tuples(list(celdas), names=["salida", "regreso"]),
+            dtype="Int32",
+        )
+        return serie.unstack("regreso").sort_index().sort_index(axis=1)
+
+    # Guarda la matriz de cada ruta en un CSV (ORIGEN-DESTINO.csv). Devuelve el numero de ficheros
+    def guardar(self, directorio=DIRECTORIO_MATRICES):
+        os.makedirs(directorio, exist_ok=True)
+        for origen, destino in self.rutas():
+            self.matriz(origen, destino).to_csv(
+                os.path.join(directorio, f"{origen}-{destino}.csv")
+            )
+        return len(self._precios)
+
+    def resumen(self):
+        """
+        Celda mas barata de cada ruta frente al precio en las fechas pedidas.
+        :return: DataFrame ordenado por precio con la salida, el regreso y el precio de la celda mas barata, el
+            precio mas barato en las fechas pedidas y lo que se ahorra moviendo las fechas.
+        """
+        import pandas as pd
+
+        filas = []
+        for (origen, destino), celdas in self._precios.items():
+            (salida, regreso), precio = min(celdas.items(), key=lambda c: (c[1], c[0]))
+            pedidas = [celdas[celda] for celda in self.pedidas if celda in celdas]
+            precio_pedidas = min(pedidas) if pedidas else None
+            filas.append(
+                {
+                    "origen": origen,
+                    "destino": destino,
+                    "salida": salida,
+                    "regreso": regreso,
+                    "precio": precio,
+                    "precio_fechas_pedidas": precio_pedidas,
+                    "ahorro": (
+                        None if precio_pedidas is None else precio_pedidas - precio
+                    ),
+                    "celdas": len(celdas),
+                }
+            )
+        df = pd.DataFrame(filas)
+        if df.empty:
+            return df
+        for columna in ("precio_fechas_pedidas", "ahorro"):
+            df[columna] = df[columna].astype("Int32")
+        return df.sort_values(["precio", "origen", "destino"], ignore_index=True)
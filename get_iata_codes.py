@@ -1,16 +1,38 @@
-import pandas as pd
+import argparse
 
-IATA_CODES_URL = "https://raw.githubusercontent.com/ip2location/ip2location-iata-icao/refs/heads/master/iata-icao.csv"
+from indice_iata import FICHERO_INDICE_IATA, IndiceIata
 
-try:
-    df = pd.read_csv(IATA_CODES_URL)
-    df = df[["iata", "airport"]]
-    df.dropna(inplace=True)
-    df.set_index("iata", inplace=True)
-    df.sort_values(by="iata", inplace=True)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="List and search IATA airport codes from the local index"
+    )
+    parser.add_argument(
+        "--prefix", type=str, default=None, help="IATA code prefix, e.g. MA"
+    )
+    parser.add_argument(
+        "--name", type=str, default=None, help="Part of the airport name, e.g. barajas"
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Download the CSV again even if the local index is up to date",
+    )
+    parser.add_argument(
+        "--index",
+        type=str,
+        default=FICHERO_INDICE_IATA,
+        help=f"Local IATA index file. Default: {FICHERO_INDICE_IATA}",
+    )
+    args = parser.parse_args()
 
-    print(df.to_string())
+    indice = IndiceIata(args.index)
+    try:
+        if args.refresh:
+            indice.refrescar(forzar=True)
+        aeropuertos = indice.buscar(prefijo=args.prefix, nombre=args.name)
+    except Exception as e:
+        print(f"Error al cargar el indice de codigos IATA: {e}")
+        exit(1)
 
-except Exception as e:
-    print(f"Error al cargar el archivo CSV desde la URL: {e}")
-    exit(1)
+    for codigo, aeropuerto, pais, _, _ in aeropuertos:
+        print(f"{codigo}  {pais:<2}  {aeropuerto}")
@@ -0,0 +1,316 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import monotonic
+
+# Estados del cortocircuito
+CERRADO = "cerrado"
+ABIERTO = "abierto"
+SEMIABIERTO = "semiabierto"
+
+
+class Gobernador:
+    """
+    Regulador adaptativo de la concurrencia y el ritmo del scrapeo (AIMD) con cortocircuito.
+    Cada ruta se scrapea dentro de un turno. Las rutas que van bien suben el limite de rutas simultaneas
+    (suma) y van soltando la pausa entre rutas; un bloqueo (alerta de sesion), un error, un resultado truncado o una
+    ruta mucho mas lenta de lo normal para sus paginas de resultados lo recortan (multiplica) y alargan la pausa.
+    Si la tasa de fallos de las ultimas rutas supera `umbral`, el cortocircuito se abre y no se scrapea nada durante
+    `enfriamiento` segundos; despues se deja pasar una ruta de prueba y, si va bien, se vuelve a cerrar.
+    :param maximo: Rutas simultaneas como mucho (el numero de workers).
+    :param minimo: Rutas simultaneas como poco.
+    :param inicial: Limite de partida. Por defecto la mitad del maximo.
+    :param factor: Multiplicador del limite en cada recorte.
+    :param pausa_maxima: Segundos maximos de pausa entre el inicio de dos rutas.
+    :param lentitud: Una ruta cuenta como lenta si tarda por pagina de resultados mas de `lentitud` veces lo tipico:
+        lo de su propio historial o, si no lo tiene (lo normal en un trabajo, que pasa una vez por cada ruta), la
+        media por pagina de todas las rutas.
+    :param ventana: Numero de rutas recientes sobre las que se calcula la tasa de fallos.
+    :param umbral: Tasa de fallos que abre el cortocircuito.
+    :param enfriamiento: Segundos que el cortocircuito se queda abierto (se duplica si la prueba falla, hasta x8).
+    :param suavizado: Peso de la ultima medida en la media movil de la latencia.
+    :param activo: Si es False los turnos no esperan ni miden nada hasta que se llama a configurar().
+    """
+
+    def __init__(
+        self,
+        maximo=1,
+        minimo=1,
+        inicial=None,
+        factor=0.5,
+        pausa_maxima=10.0,
+        lentitud=3.0,
+        ventana=20,
+        umbral=0.5,
+        enfriamiento=60.0,
+        suavizado=0.2,
+        activo=True,
+    ):
+        self._condicion = threading.Condition()
+        self._local = threading.local()
+        self.configurar(
+            maximo=maximo,
+            minimo=minimo,
+            inicial=inicial,
+            factor=factor,
+            pausa_maxima=pausa_maxima,
+            lentitud=lentitud,
+            ventana=ventana,
+            umbral=umbral,
+            enfriamiento=enfriamiento,
+            suavizado=suavizado,
+        )
+        self.activo = activo
+
+    # (Re)configura el gobernador y lo deja activo con el estado a cero
+    def configurar(
+        self,
+        maximo=1,
+        minimo=1,
+        inicial=None,
+        factor=0.5,
+        pausa_maxima=10.0,
+        lentitud=3.0,
+        ventana=20,
+        umbral=0.5,
+        enfriamiento=60.0,
+        suavizado=0.2,
+    ):
+        with self._condicion:
+            self.maximo = max(1, maximo)
+            self.minimo = max(1, min(minimo, self.maximo))
+            self.factor = factor
+            self.pausa_maxima = pausa_maxima
+            self.lentitud = lentitud
+            self.umbral = umbral
+            self.enfriamiento_base = enfriamiento
+            self.suavizado = suavizado
+
+            self.limite = float(
+                inicial if inicial is not None else max(self.minimo, self.maximo / 2)
+            )
+            self.pausa = 0.0
+            self.en_curso = 0
+            self._ultimo_inicio = 0.0
+            self._ultimo_recorte = 0.0
+            self._resultados = deque(maxlen=ventana)
+            self._latencias = {}
+            self._latencia_global = None
+            self._latencia_pagina = None
+
+            self.circuito = CERRADO
+            self.enfriamiento = enfriamiento
+            self._abierto_hasta = 0.0
+            self._sonda = False
+
+            self.stats = {
+                "rutas": 0,
+                "ok": 0,
+                "errores": 0,
+                "bloqueos": 0,
+                "truncados": 0,
+                "lentas": 0,
+                "recortes": 0,
+                "aperturas": 0,
+                "espera": 0.0,
+            }
+        self.activo = True
+
+    def _puede_empezar(self, ahora):
+        if self.circuito == ABIERTO:
+            if ahora < self._abierto_hasta:
+                return False, self._abierto_hasta - ahora
+            # Fin del enfriamiento: se deja pasar una sola ruta de prueba
+            self.circuito = SEMIABIERTO
+            self._sonda = False
+            print("Cortocircuito semiabierto: probando con una ruta")
+        if self.circuito == SEMIABIERTO:
+            if self._sonda or self.en_curso:
+                return False, 1.0
+            return True, 0.0
+        if self.en_curso >= int(self.limite):
+            return False, None
+        espera = self._ultimo_inicio + self.pausa - ahora
+        if espera > 0:
+            return False, espera
+        return True, 0.0
+
+    @contextmanager
+    def turno(self, ruta=None):
+        """
+        Espera a que el gobernador deje empezar una ruta y mide su resultado. Dentro del turno se pueden
+        apuntar señales (senal()); una excepcion cuenta como error.
+        :param ruta: Clave de la ruta (p.e. "MAD-BCN"), para llevar su latencia tipica.
+        """
+        if not self.activo:
+            yield
+            return
+
+        entrada = monotonic()
+        with self._condicion:
+            while True:
+                ahora = monotonic()
+                puede, espera = self._puede_empezar(ahora)
+                if puede:
+                    break
+                self._condicion.wait(espera)
+            self.en_curso += 1
+            self._ultimo_inicio = ahora
+            if self.circuito == SEMIABIERTO:
+                self._sonda = True
+            self.stats["espera"] += ahora - entrada
+
+        self._local.senales = set()
+        self._local.paginas = 1
+        inicio = monotonic()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            senales = self._local.senales
+            self._local.senales = None
+            self._registrar(
+                ruta, monotonic() - inicio, error, senales, self._local.paginas
+            )
+
+    # Apunta una señal ("bloqueo" o "truncado") en la ruta que se esta scrapeando en este hilo
+    def senal(self, tipo):
+        senales = getattr(self._local, "senales", None)
+        if senales is not None:
+            senales.add(tipo)
+
+    # Apunta una pagina de resultados mas ("Mostrar más") en la ruta que se esta scrapeando en este hilo
+    def pagina(self):
+        if getattr(self._local, "senales", None) is not None:
+            self._local.paginas += 1
+
+    def _media(self, anterior, medida):
+        if anterior is None:
+            return medida
+        return anterior + self.suavizado * (medida - anterior)
+
+    def _registrar(self, ruta, latencia, error, senales, paginas=1):
+        with self._condicion:
+            self.en_curso -= 1
+            self.stats["rutas"] += 1
+
+            # Las rutas con muchas paginas de resultados tardan mas sin que la web vaya peor, asi que se compara
+            # la latencia por pagina: con el historial de la ruta si lo tiene, y si no con la media de todas
+            por_pagina = latencia / max(1, paginas)
+            tipica = self._latencias.get(ruta) if ruta is not None else None
+            if tipica is None:
+                tipica = self._latencia_pagina
+            lenta = (
+                not error and tipica is not None and por_pagina > self.lentitud * tipica
+            )
+            fallo = error or bool(senales)
+            if error:
+                self.stats["errores"] += 1
+            if "bloqueo" in senales:
+                self.stats["bloqueos"] += 1
+            if "truncado" in senales:
+                self.stats["truncados"] += 1
+            if lenta:
+                self.stats["lentas"] += 1
+
+            if not error:
+                # Solo se aprende la latencia de las rutas que terminan
+                self._latencia_global = self._media(self._latencia_global, latencia)
+                self._latencia_pagina = self._media(self._latencia_pagina, por_pagina)
+                if ruta is not None:
+                    self._latencias[ruta] = self._media(
+                        self._latencias.get(ruta), por_pagina
+                    )
+
+            if fallo or lenta:
+                self._recortar()
+            else:
+                self.stats["ok"] += 1
+                # Aumento aditivo: +1 ruta simultanea por cada "limite" rutas que van bien
+                self.limite = min(self.maximo, self.limite + 1 / self.limite)
+                # La pausa se va soltando poco a poco (por debajo de 0.1s se quita)
+                self.pausa = self.pausa * 0.9 if self.pausa > 0.1 else 0.0
+
+            self._actualizar_circuito(fallo)
+            self._condicion.notify_all()
+
+    # Recorte multiplicativo, como mucho uno por latencia tipica (una rafaga de fallos es un solo evento)
+    def _recortar(self):
+        ahora = monotonic()
+        if ahora - self._ultimo_recorte < (self._latencia_global or 0.0):
+            return
+        self._ultimo_recorte = ahora
+        self.stats["recortes"] += 1
+        self.limite = max(self.minimo, self.limite * self.factor)
+        self.pausa = min(self.pausa_maxima, max(1.0, self.pausa * 2))
+        print(
+            f"Gobernador: recorte a {int(self.limite)} rutas simultaneas y {self.pausa:.1f}s entre rutas"
+        )
+
+    def _actualizar_circuito(self, fallo):
+        if self.circuito == SEMIABIERTO:
+            if fallo:
+                self.enfriamiento = min(
+                    self.enfriamiento * 2, self.enfriamiento_base * 8
+                )
+                self._abrir()
+            else:
+                self.circuito = CERRADO
+                self.enfriamiento = self.enfriamiento_base
+                self._resultados.clear()
+                print("Cortocircuito cerrado")
+            return
+
+        self._resultados.append(fallo)
+        minimo_muestras = max(5, self._resultados.maxlen // 2)
+        if (
+            self.circuito == CERRADO
+            and len(self._resultados) >= minimo_muestras
+            and sum(self._resultados) / len(self._resultados) >= self.umbral
+        ):
+            self._abrir()
+
+    def _abrir(self):
+        self.circuito = ABIERTO
+        self._abierto_hasta = monotonic() + self.enfriamiento
+        self.limite = float(self.minimo)
+        self.stats["aperturas"] += 1
+        print(
+            f"Cortocircuito abierto: demasiados fallos, se para el scrapeo {self.enfriamiento:.0f}s"
+        )
+
+    def estado(self):
+        with self._condicion:
+            fallos = (
+                sum(self._resultados) / len(self._resultados)
+                if self._resultados
+                else 0.0
+            )
+            return {
+                "activo": self.activo,
+                "circuito": self.circuito,
+                "limite": int(self.limite),
+                "en_curso": self.en_curso,
+                "pausa": round(self.pausa, 2),
+                "tasa_fallos": round(fallos, 3),
+                "latencia_tipica": (
+                    round(self._latencia_global, 2)
+                    if self._latencia_global is not None
+                    else None
+                ),
+                **{
+                    clave: round(valor, 2) if isinstance(valor, float) else valor
+                    for clave, valor in self.stats.items()
+                },
+            }
+
+    def imprimir_informe(self):
+        if self.activo:
+            print(f"Gobernador: {self.estado()}")
+
+
+# Gobernador compartido por todo el proceso (inactivo hasta que se configura)
+GOBERNADOR = Gobernador(activo=False)
@@ -0,0 +1,484 @@
+import argparse
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from time import time
+
+FICHERO_HISTORICO = "historico_precios.sqlite"
+
+# Columnas de la tabla de tarifas, en el orden en el que se insertan. La url no se guarda: sale de la ruta y las fechas
+COLUMNAS_TARIFA = (
+    "origen",
+    "destino",
+    "salida",
+    "regreso",
+    "scrapeo",
+    "precio",
+    "moneda",
+    "aerolineas",
+    "inicio_ida",
+    "fin_ida",
+    "inicio_vuelta",
+    "fin_vuelta",
+    "escala_ida",
+    "escala_vuelta",
+    "duracion_ida",
+    "duracion_vuelta",
+    "equipaje_mano",
+    "lote",
+    "dia",
+)
+
+# Clave de una tarifa: la misma ruta, fechas, horas y precio vistos el mismo dia de scrapeo son la misma tarifa, asi
+# que volver a cargar un dia (ingerir_dataset) o un volcado no la duplica
+CLAVE_TARIFA = (
+    "origen",
+    "destino",
+    "salida",
+    "regreso",
+    "inicio_ida",
+    "fin_ida",
+    "inicio_vuelta",
+    "fin_vuelta",
+    "precio",
+    "dia",
+)
+
+# Agrupaciones de mas_baratas(): la tarifa mas barata de cada ruta con sus fechas, o de cada ruta en cualquier fecha
+AGRUPACIONES = {
+    "fechas": ("origen", "destino", "salida", "regreso"),
+    "ruta": ("origen", "destino"),
+}
+
+
+# Instante (segundos epoch) de hace `dias` dias, o None si no se indica
+def _hace_dias(dias):
+    return None if dias is None else time() - dias * 24 * 3600
+
+
+# Condiciones WHERE (con sus parametros) de las consultas a partir de los filtros que no son None
+def _condiciones(**filtros):
+    condiciones, parametros = ["precio IS NOT NULL"], []
+    operadores = {
+        "origen": "origen = ?",
+        "destino": "destino = ?",
+        "salida": "salida = ?",
+        "regreso": "regreso = ?",
+        "salida_desde": "salida >= ?",
+        "salida_hasta": "salida <= ?",
+        "desde": "scrapeo >= ?",
+    }
+    for filtro, valor in filtros.items():
+        if valor is not None:
+            condiciones.append(operadores[filtro])
+            parametros.append(valor)
+    return condiciones, parametros
+
+
+class HistoricoPrecios:
+    """
+    Historico de tarifas (SQLite) alimentado con el df normalizado de crear_df(): una fila por itinerario y scrapeo,
+    indexada por (origen, destino, salida, regreso, scrapeo), para consultar la tarifa mas barata de cada ruta, la
+    evolucion del precio de una ruta y las rutas que aparecen nuevas sin cargar el dataset entero.
+    :param fichero: Fichero SQLite del historico.
+    """
+
+    def __init__(self, fichero=FICHERO_HISTORICO):
+        self.fichero = fichero
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(fichero, check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        # Con WAL, NORMAL solo arriesga la ultima transaccion ante un corte de luz y evita un fsync por lote
+        self._conexion.execute("PRAGMA synchronous=NORMAL")
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS tarifas ("
+            "origen TEXT NOT NULL, destino TEXT NOT NULL, salida TEXT, regreso TEXT, scrapeo REAL NOT NULL, "
+            "precio INTEGER, moneda TEXT, aerolineas TEXT, inicio_ida TEXT, fin_ida TEXT, inicio_vuelta TEXT, "
+            "fin_vuelta TEXT, escala_ida INTEGER, escala_vuelta INTEGER, duracion_ida INTEGER, "
+            "duracion_vuelta INTEGER, equipaje_mano INTEGER, lote TEXT, dia TEXT)"
+        )
+        # Historicos creados antes de apuntar el lote y el dia de scrapeo de cada tarifa (al añadir el dia se quitan
+        # las tarifas repetidas que hubiera, para poder crear la clave unica)
+        columnas = {
+            fila[1]
+            for fila in self._conexion.execute("PRAGMA table_info(tarifas)").fetchall()
+        }
+        if "lote" not in columnas:
+            self._conexion.execute("ALTER TABLE tarifas ADD COLUMN lote TEXT")
+        if "dia" not in columnas:
+            self._conexion.execute("ALTER TABLE tarifas ADD COLUMN dia TEXT")
+            self._conexion.execute(
+                "UPDATE tarifas SET dia = date(scrapeo, 'unixepoch', 'localtime')"
+            )
+            self._conexion.execute(
+                "DELETE FROM tarifas WHERE rowid NOT IN ("
+                f"SELECT MIN(rowid) FROM tarifas GROUP BY {', '.join(CLAVE_TARIFA)})"
+            )
+        self._conexion.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS tarifas_clave "
+            f"ON tarifas ({', '.join(CLAVE_TARIFA)})"
+        )
+        self._conexion.execute(
+            "CREATE INDEX IF NOT EXISTS tarifas_ruta "
+            "ON tarifas (origen, destino, salida, regreso, scrapeo)"
+        )
+        self._conexion.execute(
+            "CREATE INDEX IF NOT EXISTS tarifas_scrapeo ON tarifas (scrapeo)"
+        )
+        # Primera vez que se vio cada ruta, para detectar rutas nuevas sin recorrer todas las tarifas
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS rutas ("
+            "origen TEXT, destino TEXT, primera_vez REAL NOT NULL, PRIMARY KEY (origen, destino))"
+        )
+        self._conexion.execute(
+            "CREATE INDEX IF NOT EXISTS rutas_primera_vez ON rutas (primera_vez)"
+        )
+        self._conexion.commit()
+
+    def ingerir(self, df, scrapeo=None, lote=None):
+        """
+        Añade al historico las filas del df tipado de normalizar_df() en una sola transaccion. Las tarifas que ya
+        estan en el historico (misma CLAVE_TARIFA) se ignoran.
+        :param df: DataFrame tipado (el que devuelve crear_df()).
+        :param scrapeo: Instante del scrapeo (segundos epoch). Por defecto ahora.
+        :param lote: Identificador del volcado al que pertenecen las filas, para poder deshacerlo (ver borrar_lote).
+        :return: Numero de filas añadidas.
+        """
+        import pandas as pd
+
+        from normalizacion import formatear_hora
+
+        if df.empty:
+            return 0
+        scrapeo = scrapeo or time()
+
+        # Conversion por columnas a valores de Python (textos, enteros y None) que sqlite3 inserta directamente
+        columnas = {
+            "origen": df["origen"].astype(str),
+            "destino": df["destino"].astype(str),
+            "salida": df["fecha_inicio"].dt.strftime("%Y-%m-%d"),
+            "regreso": df["fecha_fin"].dt.strftime("%Y-%m-%d"),
+            "scrapeo": scrapeo,
+            "precio": df["precio"],
+            "moneda": df["moneda"].astype(str),
+            "aerolineas": df["aerolineas"].astype(str),
+        }
+        for columna in ("inicio_ida", "fin_ida", "inicio_vuelta", "fin_vuelta"):
+            columnas[columna] = formatear_hora(df[columna])
+        for columna in (
+            "escala_ida",
+            "escala_vuelta",
+            "duracion_ida",
+            "duracion_vuelta",
+            "equipaje_mano",
+        ):
+            columnas[columna] = df[columna]
+        columnas["lote"] = lote
+        columnas["dia"] = datetime.fromtimestamp(scrapeo).strftime("%Y-%m-%d")
+        filas = pd.DataFrame(columnas, index=df.index)[list(COLUMNAS_TARIFA)]
+        filas = filas.astype(object)
+        filas = filas.where(filas.notna(), None)
+
+        with self._lock:
+            with self._conexion:
+                nuevas = self._conexion.executemany(
+                    f"INSERT OR IGNORE INTO tarifas VALUES ({', '.join('?' * len(COLUMNAS_TARIFA))})",
+                    filas.itertuples(index=False, name=None),
+                ).rowcount
+                # Al cargar dias antiguos del dataset, la primera vez de una ruta puede ir hacia atras
+                self._conexion.executemany(
+                    "INSERT INTO rutas VALUES (?, ?, ?) ON CONFLICT (origen, destino) "
+                    "DO UPDATE SET primera_vez = MIN(primera_vez, excluded.primera_vez)",
+                    filas[["origen", "destino", "scrapeo"]]
+                    .drop_duplicates(["origen", "destino"])
+                    .itertuples(index=False, name=None),
+                )
+        return nuevas
+
+    # Borra las tarifas de un volcado que no llego a terminar. La primera vez de sus rutas vuelve a ser la de las
+    # tarifas que quedan, y las rutas que solo tenian tarifas de ese volcado dejan de estar en el historico
+    def borrar_lote(self, lote):
+        with self._lock:
+            with self._conexion:
+                rutas = self._conexion.execute(
+                    "SELECT DISTINCT origen, destino FROM tarifas WHERE lote = ?",
+                    (lote,),
+                ).fetchall()
+                borradas = self._conexion.execute(
+                    "DELETE FROM tarifas WHERE lote = ?", (lote,)
+                ).rowcount
+                self._conexion.executemany(
+                    "DELETE FROM rutas WHERE origen = ? AND destino = ? AND NOT EXISTS ("
+                    "SELECT 1 FROM tarifas WHERE tarifas.origen = rutas.origen "
+                    "AND tarifas.destino = rutas.destino)",
+                    rutas,
+                )
+                self._conexion.executemany(
+                    "UPDATE rutas SET primera_vez = (SELECT MIN(scrapeo) FROM tarifas "
+                    "WHERE tarifas.origen = rutas.origen AND tarifas.destino = rutas.destino) "
+                    "WHERE origen = ? AND destino = ?",
+                    rutas,
+                )
+        return borradas
+
+    def ingerir_dataset(self, directorio, desde=None, hasta=None, origenes=None):
+        """
+        Carga en el historico lo que ya hay en el dataset Parquet (p.e. el de antes de tener historico). Como el
+        dataset solo guarda el dia del scrapeo, las filas quedan scrapeadas a las 00:00 de ese dia. Se puede volver
+        a cargar el mismo rango: las tarifas que ya estan en el historico no se duplican.
+        :param desde: Primer dia de scrapeo YYYY-MM-DD.
+        :param hasta: Ultimo dia de scrapeo YYYY-MM-DD.
+        :param origenes: Codigos IATA de origen.
+        :return: Numero de filas añadidas.
+        """
+        from dataset_vuelos import leer_dataset
+
+        df = leer_dataset(directorio, origenes=origenes, desde=desde, hasta=hasta)
+        filas = 0
+        for dia, grupo in df.groupby("fecha_scrapeo", observed=True):
+            filas += self.ingerir(
+                grupo, scrapeo=datetime.fromisoformat(dia).timestamp()
+            )
+        return filas
+
+    def _consultar(self, sql, parametros):
+        import pandas as pd
+
+        with self._lock:
+            return pd.read_sql_query(sql, self._conexion, params=parametros)
+
+    def mas_baratas(
+        self,
+        origen=None,
+        destino=None,
+        salida_desde=None,
+        salida_hasta=None,
+        dias_semana=None,
+        dias=None,
+        agrupar="fechas",
+        limite=None,
+    ):
+        """
+        Tarifa mas barata de cada ruta (p.e. MAD a cualquier destino, cada fin de semana de diciembre, en lo
+        scrapeado los ultimos 30 dias).
+        :param origen: Codigo IATA de origen. Por defecto todos.
+        :param destino: Codigo IATA de destino. Por defecto todos.
+        :param salida_desde: Primer dia de salida YYYY-MM-DD.
+        :param salida_hasta: Ultimo dia de salida YYYY-MM-DD.
+        :param dias_semana: Dias de la semana de la salida (0 lunes ... 6 domingo).
+        :param dias: Solo las tarifas scrapeadas en los ultimos `dias` dias.
+        :param agrupar: "fechas" (una fila por ruta y fechas) o "ruta" (una fila por origen y destino).
+        :param limite: Numero maximo de filas, de la mas barata a la mas cara.
+        :return: DataFrame con la tarifa mas barata de cada grupo, cuando se vio y cuantas veces se ha visto el grupo.
+        """
+        condiciones, parametros = _condiciones(
+            origen=origen,
+            destino=destino,
+            salida_desde=salida_desde,
+            salida_hasta=salida_hasta,
+            desde=_hace_dias(dias),
+        )
+        if dias_semana:
+            # strftime('%w') va de 0 (domingo) a 6 (sabado)
+            dias_sqlite = [str((dia + 1) % 7) for dia in dias_semana]
+            condiciones.append(
+                f"strftime('%w', salida) IN ({', '.join('?' * len(dias_sqlite))})"
+            )
+            parametros.extend(dias_sqlite)
+        grupo = ", ".join(AGRUPACIONES[agrupar])
+        # SQLite devuelve las columnas sueltas de la fila en la que se alcanza el MIN()
+        sql = (
+            f"SELECT origen, destino, salida, regreso, MIN(precio) AS precio, moneda, aerolineas, inicio_ida, "
+            f"inicio_vuelta, escala_ida, escala_vuelta, datetime(scrapeo, 'unixepoch', 'localtime') AS visto, "
+            f"COUNT(*) AS observaciones FROM tarifas WHERE {' AND '.join(condiciones)} "
+            f"GROUP BY {grupo} ORDER BY precio, {grupo}"
+        )
+        if limite:
+            sql += " LIMIT ?"
+            parametros.append(limite)
+        return self._consultar(sql, parametros)
+
+    def tendencia(self, origen, destino, salida=None, regreso=None, dias=None):
+        """
+        Evolucion diaria del precio de una ruta (de unas fechas concretas, o de todas las scrapeadas).
+        :param dias: Solo los ultimos `dias` dias de scrapeo.
+        :return: DataFrame con el precio minimo, medio y maximo de cada dia de scrapeo y el cambio del minimo
+            respecto al dia anterior.
+        """
+        condiciones, parametros = _condiciones(
+            origen=origen,
+            destino=destino,
+            salida=salida,
+            regreso=regreso,
+            desde=_hace_dias(dias),
+        )
+        df = self._consultar(
+            "SELECT date(scrapeo, 'unixepoch', 'localtime') AS dia, MIN(precio) AS minimo, "
+            "ROUND(AVG(precio), 1) AS media, MAX(precio) AS maximo, COUNT(*) AS tarifas "
+            f"FROM tarifas WHERE {' AND '.join(condiciones)} GROUP BY dia ORDER BY dia",
+            parametros,
+        )
+        df["cambio"] = df["minimo"].diff()
+        return df
+
+    def rutas_nuevas(self, dias=7, origen=None):
+        """
+        Rutas (origen, destino) que se han visto por primera vez en los ultimos `dias` dias.
+        :return: DataFrame con cada ruta nueva, cuando se vio por primera vez y su tarifa mas barata.
+        """
+        filtro, parametros = "", [_hace_dias(dias)]
+        if origen is not None:
+            filtro = " AND rutas.origen = ?"
+            parametros.append(origen)
+        return self._consultar(
+            "SELECT rutas.origen, rutas.destino, datetime(primera_vez, 'unixepoch', 'localtime') AS primera_vez, "
+            "MIN(precio) AS precio_minimo, COUNT(DISTINCT salida || regreso) AS fechas, COUNT(*) AS tarifas "
+            "FROM rutas JOIN tarifas ON tarifas.origen = rutas.origen AND tarifas.destino = rutas.destino "
+            f"WHERE primera_vez >= ?{filtro} GROUP BY rutas.origen, rutas.destino "
+            "ORDER BY primera_vez DESC, rutas.origen, rutas.destino",
+            parametros,
+        )
+
+    def informe(self):
+        with self._lock:
+            filas, primera, ultima = self._conexion.execute(
+                "SELECT COUNT(*), datetime(MIN(scrapeo), 'unixepoch', 'localtime'), "
+                "datetime(MAX(scrapeo), 'unixepoch', 'localtime') FROM tarifas"
+            ).fetchone()
+            rutas = self._conexion.execute("SELECT COUNT(*) FROM rutas").fetchone()[0]
+        return {"tarifas": filas, "rutas": rutas, "primera": primera, "ultima": ultima}
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the fare history")
+    parser.add_argument(
+        "--history",
+        type=str,
+        default=FICHERO_HISTORICO,
+        help=f"Fare history file. Default: {FICHERO_HISTORICO}",
+    )
+    subparsers = parser.add_subparsers(dest="consulta", required=True)
+
+    parser_ingerir = subparsers.add_parser(
+        "ingest", help="Load the partitioned Parquet dataset into the fare history"
+    )
+    parser_ingerir.add_argument(
+        "--dir", type=str, default="datos", help="Dataset directory. Default: datos"
+    )
+    parser_ingerir.add_argument(
+        "--sources", type=str, nargs="*", help="Origin IATA codes, e.g. MAD BCN"
+    )
+    parser_ingerir.add_argument(
+        "--since", type=str, default=None, help="First scrape day (YYYY-MM-DD)"
+    )
+    parser_ingerir.add_argument(
+        "--until", type=str, default=None, help="Last scrape day (YYYY-MM-DD)"
+    )
+
+    parser_baratas = subparsers.add_parser(
+        "cheapest", help="Cheapest fare per route (and dates)"
+    )
+    parser_baratas.add_argument("--source", type=str, help="Origin IATA code")
+    parser_baratas.add_argument("--destination", type=str, help="Destination IATA code")
+    parser_baratas.add_argument(
+        "--depart-from", type=str, help="First departure day (YYYY-MM-DD)"
+    )
+    parser_baratas.add_argument(
+        "--depart-to", type=str, help="Last departure day (YYYY-MM-DD)"
+    )
+    parser_baratas.add_argument(
+        "--weekdays",
+        type=int,
+        nargs="*",
+        choices=range(7),
+        help="Departure weekdays, 0 = Monday ... 6 = Sunday (e.g. 4 5 for weekend trips)",
+    )
+    parser_baratas.add_argument(
+        "--days", type=int, default=None, help="Only fares scraped in the last N days"
+    )
+    parser_baratas.add_argument(
+        "--group",
+        choices=list(AGRUPACIONES),
+        default="fechas",
+        help="One row per route and dates (fechas) or per route (ruta). Default: fechas",
+    )
+    parser_baratas.add_argument(
+        "--limit", type=int, default=None, help="Maximum rows, cheapest first"
+    )
+
+    parser_tendencia = subparsers.add_parser(
+        "trend", help="Daily price trend of a route"
+    )
+    parser_tendencia.add_argument(
+        "--source", type=str, required=True, help="Origin IATA code"
+    )
+    parser_tendencia.add_argument(
+        "--destination", type=str, required=True, help="Destination IATA code"
+    )
+    parser_tendencia.add_argument(
+        "--depart", type=str, help="Departure day (YYYY-MM-DD). Default: all"
+    )
+    parser_tendencia.add_argument(
+        "--return",
+        dest="regreso",
+        type=str,
+        help="Return day (YYYY-MM-DD). Default: all",
+    )
+    parser_tendencia.add_argument(
+        "--days", type=int, default=None, help="Only the last N scrape days"
+    )
+
+    parser_nuevas = subparsers.add_parser(
+        "new-routes", help="Routes first seen in the last N days"
+    )
+    parser_nuevas.add_argument(
+        "--days", type=int, default=7, help="Window in days. Default: 7"
+    )
+    parser_nuevas.add_argument("--source", type=str, help="Origin IATA code")
+
+    args = parser.parse_args()
+    if args.consulta != "ingest" and not os.path.exists(args.history):
+        parser.error(f"fare history not found: {args.history}")
+
+    historico = HistoricoPrecios(args.history)
+    if args.consulta == "ingest":
+        filas = historico.ingerir_dataset(
+            args.dir, desde=args.since, hasta=args.until, origenes=args.sources
+        )
+        print(f"Añadidas {filas} tarifas al historico {args.history}")
+        print(historico.informe())
+    elif args.consulta == "cheapest":
+        print(
+            historico.mas_baratas(
+                origen=args.source,
+                destino=args.destination,
+                salida_desde=args.depart_from,
+                salida_hasta=args.depart_to,
+                dias_semana=args.weekdays,
+                dias=args.days,
+                agrupar=args.group,
+                limite=args.limit,
+            ).to_string(index=False)
+        )
+    elif args.consulta == "trend":
+        print(
+            historico.tendencia(
+                args.source,
+                args.destination,
+                salida=args.depart,
+                regreso=args.regreso,
+                dias=args.days,
+            ).to_string(index=False)
+        )
+    elif args.consulta == "new-routes":
+        print(
+            historico.rutas_nuevas(dias=args.days, origen=args.source).to_string(
+                index=False
+            )
+        )
+    historico.cerrar()
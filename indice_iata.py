@@ -0,0 +1,155 @@
+import csv
+import io
+import json
+import os
+import threading
+from time import time
+
+IATA_CODES_URL = "https://raw.githubusercontent.com/ip2location/ip2location-iata-icao/refs/heads/master/iata-icao.csv"
+
+FICHERO_INDICE_IATA = "iata_indice.json"
+
+# Cada cuanto se pregunta al servidor si el CSV ha cambiado (peticion condicional, sin descarga si no cambia)
+INTERVALO_REFRESCO = 7 * 24 * 3600
+
+
+# Funcion para construir el indice {IATA: [aeropuerto, pais, latitud, longitud]} a partir del CSV de ip2location
+def construir_indice(texto_csv):
+    aeropuertos = {}
+    for fila in csv.DictReader(io.StringIO(texto_csv)):
+        codigo = (fila.get("iata") or "").strip().upper()
+        if not codigo:
+            continue
+        aeropuertos[codigo] = [
+            (fila.get("airport") or "").strip(),
+            (fila.get("country_code") or "").strip(),
+            float(fila["latitude"]) if fila.get("latitude") else None,
+            float(fila["longitude"]) if fila.get("longitude") else None,
+        ]
+    return aeropuertos
+
+
+class IndiceIata:
+    """
+    Indice local de codigos IATA (aeropuerto, pais y coordenadas) construido una vez a partir del CSV de ip2location.
+    Se carga del disco solo cuando se usa, y cada `intervalo` segundos se revalida con una peticion condicional
+    (ETag / If-Modified-Since). Sin conexion se sigue usando el indice que haya en disco.
+    :param fichero: Fichero JSON del indice.
+    :param url: Url del CSV de codigos IATA.
+    :param intervalo: Segundos entre revalidaciones. None para no revalidar nunca.
+    """
+
+    def __init__(
+        self,
+        fichero=FICHERO_INDICE_IATA,
+        url=IATA_CODES_URL,
+        intervalo=INTERVALO_REFRESCO,
+        timeout=10,
+    ):
+        self.fichero = fichero
+        self.url = url
+        self.intervalo = intervalo
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._datos = None
+        self._intentado = 0.0
+
+    def _leer(self):
+        if not os.path.exists(self.fichero):
+            return None
+        try:
+            with open(self.fichero, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as exception:
+            print(f"Ignorando indice IATA corrupto... {exception}")
+            return None
+
+    def _escribir(self, datos):
+        temporal = f"{self.fichero}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(datos, f, ensure_ascii=False)
+        os.replace(temporal, self.fichero)
+
+    def refrescar(self, forzar=False):
+        """
+        Revalida el indice contra el servidor: si el CSV no ha cambiado (304) solo se actualiza la fecha de comprobacion.
+        :param forzar: Si es True descarga el CSV completo aunque no haya cambiado.
+        :return: True si se ha descargado un CSV nuevo.
+        """
+        import requests
+
+        with self._lock:
+            datos = self._datos if self._datos is not None else self._leer()
+            cabeceras = {}
+            if datos is not None and not forzar:
+                if datos.get("etag"):
+                    cabeceras["If-None-Match"] = datos["etag"]
+                if datos.get("last_modified"):
+                    cabeceras["If-Modified-Since"] = datos["last_modified"]
+
+            response = requests.get(self.url, headers=cabeceras, timeout=self.timeout)
+            if response.status_code == 304 and datos is not None:
+                datos["comprobado"] = time()
+                descargado = False
+            else:
+                response.raise_for_status()
+                datos = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "comprobado": time(),
+                    "aeropuertos": construir_indice(response.text),
+                }
+                descargado = True
+            self._escribir(datos)
+            self._datos = datos
+            return descargado
+
+    # Carga el indice la primera vez que se usa y lo revalida cuando toca, tambien si ya estaba en memoria (procesos
+    # largos). Sin conexion se usa el que haya y no se vuelve a intentar hasta pasado otro intervalo
+    def _cargar(self):
+        with self._lock:
+            if self._datos is None:
+                self._datos = self._leer()
+            datos = self._datos
+            caducado = datos is None or (
+                self.intervalo is not None
+                and time() - max(datos["comprobado"], self._intentado) > self.intervalo
+            )
+            if caducado:
+                self._intentado = time()
+
+        if caducado:
+            import requests
+
+            try:
+                self.refrescar()
+            except requests.RequestException as exception:
+                if datos is None:
+                    raise
+                print(
+                    f"No se ha podido revalidar el indice IATA, se usa el local... {exception}"
+                )
+        return self._datos
+
+    @property
+    def aeropuertos(self):
+        return self._cargar()["aeropuertos"]
+
+    def codigos(self):
+        return set(self.aeropuertos)
+
+    def __contains__(self, codigo):
+        return codigo.upper() in self.aeropuertos
+
+    def buscar(self, prefijo=None, nombre=None):
+        """
+        Busca aeropuertos por prefijo del codigo IATA y/o por parte del nombre (sin distinguir mayusculas).
+        :return: Lista ordenada de (codigo, aeropuerto, pais, latitud, longitud).
+        """
+        prefijo = (prefijo or "").upper()
+        nombre = (nombre or "").lower()
+        return [
+            (codigo, *datos)
+            for codigo, datos in sorted(self.aeropuertos.items())
+            if codigo.startswith(prefijo) and nombre in datos[0].lower()
+        ]
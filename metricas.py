@@ -0,0 +1,257 @@
+import functools
+import json
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter, time
+
+# Limites (segundos) de los buckets del histograma de duracion de los tramos
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Prefijo de las metricas en el formato de Prometheus
+PREFIJO = "scraper"
+
+
+def _etiquetas_prometheus(etiquetas):
+    if not etiquetas:
+        return ""
+    pares = []
+    for clave, valor in etiquetas:
+        valor = (
+            str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        pares.append(f'{clave}="{valor}"')
+    return "{" + ",".join(pares) + "}"
+
+
+class Metricas:
+    """
+    Instrumentacion del scrapeo: tramos (duracion de cada etapa, con errores e histograma) y contadores.
+    Los tramos anidados en el mismo hilo apuntan a su tramo padre. Se pueden volcar como log JSON (una linea
+    por tramo terminado) y exportar en el formato de texto de Prometheus (ver arrancar_servidor_metricas).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._tramos = {}
+        self._contadores = {}
+        self._log = None
+
+    # Activa el log JSON de tramos en un fichero (se añaden lineas). None lo desactiva
+    def configurar(self, fichero_log=None):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+            self._log = (
+                open(fichero_log, "a", encoding="utf-8") if fichero_log else None
+            )
+
+    def _escribir_log(self, evento):
+        with self._lock:
+            if self._log is not None:
+                self._log.write(json.dumps(evento, ensure_ascii=False) + "\n")
+                self._log.flush()
+
+    @contextmanager
+    def tramo(self, nombre, **etiquetas):
+        """
+        Mide la duracion de una etapa. Una excepcion dentro del tramo cuenta como error (y se propaga).
+        :param nombre: Nombre del tramo (p.e. "datos_destino.scroll").
+        :param etiquetas: Etiquetas del tramo (solo van al log JSON, no a las metricas agregadas).
+        """
+        pila = getattr(self._local, "pila", None)
+        if pila is None:
+            pila = self._local.pila = []
+        padre = pila[-1] if pila else None
+        pila.append(nombre)
+        inicio = perf_counter()
+        ok = True
+        try:
+            yield
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            duracion = perf_counter() - inicio
+            pila.pop()
+            self._registrar(nombre, duracion, ok)
+            if self._log is not None:
+                self._escribir_log(
+                    {
+                        "ts": round(time(), 3),
+                        "evento": "tramo",
+                        "tramo": nombre,
+                        "padre": padre,
+                        "duracion": round(duracion, 4),
+                        "ok": ok,
+                        "hilo": threading.current_thread().name,
+                        **etiquetas,
+                    }
+                )
+
+    # Decorador para medir una funcion entera como un tramo
+    def medir(self, nombre):
+        def decorador(funcion):
+            @functools.wraps(funcion)
+            def envoltura(*args, **kwargs):
+                with self.tramo(nombre):
+                    return funcion(*args, **kwargs)
+
+            return envoltura
+
+        return decorador
+
+    def _registrar(self, nombre, duracion, ok):
+        with self._lock:
+            datos = self._tramos.get(nombre)
+            if datos is None:
+                datos = self._tramos[nombre] = {
+                    "veces": 0,
+                    "total": 0.0,
+                    "maximo": 0.0,
+                    "errores": 0,
+                    "buckets": [0] * (len(BUCKETS) + 1),
+                }
+            datos["veces"] += 1
+            datos["total"] += duracion
+            datos["maximo"] = max(datos["maximo"], duracion)
+            datos["buckets"][bisect_left(BUCKETS, duracion)] += 1
+            if not ok:
+                datos["errores"] += 1
+
+    def contar(self, nombre, cantidad=1, **etiquetas):
+        """
+        Suma `cantidad` a un contador (p.e. contar("itinerarios_parseados", 25, backend="lxml")).
+        """
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + cantidad
+
+    def informe(self):
+        with self._lock:
+            tramos = {nombre: dict(datos) for nombre, datos in self._tramos.items()}
+            contadores = dict(self._contadores)
+        filas = [
+            {
+                "tramo": nombre,
+                "veces": datos["veces"],
+                "total": round(datos["total"], 2),
+                "media": round(datos["total"] / datos["veces"], 3),
+                "maximo": round(datos["maximo"], 2),
+                "errores": datos["errores"],
+            }
+            for nombre, datos in sorted(tramos.items(), key=lambda t: -t[1]["total"])
+        ]
+        cuentas = {
+            nombre
+            + "".join(f" {clave}={valor}" for clave, valor in etiquetas): cantidad
+            for (nombre, etiquetas), cantidad in sorted(contadores.items())
+        }
+        return {"tramos": filas, "contadores": cuentas}
+
+    def imprimir_informe(self):
+        informe = self.informe()
+        print("Tiempo por tramo:")
+        for fila in informe["tramos"]:
+            print(
+                f"  {fila['tramo']:<30} veces={fila['veces']:<5} total={fila['total']:>8}s "
+                f"media={fila['media']:>7}s max={fila['maximo']:>6}s errores={fila['errores']}"
+            )
+        print(f"Contadores: {informe['contadores']}")
+        self._escribir_log({"ts": round(time(), 3), "evento": "resumen", **informe})
+
+    def prometheus(self):
+        """
+        Metricas en el formato de texto de Prometheus: histograma de duracion y errores por tramo, y un
+        contador <PREFIJO>_<nombre>_total por cada contador.
+        """
+        with self._lock:
+            tramos = {
+                nombre: dict(datos, buckets=list(datos["buckets"]))
+                for nombre, datos in self._tramos.items()
+            }
+            contadores = dict(self._contadores)
+
+        metrica = f"{PREFIJO}_tramo_segundos"
+        lineas = [
+            f"# HELP {metrica} Duracion de cada tramo del scrapeo",
+            f"# TYPE {metrica} histogram",
+        ]
+        for nombre, datos in sorted(tramos.items()):
+            acumulado = 0
+            for limite, cantidad in zip(BUCKETS + ("+Inf",), datos["buckets"]):
+                acumulado += cantidad
+                etiquetas = _etiquetas_prometheus((("tramo", nombre), ("le", limite)))
+                lineas.append(f"{metrica}_bucket{etiquetas} {acumulado}")
+            etiquetas = _etiquetas_prometheus((("tramo", nombre),))
+            lineas.append(f"{metrica}_sum{etiquetas} {datos['total']:.6f}")
+            lineas.append(f"{metrica}_count{etiquetas} {datos['veces']}")
+
+        lineas.append(
+            f"# HELP {PREFIJO}_tramo_errores_total Tramos terminados con una excepcion"
+        )
+        lineas.append(f"# TYPE {PREFIJO}_tramo_errores_total counter")
+        for nombre, datos in sorted(tramos.items()):
+            etiquetas = _etiquetas_prometheus((("tramo", nombre),))
+            lineas.append(
+                f"{PREFIJO}_tramo_errores_total{etiquetas} {datos['errores']}"
+            )
+
+        por_nombre = {}
+        for (nombre, etiquetas), cantidad in sorted(contadores.items()):
+            por_nombre.setdefault(nombre, []).append((etiquetas, cantidad))
+        for nombre, series in por_nombre.items():
+            lineas.append(f"# TYPE {PREFIJO}_{nombre}_total counter")
+            for etiquetas, cantidad in series:
+                lineas.append(
+                    f"{PREFIJO}_{nombre}_total{_etiquetas_prometheus(etiquetas)} {cantidad}"
+                )
+        return "\n".join(lineas) + "\n"
+
+    # Vacia tramos y contadores (p.e. entre ejecuciones de un benchmark)
+    def reiniciar(self):
+        with self._lock:
+            self._tramos.clear()
+            self._contadores.clear()
+
+
+# Metricas compartidas por todo el proceso (y por todos los workers)
+METRICAS = Metricas()
+
+
+# Respuesta del endpoint: las metricas en /metrics con el formato de texto de Prometheus
+def _servir_metricas(manejador):
+    if manejador.path.split("?")[0] != "/metrics":
+        manejador.send_error(404)
+        return
+    contenido = manejador.metricas.prometheus().encode("utf-8")
+    manejador.send_response(200)
+    manejador.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+    manejador.send_header("Content-Length", str(len(contenido)))
+    manejador.end_headers()
+    manejador.wfile.write(contenido)
+
+
+def arrancar_servidor_metricas(puerto=0, host="127.0.0.1", metricas=METRICAS):
+    """
+    Arranca en segundo plano el endpoint de metricas para Prometheus.
+    :param puerto: Puerto donde escuchar. Con 0 se elige uno libre.
+    :param host: Interfaz donde escuchar ("0.0.0.0" para que Prometheus lo lea desde otra maquina).
+    :return: El servidor; las metricas estan en f"http://{host}:{servidor.server_port}/metrics".
+    """
+    # http.server se importa al arrancar el endpoint, no al cargar el modulo (arranque rapido del script)
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    manejador = type(
+        "Manejador",
+        (BaseHTTPRequestHandler,),
+        {
+            "metricas": metricas,
+            "do_GET": _servir_metricas,
+            "log_message": lambda self, format, *args: None,
+        },
+    )
+    servidor = ThreadingHTTPServer((host, puerto), manejador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+
+# Columnas del df final, en el orden en el que las genera registros.df_rutas()
+COLUMNAS_DF = [
+    "url",
+    "origen",
+    "destino",
+    "fecha_inicio",
+    "fecha_fin",
+    "pasajeros",
+    "inicio_ida",
+    "fin_ida",
+    "inicio_vuelta",
+    "fin_vuelta",
+    "escala_ida",
+    "escala_vuelta",
+    "duracion_ida",
+    "duracion_vuelta",
+    "aerolineas",
+    "equipaje_mano",
+    "equipaje_bodega",
+    "precio",
+    "clase",
+]
+
+# Moneda de los precios de edreams.es
+MONEDA = "EUR"
+
+PATRON_DURACION = r"^\s*(?:(?P<h>\d+)\s*h)?\s*(?:(?P<m>\d+)\s*min)?\s*$"
+
+
+# Aplica `funcion` (vectorizada) solo a los valores distintos de la serie y reparte el resultado por posicion.
+# Horas, escalas, duraciones y precios se repiten muchisimo, asi que se procesan unos pocos miles de valores en vez de millones
+def por_valores_unicos(serie, funcion):
+    codigos, unicos = pd.factorize(serie, use_na_sentinel=True)
+    resultado = funcion(pd.Series(unicos))
+    return pd.Series(resultado.array.take(codigos, allow_fill=True), index=serie.index)
+
+
+# Escalas "directo" / "1 escala" / "2 escalas" -> numero de escalas (Int8, nulo si no se reconoce)
+def normalizar_escalas(serie):
+    texto = serie.astype("string").str.strip()
+    escalas = pd.to_numeric(texto.str.extract(r"^(\d+)", expand=False), errors="coerce")
+    escalas = escalas.mask(texto.str.lower() == "directo", 0)
+    return escalas.astype("Int8")
+
+
+# Duracion "1 h 35 min" / "2 h" / "45 min" -> minutos (Int16, nulo si no se reconoce)
+def normalizar_duracion(serie):
+    partes = serie.astype("string").str.extract(PATRON_DURACION)
+    horas = pd.to_numeric(partes["h"], errors="coerce")
+    minutos = pd.to_numeric(partes["m"], errors="coerce")
+    total = horas.fillna(0) * 60 + minutos.fillna(0)
+    total = total.mask(horas.isna() & minutos.isna())
+    return total.astype("Int16")
+
+
+# Hora "HH:MM" -> timedelta desde medianoche (NaT si no se reconoce)
+def normalizar_hora(serie):
+    texto = serie.astype("string").str.strip()
+    return pd.to_timedelta(texto.where(texto.str.match(r"^\d{2}:\d{2}$")) + ":00")
+
+
+# Precio "1.234" -> 1234 (Int32, nulo si no tiene digitos)
+def normalizar_precio(serie):
+    digitos = serie.astype("string").str.replace(r"\D", "", regex=True)
+    return pd.to_numeric(digitos.replace("", pd.NA), errors="coerce").astype("Int32")
+
+
+# Lista de aerolineas -> texto "A, B" como categoria (pocas aerolineas distintas en millones de filas)
+def normalizar_aerolineas(serie):
+    texto = serie.str.join(", ")
+    return texto.astype("category")
+
+
+def normalizar_df(df):
+    """
+    Normaliza de forma vectorizada el df creado con registros.df_rutas() a un esquema tipado:
+    escalas Int8, duraciones en minutos Int16, precio Int32 + moneda, horas como timedelta desde medianoche,
+    fechas como datetime64 y origen/destino/aerolineas como categorias.
+    :param df: DataFrame con las columnas COLUMNAS_DF tal y como salen del scrapeo.
+    :return: Nuevo DataFrame tipado.
+    """
+    df = df.copy()
+
+    for columna in ("escala_ida", "escala_vuelta"):
+        df[columna] = por_valores_unicos(df[columna], normalizar_escalas)
+    for columna in ("duracion_ida", "duracion_vuelta"):
+        df[columna] = por_valores_unicos(df[columna], normalizar_duracion)
+    for columna in ("inicio_ida", "fin_ida", "inicio_vuelta", "fin_vuelta"):
+        df[columna] = por_valores_unicos(df[columna], normalizar_hora)
+    for columna in ("fecha_inicio", "fecha_fin"):
+        df[columna] = pd.to_datetime(df[columna], format="%Y-%m-%d", errors="coerce")
+
+    df["precio"] = por_valores_unicos(df["precio"], normalizar_precio)
+    df.insert(
+        df.columns.get_loc("precio") + 1,
+        "moneda",
+        pd.Categorical([MONEDA] * len(df)),
+    )
+
+    df["aerolineas"] = normalizar_aerolineas(df["aerolineas"])
+    df["origen"] = df["origen"].astype("category")
+    df["destino"] = df["destino"].astype("category")
+    df["pasajeros"] = df["pasajeros"].astype(np.int8)
+    df["equipaje_mano"] = df["equipaje_mano"].astype(np.int8)
+    df["equipaje_bodega"] = df["equipaje_bodega"].astype(np.int8)
+
+    return df
+
+
+# Minutos -> "1h 35m" (el formato que se subia antes a airtable)
+def formatear_duracion(serie):
+    horas = (serie // 60).astype("string")
+    minutos = (serie % 60).astype("string")
+    texto = horas + "h " + minutos + "m"
+    return texto.mask(serie % 60 == 0, horas + "h").mask(serie < 60, minutos + "m")
+
+
+# Timedelta desde medianoche -> "HH:MM"
+def formatear_hora(serie):
+    minutos = (serie.dt.total_seconds() // 60).astype("Int32")
+    return (
+        (minutos // 60).astype("string").str.zfill(2)
+        + ":"
+        + (minutos % 60).astype("string").str.zfill(2)
+    )
+
+
+def df_exportable(df):
+    """
+    Convierte el df tipado de normalizar_df() a valores planos de Python serializables a JSON
+    (fechas y horas como texto, duraciones como "1h 35m", aerolineas como lista y nulos como None).
+    :param df: DataFrame tipado.
+    :return: DataFrame de objetos listo para exportar (p.ej. a airtable).
+    """
+    df = df.copy()
+    for columna in ("duracion_ida", "duracion_vuelta"):
+        df[columna] = formatear_duracion(df[columna])
+    for columna in ("inicio_ida", "fin_ida", "inicio_vuelta", "fin_vuelta"):
+        df[columna] = formatear_hora(df[columna])
+    for columna in ("fecha_inicio", "fecha_fin"):
+        df[columna] = df[columna].dt.strftime("%Y-%m-%d")
+    df["aerolineas"] = df["aerolineas"].astype("string").str.split(", ").astype(object)
+    df = df.astype(object)
+    return df.where(df.notna(), None)
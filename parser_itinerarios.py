@@ -0,0 +1,242 @@
+import re
+
+from bs4 import BeautifulSoup, Tag
+
+from metricas import METRICAS
+from registros import Itinerario, equipaje_de_mano
+
+# lxml es opcional: si esta instalado se usa como backend rapido, si no se usa BeautifulSoup
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+# Patron de las horas de salida y llegada (XX:XX)
+PATRON_HORA = re.compile(r"^\d{2}:\d{2}$")
+
+# Sufijo estable de las clases css dinamicas de los textos de horas
+SUFIJO_CLASE_HORA = "BaseText-Body"
+
+ID_CONTENEDOR = "results_list_container"
+
+
+# Funcion para montar el itinerario a partir de lo recogido en el recorrido del arbol
+def _montar_itinerario(
+    pequenos,
+    aerolineas,
+    precio_unitario,
+    horas,
+    duraciones,
+    escalas,
+    equipajes,
+):
+    # Aeropuertos, es una lista con los 2 de la ida y los 2 de la vuelta
+    aeropuertos_data = [pequenos[0], pequenos[2], pequenos[4], pequenos[6]]
+    if precio_unitario is None:
+        raise IndexError("no se ha encontrado el precio del vuelo")
+
+    return Itinerario(
+        aeropuertos_data,
+        list(dict.fromkeys(aerolineas)),
+        horas,
+        duraciones,
+        escalas,
+        equipaje_de_mano(equipajes),
+        precio_unitario,
+    )
+
+
+# Recorrido en una sola pasada de un itinerario con BeautifulSoup
+def _itinerario_bs4(element):
+    pequenos = []
+    aerolineas = []
+    precio_unitario = None
+    horas = []
+    duraciones = []
+    escalas = []
+    equipajes = []
+
+    for nodo in element.descendants:
+        if not isinstance(nodo, Tag):
+            continue
+        nombre = nodo.name
+        attrs = nodo.attrs
+
+        if nombre == "div":
+            if attrs.get("type") == "small":
+                pequenos.append(nodo.text.strip())
+
+            # Logica para sacar las horas de despegue y llegada (clase dinamica acabada en BaseText-Body y texto XX:XX)
+            if len(attrs) == 1 and "class" in attrs:
+                if any(c.endswith(SUFIJO_CLASE_HORA) for c in attrs["class"]):
+                    texto = nodo.text
+                    if PATRON_HORA.match(texto.strip()):
+                        horas.append(texto)
+            # Logica para sacar datos de escalas, a partir del sibling del elemento con atributo orientation
+            elif len(attrs) > 1 and "orientation" in attrs:
+                next_sibling = nodo.find_next_sibling()
+                if next_sibling:
+                    span_items = next_sibling.find_all("span")
+                    duraciones.append(span_items[0].text)
+                    escalas.append(span_items[1].text if len(span_items) > 1 else "0")
+
+        elif nombre == "img":
+            if "alt" in attrs:
+                aerolineas.append(attrs["alt"])
+
+        elif nombre == "span":
+            if "money-integer" in attrs.get("class", ()):
+                # El precio bueno es el que esta en a > span > span.money-integer
+                padre = nodo.parent
+                if (
+                    precio_unitario is None
+                    and padre is not None
+                    and padre.name == "span"
+                    and padre.parent is not None
+                    and padre.parent.name == "a"
+                ):
+                    precio_unitario = nodo.text
+
+        elif nombre == "path":
+            # clip-rule es algo fijo que siempre podremos encontrar, el equipaje esta en el sibling del tercer parent
+            if len(attrs) > 1 and "clip-rule" in attrs:
+                tri_parent = nodo.parent.parent.parent
+                if tri_parent:
+                    equipaje_div = tri_parent.find_next_sibling()
+                    if equipaje_div:
+                        equipajes.append(equipaje_div.text)
+
+    return _montar_itinerario(
+        pequenos,
+        aerolineas,
+        precio_unitario,
+        horas,
+        duraciones,
+        escalas,
+        equipajes,
+    )
+
+
+# Siguiente sibling que sea un elemento (lxml tambien devuelve comentarios e instrucciones)
+def _siguiente_elemento(nodo):
+    siguiente = nodo.getnext()
+    while siguiente is not None and not isinstance(siguiente.tag, str):
+        siguiente = siguiente.getnext()
+    return siguiente
+
+
+# Recorrido en una sola pasada de un itinerario con lxml
+def _itinerario_lxml(element):
+    pequenos = []
+    aerolineas = []
+    precio_unitario = None
+    horas = []
+    duraciones = []
+    escalas = []
+    equipajes = []
+
+    for nodo in element.iterdescendants():
+        nombre = nodo.tag
+        if not isinstance(nombre, str):
+            continue
+        attrs = nodo.attrib
+
+        if nombre == "div":
+            if attrs.get("type") == "small":
+                pequenos.append(nodo.text_content().strip())
+
+            if len(attrs) == 1 and "class" in attrs:
+                if any(c.endswith(SUFIJO_CLASE_HORA) for c in attrs["class"].split()):
+                    texto = nodo.text_content()
+                    if PATRON_HORA.match(texto.strip()):
+                        horas.append(texto)
+            elif len(attrs) > 1 and "orientation" in attrs:
+                next_sibling = _siguiente_elemento(nodo)
+                if next_sibling is not None:
+                    span_items = list(next_sibling.iterdescendants("span"))
+                    duraciones.append(span_items[0].text_content())
+                    escalas.append(
+                        span_items[1].text_content() if len(span_items) > 1 else "0"
+                    )
+
+        elif nombre == "img":
+            if "alt" in attrs:
+                aerolineas.append(attrs["alt"])
+
+        elif nombre == "span":
+            if "money-integer" in attrs.get("class", "").split():
+                texto = nodo.text_content()
+                padre = nodo.getparent()
+                if (
+                    precio_unitario is None
+                    and padre is not None
+                    and padre.tag == "span"
+                    and padre.getparent() is not None
+                    and padre.getparent().tag == "a"
+                ):
+                    precio_unitario = texto
+
+        elif nombre == "path":
+            if len(attrs) > 1 and "clip-rule" in attrs:
+                tri_parent = nodo.getparent().getparent().getparent()
+                if tri_parent is not None:
+                    equipaje_div = _siguiente_elemento(tri_parent)
+                    if equipaje_div is not None:
+                        equipajes.append(equipaje_div.text_content())
+
+    return _montar_itinerario(
+        pequenos,
+        aerolineas,
+        precio_unitario,
+        horas,
+        duraciones,
+        escalas,
+        equipajes,
+    )
+
+
+def _elementos_bs4(html):
+    soup = BeautifulSoup(html, "html.parser")
+    results_container = soup.find(id=ID_CONTENEDOR) or soup
+    return results_container.find_all(attrs={"data-testid": "itinerary"})
+
+
+def _elementos_lxml(html):
+    doc = lxml.html.fromstring(html)
+    contenedores = doc.xpath(f'//*[@id="{ID_CONTENEDOR}"]')
+    raiz = contenedores[0] if contenedores else doc
+    return raiz.xpath('descendant-or-self::*[@data-testid="itinerary"]')
+
+
+BACKENDS = {
+    "bs4": (_elementos_bs4, _itinerario_bs4),
+    "lxml": (_elementos_lxml, _itinerario_lxml),
+}
+
+
+# Backend por defecto: lxml si esta instalado, si no BeautifulSoup
+def backend_por_defecto():
+    return "lxml" if lxml is not None else "bs4"
+
+
+def parsear_itinerarios(html, backend=None):
+    """
+    Extrae los itinerarios de la pagina (o de un fragmento) de resultados.
+    :param html: HTML de la pagina completa, del contenedor de resultados o de uno o varios itinerarios.
+    :param backend: "bs4" o "lxml". Por defecto lxml si esta instalado.
+    :return: Lista de Itinerario.
+    """
+    backend = backend or backend_por_defecto()
+    if backend == "lxml" and lxml is None:
+        raise ValueError("El backend lxml necesita tener instalado el paquete lxml")
+    elementos, itinerario = BACKENDS[backend]
+
+    lista_datos_destino = []
+    for element in elementos(html):
+        try:
+            lista_datos_destino.append(itinerario(element))
+        except Exception as exception:
+            print(f"Ignorando vuelo por problemas al scrapear...{exception}")
+            METRICAS.contar("itinerarios_ignorados", backend=backend)
+    METRICAS.contar("itinerarios_parseados", len(lista_datos_destino), backend=backend)
+    return lista_datos_destino
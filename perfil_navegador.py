@@ -0,0 +1,183 @@
+import os
+import threading
+
+# Tamaño fijo de ventana del perfil ligero (en headless no se puede maximizar)
+TAMANO_VENTANA = (1366, 900)
+
+# Directorio base de la cache en disco compartida entre ejecuciones (un subdirectorio por navegador a la vez)
+DIRECTORIO_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "scraper_edreams")
+
+# Peticiones que no necesitamos para scrapear: imagenes (los logos de aerolineas se leen del alt), fuentes, media
+RECURSOS_BLOQUEADOS = [
+    "*.png",
+    "*.jpg",
+    "*.jpeg",
+    "*.gif",
+    "*.webp",
+    "*.avif",
+    "*.svg",
+    "*.ico",
+    "*.woff",
+    "*.woff2",
+    "*.ttf",
+    "*.otf",
+    "*.mp4",
+    "*.webm",
+    "*.mp3",
+]
+
+# Dominios conocidos de trackers y publicidad
+DOMINIOS_BLOQUEADOS = [
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*googleadservices.com*",
+    "*doubleclick.net*",
+    "*googlesyndication.com*",
+    "*facebook.net*",
+    "*connect.facebook.com*",
+    "*hotjar.com*",
+    "*criteo.com*",
+    "*criteo.net*",
+    "*taboola.com*",
+    "*outbrain.com*",
+    "*bat.bing.com*",
+    "*analytics.tiktok.com*",
+    "*scorecardresearch.com*",
+    "*newrelic.com*",
+    "*nr-data.net*",
+    "*quantserve.com*",
+]
+
+_lock = threading.Lock()
+_slots_cache = set()
+
+
+# Reserva un subdirectorio de cache libre: Chrome no permite compartir la misma cache entre procesos a la vez
+def reservar_cache(directorio=DIRECTORIO_CACHE):
+    with _lock:
+        slot = 0
+        while slot in _slots_cache:
+            slot += 1
+        _slots_cache.add(slot)
+    ruta = os.path.join(directorio, f"slot_{slot}")
+    os.makedirs(ruta, exist_ok=True)
+    return slot, ruta
+
+
+def liberar_cache(slot):
+    with _lock:
+        _slots_cache.discard(slot)
+
+
+# Argumentos de Chrome del perfil ligero
+def argumentos_ligeros(directorio_cache):
+    ancho, alto = TAMANO_VENTANA
+    return [
+        "--headless=new",
+        f"--window-size={ancho},{alto}",
+        "--disable-extensions",
+        "--disable-gpu",
+        "--no-first-run",
+        "--mute-audio",
+        "--blink-settings=imagesEnabled=false",
+        f"--disk-cache-dir={directorio_cache}",
+    ]
+
+
+# Preferencias de Chrome del perfil ligero (2 = bloquear)
+PREFERENCIAS_LIGERAS = {
+    "profile.managed_default_content_settings.images": 2,
+    "profile.managed_default_content_settings.media_stream": 2,
+    "profile.default_content_setting_values.notifications": 2,
+}
+
+
+# Activa el bloqueo de peticiones por patron via Chrome DevTools Protocol
+def bloquear_peticiones(browser):
+    browser.execute_cdp_cmd("Network.enable", {})
+    browser.execute_cdp_cmd(
+        "Network.setBlockedURLs", {"urls": RECURSOS_BLOQUEADOS + DOMINIOS_BLOQUEADOS}
+    )
+
+
+# Amplia el buffer de resource timing (por defecto 250 entradas) para poder medir todas las peticiones de la pagina
+SCRIPT_PREPARAR_MEDICION = "performance.setResourceTimingBufferSize(10000);"
+
+# Bytes transferidos (documento + recursos) y tiempos de carga de la pagina actual
+SCRIPT_MEDICION = """
+var nav = performance.getEntriesByType('navigation')[0];
+var recursos = performance.getEntriesByType('resource');
+var bytes = nav ? nav.transferSize : 0;
+for (var i = 0; i < recursos.length; i++) { bytes += recursos[i].transferSize || 0; }
+return {
+    bytes: bytes,
+    peticiones: recursos.length + (nav ? 1 : 0),
+    dom: nav ? nav.domContentLoadedEventEnd - nav.startTime : null,
+    carga: nav ? nav.loadEventEnd - nav.startTime : null
+};
+"""
+
+
+class EstadisticasRed:
+    """
+    Acumula por ruta los bytes transferidos, el numero de peticiones y los tiempos de carga de la pagina.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rutas = 0
+        self.bytes = 0
+        self.peticiones = 0
+        self.dom = 0.0
+        self.carga = 0.0
+
+    def registrar(self, medicion):
+        with self._lock:
+            self.rutas += 1
+            self.bytes += medicion.get("bytes") or 0
+            self.peticiones += medicion.get("peticiones") or 0
+            self.dom += (medicion.get("dom") or 0) / 1000
+            self.carga += (medicion.get("carga") or 0) / 1000
+
+    def informe(self):
+        with self._lock:
+            if not self.rutas:
+                return {}
+            return {
+                "rutas": self.rutas,
+                "kb_por_ruta": round(self.bytes / self.rutas / 1024, 1),
+                "peticiones_por_ruta": round(self.peticiones / self.rutas, 1),
+                "dom_por_ruta": round(self.dom / self.rutas, 2),
+                "carga_por_ruta": round(self.carga / self.rutas, 2),
+            }
+
+    def imprimir_informe(self):
+        datos = self.informe()
+        if datos:
+            print(
+                f"Red: {datos['rutas']} rutas, {datos['kb_por_ruta']} KB/ruta, "
+                f"{datos['peticiones_por_ruta']} peticiones/ruta, DOM {datos['dom_por_ruta']}s/ruta, "
+                f"carga {datos['carga_por_ruta']}s/ruta"
+            )
+
+
+# Estadisticas compartidas por todo el proceso (y por todos los workers)
+ESTADISTICAS = EstadisticasRed()
+
+
+def preparar_medicion(browser):
+    try:
+        browser.execute_script(SCRIPT_PREPARAR_MEDICION)
+    except Exception:
+        pass
+
+
+# Mide la pagina actual y la acumula en las estadisticas. Devuelve la medicion (o None si falla)
+def medir_pagina(browser):
+    try:
+        medicion = browser.execute_script(SCRIPT_MEDICION)
+    except Exception as exception:
+        print(f"No se ha podido medir la pagina... {exception}")
+        return None
+    ESTADISTICAS.registrar(medicion)
+    return medicion
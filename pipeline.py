@@ -0,0 +1,172 @@
+import queue
+import threading
+
+# Marca de fin de cola
+_FIN = object()
+
+
+# Generador que va sacando elementos de una cola hasta recibir la marca de fin
+def iterar_cola(cola):
+    while True:
+        elemento = cola.get()
+        if elemento is _FIN:
+            return
+        yield elemento
+
+
+# Generador que agrupa los elementos en lotes de como mucho `tamano`
+def agrupar(elementos, tamano):
+    lote = []
+    for elemento in elementos:
+        lote.append(elemento)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+class Pipeline:
+    """
+    Pipeline en streaming: descubrir -> obtener (y parsear) -> normalizar -> sumidero.
+    Las etapas se conectan con colas acotadas, de forma que si el sumidero es lento los workers se
+    bloquean al llenarse la cola (backpressure) y la memoria no crece con el numero de destinos.
+    :param descubrir: Funcion (origen, inicio, fin) -> iterable de rutas (dict con origen, destino, inicio, fin, url).
+    :param obtener: Funcion (ruta) -> iterable de itinerarios de la ruta. Se ejecuta en `workers` hilos.
+    :param normalizar: Funcion (ruta, itinerario) -> fila final.
+    :param sumidero: Funcion (lote de filas) -> None. Se ejecuta en su propio hilo.
+    :param workers: Numero de hilos de la etapa obtener.
+    :param tam_cola: Tamaño maximo de cada cola entre etapas.
+    :param tam_lote: Numero de filas que se entregan de cada vez al sumidero.
+    """
+
+    def __init__(
+        self,
+        descubrir,
+        obtener,
+        normalizar,
+        sumidero,
+        workers=1,
+        tam_cola=1000,
+        tam_lote=500,
+    ):
+        self.descubrir = descubrir
+        self.obtener = obtener
+        self.normalizar = normalizar
+        self.sumidero = sumidero
+        self.workers = workers
+        self.tam_lote = tam_lote
+
+        # Cola de rutas pendientes de obtener y cola de itinerarios pendientes de llegar al sumidero
+        self._rutas = queue.Queue(maxsize=max(workers * 2, 1))
+        self._itinerarios = queue.Queue(maxsize=tam_cola)
+
+        self._lock = threading.Lock()
+        self.stats = {
+            "descubrimientos_fallidos": 0,
+            "rutas": 0,
+            "rutas_fallidas": 0,
+            "filas": 0,
+            "lotes": 0,
+            "lotes_fallidos": 0,
+            "filas_perdidas": 0,
+        }
+
+    def _contar(self, clave, cantidad=1):
+        with self._lock:
+            self.stats[clave] += cantidad
+
+    # Etapa obtener: cada worker saca rutas y va metiendo sus itinerarios en la cola del sumidero
+    def _worker(self):
+        for ruta in iterar_cola(self._rutas):
+            try:
+                # Los itinerarios pasan al sumidero segun se obtienen (si la ruta falla a mitad, no se pierde lo ya obtenido)
+                for itinerario in self.obtener(ruta):
+                    self._itinerarios.put((ruta, itinerario))
+            except Exception as exception:
+                # Si falla una ruta, perdemos solo esa y no el resto
+                print(
+                    f"Ignorando destino {ruta['destino']} por problemas al scrapear...{exception}"
+                )
+                self._contar("rutas_fallidas")
+                continue
+            self._contar("rutas")
+
+    # Etapa normalizar: un itinerario que no se puede normalizar se cuenta como fila perdida y se sigue vaciando
+    # la cola (si el error saliera del generador, el hilo del sumidero moriria y los workers se quedarian bloqueados)
+    def _normalizar(self):
+        for ruta, itinerario in iterar_cola(self._itinerarios):
+            try:
+                fila = self.normalizar(ruta, itinerario)
+            except Exception as exception:
+                print(
+                    f"Error normalizando un itinerario de {ruta.get('destino')}, se pierde la fila...{exception}"
+                )
+                self._contar("filas_perdidas")
+                continue
+            yield fila
+
+    # Etapas normalizar + sumidero, encadenadas con generadores sobre la cola de itinerarios
+    def _sumidero(self):
+        for lote in agrupar(self._normalizar(), self.tam_lote):
+            try:
+                self.sumidero(lote)
+            except Exception as exception:
+                print(
+                    f"Error en el sumidero, se pierde un lote de {len(lote)} filas...{exception}"
+                )
+                self._contar("lotes_fallidos")
+                self._contar("filas_perdidas", len(lote))
+                continue
+            self._contar("filas", len(lote))
+            self._contar("lotes")
+
+    def ejecutar(self, pares):
+        """
+        Ejecuta el pipeline completo.
+        :param pares: Iterable de (origen, inicio, fin) a scrapear.
+        :return: Estadisticas de la ejecucion.
+        """
+        workers = [
+            threading.Thread(target=self._worker, daemon=True)
+            for _ in range(self.workers)
+        ]
+        hilo_sumidero = threading.Thread(target=self._sumidero, daemon=True)
+        for hilo in workers:
+            hilo.start()
+        hilo_sumidero.start()
+
+        try:
+            # Etapa descubrir, en el hilo principal: se bloquea si los workers van por detras
+            for origen, inicio, fin in pares:
+                # descubrir puede ser un generador: los errores saltan al iterarlo, no al llamarlo
+                try:
+                    for ruta in self.descubrir(origen, inicio, fin):
+                        self._rutas.put(ruta)
+                except Exception as exception:
+                    print(f"Excepcion buscando destinos de {origen}... {exception}")
+                    self._contar("descubrimientos_fallidos")
+        finally:
+            for _ in workers:
+                self._rutas.put(_FIN)
+            for hilo in workers:
+                hilo.join()
+            self._itinerarios.put(_FIN)
+            hilo_sumidero.join()
+
+        return dict(self.stats)
+
+    def imprimir_informe(self):
+        with self._lock:
+            stats = dict(self.stats)
+        print(
+            f"Pipeline: {stats['rutas']} rutas ({stats['rutas_fallidas']} fallidas), "
+            f"{stats['filas']} filas en {stats['lotes']} lotes, "
+            f"{stats['descubrimientos_fallidos']} busquedas de destinos fallidas"
+        )
+        # Lo que no llega al sumidero no esta en el dataset: se avisa aparte para que no pase desapercibido
+        if stats["filas_perdidas"]:
+            print(
+                f"ATENCION: el sumidero ha fallado en {stats['lotes_fallidos']} lotes, "
+                f"se han perdido {stats['filas_perdidas']} filas"
+            )
@@ -0,0 +1,216 @@
+import sys
+import threading
+from collections import Counter
+from operator import attrgetter
+
+# Campos de cada itinerario que pasan tal cual a las columnas del df (mismos nombres que COLUMNAS_DF)
+CAMPOS_ITINERARIO = (
+    "inicio_ida",
+    "fin_ida",
+    "inicio_vuelta",
+    "fin_vuelta",
+    "escala_ida",
+    "escala_vuelta",
+    "duracion_ida",
+    "duracion_vuelta",
+    "aerolineas",
+    "equipaje_mano",
+    "precio",
+)
+
+# Campos de la ruta, comunes a todos sus itinerarios (mismos nombres que COLUMNAS_DF)
+CAMPOS_RUTA = ("url", "origen", "destino", "fecha_inicio", "fecha_fin")
+
+# Valores fijos de todas las filas: edreams no da ni equipaje de bodega ni clase, y se busca para 1 pasajero
+VALORES_FIJOS = {"pasajeros": 1, "equipaje_bodega": 0, "clase": None}
+
+# Tuplas (aeropuertos, aerolineas) compartidas: hay muy pocas distintas para millones de itinerarios
+_tuplas = {}
+_lock_tuplas = threading.Lock()
+
+
+def _texto(valor):
+    return sys.intern(str(valor).strip())
+
+
+def _tupla(valores):
+    tupla = tuple(_texto(valor) for valor in valores)
+    compartida = _tuplas.get(tupla)
+    if compartida is None:
+        with _lock_tuplas:
+            compartida = _tuplas.setdefault(tupla, tupla)
+    return compartida
+
+
+# En edreams solo se puede detectar el equipaje de mano: 1 si el primer equipaje es "Equipaje de mano", si no 0
+def equipaje_de_mano(equipajes):
+    return 1 if len(equipajes) > 1 and equipajes[0] == "Equipaje de mano" else 0
+
+
+class Itinerario:
+    """
+    Itinerario compacto (__slots__) con los textos internados: horas, escalas, duraciones y precios se repiten
+    muchisimo, asi que millones de itinerarios comparten unos pocos miles de textos. Los campos se llaman como las
+    columnas del df (ver df_rutas); los datos de la ruta (url, origen, destino, fechas) van una sola vez en su Ruta.
+    :param aeropuertos: Los 2 aeropuertos de la ida y los 2 de la vuelta.
+    :param aerolineas: Aerolineas del itinerario, sin repetir.
+    :param horas: Salida y llegada de la ida y de la vuelta ("HH:MM").
+    :param duraciones: Duracion de la ida y de la vuelta, como la muestra la web ("2 h 35 min").
+    :param escalas: Escalas de la ida y de la vuelta, como las muestra la web ("directo", "1 escala").
+    :param equipaje_mano: 1 si incluye equipaje de mano, si no 0.
+    :param precio: Precio por pasajero, como lo muestra la web ("1.234").
+    """
+
+    __slots__ = ("aeropuertos",) + CAMPOS_ITINERARIO
+
+    def __init__(
+        self, aeropuertos, aerolineas, horas, duraciones, escalas, equipaje_mano, precio
+    ):
+        self.aeropuertos = _tupla(aeropuertos[:4])
+        self.aerolineas = _tupla(aerolineas)
+        self.inicio_ida, self.fin_ida, self.inicio_vuelta, self.fin_vuelta = map(
+            _texto, horas[:4]
+        )
+        self.duracion_ida, self.duracion_vuelta = map(_texto, duraciones[:2])
+        self.escala_ida, self.escala_vuelta = map(_texto, escalas[:2])
+        self.equipaje_mano = 1 if equipaje_mano else 0
+        self.precio = _texto(precio)
+
+    @classmethod
+    def desde_lista(cls, datos):
+        """
+        Crea el itinerario a partir de su lista: la de a_lista() o la lista anidada que se guardaba antes
+        [aeropuertos, aerolineas, horas, duraciones, escalas, equipajes, precio, precios] (diarios y caches antiguos).
+        """
+        equipaje = datos[5]
+        if isinstance(equipaje, list):
+            equipaje = equipaje_de_mano(equipaje)
+        return cls(datos[0], datos[1], datos[2], datos[3], datos[4], equipaje, datos[6])
+
+    # Lista serializable en JSON (diario, cache de rutas, cola de tareas)
+    def a_lista(self):
+        return [
+            list(self.aeropuertos),
+            list(self.aerolineas),
+            [self.inicio_ida, self.fin_ida, self.inicio_vuelta, self.fin_vuelta],
+            [self.duracion_ida, self.duracion_vuelta],
+            [self.escala_ida, self.escala_vuelta],
+            self.equipaje_mano,
+            self.precio,
+        ]
+
+    # Identidad del vuelo: mismos aeropuertos, horas, duraciones y aerolineas (el precio puede cambiar)
+    def identidad(self):
+        return (
+            self.aeropuertos,
+            (self.inicio_ida, self.fin_ida, self.inicio_vuelta, self.fin_vuelta),
+            (self.duracion_ida, self.duracion_vuelta),
+            tuple(sorted(self.aerolineas)),
+        )
+
+    def __eq__(self, otro):
+        if not isinstance(otro, Itinerario):
+            return NotImplemented
+        return all(
+            getattr(self, campo) == getattr(otro, campo) for campo in self.__slots__
+        )
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Itinerario({self.a_lista()!r})"
+
+
+# Para json.dumps(itinerarios, default=serializar): convierte cada Itinerario en su lista
+def serializar(objeto):
+    if isinstance(objeto, Itinerario):
+        return objeto.a_lista()
+    raise TypeError(f"{type(objeto).__name__} no es serializable")
+
+
+# Lista de itinerarios a partir de sus listas (json.loads de lo guardado con serializar)
+def deserializar(listas):
+    return [Itinerario.desde_lista(datos) for datos in listas]
+
+
+class Ruta:
+    """
+    Itinerarios de una ruta (origen, destino y fechas de una busqueda). La url y los datos de la ruta se guardan
+    una vez para todos sus itinerarios. `cacheada` indica que los itinerarios vienen de la cache de rutas.
+    """
+
+    __slots__ = CAMPOS_RUTA + ("itinerarios", "cacheada")
+
+    def __init__(
+        self,
+        url,
+        origen,
+        destino,
+        fecha_inicio,
+        fecha_fin,
+        itinerarios=(),
+        cacheada=False,
+    ):
+        self.url = url
+        self.origen = sys.intern(origen)
+        self.destino = sys.intern(destino)
+        self.fecha_inicio = sys.intern(fecha_inicio)
+        self.fecha_fin = sys.intern(fecha_fin)
+        self.itinerarios = list(itinerarios)
+        self.cacheada = cacheada
+
+    # Unidad del diario de trabajo (origen, inicio, fin, destino)
+    @property
+    def unidad(self):
+        return (self.origen, self.fecha_inicio, self.fecha_fin, self.destino)
+
+    def __len__(self):
+        return len(self.itinerarios)
+
+
+# Filas de cada unidad del diario en un conjunto de rutas, para DiarioTrabajo.registrar_volcado()
+def unidades_rutas(rutas):
+    cuenta = Counter()
+    for ruta in rutas:
+        cuenta[ruta.unidad] += len(ruta.itinerarios)
+    return cuenta
+
+
+def df_rutas(rutas):
+    """
+    Convierte rutas en el df con las columnas COLUMNAS_DF (sin normalizar) de una sola vez y por columnas:
+    los campos de la ruta se repiten con numpy y los de los itinerarios son referencias a los textos internados,
+    sin crear una lista ni un texto nuevo por fila.
+    :param rutas: Lista de Ruta.
+    :return: DataFrame con una fila por itinerario, en el orden de las rutas.
+    """
+    import numpy as np
+    import pandas as pd
+
+    from normalizacion import COLUMNAS_DF
+
+    longitudes = np.fromiter(
+        (len(ruta.itinerarios) for ruta in rutas), dtype=np.int64, count=len(rutas)
+    )
+    itinerarios = [itinerario for ruta in rutas for itinerario in ruta.itinerarios]
+    filas = len(itinerarios)
+
+    columnas = {}
+    for campo in CAMPOS_RUTA:
+        valores = np.empty(len(rutas), dtype=object)
+        valores[:] = [getattr(ruta, campo) for ruta in rutas]
+        columnas[campo] = np.repeat(valores, longitudes)
+    for campo in CAMPOS_ITINERARIO:
+        if campo == "equipaje_mano":
+            columnas[campo] = np.fromiter(
+                map(attrgetter(campo), itinerarios), dtype=np.int64, count=filas
+            )
+        else:
+            columnas[campo] = np.fromiter(
+                map(attrgetter(campo), itinerarios), dtype=object, count=filas
+            )
+
+    df = pd.DataFrame(columnas, index=pd.RangeIndex(filas))
+    for campo, valor in VALORES_FIJOS.items():
+        df[campo] = valor
+    return df[COLUMNAS_DF]
@@ -1,125 +1,432 @@
 import argparse
 import json
-import locale
 import os
-import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from time import sleep
-
-import numpy as np
-import pandas as pd
-import requests
-import tqdm
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.common.by import By
+from functools import partial
+
+# Solo modulos ligeros a nivel de modulo: pandas, selenium, bs4, requests, pyarrow... se importan en las etapas que los usan,
+# para que --help y la validacion de argumentos no tengan que cargarlos
+from browser_pool import BrowserPool, aceptar_cookies, crear_chrome
+from cache_destinos import CacheDestinos
+from cache_rutas import CacheRutas, ItinerariosCacheados, variante_opciones
+from dataset_vuelos import DIRECTORIO_DATOS
+from diario_trabajo import FICHERO_DIARIO, DiarioTrabajo, descontar
+from esperas import MOTOR
+from fechas_flexibles import DIRECTORIO_MATRICES, MatrizPrecios, planificar_matrices
+from gobernador import GOBERNADOR
+from indice_iata import IndiceIata
+from metricas import METRICAS, arrancar_servidor_metricas
+from perfil_navegador import ESTADISTICAS as ESTADISTICAS_RED
+from perfil_navegador import medir_pagina, preparar_medicion
+from pipeline import Pipeline
+from registros import Ruta, df_rutas, unidades_rutas
+
+# Url base de la web (EDREAMS_URL permite apuntar a la web simulada de servidor_simulado.py)
+URL_EDREAMS = os.getenv("EDREAMS_URL", "https://www.edreams.es")
+
+# Plantilla de la url de resultados de un destino + fechas
+URL_RESULTADOS = "{url}/travel/#results/type=R;dep={inicio};from={origen};to={destino};ret={fin};collectionmethod=false"
+
+# Celdas de la matriz de fechas flexibles (empezando por las fechas pedidas) en las que se intenta descubrir los destinos
+INTENTOS_DESCUBRIMIENTO_FLEX = 3
+
+# Selector de los itinerarios dentro del contenedor de resultados
+SELECTOR_ITINERARIOS = '#results_list_container [data-testid="itinerary"]'
+
+# Plantilla de la url de la rejilla de destinos ("cualquier destino") a la que lleva el formulario de busqueda
+URL_DESCUBRIMIENTO = os.getenv(
+    "EDREAMS_URL_DESCUBRIMIENTO",
+    "{url}/travel/#inspirational/type=R;dep={inicio};from={origen};ret={fin};collectionmethod=false",
+)
+
+# Fallos seguidos de la rejilla por url tras los que se deja de intentar y se va directo al formulario
+MAX_FALLOS_URL = 3
+
+# Nombres de los meses tal y como los muestra el calendario de la web (evita depender del locale del sistema)
+MESES = [
+    "Enero",
+    "Febrero",
+    "Marzo",
+    "Abril",
+    "Mayo",
+    "Junio",
+    "Julio",
+    "Agosto",
+    "Septiembre",
+    "Octubre",
+    "Noviembre",
+    "Diciembre",
+]
 
 
 # Funcion principal del scrapeo a edreams. Gestiona todas las acciones necesarias para scrapear (selenium, diferentes urls, soap, preparar y devolver datos)
-def scrapping_edreams(origen, inicio, fin):
+# opciones_destino son los parametros extra que se pasan a datos_destino() (parser, etc.)
+@METRICAS.medir("scrapping_edreams")
+def scrapping_edreams(
+    origen,
+    inicio,
+    fin,
+    pool,
+    workers=1,
+    cliente=None,
+    cache_destinos=None,
+    opciones_destino=None,
+    cache_rutas=None,
+    diario=None,
+):
+    import tqdm
+
+    opciones_destino = opciones_destino or {}
     print(f"Procesando {origen} - {inicio} to {fin}")
-    url = "https://www.edreams.es"
-
-    # Llamada a la funcion que se encarga de hacer las acciones necesarias mediante selenium para lanzar la busquesda inicial por origen + fechas
-    soup = obtener_posibles_destinos(url=url, origen=origen, inicio=inicio, fin=fin)
+    url = URL_EDREAMS
+
+    # Llamada a la funcion que se encarga de obtener los destinos posibles para el origen + fechas (diario, cache, url directa o formulario)
+    lista_destinos = descubrir_destinos(
+        url=url,
+        origen=origen,
+        inicio=inicio,
+        fin=fin,
+        pool=pool,
+        cache=cache_destinos,
+        diario=diario,
+    )
+    if lista_destinos is None:
+        return []
 
-    # Generar las URLs de destinos+fechas basado en el contenido de la etiqueta article y la plantilla de url
+    # Generar las URLs de destinos+fechas basado en la plantilla de url
     # "{url}/travel/#results/type=R;dep={inicio};from={origen};to={destino};ret={fin};collectionmethod=false"
-    destinos = soup.find_all("article", class_="od-inspirational-grid-col")
-    # obtenemos los codigos IATA sobre los que luego buscaremos al intruducirlos como parametros en la URL
-    lista_destinos = [destino.find("figure")["data-iata"] for destino in destinos]
 
     urls_destinos = {}
     for destino in lista_destinos:
-        # url_template = f"{url}/travel/#results/type=R;dep={inicio};from={origen};to={???};ret={fin};collectionmethod=false"
-        urls_destinos[destino] = (
-            f"{url}/travel/#results/type=R;dep={inicio};from={origen};to={destino};ret={fin};collectionmethod=false"
+        urls_destinos[destino] = URL_RESULTADOS.format(
+            url=url, origen=origen, destino=destino, inicio=inicio, fin=fin
         )
 
-    # scrap data
-    datos_scrapeados = []
-    for destino, destino_url in tqdm.tqdm(
-        urls_destinos.items(), total=len(urls_destinos)
-    ):
-        # datos fijos que sabemos por la propia busqueda: url, origen, destino, inicio, fin
-        fixed_data = [destino_url, origen, destino, inicio, fin]
+    resultados_destinos = {}
+    pendientes = dict(urls_destinos)
+
+    # Al reanudar un trabajo: los destinos ya volcados se saltan y los ya scrapeados salen del diario
+    if diario is not None:
+        for destino in list(pendientes):
+            estado, itinerarios = diario.estado(origen, inicio, fin, destino)
+            if estado == "volcada":
+                del pendientes[destino]
+                del urls_destinos[destino]
+            elif estado == "scrapeada":
+                resultados_destinos[destino] = itinerarios
+                del pendientes[destino]
+
+    # Con el backend api, si aun no tenemos la peticion de busqueda, la capturamos con el navegador en el primer destino
+    if cliente is not None and not cliente.preparado and pendientes:
+        destino, destino_url = next(iter(pendientes.items()))
+        resultados_destinos[destino] = capturar_busqueda(
+            url=destino_url,
+            pool=pool,
+            cliente=cliente,
+            ruta=dict(origen=origen, destino=destino, inicio=inicio, fin=fin),
+            **opciones_destino,
+        )
+        if diario is not None:
+            resultados_destinos[destino] = diario.completar(
+                origen, inicio, fin, destino, resultados_destinos[destino]
+            )
+        del pendientes[destino]
+
+    # scrap data, repartiendo los destinos entre N workers (cada uno con su navegador del pool)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futuros = {
+            executor.submit(
+                scrapear_destino,
+                url=destino_url,
+                pool=pool,
+                cliente=cliente,
+                ruta=dict(origen=origen, destino=destino, inicio=inicio, fin=fin),
+                cache_rutas=cache_rutas,
+                **opciones_destino,
+            ): destino
+            for destino, destino_url in pendientes.items()
+        }
+        barra = tqdm.tqdm(as_completed(futuros), total=len(futuros))
+        for futuro in barra:
+            destino = futuros[futuro]
+            if GOBERNADOR.activo:
+                estado = GOBERNADOR.estado()
+                barra.set_postfix(
+                    limite=estado["limite"],
+                    pausa=estado["pausa"],
+                    circuito=estado["circuito"],
+                )
+            try:
+                resultados_destinos[destino] = futuro.result()
+            except Exception as exception:
+                # Si un worker falla, perdemos solo ese destino y no el resto (con diario, se reintenta al reanudar)
+                print(
+                    f"Ignorando destino {destino} por problemas al scrapear...{exception}"
+                )
+                resultados_destinos[destino] = []
+                METRICAS.contar("destinos_fallidos")
+                if diario is not None:
+                    diario.fallar(origen, inicio, fin, destino, exception)
+                continue
+            # Con diario solo quedan por volcar los itinerarios que no escribiera ya un intento anterior
+            if diario is not None:
+                pendientes_volcar = diario.completar(
+                    origen, inicio, fin, destino, resultados_destinos[destino]
+                )
+                if isinstance(resultados_destinos[destino], ItinerariosCacheados):
+                    pendientes_volcar = ItinerariosCacheados(pendientes_volcar)
+                resultados_destinos[destino] = pendientes_volcar
+
+    # Recomponemos los resultados en el mismo orden en el que se descubrieron los destinos: una Ruta por destino
+    # con los datos fijos que sabemos por la propia busqueda (url, origen, destino, inicio, fin) y sus itinerarios
+    return [
+        Ruta(
+            destino_url,
+            origen,
+            destino,
+            inicio,
+            fin,
+            resultados_destinos[destino],
+            cacheada=isinstance(resultados_destinos[destino], ItinerariosCacheados),
+        )
+        for destino, destino_url in urls_destinos.items()
+    ]
+
+
+# Funcion que ejecuta cada worker: usa el backend api si esta disponible, y si no (o si falla) un navegador del pool
+# Con cache de rutas, solo se scrapea si la ruta no esta en la cache o ha caducado
+def scrapear_destino(
+    url, pool, cliente=None, ruta=None, cache_rutas=None, **opciones_destino
+):
+    if cache_rutas is not None:
+        clave = CacheRutas.clave(**ruta, variante=variante_opciones(opciones_destino))
+        return cache_rutas.obtener_o_scrapear(
+            clave,
+            partial(scrapear_destino, url, pool, cliente, ruta, **opciones_destino),
+        )
+
+    # El gobernador decide cuantas rutas se scrapean a la vez y con que pausa, segun como responda la web
+    with GOBERNADOR.turno(f"{ruta['origen']}-{ruta['destino']}" if ruta else url):
+        if cliente is not None and cliente.preparado:
+            try:
+                return cliente.datos_destino(**ruta)
+            except Exception as exception:
+                print(f"Fallo en el backend api, usando el navegador... {exception}")
+                METRICAS.contar("reintentos", componente="api")
+
+        with pool.sesion() as browser:
+            return datos_destino(url=url, browser=browser, **opciones_destino)
+
+
+# Funcion para scrapear un destino con el navegador y, de paso, capturar la peticion de busqueda para el backend api
+def capturar_busqueda(url, pool, cliente, ruta, **opciones_destino):
+    with GOBERNADOR.turno(
+        f"{ruta['origen']}-{ruta['destino']}"
+    ), pool.sesion() as browser:
+        data_destino = datos_destino(url=url, browser=browser, **opciones_destino)
+        if cliente.capturar(browser, **ruta):
+            cliente.guardar()
+            print("Peticion de busqueda capturada, el resto de destinos iran por api")
+        else:
+            print(
+                "No se ha podido capturar la peticion de busqueda, se sigue con navegador"
+            )
+    return data_destino
 
-        # datos obtenidos del scrapeo de la url con los vuelos a ese destino
-        data_destino = datos_destino(url=destino_url)
 
-        # list comprehension para nutrir cada elemento con los valores fijos
-        full_data_destino = [fixed_data + rd for rd in data_destino]
+# Funcion para obtener los destinos de un origen + fechas: del diario si el trabajo ya los descubrio, y si no con el navegador
+# Los apunta en el diario (o apunta el fallo, para reintentarlo al reanudar). Devuelve None si no se han podido obtener
+def descubrir_destinos(url, origen, inicio, fin, pool, cache=None, diario=None):
+    if diario is not None:
+        destinos = diario.destinos(origen, inicio, fin)
+        if destinos is not None:
+            return destinos
 
-        datos_scrapeados.extend(full_data_destino)
+    try:
+        destinos = obtener_posibles_destinos(
+            url=url, origen=origen, inicio=inicio, fin=fin, pool=pool, cache=cache
+        )
+        error = "no se ha podido cargar la rejilla de destinos"
+    except Exception as exception:
+        destinos, error = None, exception
+
+    if destinos is None:
+        print(
+            f"No se han podido obtener destinos para {origen} - {inicio} to {fin}... {error}"
+        )
+        if diario is not None:
+            diario.fallar_descubrimiento(origen, inicio, fin, error)
+        return None
 
-    return datos_scrapeados
+    if diario is not None:
+        diario.planificar(origen, inicio, fin, destinos)
+    return destinos
 
 
 # Funcion que realiza con selenium todas las acciones dinamicas para poder obtener todos los posibles destinos en base a un origen y unas fechas
-def obtener_posibles_destinos(url, origen, inicio, fin):
-    browser = webdriver.Chrome()
+# Devuelve la lista de codigos IATA de destino, o None si no se han podido obtener
+@METRICAS.medir("obtener_posibles_destinos")
+def obtener_posibles_destinos(url, origen, inicio, fin, pool, cache=None):
+    # Si ya descubrimos los destinos de este origen + fechas, nos saltamos el navegador
+    if cache is not None:
+        destinos = cache.obtener(origen, inicio, fin)
+        if destinos is not None:
+            print(f"Usando {len(destinos)} destinos cacheados para {origen}")
+            return destinos
+
+    with pool.sesion() as browser:
+        # Primero intentamos cargar directamente la rejilla de destinos por url, y si falla usamos el formulario.
+        # Si la url falla varias veces seguidas (p.ej. la web ha cambiado su formato) no se vuelve a probar
+        soup = None
+        with _LOCK_FALLOS_URL:
+            probar_url = _FALLOS_URL["seguidos"] < MAX_FALLOS_URL
+        if probar_url:
+            soup = _descubrir_por_url(browser, url, origen, inicio, fin)
+            with _LOCK_FALLOS_URL:
+                _FALLOS_URL["seguidos"] = (
+                    0 if soup is not None else _FALLOS_URL["seguidos"] + 1
+                )
+            if soup is None:
+                print(
+                    "No se ha podido cargar la rejilla de destinos por url, usando el formulario"
+                )
+        if soup is None:
+            soup = _buscar_destinos(browser, url, origen, inicio, fin)
+
+    if soup is None:
+        return None
+
+    destinos = extraer_destinos(soup)
+    if cache is not None and destinos:
+        cache.guardar(origen, inicio, fin, destinos)
+    return destinos
+
+
+# Funcion para obtener los codigos IATA de la rejilla de destinos (etiquetas article con un figure con data-iata)
+def extraer_destinos(soup):
+    destinos = soup.find_all("article", class_="od-inspirational-grid-col")
+    figuras = [destino.find("figure") for destino in destinos]
+    return [
+        figura["data-iata"]
+        for figura in figuras
+        if figura is not None and figura.has_attr("data-iata")
+    ]
+
+
+# Fallos seguidos de _descubrir_por_url, compartidos por todos los workers
+_FALLOS_URL = {"seguidos": 0}
+_LOCK_FALLOS_URL = threading.Lock()
+
+
+# Funcion para cargar la rejilla de destinos construyendo directamente su url, sin pasar por el formulario
+def _descubrir_por_url(browser, url, origen, inicio, fin):
+    from bs4 import BeautifulSoup
+    from selenium.webdriver.common.by import By
+
+    try:
+        browser.get("about:blank")
+        browser.get(
+            URL_DESCUBRIMIENTO.format(url=url, origen=origen, inicio=inicio, fin=fin)
+        )
+        aceptar_cookies(browser)
+
+        numero = MOTOR.estable(
+            browser,
+            "destinos.rejilla_url",
+            By.CSS_SELECTOR,
+            "article.od-inspirational-grid-col",
+            opcional=True,
+        )
+        if not numero:
+            return None
+        return BeautifulSoup(browser.page_source, "html.parser")
+
+    except Exception as exception:
+        print(f"Excepcion cargando la rejilla de destinos por url... {exception}")
+        return None
+
+
+def _buscar_destinos(browser, url, origen, inicio, fin):
+    from bs4 import BeautifulSoup
+    from selenium.webdriver.common.by import By
+
     browser.get(url)
-    sleep(1)
-    browser.maximize_window()
-    sleep(1)
 
     try:
-        # aceptar cookies
-        browser.find_element(By.ID, "didomi-notice-agree-button").click()
-        sleep(5)
+        # aceptar cookies (solo aparece la primera vez en cada sesion del pool)
+        aceptar_cookies(browser)
 
         # Escribir en el inputo de origen el valor recibido
-        browser.find_element(By.XPATH, '//input[@test-id="input-airport"]').send_keys(
-            origen
-        )
-        sleep(5)
+        MOTOR.presente(
+            browser,
+            "destinos.input_origen",
+            By.XPATH,
+            '//input[@test-id="input-airport"]',
+        ).send_keys(origen)
 
         # Click en el origen que se muestra como resultado del paso anterior
-        browser.find_element(
-            By.XPATH, '//div[@test-id="airport-departure"]'
-        ).find_element(
-            By.XPATH, f'.//ul/li/div/span[contains(text(), "{origen}")]'
+        MOTOR.clicable(
+            browser,
+            "destinos.opcion_origen",
+            By.XPATH,
+            f'//div[@test-id="airport-departure"]//ul/li/div/span[contains(text(), "{origen}")]',
         ).click()
-        sleep(5)
 
         # Click en la primera opcion de destino que se muestra al hacer el paso anterior, que es cualquier destino
-        browser.find_element(
-            By.XPATH, '//div[@test-id="airport-destination"]'
-        ).find_element(
+        MOTOR.clicable(
+            browser,
+            "destinos.opcion_cualquier_destino",
             By.XPATH,
-            './/div/div/ul/li/div[contains(@class, "odf-dropdown-col") and contains(@class, "lg") and contains(@class, "odf-text-nowrap")]',
+            '//div[@test-id="airport-destination"]//div/div/ul/li/div[contains(@class, "odf-dropdown-col") and contains(@class, "lg") and contains(@class, "odf-text-nowrap")]',
         ).click()
-        sleep(5)
 
         # Logica para abrir el calendario y elegir las fechas que hemos recibido, fecha de inicio
-        div_calendario_salida = browser.find_element(
-            By.XPATH, '//div[@data-testid="departure-date-picker"]'
+        div_calendario_salida = MOTOR.presente(
+            browser,
+            "destinos.calendario_salida",
+            By.XPATH,
+            '//div[@data-testid="departure-date-picker"]',
         )
         procesar_calendario(fecha=inicio, element=div_calendario_salida)
-        sleep(5)
 
         # Logica para abrir el calendario y elegir las fechas que hemos recibido, fecha de fin
-        div_calendario_vuelta = browser.find_element(
-            By.XPATH, '//div[@data-testid="return-date-picker"]'
+        div_calendario_vuelta = MOTOR.presente(
+            browser,
+            "destinos.calendario_vuelta",
+            By.XPATH,
+            '//div[@data-testid="return-date-picker"]',
         )
         procesar_calendario(fecha=fin, element=div_calendario_vuelta)
-        sleep(5)
 
         # Click en el boton Continuar para confirmar las fechas (y todo lo previo)
-        div_calendario_vuelta.find_element(
-            By.XPATH, './/div/button[contains(text(), "Continuar")]'
+        MOTOR.clicable(
+            browser,
+            "destinos.boton_continuar",
+            By.XPATH,
+            '//div[@data-testid="return-date-picker"]//div/button[contains(text(), "Continuar")]',
         ).click()
 
         # Lanzar la busqueda de destinos
-        boton_buscar = browser.find_element(
-            By.XPATH, '//button[@test-id="search-flights-btn"]'
+        MOTOR.clicable(
+            browser,
+            "destinos.boton_buscar",
+            By.XPATH,
+            '//button[@test-id="search-flights-btn"]',
+        ).click()
+
+        # Esperamos a que la rejilla de destinos este cargada y no siga creciendo
+        MOTOR.estable(
+            browser,
+            "destinos.rejilla",
+            By.CSS_SELECTOR,
+            "article.od-inspirational-grid-col",
+            timeout=60,
         )
-        boton_buscar.click()
-        sleep(10)
 
         # Una vez ha cargado los resultados, lo montamos en BS y lo devolvemos
         soup = BeautifulSoup(browser.page_source, "html.parser")
-        browser.quit()
 
         if soup is None:
             raise Exception
@@ -133,9 +440,8 @@ def obtener_posibles_destinos(url, origen, inicio, fin):
 
 # Funcion para parsear la fecha recibida a un formato especial que hay en la pagina
 def custom_ano_mes_format(fecha=datetime.now()):
-    locale.setlocale(locale.LC_TIME, "es_ES.UTF-8")
-    # Obtener el nombre del mes en formato completo (por ejemplo, "noviembre")
-    parsed_month = fecha.strftime("%B").capitalize()
+    # Obtener el nombre del mes en formato completo (por ejemplo, "Noviembre")
+    parsed_month = MESES[fecha.month - 1]
 
     # Obtener los dos últimos dígitos del año (por ejemplo, "23" en lugar de "2023")
     parsed_year = fecha.strftime("%y")
@@ -148,6 +454,8 @@ def custom_ano_mes_format(fecha=datetime.now()):
 
 # Funcion para mostrar el mes deseado, via selenium
 def mostrar_mes(ano_mes_str, html_element):
+    from selenium.webdriver.common.by import By
+
     while True:
         # Obtener los calendarios de los meses que actualmente vemos en la pagina
         meses_visibles = [
@@ -173,6 +481,8 @@ def mostrar_mes(ano_mes_str, html_element):
 
 # Funcion para procesar las acciones necesarias con selenium para mostrar el calendario
 def procesar_calendario(fecha, element):
+    from selenium.webdriver.common.by import By
+
     # A partir de la fecha recibida, transformamos a formato "Mes 'YY" que es lo que la web muestra y por lo tanto hay que buscar
     fecha_datetime = datetime.strptime(fecha, "%Y-%m-%d")
     fecha_ano_mes = custom_ano_mes_format(fecha_datetime)
@@ -198,15 +508,26 @@ def procesar_calendario(fecha, element):
 
 # Funcion para detectar y quitar una alerta/boton molesto
 def check_boton_molesto(browser):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
     # check stupid alert
     try:
         stupid_alert = browser.find_element(By.ID, "sessionAboutToExpireAlert")
 
         if stupid_alert:
-            stupid_button = stupid_alert.find_element(By.CCS_SELECTOR, "button")
+            stupid_button = stupid_alert.find_element(By.CSS_SELECTOR, "button")
             if stupid_button:
                 stupid_button.click()
-                sleep(1)
+                # La alerta de sesion es señal de que la web nos esta frenando
+                GOBERNADOR.senal("bloqueo")
+                METRICAS.contar("alertas_sesion")
+                MOTOR.esperar(
+                    browser,
+                    "alerta.cerrar",
+                    EC.invisibility_of_element(stupid_alert),
+                    opcional=True,
+                )
                 return True
     except Exception:
         # print("Error detectando el boton estupido...")
@@ -216,30 +537,143 @@ def check_boton_molesto(browser):
 
 
 # Funcion para scrapear con selenuim y BS el detalle de los vuelos segun la url recibida que contiene ya el conjunto de datos de origen, destino, inicio y fin
-def datos_destino(url):
+# Con incremental=True los itinerarios se van cosechando durante el bucle de "Mostrar más" (ver cosechar_destino)
+@METRICAS.medir("datos_destino")
+def datos_destino(
+    url,
+    browser,
+    parser=None,
+    captura="contenedor",
+    comparar_captura=False,
+    incremental=False,
+    **opciones_cosecha,
+):
+    from captura import extraer_itinerarios
+
+    # Si la pagina falla a mitad de la cosecha, nos quedamos con los itinerarios ya cosechados
+    if incremental:
+        itinerarios = []
+        try:
+            for itinerario in cosechar_destino(
+                url=url, browser=browser, parser=parser, **opciones_cosecha
+            ):
+                itinerarios.append(itinerario)
+        except Exception as exception:
+            if not itinerarios:
+                raise
+            print(
+                f"Cosecha interrumpida, se guardan {len(itinerarios)} itinerarios...{exception}"
+            )
+            METRICAS.contar("cosechas_parciales")
+        return itinerarios
+
+    cargar_resultados(url=url, browser=browser)
+
+    # Hacemos scroll y click en mostrar mas resultados hasta que no se pueda mas, y despues extraemos todo
+    with METRICAS.tramo("datos_destino.scroll"):
+        for _ in mostrar_mas(browser=browser):
+            pass
+    medir_pagina(browser)
+
+    # Traemos del navegador solo el html necesario (por defecto el contenedor de resultados) y lo parseamos
+    with METRICAS.tramo("datos_destino.parseo"):
+        return extraer_itinerarios(
+            browser, modo=captura, parser=parser, comparar=comparar_captura
+        )
+
+
+def cosechar_destino(
+    url,
+    browser,
+    parser=None,
+    max_resultados=None,
+    precio_maximo=None,
+    pasos_sin_mejora=None,
+):
+    """
+    Generador que devuelve los itinerarios de un destino a medida que se cargan, tras cada "Mostrar más".
+    :param max_resultados: Deja de cargar resultados al llegar a este numero de itinerarios.
+    :param precio_maximo: Descarta los vuelos mas caros, y deja de cargar si una tanda entera lo supera.
+    :param pasos_sin_mejora: Deja de cargar si en este numero de tandas seguidas no aparece un precio mas barato.
+    :return: Itinerarios unicos (misma lista de datos que datos_destino()).
+    """
+    from captura import Cosechador
+
+    cargar_resultados(url=url, browser=browser)
+
+    cosechador = Cosechador(
+        parser=parser,
+        max_resultados=max_resultados,
+        precio_maximo=precio_maximo,
+        pasos_sin_mejora=pasos_sin_mejora,
+    )
+    for _ in mostrar_mas(browser=browser):
+        yield from cosechador.cosechar(browser)
+        if cosechador.terminado:
+            print(f"Parada anticipada: {cosechador.motivo}")
+            break
+    else:
+        # Ultima cosecha, con la lista ya completa
+        yield from cosechador.cosechar(browser)
+    medir_pagina(browser)
+
+
+# Funcion para cargar la pagina de resultados de un destino y esperar a los primeros itinerarios
+@METRICAS.medir("datos_destino.carga")
+def cargar_resultados(url, browser):
+    from selenium.webdriver.common.by import By
+
     print(f"Processing {url}")
-    lista_datos_destino = []
 
-    browser = webdriver.Chrome()
+    # Al reutilizar el navegador del pool, pasamos por una pagina en blanco para forzar la carga completa
+    # (si no, al cambiar solo el hash de la url la web no relanzaria la busqueda)
+    browser.get("about:blank")
     browser.get(url)
-    sleep(1)
-    browser.maximize_window()
-    sleep(15)
+    preparar_medicion(browser)
+
+    # Aceptar cookies (solo aparece la primera vez en cada sesion del pool)
+    aceptar_cookies(browser)
 
-    # Aceptar cookies
-    browser.find_element(By.ID, "didomi-notice-agree-button").click()
-    sleep(1)
+    # Esperamos al contenedor de resultados y a que los primeros itinerarios terminen de pintarse
+    MOTOR.presente(
+        browser, "resultados.contenedor", By.ID, "results_list_container", timeout=60
+    )
+    MOTOR.estable(
+        browser,
+        "resultados.primera_carga",
+        By.CSS_SELECTOR,
+        SELECTOR_ITINERARIOS,
+        ventana=1.5,
+        opcional=True,
+    )
+
+
+# Generador con el bucle de scroll y click en "Mostrar más". Devuelve el numero de clicks cada vez que la lista esta estable
+def mostrar_mas(browser):
+    from selenium.webdriver.common.by import By
 
     # Bucle para hacer scroll y clieck en mostrar mas resultados, hasta que no se pueda hacer mas scroll
     counter = 0
     scroll = 10000
     while True:
+        METRICAS.contar("scroll_iteraciones")
         # Scroll
         browser.execute_script(f"window.scrollBy(0, {scroll});")
-        sleep(6)
+        # En vez de esperar un tiempo fijo, esperamos a que no haya peticiones en curso y la lista no cambie
+        MOTOR.red_inactiva(browser, "resultados.scroll_red", opcional=True)
+        MOTOR.estable(
+            browser,
+            "resultados.scroll_lista",
+            By.CSS_SELECTOR,
+            SELECTOR_ITINERARIOS,
+            opcional=True,
+        )
         # Checkeamos si existe un boton molesto, y lo quitamos
         check_boton_molesto(browser=browser)
 
+        # Los resultados cargados hasta ahora ya estan estables
+        yield counter
+
         # Buscamos los botones
         botones = browser.find_element(By.ID, "results_list_container").find_elements(
             By.XPATH, ".//button"
@@ -256,10 +690,13 @@ def datos_destino(url):
                     print("Boton estupido detectado y clickado :)")
                     continue
                 else:
-                    # Si hay error desconocido, simplemente dejamos de hacer scroll y pasamos a extraer datos
+                    # Si hay error desconocido, simplemente dejamos de hacer scroll y pasamos a extraer datos (resultados truncados)
+                    GOBERNADOR.senal("truncado")
                     break
 
             counter += 1
+            METRICAS.contar("clicks_mostrar_mas")
+            GOBERNADOR.pagina()
             # Cada bucle aumentamos el scroll
             scroll += 500
 
@@ -267,222 +704,150 @@ def datos_destino(url):
             # Si no tengo botones ni boton molesto, dejo de hacer scroll
             break
 
-    sleep(4)
+    MOTOR.estable(
+        browser,
+        "resultados.final",
+        By.CSS_SELECTOR,
+        SELECTOR_ITINERARIOS,
+        opcional=True,
+    )
     print(f"Scroll hecho {counter} veces")
 
-    # Montamos el BS con el contenido
-    soup = BeautifulSoup(browser.page_source, "html.parser")
-    browser.quit()
-
-    # Contenedor con todos los divs de vuelos
-    results_container = soup.find(id="results_list_container")
-    elements = results_container.find_all(attrs={"data-testid": "itinerary"})
-
-    for element in elements:
-        duraciones = []
-        escalas = []
-        datos_horas = []
-        equipajes = []
-
-        try:
-            # Aeropuertos, es una lista con los 2 de la ida y los 2 de la vuelta
-            aeropuertos = element.find_all("div", {"type": "small"})
-            aeropuertos_data = [
-                aeropuertos[0].text.strip(),
-                aeropuertos[2].text.strip(),
-                aeropuertos[4].text.strip(),
-                aeropuertos[6].text.strip(),
-            ]
-
-            # Aerolineas, las dejamos en una lista de valores unicos
-            aerolineas_elem = element.find_all("img")
-            aerolineas = list(
-                {a.attrs["alt"] for a in aerolineas_elem if "alt" in a.attrs}
-            )
-
-            # Precios. El bueno es el unit_price, pero tambien hay otros precios con descuento que pueden servir
-            price_spans = element.find_all("span", class_="money-integer")
-            prices = [p.text for p in price_spans]
-            unit_price = element.select("a > span > span.money-integer")[0].text
-
-            # Variable para tener todos los divs del vuelo
-            divs_vuelo = element.find_all("div")
-
-            # Bucle para iterar por todos los divs y sacar los diferentes datos
-            for div_item in divs_vuelo:
-                # Logica para sacar las horas de despegue y llegada
-                if len(div_item.attrs) == 1 and "class" in div_item.attrs:
-                    # Al ser clases css dinamicas, hay que recorrerlas y buscar la que acabe en BaseText-Body que es estatico.
-                    for attr_class in div_item.attrs["class"]:
-                        # Regex para buscar en el contenido del div que tenga un formato de XX:XX
-                        if attr_class.endswith("BaseText-Body") and re.match(
-                            r"^\d{2}:\d{2}$", div_item.text.strip()
-                        ):
-                            datos_horas.append(div_item.text)
-                # Logica para sacar datos de escalas, a partir de un atributo orientation que tiene ese elemento
-                elif len(div_item.attrs) > 1 and "orientation" in div_item.attrs:
-                    # Es imposible detectar directamente el elemento, por eso buscamos el anterior que si podemos encontrar, y vamos al siguiente sibling
-                    next_sibling = div_item.findNextSibling()
-                    if next_sibling:
-                        # El span contiene las duraciones y las escalas
-                        span_items = next_sibling.find_all("span")
-                        duraciones.append(span_items[0].text)
-                        escalas.append(
-                            span_items[1].text if len(span_items) > 1 else "0"
-                        )
-
-            # Bucle para iterar por todos los elementos path y sacar datos
-            child_paths = element.find_all("path")
-            for path_item in child_paths:
-                # clip-rule es algo fijo que siempre podremos encontrar
-                if len(path_item.attrs) > 1 and "clip-rule" in path_item.attrs:
-                    # ojo sensibles: buscamos tres veces el parent
-                    tri_parent = path_item.parent.parent.parent
-                    if tri_parent:
-                        # buscamos el siguiente elemento
-                        equipaje_div = tri_parent.findNextSibling()
-                        if equipaje_div:
-                            # agregamos la info de maletas
-                            equipajes.append(equipaje_div.text)
-
-        except Exception as exception:
-            print(f"Ignorando vuelo por problemas al scrapear...{exception}")
-            continue
-
-        lista_datos_destino.append(
-            [
-                aeropuertos_data,
-                aerolineas,
-                datos_horas,
-                duraciones,
-                escalas,
-                equipajes,
-                unit_price,
-                prices,
-            ]
-        )
-
-    return lista_datos_destino
-
 
-AIRTABLE_BASE_URL = os.getenv("AIRTABLE_BASE_URL")
-BASE_ID = os.getenv("AIRTABLE_BASE_ID")
-TABLE_ID = os.getenv("AIRTABLE_TABLE_ID")
-API_KEY = os.getenv("AIRTABLE_API_KEY_SHARED")
-
-
-# Funcion para subir a airtables el df
-def subir_datos_airtable(df):
-    API_KEY = os.getenv(
-        "AIRTABLE_API_KEY_SHARED"
-    )  # API KEY de AirTable cargada desde el ordenador mediante un fichero .env
-
-    # Headers - Credenciales para hacer solicitudes mediante API en AirTable
-    headers = {"Authorization": f"Bearer {API_KEY}", "Content-Type": "application/json"}
+# Funcion para subir a airtables el df (upsert sobre la clave natural del vuelo)
+@METRICAS.medir("subir_datos_airtable")
+def subir_datos_airtable(df, subidor=None):
+    from subida_airtable import SubidorAirtable
+
+    # Sin subidor, uno configurado con las variables de entorno AIRTABLE_* (cargadas desde un fichero .env)
+    propio = subidor is None
+    if propio:
+        subidor = SubidorAirtable.desde_entorno()
+
+    subidos = subidor.subir(df)
+    print(f"Subidos {subidos} registros a airtables")
+
+    if propio:
+        subidor.imprimir_informe()
+        subidor.cerrar()
+    return subidos
+
+
+# Funcion para enviar un df a airtables; con delta solo van los vuelos nuevos o con otro precio
+def enviar_df(df, subidor, delta=None):
+    if delta is not None:
+        df = delta.filtrar(df)
+    if df.empty:
+        return
+    subidos = subir_datos_airtable(df=df, subidor=subidor)
+    # Si el lote no ha subido entero sus vuelos salen del indice y se vuelven a enviar en la siguiente ejecucion
+    if delta is not None and subidos < len(df):
+        delta.descartar(df)
+
+
+# Funcion para cerrar las rutas scrapeadas del delta: envia los vuelos desaparecidos y los precios sustituidos
+def cerrar_delta(subidor, delta):
+    registros = delta.cerrar()
+    # Si el cierre no se ha podido subir, se reabre y no se guarda el indice: lo reintenta el siguiente cierre
+    if registros and subidor.subir_registros(registros) < len(registros):
+        delta.reabrir()
+        print("No se guarda el indice de envios porque han fallado lotes de airtable")
+        return
+    delta.guardar()
+
+
+# Funcion para crear el df con las rutas scrapeadas de edreams (lista de Ruta)
+# Con historico (HistoricoPrecios), las tarifas tambien se añaden al historico de precios
+# Con lote, las filas escritas (dataset e historico) llevan su identificador para poder deshacer el volcado
+@METRICAS.medir("crear_df")
+def crear_df(rutas, directorio=DIRECTORIO_DATOS, historico=None, lote=None):
+    import numpy as np
+
+    from dataset_vuelos import escribir_dataset
+    from normalizacion import normalizar_df
+
+    # Conversion por columnas de los itinerarios y normalizacion vectorizada a un esquema tipado
+    # (escalas, duraciones en minutos, precio numerico...)
+    with METRICAS.tramo("crear_df.normalizacion"):
+        df = normalizar_df(df_rutas(rutas))
+
+    # Las rutas servidas por la cache ya se escribieron cuando se scrapearon: volver a escribirlas con la fecha
+    # de hoy inflaria el historico y falsearia su tendencia
+    nuevas = np.repeat(
+        [not ruta.cacheada for ruta in rutas], [len(ruta) for ruta in rutas]
+    )
+    escribir = df if nuevas.all() else df[nuevas]
+    if len(escribir) < len(df):
+        print(f"No se escriben {len(df) - len(escribir)} filas servidas por la cache")
 
-    # Formateos para evitar errores
-    df1 = df.replace({"": None})
-    df1 = df1.replace({np.nan: None})
+    # Añadimos las filas al dataset Parquet particionado por dia de scrapeo, origen y mes de salida
+    with METRICAS.tramo("crear_df.escritura"):
+        filas = escribir_dataset(escribir, directorio=directorio, lote=lote)
+    METRICAS.contar("filas_dataset", filas)
+    print(f"Añadidas {filas} filas al dataset {directorio}")
 
-    datos_df = []
+    if historico is not None:
+        with METRICAS.tramo("crear_df.historico"):
+            historico.ingerir(escribir, lote=lote)
 
-    for idx, row in df1.iterrows():
-        data = {"fields": row.to_dict()}
-        datos_df.append(data)
+    return df
 
-    # endpoint
-    endpoint = f"{AIRTABLE_BASE_URL}/{BASE_ID}/{TABLE_ID}"
 
-    counter = 0
-    while counter < len(datos_df):
-        datos_subir = datos_df[counter : counter + 10]
-        datos_subir = {"records": datos_subir, "typecast": True}
-
-        response = requests.post(url=endpoint, json=datos_subir, headers=headers)
-
-        (f"response: {response.status_code}")
-        # print(f"endpoint: {response.url}")
-        # print("-"*120)
-        counter += 10
-        sleep(1)
-
-    print(f"Subidos {len(datos_df)} registros a airtables")
-
-
-# Funcion para crear el df con los datos scrapeados de edreams
-def crear_df(data):
-    columnas_df = [
-        "url",
-        "origen",
-        "destino",
-        "fecha_inicio",
-        "fecha_fin",
-        "pasajeros",
-        "inicio_ida",
-        "fin_ida",
-        "inicio_vuelta",
-        "fin_vuelta",
-        "escala_ida",
-        "escala_vuelta",
-        "duracion_ida",
-        "duracion_vuelta",
-        "aerolineas",
-        "equipaje_mano",
-        "equipaje_bodega",
-        "precio",
-        "clase",
-    ]
-    df = pd.DataFrame(data, columns=columnas_df)
+# Funcion para deshacer un volcado a medias: borra sus ficheros del dataset y sus tarifas del historico
+def deshacer_volcado(lote, directorio, fichero_historico=None, historico=None):
+    from dataset_vuelos import borrar_lote
 
-    # Ajusta las columnas de escalas para que sea solo el numero. De origen viene directo o X escalas
-    df["escala_ida"] = df.apply(
-        lambda row: int(row["escala_ida"][:1] if row["escala_ida"] != "directo" else 0),
-        axis=1,
-    )
-    df["escala_vuelta"] = df.apply(
-        lambda row: int(
-            row["escala_vuelta"][:1] if row["escala_vuelta"] != "directo" else 0
-        ),
-        axis=1,
-    )
+    ficheros = borrar_lote(directorio, lote)
+    tarifas = 0
+    if fichero_historico:
+        if historico is not None and os.path.abspath(
+            historico.fichero
+        ) == os.path.abspath(fichero_historico):
+            tarifas = historico.borrar_lote(lote)
+        elif os.path.exists(fichero_historico):
+            from historico_precios import HistoricoPrecios
 
-    # Ajusta las columnas de duracion para que el formato sea 1h 35m en vez de 1 h 35 min
-    df["duracion_ida"] = df.apply(
-        lambda row: row["duracion_ida"].replace(" h", "h").replace(" min", "m"), axis=1
-    )
-    df["duracion_vuelta"] = df.apply(
-        lambda row: row["duracion_vuelta"].replace(" h", "h").replace(" min", "m"),
-        axis=1,
-    )
+            otro = HistoricoPrecios(fichero_historico)
+            tarifas = otro.borrar_lote(lote)
+            otro.cerrar()
+    print(f"Deshecho el volcado {lote}: {ficheros} ficheros y {tarifas} tarifas")
 
-    # guardar en pkl el df con un timestamp
-    now = datetime.now()
-    now_timestamp = now.strftime("%Y%m%d%H%M%S")
-    file_name = f"edreams_data_{now_timestamp}"
-    df.to_pickle(f"{file_name}.pkl")
-    print(f"Creado {file_name}.pkl")  ## Ejecución del proceso
 
-    return df
+def volcar_lote(rutas, registro, directorio=DIRECTORIO_DATOS, historico=None):
+    """
+    crear_df() apuntando el volcado en el diario (o en la cola de tareas) antes de escribir, para que no se dupliquen
+    filas si el proceso se corta entre la escritura y el apunte: al reanudar, deshacer_volcados() borra lo escrito.
+    Si la escritura falla, se deshace en el momento.
+    :param registro: DiarioTrabajo o ColaTareas.
+    :return: (df, lote). El lote se cierra con registro.registrar_volcado(...) o registro.marcar_volcadas(...).
+    """
+    fichero_historico = historico.fichero if historico is not None else None
+    lote = registro.iniciar_volcado(directorio, fichero_historico)
+    try:
+        df = crear_df(rutas, directorio=directorio, historico=historico, lote=lote)
+    except Exception:
+        deshacer_volcado(lote, directorio, fichero_historico, historico)
+        registro.descartar_volcado(lote)
+        raise
+    return df, lote
 
 
-IATA_CODES_URL = "https://raw.githubusercontent.com/ip2location/ip2location-iata-icao/refs/heads/master/iata-icao.csv"
+# Al reanudar: deshace los volcados que el trabajo anterior empezo y no llego a apuntar
+def deshacer_volcados(registro, historico=None):
+    for lote, directorio, fichero_historico in registro.volcados_pendientes():
+        deshacer_volcado(lote, directorio, fichero_historico, historico)
+        registro.descartar_volcado(lote)
 
 
 def cargar_codigos_iata_desde_url():
     """
-    Descarga y carga los códigos IATA desde una URL de archivo CSV.
-    :param url: URL del archivo CSV.
+    Carga los códigos IATA desde el indice local (construido y revalidado a partir del CSV de ip2location).
     :return: Conjunto de códigos IATA válidos.
     """
     try:
-        # Leer el CSV directamente desde el contenido descargado
-        df = pd.read_csv(IATA_CODES_URL)
-
-        # Obtener la columna "iata_code" y convertirla en un conjunto
-        codigos_iata = set(df["iata"].dropna().str.upper())
-        return codigos_iata
+        return IndiceIata().codigos()
     except Exception as e:
-        print(f"Error al cargar el archivo CSV desde la URL: {e}")
+        print(f"Error al cargar el indice de codigos IATA: {e}")
         exit(1)
 
 
@@ -506,73 +871,567 @@ def validar_codigos_iata(codigos, codigos_validos):
     return resultados
 
 
+def validar_fechas(fechas):
+    """
+    Valida la lista de rangos de fechas ({"from": "YYYY-MM-DD", "to": "YYYY-MM-DD"}).
+    :param fechas: Lista de rangos recibida por --dates.
+    :return: Lista de errores (vacia si todas son validas).
+    """
+    if not isinstance(fechas, list) or not fechas:
+        return ["--dates must be a non-empty JSON list"]
+
+    errores = []
+    for rango in fechas:
+        if not isinstance(rango, dict) or not {"from", "to"} <= set(rango):
+            errores.append(f"{rango}: expected an object with 'from' and 'to'")
+            continue
+        try:
+            inicio = datetime.strptime(rango["from"], "%Y-%m-%d")
+            fin = datetime.strptime(rango["to"], "%Y-%m-%d")
+        except (TypeError, ValueError):
+            errores.append(f"{rango}: dates must be YYYY-MM-DD")
+            continue
+        if fin < inicio:
+            errores.append(f"{rango}: 'to' is before 'from'")
+    return errores
+
+
 # scraping process #
-def scrap(fechas, origenes):
+def scrap(
+    fechas,
+    origenes,
+    pool_size=1,
+    max_paginas=50,
+    workers=1,
+    backend="browser",
+    api_base_url=None,
+    grabar_en=None,
+    ttl_plantilla=24 * 3600,
+    ttl_destinos=24 * 3600,
+    parser=None,
+    captura="contenedor",
+    comparar_captura=False,
+    incremental=False,
+    max_resultados=None,
+    precio_maximo=None,
+    pasos_sin_mejora=None,
+    perfil="completo",
+    streaming=False,
+    subir=False,
+    upsert=True,
+    tam_cola=1000,
+    tam_lote=500,
+    directorio_datos=DIRECTORIO_DATOS,
+    delta_sync=False,
+    indice_delta=None,
+    ttl_rutas=1800,
+    max_rutas=5000,
+    stale_rutas=0,
+    fichero_diario=None,
+    reanudar=False,
+    adaptativo=False,
+    umbral_cortocircuito=0.5,
+    enfriamiento=60,
+    fichero_metricas=None,
+    puerto_metricas=None,
+    host_metricas="127.0.0.1",
+    fichero_historico=None,
+    dias_flex=0,
+    estancia_min=None,
+    estancia_max=None,
+    directorio_matrices=DIRECTORIO_MATRICES,
+):
+    from api_edreams import ClienteResultados
+    from captura import ESTADISTICAS as ESTADISTICAS_CAPTURA
+    from sincronizacion import FICHERO_INDICE, SincronizadorDelta
+    from subida_airtable import SubidorAirtable
+
+    # Instrumentacion: log JSON con cada tramo terminado y endpoint /metrics para Prometheus mientras dura el trabajo
+    METRICAS.configurar(fichero_metricas)
+    servidor_metricas = None
+    if puerto_metricas is not None:
+        servidor_metricas = arrancar_servidor_metricas(puerto_metricas, host_metricas)
+        print(
+            f"Metricas en http://{host_metricas}:{servidor_metricas.server_port}/metrics"
+        )
+
+    # Backend api: reutiliza la peticion de busqueda capturada (o la captura con el navegador la primera vez)
+    cliente = None
+    if backend == "api":
+        cliente = ClienteResultados.cargar(
+            ttl=ttl_plantilla,
+            base_url=api_base_url,
+            conexiones=max(workers, 10),
+            grabar_en=grabar_en,
+        )
+
+    # Opciones con las que se scrapea la pagina de resultados de cada destino
+    opciones_destino = {
+        "parser": parser,
+        "captura": captura,
+        "comparar_captura": comparar_captura,
+        "incremental": incremental,
+    }
+    if incremental:
+        opciones_destino.update(
+            max_resultados=max_resultados,
+            precio_maximo=precio_maximo,
+            pasos_sin_mejora=pasos_sin_mejora,
+        )
+
+    # Subidor de airtable compartido por todos los lotes, para respetar un unico limite de peticiones.
+    # El delta necesita upsert: actualiza el estado de registros ya enviados por su clave
+    subidor = (
+        SubidorAirtable.desde_entorno(upsert=upsert or delta_sync) if subir else None
+    )
+    # Deteccion de cambios: solo se suben los vuelos nuevos, con otro precio o desaparecidos desde el ultimo envio
+    delta = (
+        SincronizadorDelta(indice_delta or FICHERO_INDICE)
+        if subir and delta_sync
+        else None
+    )
+
+    # Gobernador adaptativo: --workers pasa a ser el maximo de rutas simultaneas
+    if adaptativo:
+        GOBERNADOR.configurar(
+            maximo=workers, umbral=umbral_cortocircuito, enfriamiento=enfriamiento
+        )
+
+    # Historico de precios indexado por ruta, fechas y scrapeo (opcional)
+    historico = None
+    if fichero_historico:
+        from historico_precios import HistoricoPrecios
+
+        historico = HistoricoPrecios(fichero_historico)
+
+    # Diario del trabajo (solo con --journal o --resume): estado de cada (origen, fechas, destino) y resultados
+    # parciales, para poder reanudarlo
+    diario = None
+    if fichero_diario or reanudar:
+        fichero_diario = fichero_diario or FICHERO_DIARIO
+        diario = DiarioTrabajo(fichero_diario, reanudar=reanudar)
+    if reanudar:
+        deshacer_volcados(diario, historico)
+        print(f"Reanudando el trabajo de {fichero_diario}: {diario.informe()}")
+
+    # Cache de destinos descubiertos por origen + fechas (ttl 0 la desactiva)
+    cache_destinos = CacheDestinos(ttl=ttl_destinos) if ttl_destinos else None
+    # Cache de itinerarios por ruta, para no volver a scrapear rutas recientes en lotes solapados o reintentos (ttl 0 la desactiva)
+    cache_rutas = (
+        CacheRutas(ttl=ttl_rutas, max_entradas=max_rutas, stale=stale_rutas)
+        if ttl_rutas
+        else None
+    )
+
+    # Pool de navegadores compartido por todo el proceso, para pagar el arranque de Chrome una vez por worker y no por destino
+    # Necesitamos al menos un navegador por worker para que no se queden esperando
+    tamano = max(pool_size, workers)
+    crear_navegador = partial(
+        crear_chrome, registrar_red=backend == "api", perfil=perfil
+    )
+    with BrowserPool(
+        tamano=tamano, max_paginas=max_paginas, crear_navegador=crear_navegador
+    ) as pool:
+        argumentos = dict(
+            fechas=fechas,
+            origenes=origenes,
+            pool=pool,
+            workers=workers,
+            cliente=cliente,
+            cache_destinos=cache_destinos,
+            cache_rutas=cache_rutas,
+            opciones_destino=opciones_destino,
+            subidor=subidor,
+            delta=delta,
+            directorio_datos=directorio_datos,
+            diario=diario,
+            historico=historico,
+        )
+        if dias_flex:
+            _scrap_flex(
+                dias_flex=dias_flex,
+                estancia_min=estancia_min,
+                estancia_max=estancia_max,
+                directorio_matrices=directorio_matrices,
+                tam_cola=tam_cola,
+                tam_lote=tam_lote,
+                **argumentos,
+            )
+        elif streaming:
+            _scrap_streaming(tam_cola=tam_cola, tam_lote=tam_lote, **argumentos)
+        else:
+            _scrap(**argumentos)
+        # Los refrescos en segundo plano de la cache usan el pool: hay que esperarlos antes de cerrarlo
+        if cache_rutas is not None:
+            cache_rutas.cerrar()
+            print(f"Cache de rutas: {cache_rutas.informe()}")
+        print(f"Pool de navegadores: {pool.estadisticas()}")
+    if diario is not None:
+        informe_diario = diario.informe()
+        diario.cerrar()
+        print(f"Diario del trabajo: {informe_diario}")
+        if informe_diario["fallida"] or informe_diario["descubrimientos_fallidos"]:
+            print(
+                "Hay unidades fallidas: vuelve a lanzar el mismo comando con --resume"
+            )
+    GOBERNADOR.imprimir_informe()
+    MOTOR.imprimir_informe()
+    ESTADISTICAS_CAPTURA.imprimir_informe()
+    ESTADISTICAS_RED.imprimir_informe()
+
+    if cliente is not None:
+        print(f"Backend api: {cliente.stats}")
+        cliente.cerrar()
+
+    if delta is not None:
+        delta.imprimir_informe()
+    if subidor is not None:
+        subidor.imprimir_informe()
+        subidor.cerrar()
+    if historico is not None:
+        print(f"Historico de precios: {historico.informe()}")
+        historico.cerrar()
+
+    METRICAS.imprimir_informe()
+    METRICAS.configurar(None)
+    if servidor_metricas is not None:
+        servidor_metricas.shutdown()
+
+
+# Version en streaming del proceso: descubrir -> obtener -> normalizar -> sumidero conectados con colas acotadas
+def _scrap_streaming(
+    fechas,
+    origenes,
+    pool,
+    workers,
+    cliente=None,
+    cache_destinos=None,
+    cache_rutas=None,
+    opciones_destino=None,
+    subidor=None,
+    delta=None,
+    tam_cola=1000,
+    tam_lote=500,
+    directorio_datos=DIRECTORIO_DATOS,
+    diario=None,
+    historico=None,
+    pares=None,
+    destinos_pares=None,
+    matriz=None,
+):
+    opciones_destino = opciones_destino or {}
+    captura = {"lock": threading.Lock(), "intentada": False}
+
+    def descubrir(origen, inicio, fin):
+        print(f"Procesando {origen} - {inicio} to {fin}")
+        # Destinos ya descubiertos para estas fechas (modo de fechas flexibles), y si no se cargan
+        lista_destinos = (destinos_pares or {}).get((origen, inicio, fin))
+        if lista_destinos is None:
+            lista_destinos = descubrir_destinos(
+                url=URL_EDREAMS,
+                origen=origen,
+                inicio=inicio,
+                fin=fin,
+                pool=pool,
+                cache=cache_destinos,
+                diario=diario,
+            )
+        for destino in lista_destinos or []:
+            # Al reanudar un trabajo, los destinos ya volcados se saltan
+            if (
+                diario is not None
+                and diario.estado(origen, inicio, fin, destino)[0] == "volcada"
+            ):
+                continue
+            yield dict(
+                origen=origen,
+                destino=destino,
+                inicio=inicio,
+                fin=fin,
+                url=URL_RESULTADOS.format(
+                    url=URL_EDREAMS,
+                    origen=origen,
+                    destino=destino,
+                    inicio=inicio,
+                    fin=fin,
+                ),
+            )
+
+    # Con diario, los itinerarios de cada ruta pasan al sumidero segun se obtienen y la ruta se apunta al terminar
+    # (o al fallar, con lo que se llego a obtener). Los ya scrapeados salen del diario y, si un intento anterior
+    # dejo parte de la ruta escrita, esos itinerarios no se vuelven a mandar
+    def obtener_con_diario(ruta):
+        unidad = (ruta["origen"], ruta["inicio"], ruta["fin"], ruta["destino"])
+        estado, itinerarios = diario.estado(*unidad)
+        if estado == "scrapeada":
+            yield from itinerarios
+            return
+        escritos = diario.escritos(*unidad)
+        obtenidos = []
+        try:
+            for itinerario in descontar(escritos, obtener(ruta)):
+                obtenidos.append(itinerario)
+                yield itinerario
+        except Exception as exception:
+            diario.fallar(*unidad, exception, itinerarios=obtenidos, escritos=escritos)
+            raise
+        diario.completar(*unidad, obtenidos, escritos=escritos)
+
+    def obtener(ruta):
+        datos_ruta = {k: ruta[k] for k in ("origen", "destino", "inicio", "fin")}
+
+        # Con el backend api, el primer worker que llega intenta capturar la peticion de busqueda (una sola vez)
+        if cliente is not None and not captura["intentada"]:
+            with captura["lock"]:
+                if not captura["intentada"]:
+                    captura["intentada"] = True
+                    return capturar_busqueda(
+                        url=ruta["url"],
+                        pool=pool,
+                        cliente=cliente,
+                        ruta=datos_ruta,
+                        **opciones_destino,
+                    )
+
+        # En modo incremental los itinerarios salen del navegador segun se cargan
+        if opciones_destino.get("incremental") and (
+            cliente is None or not cliente.preparado
+        ):
+            if cache_rutas is None:
+                return _cosechar_con_pool(ruta["url"], pool, opciones_destino)
+            clave = CacheRutas.clave(
+                **datos_ruta, variante=variante_opciones(opciones_destino)
+            )
+            return cache_rutas.iterar_o_scrapear(
+                clave,
+                partial(_cosechar_con_pool, ruta["url"], pool, opciones_destino),
+                al_acertar=partial(ruta.__setitem__, "cacheada", True),
+            )
+
+        itinerarios = scrapear_destino(
+            url=ruta["url"],
+            pool=pool,
+            cliente=cliente,
+            ruta=datos_ruta,
+            cache_rutas=cache_rutas,
+            **opciones_destino,
+        )
+        # La marca de cache viaja en la ruta hasta el sumidero, que no escribe esas filas
+        ruta["cacheada"] = isinstance(itinerarios, ItinerariosCacheados)
+        return itinerarios
+
+    # Los itinerarios viajan por el pipeline con su ruta y el sumidero los agrupa en una Ruta por url
+    def normalizar(ruta, itinerario):
+        return ruta, itinerario
+
+    # Unidades con un lote fallido: el resto de sus filas ya no se escribe en esta ejecucion, para que lo volcado de
+    # cada unidad sean siempre sus primeras filas y al reanudar se escriba justo lo que falta
+    rotas = set()
+
+    def sumidero(lote):
+        rutas = {}
+        for ruta, itinerario in lote:
+            if (ruta["origen"], ruta["inicio"], ruta["fin"], ruta["destino"]) in rotas:
+                continue
+            if ruta["url"] not in rutas:
+                rutas[ruta["url"]] = Ruta(
+                    ruta["url"],
+                    ruta["origen"],
+                    ruta["destino"],
+                    ruta["inicio"],
+                    ruta["fin"],
+                    cacheada=ruta.get("cacheada", False),
+                )
+            rutas[ruta["url"]].itinerarios.append(itinerario)
+        rutas = list(rutas.values())
+        if not rutas:
+            return
+        if diario is None:
+            data_df = crear_df(rutas, directorio=directorio_datos, historico=historico)
+        else:
+            try:
+                data_df, id_lote = volcar_lote(
+                    rutas, diario, directorio=directorio_datos, historico=historico
+                )
+            except Exception:
+                rotas.update(ruta.unidad for ruta in rutas)
+                raise
+            diario.registrar_volcado(unidades_rutas(rutas), lote=id_lote)
+        if matriz is not None:
+            matriz.agregar(data_df)
+        if subidor is not None:
+            enviar_df(data_df, subidor, delta)
+
+    pipeline = Pipeline(
+        descubrir=descubrir,
+        obtener=obtener if diario is None else obtener_con_diario,
+        normalizar=normalizar,
+        sumidero=sumidero,
+        workers=workers,
+        tam_cola=tam_cola,
+        tam_lote=tam_lote,
+    )
+    # Por defecto todos los origenes con todas las fechas; el modo de fechas flexibles pasa sus propias celdas
+    if pares is None:
+        pares = (
+            (origen, date["from"], date["to"]) for origen in origenes for date in fechas
+        )
+    pipeline.ejecutar(pares)
+    pipeline.imprimir_informe()
+    # Con el pipeline terminado ya estan cerradas todas las rutas
+    if delta is not None:
+        cerrar_delta(subidor, delta)
+    print("===================== FIN DEL PROCESO =====================")
+
+
+# Destinos de un origen para toda una matriz de fechas flexibles: los destinos casi no dependen de las fechas, asi que
+# se descubren una sola vez (en las fechas pedidas y, si la rejilla falla, en las celdas mas cercanas) y valen para
+# todas las celdas, que el pipeline recorre sin volver a cargar la rejilla (con diario, se apuntan para cada celda)
+def _descubrir_matriz(origen, celdas, pool, cache_destinos, diario=None):
+    destinos = None
+    for inicio, fin in celdas[:INTENTOS_DESCUBRIMIENTO_FLEX]:
+        destinos = descubrir_destinos(
+            url=URL_EDREAMS,
+            origen=origen,
+            inicio=inicio,
+            fin=fin,
+            pool=pool,
+            cache=cache_destinos,
+            diario=diario,
+        )
+        if destinos is not None:
+            break
+    if destinos is None:
+        return None
+    if diario is not None:
+        for inicio, fin in celdas:
+            if diario.destinos(origen, inicio, fin) is None:
+                diario.planificar(origen, inicio, fin, destinos)
+    return destinos
+
+
+def _scrap_flex(
+    fechas,
+    origenes,
+    pool,
+    diario,
+    dias_flex,
+    estancia_min=None,
+    estancia_max=None,
+    directorio_matrices=DIRECTORIO_MATRICES,
+    cache_destinos=None,
+    **argumentos,
+):
+    """
+    Modo de fechas flexibles: scrapea la matriz de fechas alrededor de cada rango de --dates (salida y regreso
+    +-dias_flex, con la estancia entre estancia_min y estancia_max noches) y guarda una matriz de precios por ruta.
+    Frente a lanzar scrap() con cada par de fechas, los destinos se descubren una vez por origen y matriz, y todas
+    las celdas van por un unico pipeline con el mismo pool de navegadores (sin esperar a que acabe cada par), de las
+    fechas pedidas hacia fuera.
+    :param argumentos: Resto de parametros de _scrap_streaming() (workers, cliente, subidor, tam_lote...).
+    """
+    matrices = planificar_matrices(fechas, dias_flex, estancia_min, estancia_max)
+    pares = []
+    destinos_pares = {}
+    for origen in origenes:
+        for (inicio, fin), celdas in matrices:
+            print(
+                f"Matriz {origen} {inicio} to {fin} +-{dias_flex} dias: {len(celdas)} pares de fechas"
+            )
+            if not celdas:
+                continue
+            destinos = _descubrir_matriz(origen, celdas, pool, cache_destinos, diario)
+            if destinos is None:
+                print(f"Se omite la matriz de {origen} {inicio} to {fin}")
+                continue
+            for salida, regreso in celdas:
+                pares.append((origen, salida, regreso))
+                destinos_pares[(origen, salida, regreso)] = destinos
+
+    matriz = MatrizPrecios(pedidas=[rango for rango, _ in matrices])
+    _scrap_streaming(
+        fechas=fechas,
+        origenes=origenes,
+        pool=pool,
+        diario=diario,
+        cache_destinos=cache_destinos,
+        pares=pares,
+        destinos_pares=destinos_pares,
+        matriz=matriz,
+        **argumentos,
+    )
+
+    rutas = matriz.guardar(directorio_matrices)
+    print(f"Matrices de precios de {rutas} rutas en {directorio_matrices}")
+    resumen = matriz.resumen()
+    if not resumen.empty:
+        print(resumen.to_string(index=False))
+    return matriz
+
+
+# Generador que mantiene un navegador del pool mientras se cosechan los itinerarios de una ruta
+def _cosechar_con_pool(url, pool, opciones_destino):
+    opciones_cosecha = {
+        k: v
+        for k, v in opciones_destino.items()
+        if k in ("parser", "max_resultados", "precio_maximo", "pasos_sin_mejora")
+    }
+    with GOBERNADOR.turno(url), pool.sesion() as browser:
+        yield from cosechar_destino(url=url, browser=browser, **opciones_cosecha)
+
+
+def _scrap(
+    fechas,
+    origenes,
+    pool,
+    workers,
+    cliente=None,
+    cache_destinos=None,
+    cache_rutas=None,
+    opciones_destino=None,
+    subidor=None,
+    delta=None,
+    directorio_datos=DIRECTORIO_DATOS,
+    diario=None,
+    historico=None,
+):
     # Bucle para recorrer cada uno de los origenes
     for origen in origenes:
         # Bucle para recorrer cada una de las fechas
         for date in fechas:
-            data = []
-            # Llamada a la funcion que, en base al origen + fechas, lanza todo el scrapeo necesario y nos devuelve una lista de valores
-            lista_datos_obtenidos = scrapping_edreams(
-                origen=origen, inicio=date["from"], fin=date["to"]
+            # Llamada a la funcion que, en base al origen + fechas, lanza todo el scrapeo necesario y nos devuelve las rutas con sus itinerarios
+            rutas = scrapping_edreams(
+                origen=origen,
+                inicio=date["from"],
+                fin=date["to"],
+                pool=pool,
+                workers=workers,
+                cliente=cliente,
+                cache_destinos=cache_destinos,
+                opciones_destino=opciones_destino,
+                cache_rutas=cache_rutas,
+                diario=diario,
             )
 
-            # Bucle para recopilar los datos obtenidos del scrapeo, setear algunos datos fijos, parsear y tener el conjunto de datos finales para generar el df
-            for datos_obtenidos in lista_datos_obtenidos:
-                url = datos_obtenidos[0]
-                origen = datos_obtenidos[1]
-                destino = datos_obtenidos[2]
-                fecha_inicio = datos_obtenidos[3]
-                fecha_fin = datos_obtenidos[4]
-                pasajeros = 1  # valor fijo
-                inicio_ida = datos_obtenidos[7][0]
-                fin_ida = datos_obtenidos[7][1]
-                inicio_vuelta = datos_obtenidos[7][2]
-                fin_vuelta = datos_obtenidos[7][3]
-                escala_ida = datos_obtenidos[9][0]
-                escala_vuelta = datos_obtenidos[9][1]
-                duracion_ida = datos_obtenidos[8][0]
-                duracion_vuelta = datos_obtenidos[8][1]
-                aerolineas = datos_obtenidos[6]
-                equipaje_mano_value = (
-                    datos_obtenidos[10][0] if len(datos_obtenidos[10]) > 1 else ""
-                )  # En edreams solo podemos detectar equipaje de mano, buscamos ese valor y sino 0
-                equipaje_mano = 1 if equipaje_mano_value == "Equipaje de mano" else 0
-                equipaje_bodega = 0  # no existe este valor en edreams
-                precio = datos_obtenidos[11]
-                clase = None  # no existe este valor en edreams
-
-                data.append(
-                    [
-                        url,
-                        origen,
-                        destino,
-                        fecha_inicio,
-                        fecha_fin,
-                        pasajeros,
-                        inicio_ida,
-                        fin_ida,
-                        inicio_vuelta,
-                        fin_vuelta,
-                        escala_ida,
-                        escala_vuelta,
-                        duracion_ida,
-                        duracion_vuelta,
-                        aerolineas,
-                        equipaje_mano,
-                        equipaje_bodega,
-                        precio,
-                        clase,
-                    ]
-                )
-
-            if len(data) > 0:
+            if any(ruta.itinerarios for ruta in rutas):
                 # Creamos el df
-                data_df = crear_df(data=data)
+                if diario is None:
+                    data_df = crear_df(
+                        rutas, directorio=directorio_datos, historico=historico
+                    )
+                else:
+                    data_df, id_lote = volcar_lote(
+                        rutas, diario, directorio=directorio_datos, historico=historico
+                    )
+                    diario.registrar_volcado(unidades_rutas(rutas), lote=id_lote)
                 # Subimos el df a airtables
-                # subir_datos_airtable(df=data_df)
+                if subidor is not None:
+                    enviar_df(data_df, subidor, delta)
                 print(data_df)
+
+            # Rutas de este origen + fechas terminadas: enviamos lo que ha desaparecido desde el ultimo envio
+            if delta is not None:
+                cerrar_delta(subidor, delta)
         print("===================== FIN DEL PROCESO =====================")
 
 
@@ -596,11 +1455,294 @@ if __name__ == "__main__":
         help='Input sources list, IATA codes (JSON). Example: \'["MAD","VLC","BCN"]\'',
     )
 
+    # Parámetros del pool de navegadores
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=1,
+        help="Number of browser sessions kept warm in the pool. Default: 1",
+    )
+    parser.add_argument(
+        "--recycle-after",
+        type=int,
+        default=50,
+        help="Restart a pooled browser after this many pages. Default: 50",
+    )
+
+    # Parámetro para scrapear los destinos en paralelo
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of destinations scraped in parallel, each with its own browser. Default: 1",
+    )
+
+    # Parámetros del backend de busqueda
+    parser.add_argument(
+        "--backend",
+        choices=["browser", "api"],
+        default="browser",
+        help="Results backend: render pages in Chrome or replay the search requests over HTTP. Default: browser",
+    )
+    parser.add_argument(
+        "--api-base-url",
+        type=str,
+        default=None,
+        help="Override the host of the replayed search requests (e.g. a local stand-in server)",
+    )
+    parser.add_argument(
+        "--record-dir",
+        type=str,
+        default=None,
+        help="Save every api request and response in this directory (for servidor_simulado.py)",
+    )
+    parser.add_argument(
+        "--api-template-ttl",
+        type=float,
+        default=24,
+        help="Hours a captured search request is reused before capturing it again. 0 never expires it. Default: 24",
+    )
+
+    # Parámetro para la cache de destinos descubiertos
+    parser.add_argument(
+        "--discovery-cache-ttl",
+        type=float,
+        default=24,
+        help="Hours a discovered destination list is reused for the same origin and dates. 0 disables the cache. Default: 24",
+    )
+
+    # Parámetro para elegir el parser de los resultados
+    parser.add_argument(
+        "--parser",
+        choices=["bs4", "lxml"],
+        default=None,
+        help="HTML parser backend for the results pages. Default: lxml if installed, else bs4",
+    )
+
+    # Parámetros de captura del html de resultados
+    parser.add_argument(
+        "--capture",
+        choices=["pagina", "contenedor", "itinerarios"],
+        default="contenedor",
+        help="HTML pulled from the browser: full page, results container or itineraries only. Default: contenedor",
+    )
+    parser.add_argument(
+        "--capture-compare",
+        action="store_true",
+        help="Also measure the full page capture on every route to compare bytes and parse time",
+    )
+
+    # Parámetros de la cosecha incremental durante el bucle de "Mostrar más"
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Harvest new itineraries after every 'Mostrar más' step instead of once at the end",
+    )
+    parser.add_argument(
+        "--max-results",
+        type=int,
+        default=None,
+        help="Incremental mode: stop loading a destination after this many itineraries",
+    )
+    parser.add_argument(
+        "--max-price",
+        type=int,
+        default=None,
+        help="Incremental mode: drop fares above this price and stop when a whole batch is above it",
+    )
+    parser.add_argument(
+        "--stop-after-no-cheaper",
+        type=int,
+        default=None,
+        help="Incremental mode: stop after this many consecutive batches without a cheaper fare",
+    )
+
+    # Parámetro del perfil del navegador
+    parser.add_argument(
+        "--browser-profile",
+        choices=["completo", "ligero"],
+        default="completo",
+        help="completo: visible maximized Chrome. ligero: headless, fixed viewport, no images/fonts/media/trackers, shared disk cache. Default: completo",
+    )
+
+    # Parámetros del modo streaming y de la subida de datos
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Run discover -> fetch -> normalize -> sink as a streaming pipeline with bounded queues",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=500,
+        help="Streaming mode: rows handed to the sink at a time. Default: 500",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=1000,
+        help="Streaming mode: itineraries buffered before workers wait for the sink. Default: 1000",
+    )
+    parser.add_argument(
+        "--upload-airtable",
+        action="store_true",
+        help="Upload the scraped rows to Airtable",
+    )
+    parser.add_argument(
+        "--airtable-no-upsert",
+        action="store_true",
+        help="With --upload-airtable: create records instead of upserting on the 'clave' field (url + times + price), for tables without a 'clave' text field. Re-uploads then duplicate rows",
+    )
+    parser.add_argument(
+        "--route-cache-ttl",
+        type=float,
+        default=30,
+        help="Minutes the itineraries scraped for a route are reused by later runs. 0 disables the cache. Default: 30. Reused itineraries are not written again to the dataset or the fare history",
+    )
+    parser.add_argument(
+        "--route-cache-size",
+        type=int,
+        default=5000,
+        help="Routes kept in the route cache, least recently used are evicted. Default: 5000",
+    )
+    parser.add_argument(
+        "--route-cache-stale",
+        type=float,
+        default=0,
+        help="Minutes after expiry a cached route is still served while it is re-scraped in the background. The refreshed itineraries are written to the dataset the next time the route is requested. Default: 0",
+    )
+    parser.add_argument(
+        "--delta-sync",
+        action="store_true",
+        help="With --upload-airtable: only upload fares that are new, changed price or vanished since the last upload. Needs upsert (not compatible with --airtable-no-upsert) and an 'estado' text field",
+    )
+    parser.add_argument(
+        "--delta-index",
+        type=str,
+        default=None,
+        help="Delta sync: local index of the last uploaded fares per route. Default: indice_enviados.json",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Adapt concurrency (up to --workers) and pacing to latency, errors and session alerts, with a circuit breaker",
+    )
+    parser.add_argument(
+        "--breaker-threshold",
+        type=float,
+        default=0.5,
+        help="Adaptive mode: failure rate over the last 20 routes that opens the circuit breaker. Default: 0.5",
+    )
+    parser.add_argument(
+        "--breaker-cooldown",
+        type=float,
+        default=60,
+        help="Adaptive mode: seconds the circuit breaker stays open before a probe route. Default: 60",
+    )
+    parser.add_argument(
+        "--journal",
+        type=str,
+        default=None,
+        help=f"Keep a job journal with the status and partial results of every (origin, dates, destination), so the job can be resumed. Default with --resume: {FICHERO_DIARIO}",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume the job in --journal: skip finished destinations and retry only pending or failed ones",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=DIRECTORIO_DATOS,
+        help=f"Parquet dataset the scraped rows are appended to, partitioned by scrape day, origin and departure month. Default: {DIRECTORIO_DATOS}",
+    )
+    parser.add_argument(
+        "--history",
+        type=str,
+        default=None,
+        help="Also append the scraped fares to this SQLite fare history (see historico_precios.py). Default: disabled",
+    )
+    parser.add_argument(
+        "--flex-days",
+        type=int,
+        default=0,
+        help="Flexible dates: also scrape every departure/return pair within N days of each --dates range and write a price matrix per route. Default: 0 (exact dates)",
+    )
+    parser.add_argument(
+        "--min-stay",
+        type=int,
+        default=None,
+        help="With --flex-days, skip date pairs shorter than this many nights",
+    )
+    parser.add_argument(
+        "--max-stay",
+        type=int,
+        default=None,
+        help="With --flex-days, skip date pairs longer than this many nights",
+    )
+    parser.add_argument(
+        "--matrix-dir",
+        type=str,
+        default=DIRECTORIO_MATRICES,
+        help=f"With --flex-days, directory for the per-route price matrices (ORIGIN-DESTINATION.csv). Default: {DIRECTORIO_MATRICES}",
+    )
+    parser.add_argument(
+        "--metrics-log",
+        type=str,
+        default=None,
+        help="Append a JSON line per finished stage span (and a final summary) to this file",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve stage timings and counters in Prometheus text format on this port (/metrics) while the job runs",
+    )
+    parser.add_argument(
+        "--metrics-host",
+        type=str,
+        default="127.0.0.1",
+        help="Interface for --metrics-port. Default: 127.0.0.1",
+    )
+
     args = parser.parse_args()
 
+    for opcion, valor in (
+        ("--workers", args.workers),
+        ("--pool-size", args.pool_size),
+        ("--recycle-after", args.recycle_after),
+    ):
+        if valor < 1:
+            parser.error(f"{opcion} must be at least 1")
+    if args.flex_days < 0:
+        parser.error("--flex-days must be 0 or more")
+    for opcion, valor in (("--min-stay", args.min_stay), ("--max-stay", args.max_stay)):
+        if valor is not None and not args.flex_days:
+            parser.error(f"{opcion} requires --flex-days")
+        if valor is not None and valor < 0:
+            parser.error(f"{opcion} must be 0 or more")
+    if (
+        args.min_stay is not None
+        and args.max_stay is not None
+        and args.min_stay > args.max_stay
+    ):
+        parser.error("--min-stay cannot be greater than --max-stay")
+    if args.delta_sync and args.airtable_no_upsert:
+        parser.error("--delta-sync needs upsert: drop --airtable-no-upsert")
+
     # Convertir el argumento JSON a lista/diccionario
-    fechas = json.loads(args.dates)
-    origenes = json.loads(args.sources)
+    try:
+        fechas = json.loads(args.dates)
+        origenes = json.loads(args.sources)
+    except ValueError as exception:
+        parser.error(f"--dates and --sources must be valid JSON: {exception}")
+
+    # Validamos todo antes de cargar pandas, selenium, etc. (se importan al empezar a scrapear)
+    errores_fechas = validar_fechas(fechas)
+    if errores_fechas:
+        parser.error("invalid --dates: " + "; ".join(errores_fechas))
+    if not isinstance(origenes, list):
+        parser.error("--sources must be a JSON list of IATA codes")
 
     # Cargar códigos válidos desde la URL
     codigos_validos = cargar_codigos_iata_desde_url()
@@ -620,4 +1762,47 @@ if __name__ == "__main__":
         )
 
     # Llamar al proceso de scraping con las fechas proporcionadas
-    scrap(fechas=fechas, origenes=origenes)
+    scrap(
+        fechas=fechas,
+        origenes=resultados["ok"],
+        pool_size=args.pool_size,
+        max_paginas=args.recycle_after,
+        workers=args.workers,
+        backend=args.backend,
+        api_base_url=args.api_base_url,
+        grabar_en=args.record_dir,
+        ttl_plantilla=args.api_template_ttl * 3600,
+        ttl_destinos=args.discovery_cache_ttl * 3600,
+        parser=args.parser,
+        captura=args.capture,
+        comparar_captura=args.capture_compare,
+        incremental=args.incremental,
+        max_resultados=args.max_results,
+        precio_maximo=args.max_price,
+        pasos_sin_mejora=args.stop_after_no_cheaper,
+        perfil=args.browser_profile,
+        streaming=args.stream,
+        subir=args.upload_airtable,
+        upsert=not args.airtable_no_upsert,
+        tam_cola=args.queue_size,
+        tam_lote=args.batch_size,
+        directorio_datos=args.output_dir,
+        delta_sync=args.delta_sync,
+        indice_delta=args.delta_index,
+        ttl_rutas=args.route_cache_ttl * 60,
+        max_rutas=args.route_cache_size,
+        stale_rutas=args.route_cache_stale * 60,
+        fichero_diario=args.journal,
+        reanudar=args.resume,
+        adaptativo=args.adaptive,
+        umbral_cortocircuito=args.breaker_threshold,
+        enfriamiento=args.breaker_cooldown,
+        fichero_metricas=args.metrics_log,
+        puerto_metricas=args.metrics_port,
+        host_metricas=args.metrics_host,
+        fichero_historico=args.history,
+        dias_flex=args.flex_days,
+        estancia_min=args.min_stay,
+        estancia_max=args.max_stay,
+        directorio_matrices=args.matrix_dir,
+    )
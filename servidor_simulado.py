@@ -0,0 +1,583 @@
+import argparse
+import glob
+import json
+import os
+import random
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+from urllib.parse import parse_qs, urlsplit
+
+from api_edreams import clave_peticion, ruta_url
+
+AEROPUERTOS = ["MAD", "BCN", "VLC", "PAR", "LON", "ROM", "BER", "LIS", "AMS", "NYC"]
+AEROLINEAS = ["Iberia", "Vueling", "Ryanair", "Air Europa", "easyJet", "TAP"]
+
+
+# Funcion para generar un tramo (ida o vuelta) con la misma estructura que la pagina de resultados
+def _html_tramo(rnd, origen, destino):
+    salida = f"{rnd.randint(0, 23):02d}:{rnd.choice([0, 15, 30, 45]):02d}"
+    llegada = f"{rnd.randint(0, 23):02d}:{rnd.choice([0, 10, 20, 50]):02d}"
+    escalas = rnd.choice(["directo", "1 escala", "2 escalas"])
+    duracion = f"{rnd.randint(1, 14)} h {rnd.randint(0, 59)} min"
+    return (
+        '<div class="leg">'
+        f'<div class="x1y2-BaseText-Body">{salida}</div>'
+        f'<div type="small">{origen}</div><div type="small">Ciudad {origen}</div>'
+        '<div class="line" orientation="horizontal"></div>'
+        f"<div><span>{duracion}</span><span>{escalas}</span></div>"
+        f'<div class="x1y2-BaseText-Body">{llegada}</div>'
+        f'<div type="small">{destino}</div><div type="small">Ciudad {destino}</div>'
+        f'<img alt="{rnd.choice(AEROLINEAS)}" src="logo.png"/>'
+        "</div>"
+    )
+
+
+# Funcion para generar un itinerario completo (ida, vuelta, equipaje y precios). Sin origen/destino se eligen al azar
+def html_itinerario(rnd, origen=None, destino=None):
+    if origen is None or destino is None:
+        origen, destino = rnd.sample(AEROPUERTOS, 2)
+    precio = rnd.randint(30, 900)
+    return (
+        '<div data-testid="itinerary" class="itinerary">'
+        + _html_tramo(rnd, origen, destino)
+        + _html_tramo(rnd, destino, origen)
+        + '<div class="bags"><div class="icon"><div><svg><path d="M0 0" clip-rule="evenodd"></path></svg></div></div>'
+        "<div>Equipaje de mano</div></div>"
+        f'<span class="money-integer">{precio - 5}</span>'
+        f'<a href="#"><span><span class="money-integer">{precio}</span></span></a>'
+        "</div>"
+    )
+
+
+def html_resultados(numero, semilla=0, relleno_kb=600):
+    """
+    Genera una pagina de resultados sintetica con la estructura que espera el parser.
+    :param numero: Numero de itinerarios de la pagina.
+    :param semilla: Semilla para que la pagina sea reproducible.
+    :param relleno_kb: KB aproximados de scripts, estilos, cabecera y pie (lo que no es el contenedor de resultados).
+    :return: HTML de la pagina.
+    """
+    rnd = random.Random(semilla)
+    itinerarios = "".join(html_itinerario(rnd) for _ in range(numero))
+    script = "var a=function(b){return b+1};" * (relleno_kb * 1024 // 2 // 30)
+    estilos = ".odf-a{color:#000;margin:0}" * (relleno_kb * 1024 // 4 // 26)
+    enlaces = '<li><a href="/vuelos/">Vuelos baratos</a></li>' * (
+        relleno_kb * 1024 // 4 // 45
+    )
+    return (
+        f"<html><head><script>{script}</script><style>{estilos}</style></head><body>"
+        f"<header><nav><ul>{enlaces}</ul></nav></header>"
+        f'<div id="results_list_container">{itinerarios}<button>Mostrar más</button></div>'
+        "<footer>pie</footer></body></html>"
+    )
+
+
+# Funcion para cargar las respuestas grabadas por ClienteResultados(grabar_en=...) indexadas por su clave de peticion
+def cargar_grabaciones(directorio):
+    grabaciones = {}
+    for fichero in glob.glob(os.path.join(directorio, "*.json")):
+        with open(fichero, encoding="utf-8") as f:
+            datos = json.load(f)
+        peticion = datos["peticion"]
+        clave = clave_peticion(
+            peticion["metodo"], ruta_url(peticion["url"]), peticion["cuerpo"]
+        )
+        grabaciones[clave] = datos["respuesta"]
+    return grabaciones
+
+
+# Handler que responde a cada peticion con la respuesta grabada que le corresponde (o 404 si no hay)
+class ManejadorGrabaciones(BaseHTTPRequestHandler):
+    grabaciones = {}
+
+    def _responder(self):
+        longitud = int(self.headers.get("Content-Length") or 0)
+        cuerpo = self.rfile.read(longitud).decode("utf-8") if longitud else ""
+        respuesta = self.grabaciones.get(
+            clave_peticion(self.command, self.path, cuerpo)
+        )
+
+        if respuesta is None:
+            self.send_error(404, "Peticion no grabada")
+            return
+
+        contenido = json.dumps(respuesta).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(contenido)))
+        self.end_headers()
+        self.wfile.write(contenido)
+
+    do_GET = _responder
+    do_POST = _responder
+
+    def log_message(self, format, *args):
+        return
+
+
+def arrancar_servidor(directorio, puerto=0):
+    """
+    Arranca en segundo plano un servidor local que sirve las respuestas grabadas de un directorio.
+    :param directorio: Directorio con las grabaciones (ficheros .json con "peticion" y "respuesta").
+    :param puerto: Puerto donde escuchar. Con 0 se elige uno libre.
+    :return: El servidor; su url base es f"http://127.0.0.1:{servidor.server_port}".
+    """
+    manejador = type(
+        "Manejador",
+        (ManejadorGrabaciones,),
+        {"grabaciones": cargar_grabaciones(directorio)},
+    )
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), manejador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+class ManejadorAirtable(BaseHTTPRequestHandler):
+    """
+    Airtable simulado: acepta upserts (PATCH con performUpsert) y altas (POST) en cualquier tabla,
+    guarda los registros en memoria y responde 429 si se superan las peticiones por segundo de la base.
+    """
+
+    limite = 5
+    tasa_errores = 0.0
+    retry_after = None
+    tablas = {}
+    peticiones = []
+    contadores = {"peticiones": 0, "rechazadas": 0, "errores": 0}
+    lock = threading.Lock()
+
+    def _enviar_json(self, codigo, datos, cabeceras=None):
+        contenido = json.dumps(datos).encode("utf-8")
+        self.send_response(codigo)
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(contenido)))
+        self.end_headers()
+        self.wfile.write(contenido)
+
+    # Ventana deslizante de 1 segundo con las peticiones aceptadas
+    def _limite_superado(self):
+        ahora = monotonic()
+        with self.lock:
+            self.contadores["peticiones"] += 1
+            while self.peticiones and ahora - self.peticiones[0] >= 1:
+                self.peticiones.pop(0)
+            if len(self.peticiones) >= self.limite:
+                self.contadores["rechazadas"] += 1
+                return True
+            self.peticiones.append(ahora)
+            return False
+
+    def _escribir(self):
+        longitud = int(self.headers.get("Content-Length") or 0)
+        cuerpo = json.loads(self.rfile.read(longitud) or b"{}")
+
+        if self._limite_superado():
+            cabeceras = (
+                {"Retry-After": str(self.retry_after)} if self.retry_after else None
+            )
+            self._enviar_json(
+                429, {"errors": [{"error": "RATE_LIMIT_REACHED"}]}, cabeceras
+            )
+            return
+        if random.random() < self.tasa_errores:
+            with self.lock:
+                self.contadores["errores"] += 1
+            self._enviar_json(503, {"errors": [{"error": "SERVICE_UNAVAILABLE"}]})
+            return
+
+        campos_merge = (cuerpo.get("performUpsert") or {}).get("fieldsToMergeOn")
+        registros, creados, actualizados = [], [], []
+        with self.lock:
+            tabla = self.tablas.setdefault(self.path, {})
+            for registro in cuerpo.get("records", []):
+                campos = registro["fields"]
+                clave = (
+                    tuple(campos.get(c) for c in campos_merge)
+                    if campos_merge
+                    else f"rec{len(tabla)}"
+                )
+                if clave in tabla:
+                    tabla[clave]["fields"].update(campos)
+                    actualizados.append(tabla[clave]["id"])
+                else:
+                    tabla[clave] = {"id": f"rec{len(tabla)}", "fields": dict(campos)}
+                    creados.append(tabla[clave]["id"])
+                registros.append(tabla[clave])
+
+        self._enviar_json(
+            200,
+            {
+                "records": registros,
+                "createdRecords": creados,
+                "updatedRecords": actualizados,
+            },
+        )
+
+    do_POST = _escribir
+    do_PATCH = _escribir
+
+    def log_message(self, format, *args):
+        return
+
+
+def arrancar_airtable(puerto=0, limite=5, tasa_errores=0.0, retry_after=None):
+    """
+    Arranca en segundo plano un airtable simulado.
+    :param puerto: Puerto donde escuchar. Con 0 se elige uno libre.
+    :param limite: Peticiones por segundo admitidas antes de responder 429.
+    :param tasa_errores: Probabilidad de responder 503 a una peticion (para probar los reintentos).
+    :param retry_after: Segundos que se piden en la cabecera Retry-After de los 429. Por defecto no se envia.
+    :return: El servidor; su url base es f"http://127.0.0.1:{servidor.server_port}/v0".
+    """
+    manejador = type(
+        "Manejador",
+        (ManejadorAirtable,),
+        {
+            "limite": limite,
+            "tasa_errores": tasa_errores,
+            "retry_after": retry_after,
+            "tablas": {},
+            "peticiones": [],
+            "contadores": {"peticiones": 0, "rechazadas": 0, "errores": 0},
+            "lock": threading.Lock(),
+        },
+    )
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), manejador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+# Aplicacion de una sola pagina que imita a la web: lee el hash de la url (#inspirational/... o #results/...),
+# pide los fragmentos al servidor y pinta la rejilla de destinos o la lista de resultados con su "Mostrar más",
+# el banner de cookies y la alerta de sesion a punto de caducar (que tapa la pagina e intercepta los clicks)
+PAGINA_EDREAMS = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>eDreams simulado</title>
+<style>
+#didomi-notice{position:fixed;bottom:0;left:0;right:0;padding:1em;background:#eee;z-index:50}
+#sessionAboutToExpireAlert{position:fixed;top:0;left:0;right:0;bottom:0;z-index:100;background:rgba(0,0,0,.4)}
+#sessionAboutToExpireAlert div{margin:20% auto;width:300px;padding:1em;background:#fff}
+footer{height:1500px}
+</style></head>
+<body><main id="app"></main><footer>pie</footer>
+<script>
+(function () {
+  var ALERTA_CADA = __ALERTA_CADA__;
+  var app = document.getElementById("app");
+
+  function leerHash() {
+    var hash = location.hash.slice(1), barra = hash.indexOf("/"), params = {};
+    if (barra < 0) return [hash, params];
+    hash.slice(barra + 1).split(";").forEach(function (par) {
+      var igual = par.indexOf("=");
+      if (igual > 0) params[par.slice(0, igual)] = par.slice(igual + 1);
+    });
+    return [hash.slice(0, barra), params];
+  }
+
+  function consulta(params) {
+    return Object.keys(params).map(function (clave) {
+      return encodeURIComponent(clave) + "=" + encodeURIComponent(params[clave]);
+    }).join("&");
+  }
+
+  function cookies() {
+    if (document.cookie.indexOf("didomi_token=") >= 0) return;
+    var banner = document.createElement("div");
+    banner.id = "didomi-notice";
+    banner.innerHTML = '<button id="didomi-notice-agree-button">Aceptar y cerrar</button>';
+    banner.querySelector("button").onclick = function () {
+      document.cookie = "didomi_token=1; path=/";
+      banner.remove();
+    };
+    document.body.appendChild(banner);
+  }
+
+  function alerta() {
+    if (document.getElementById("sessionAboutToExpireAlert")) return;
+    var capa = document.createElement("div");
+    capa.id = "sessionAboutToExpireAlert";
+    capa.innerHTML = "<div><p>Tu sesión está a punto de caducar</p><button>Seguir buscando</button></div>";
+    capa.querySelector("button").onclick = function () { capa.remove(); };
+    document.body.appendChild(capa);
+  }
+
+  function rejilla(params) {
+    fetch("/simulado/destinos?" + consulta(params)).then(function (r) { return r.json(); }).then(function (destinos) {
+      app.innerHTML = destinos.map(function (iata) {
+        return '<article class="od-inspirational-grid-col"><figure data-iata="' + iata + '"></figure></article>';
+      }).join("");
+    });
+  }
+
+  function resultados(params) {
+    app.innerHTML = '<div id="results_list_container"><div class="lista"></div></div>';
+    var contenedor = document.getElementById("results_list_container");
+    var lista = contenedor.querySelector(".lista");
+    var pagina = 0;
+
+    function cargar() {
+      params.pagina = pagina;
+      fetch("/simulado/resultados?" + consulta(params)).then(function (r) { return r.json(); }).then(function (datos) {
+        lista.insertAdjacentHTML("beforeend", datos.html);
+        var boton = contenedor.querySelector("button.mas");
+        if (boton) boton.remove();
+        if (!datos.mas) return;
+        boton = document.createElement("button");
+        boton.className = "mas";
+        boton.textContent = "Mostrar más resultados";
+        boton.onclick = function () {
+          pagina += 1;
+          cargar();
+          // La alerta de sesion sale cada ALERTA_CADA clicks en "Mostrar más" de la sesion
+          var clicks = Number(sessionStorage.getItem("clicks") || 0) + 1;
+          sessionStorage.setItem("clicks", clicks);
+          if (ALERTA_CADA && clicks % ALERTA_CADA === 0) alerta();
+        };
+        contenedor.appendChild(boton);
+      });
+    }
+    cargar();
+  }
+
+  var vista = leerHash();
+  cookies();
+  if (vista[0] === "inspirational") rejilla(vista[1]);
+  else if (vista[0] === "results") resultados(vista[1]);
+})();
+</script></body></html>
+"""
+
+
+# Funcion para sacar los itinerarios (html de cada [data-testid="itinerary"]) de paginas de resultados guardadas
+def cargar_itinerarios_grabados(directorio):
+    import lxml.html
+
+    itinerarios = []
+    for fichero in sorted(glob.glob(os.path.join(directorio, "*.html"))):
+        with open(fichero, encoding="utf-8") as f:
+            doc = lxml.html.fromstring(f.read())
+        itinerarios.extend(
+            lxml.html.tostring(elemento, encoding="unicode")
+            for elemento in doc.xpath('//*[@data-testid="itinerary"]')
+        )
+    if not itinerarios:
+        raise ValueError(f"No hay itinerarios en las paginas .html de {directorio}")
+    return itinerarios
+
+
+class ManejadorEdreams(BaseHTTPRequestHandler):
+    """
+    Web de eDreams simulada para medir el scraper sin red: sirve la aplicacion (PAGINA_EDREAMS) en / y /travel/,
+    la rejilla de destinos en /simulado/destinos y cada pagina de resultados de una ruta en /simulado/resultados.
+    Los resultados son reproducibles (misma ruta, mismos itinerarios): sinteticos o sacados de paginas grabadas.
+    """
+
+    destinos = 8
+    por_pagina = 10
+    paginas = 5
+    alerta_cada = 0
+    retardo = 0.0
+    grabados = None
+    contadores = {"paginas": 0, "destinos": 0, "resultados": 0}
+    lock = threading.Lock()
+
+    def _enviar(self, codigo, contenido, tipo):
+        contenido = contenido.encode("utf-8")
+        self.send_response(codigo)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(contenido)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(contenido)
+
+    def _contar(self, clave):
+        with self.lock:
+            self.contadores[clave] += 1
+
+    def _destinos(self, origen):
+        return [codigo for codigo in AEROPUERTOS if codigo != origen][: self.destinos]
+
+    # Pagina `pagina` de los resultados de una ruta, generada siempre con la misma semilla
+    def _resultados(self, consulta):
+        origen, destino = consulta.get("from", ""), consulta.get("to", "")
+        pagina = int(consulta.get("pagina", 0))
+        clave = ";".join(
+            (origen, destino, consulta.get("dep", ""), consulta.get("ret", ""))
+        )
+        rnd = random.Random(zlib.crc32(f"{clave};{pagina}".encode("utf-8")))
+        if self.grabados:
+            itinerarios = [rnd.choice(self.grabados) for _ in range(self.por_pagina)]
+        else:
+            itinerarios = [
+                html_itinerario(rnd, origen, destino) for _ in range(self.por_pagina)
+            ]
+        return {"html": "".join(itinerarios), "mas": pagina + 1 < self.paginas}
+
+    def do_GET(self):
+        partes = urlsplit(self.path)
+        consulta = {
+            clave: valores[0] for clave, valores in parse_qs(partes.query).items()
+        }
+        if partes.path in ("/", "/travel/"):
+            self._contar("paginas")
+            self._enviar(
+                200,
+                PAGINA_EDREAMS.replace("__ALERTA_CADA__", str(self.alerta_cada)),
+                "text/html; charset=utf-8",
+            )
+            return
+
+        # Latencia simulada de la api de la web
+        sleep(self.retardo)
+        if partes.path == "/simulado/destinos":
+            self._contar("destinos")
+            datos = self._destinos(consulta.get("from"))
+        elif partes.path == "/simulado/resultados":
+            self._contar("resultados")
+            datos = self._resultados(consulta)
+        else:
+            self.send_error(404)
+            return
+        self._enviar(200, json.dumps(datos), "application/json")
+
+    def log_message(self, format, *args):
+        return
+
+
+def arrancar_edreams(
+    puerto=0,
+    destinos=8,
+    por_pagina=10,
+    paginas=5,
+    alerta_cada=0,
+    retardo=0.0,
+    directorio_grabadas=None,
+):
+    """
+    Arranca en segundo plano la web de eDreams simulada.
+    :param puerto: Puerto donde escuchar. Con 0 se elige uno libre.
+    :param destinos: Destinos de la rejilla de cada origen.
+    :param por_pagina: Itinerarios que se cargan en cada pagina ("Mostrar más") de resultados.
+    :param paginas: Paginas de resultados de cada ruta (clicks en "Mostrar más" + 1).
+    :param alerta_cada: Muestra la alerta de sesion cada este numero de clicks en "Mostrar más". 0 para no mostrarla.
+    :param retardo: Segundos que tarda en responder cada peticion de destinos o resultados.
+    :param directorio_grabadas: Directorio con paginas de resultados guardadas (*.html) de donde sacar los
+        itinerarios. Por defecto se generan sinteticos.
+    :return: El servidor; su url base (EDREAMS_URL) es f"http://127.0.0.1:{servidor.server_port}".
+    """
+    manejador = type(
+        "Manejador",
+        (ManejadorEdreams,),
+        {
+            "destinos": destinos,
+            "por_pagina": por_pagina,
+            "paginas": paginas,
+            "alerta_cada": alerta_cada,
+            "retardo": retardo,
+            "grabados": (
+                cargar_itinerarios_grabados(directorio_grabadas)
+                if directorio_grabadas
+                else None
+            ),
+            "contadores": {"paginas": 0, "destinos": 0, "resultados": 0},
+            "lock": threading.Lock(),
+        },
+    )
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), manejador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Local eDreams stand-in serving recorded payloads"
+    )
+    parser.add_argument(
+        "--dir", type=str, default=None, help="Directory with recorded payloads"
+    )
+    parser.add_argument(
+        "--airtable",
+        action="store_true",
+        help="Serve a fake Airtable API (upserts kept in memory, 429 over the per-base rate limit) instead of recorded payloads",
+    )
+    parser.add_argument(
+        "--airtable-error-rate",
+        type=float,
+        default=0.0,
+        help="Fake Airtable: fraction of requests answered with 503. Default: 0",
+    )
+    parser.add_argument(
+        "--edreams",
+        action="store_true",
+        help="Serve a fake eDreams website (destination grid, paginated results, session alert) for the browser scraper (EDREAMS_URL)",
+    )
+    parser.add_argument(
+        "--pages-dir",
+        type=str,
+        default=None,
+        help="Fake eDreams: directory with saved results pages (*.html) to take itineraries from. Default: synthetic",
+    )
+    parser.add_argument(
+        "--destinations",
+        type=int,
+        default=8,
+        help="Fake eDreams: destinations per origin. Default: 8",
+    )
+    parser.add_argument(
+        "--per-page",
+        type=int,
+        default=10,
+        help="Fake eDreams: itineraries per results page. Default: 10",
+    )
+    parser.add_argument(
+        "--result-pages",
+        type=int,
+        default=5,
+        help="Fake eDreams: results pages per route. Default: 5",
+    )
+    parser.add_argument(
+        "--alert-every",
+        type=int,
+        default=0,
+        help="Fake eDreams: show the session-expiry alert every N 'Mostrar más' clicks. Default: 0 (never)",
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=0.0,
+        help="Fake eDreams: seconds to answer each grid/results request. Default: 0",
+    )
+    parser.add_argument(
+        "--port", type=int, default=8765, help="Port to listen on. Default: 8765"
+    )
+    args = parser.parse_args()
+
+    if args.edreams:
+        servidor = arrancar_edreams(
+            args.port,
+            destinos=args.destinations,
+            por_pagina=args.per_page,
+            paginas=args.result_pages,
+            alerta_cada=args.alert_every,
+            retardo=args.delay,
+            directorio_grabadas=args.pages_dir,
+        )
+        print(f"eDreams simulado en http://127.0.0.1:{servidor.server_port}")
+    elif args.airtable:
+        servidor = arrancar_airtable(args.port, tasa_errores=args.airtable_error_rate)
+        print(f"Airtable simulado en http://127.0.0.1:{servidor.server_port}/v0")
+    elif args.dir:
+        servidor = arrancar_servidor(args.dir, args.port)
+        print(
+            f"Sirviendo {len(servidor.RequestHandlerClass.grabaciones)} grabaciones en http://127.0.0.1:{servidor.server_port}"
+        )
+    else:
+        parser.error("--dir is required unless --airtable or --edreams is given")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        servidor.shutdown()
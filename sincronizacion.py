@@ -0,0 +1,235 @@
+import json
+import os
+import threading
+
+import pandas as pd
+
+from normalizacion import formatear_hora
+from subida_airtable import CAMPO_CLAVE, CAMPO_ESTADO, claves_naturales
+
+FICHERO_INDICE = "indice_enviados.json"
+
+# Columnas que identifican un vuelo dentro de una ruta (todo menos el precio, que es lo que cambia)
+COLUMNAS_IDENTIDAD = [
+    "inicio_ida",
+    "fin_ida",
+    "inicio_vuelta",
+    "fin_vuelta",
+    "escala_ida",
+    "escala_vuelta",
+    "duracion_ida",
+    "duracion_vuelta",
+    "aerolineas",
+]
+
+HORAS = ["inicio_ida", "fin_ida", "inicio_vuelta", "fin_vuelta"]
+
+
+# Ruta como texto "MAD|BCN|2025-01-03|2025-01-10|1"
+def claves_ruta(df):
+    return (
+        df["origen"].astype(str)
+        + "|"
+        + df["destino"].astype(str)
+        + "|"
+        + df["fecha_inicio"].dt.strftime("%Y-%m-%d").fillna("")
+        + "|"
+        + df["fecha_fin"].dt.strftime("%Y-%m-%d").fillna("")
+        + "|"
+        + df["pasajeros"].astype(str)
+    )
+
+
+# Huella de cada vuelo: hash de 64 bits de sus columnas de identidad, en hexadecimal
+def huellas(df):
+    return pd.util.hash_pandas_object(df[COLUMNAS_IDENTIDAD], index=False).map(
+        "{:016x}".format
+    )
+
+
+# Registros de airtable que solo actualizan el estado de vuelos ya enviados, a partir de (url, horas, precio)
+def _registros_estado(vuelos, estado):
+    if not vuelos:
+        return []
+    urls, horas, precios = zip(*vuelos)
+    exportado = pd.Series(horas).str.split("|", expand=True)
+    exportado.columns = HORAS
+    exportado["url"] = list(urls)
+    exportado["precio"] = [None if p is None else str(p) for p in precios]
+    exportado = exportado.replace({"": None})
+    return [
+        {"fields": {CAMPO_CLAVE: clave, CAMPO_ESTADO: estado}}
+        for clave in claves_naturales(exportado)
+    ]
+
+
+class SincronizadorDelta:
+    """
+    Deteccion de cambios entre scrapeos: guarda por ruta la huella y el ultimo precio enviado de cada vuelo,
+    y solo deja pasar al sumidero los vuelos nuevos, los que han cambiado de precio y los que han desaparecido.
+    :param fichero: Fichero JSON del indice de lo ultimo enviado.
+    """
+
+    def __init__(self, fichero=FICHERO_INDICE):
+        self.fichero = fichero
+        self._lock = threading.Lock()
+        # {ruta: {"url": url, "vuelos": {huella: [precio, "07:05|08:20|19:00|23:55"]}}}
+        self._indice = {}
+        if os.path.exists(fichero):
+            try:
+                with open(fichero, encoding="utf-8") as f:
+                    self._indice = json.load(f)
+            except (OSError, ValueError) as exception:
+                print(f"Ignorando indice de envios corrupto... {exception}")
+        # Huellas vistas en este scrapeo por cada ruta
+        self._vistos = {}
+        # Registros enviados antes con un precio que ya no es el actual (url, horas, precio)
+        self._sustituidos = []
+        # Ultimo cierre, por si hay que reabrirlo: ([(ruta, huella, [precio, horas])], sustituidos)
+        self._cierre = ([], [])
+        self.stats = {
+            "filas": 0,
+            "nuevos": 0,
+            "cambiados": 0,
+            "sin_cambios": 0,
+            "duplicados": 0,
+            "desaparecidos": 0,
+        }
+
+    def filtrar(self, df):
+        """
+        Filtra el df tipado dejando solo los vuelos nuevos o con otro precio, marcados en la columna "estado".
+        Si un vuelo sale repetido en el scrapeo (misma huella con otras tarifas) solo cuenta el mas barato.
+        :param df: DataFrame tipado (normalizar_df).
+        :return: DataFrame con las filas a enviar.
+        """
+        if df.empty:
+            return df.assign(estado=pd.Series(dtype="string"))
+
+        filas = len(df)
+        df = df.reset_index(drop=True)
+        rutas = claves_ruta(df)
+        claves = huellas(df)
+        # Una fila por ruta + huella: la de menor precio (las de sin precio al final)
+        baratas = (
+            pd.DataFrame({"ruta": rutas, "huella": claves, "precio": df["precio"]})
+            .sort_values("precio", kind="stable", na_position="last")
+            .drop_duplicates(["ruta", "huella"])
+            .index.sort_values()
+        )
+        df, rutas, claves = df.loc[baratas], rutas[baratas], claves[baratas]
+        precios = [None if pd.isna(precio) else int(precio) for precio in df["precio"]]
+        horas = formatear_hora(df[HORAS[0]]).fillna("")
+        for columna in HORAS[1:]:
+            horas = horas + "|" + formatear_hora(df[columna]).fillna("")
+
+        estados = []
+        repetidos = []
+        with self._lock:
+            for ruta, url, huella, precio, hora in zip(
+                rutas, df["url"], claves, precios, horas
+            ):
+                entrada = self._indice.setdefault(ruta, {"url": url, "vuelos": {}})
+                vistos = self._vistos.setdefault(ruta, set())
+                anterior = entrada["vuelos"].get(huella)
+                # Ya visto en otro lote de este scrapeo: solo cuenta si ahora es mas barato
+                repetido = (
+                    huella in vistos
+                    and anterior is not None
+                    and (
+                        precio is None
+                        or (anterior[0] is not None and precio >= anterior[0])
+                    )
+                )
+                repetidos.append(repetido)
+                vistos.add(huella)
+                if repetido:
+                    estados.append(None)
+                    continue
+                if anterior is None:
+                    estado = "nuevo"
+                elif anterior[0] != precio:
+                    estado = "cambiado"
+                    self._sustituidos.append((entrada["url"], anterior[1], anterior[0]))
+                else:
+                    estado = None
+                entrada["vuelos"][huella] = [precio, hora]
+                estados.append(estado)
+
+            estados = pd.Series(estados, index=df.index, dtype="string")
+            self.stats["filas"] += filas
+            self.stats["nuevos"] += int((estados == "nuevo").sum())
+            self.stats["cambiados"] += int((estados == "cambiado").sum())
+            self.stats["duplicados"] += filas - len(df) + sum(repetidos)
+            self.stats["sin_cambios"] += int(estados.isna().sum()) - sum(repetidos)
+
+        return df.assign(estado=estados)[estados.notna()]
+
+    def descartar(self, df):
+        """
+        Quita del indice los vuelos de un lote filtrado que no se ha podido subir, para que la siguiente
+        ejecucion los vuelva a enviar como nuevos.
+        :param df: DataFrame devuelto por filtrar.
+        """
+        if df.empty:
+            return
+        with self._lock:
+            for ruta, huella in zip(claves_ruta(df), huellas(df)):
+                self._indice.get(ruta, {}).get("vuelos", {}).pop(huella, None)
+
+    # Persiste el indice (escritura atomica via fichero temporal)
+    def guardar(self):
+        with self._lock:
+            temporal = f"{self.fichero}.tmp"
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump(self._indice, f)
+            os.replace(temporal, self.fichero)
+
+    def cerrar(self):
+        """
+        Cierra las rutas scrapeadas desde la ultima llamada: los vuelos del indice que no han vuelto a aparecer
+        se dan por desaparecidos y se quitan del indice. Solo se cierran rutas con algun vuelo visto
+        (si una ruta falla no se marcan como desaparecidos todos sus vuelos).
+        :return: Registros de airtable (clave + estado) de los vuelos desaparecidos y de los precios sustituidos.
+        """
+        quitados = []
+        with self._lock:
+            sustituidos, self._sustituidos = self._sustituidos, []
+            for ruta, vistos in self._vistos.items():
+                entrada = self._indice[ruta]
+                for huella in list(entrada["vuelos"]):
+                    if huella not in vistos:
+                        quitados.append((ruta, huella, entrada["vuelos"].pop(huella)))
+            self._vistos = {}
+            self._cierre = (quitados, sustituidos)
+            self.stats["desaparecidos"] += len(quitados)
+        desaparecidos = [
+            (self._indice[ruta]["url"], hora, precio)
+            for ruta, _, (precio, hora) in quitados
+        ]
+
+        # Como el precio es parte de la clave natural, un cambio de precio es un registro nuevo y el anterior queda sustituido
+        return _registros_estado(desaparecidos, "desaparecido") + _registros_estado(
+            sustituidos, "sustituido"
+        )
+
+    # Deshace el ultimo cierre si no se ha podido subir: los desaparecidos vuelven al indice y los sustituidos
+    # quedan pendientes para el siguiente cierre
+    def reabrir(self):
+        with self._lock:
+            (quitados, sustituidos), self._cierre = self._cierre, ([], [])
+            for ruta, huella, vuelo in quitados:
+                self._indice[ruta]["vuelos"].setdefault(huella, vuelo)
+            self._sustituidos = sustituidos + self._sustituidos
+            self.stats["desaparecidos"] -= len(quitados)
+
+    def imprimir_informe(self):
+        with self._lock:
+            stats = dict(self.stats)
+        enviados = stats["nuevos"] + stats["cambiados"] + stats["desaparecidos"]
+        print(
+            f"Delta: {stats['filas']} filas scrapeadas, {enviados} enviadas "
+            f"({stats['nuevos']} nuevas, {stats['cambiados']} con otro precio, "
+            f"{stats['desaparecidos']} desaparecidas), {stats['sin_cambios']} sin cambios, "
+            f"{stats['duplicados']} repetidas"
+        )
@@ -0,0 +1,253 @@
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metricas import METRICAS
+from normalizacion import COLUMNAS_DF, df_exportable
+
+# Limite de airtable: 5 peticiones por segundo y base. Si se supera, responde 429 y bloquea la base 30 segundos
+PETICIONES_POR_SEGUNDO = 5
+
+# Airtable admite como mucho 10 registros por peticion
+REGISTROS_POR_PETICION = 10
+
+# Clave natural de un vuelo: misma url (origen, destino y fechas), mismas horas y mismo precio
+CAMPOS_CLAVE = ["url", "inicio_ida", "fin_ida", "inicio_vuelta", "fin_vuelta", "precio"]
+
+# Campo donde se guarda la clave natural (performUpsert solo admite hasta 3 campos de merge)
+CAMPO_CLAVE = "clave"
+
+# Campos de la tabla de airtable: las columnas del df original (airtable rechaza los campos que no existen,
+# asi que "moneda" no se envia y "clave" / "estado" solo van con upsert, que exige crearlos en la tabla)
+CAMPOS_AIRTABLE = COLUMNAS_DF
+
+# Estado del vuelo que manda la sincronizacion delta (nuevo, cambiado, desaparecido, sustituido)
+CAMPO_ESTADO = "estado"
+
+
+class LimitadorTokens:
+    """
+    Token bucket: se rellena a `tasa` tokens por segundo hasta `capacidad`, y cada peticion consume uno.
+    :param tasa: Tokens por segundo.
+    :param capacidad: Tokens maximos acumulados (rafaga permitida).
+    """
+
+    def __init__(self, tasa, capacidad=1):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self._tokens = capacidad
+        self._ultimo = monotonic()
+        self._lock = threading.Lock()
+
+    # Bloquea hasta que haya un token disponible y lo consume
+    def esperar(self):
+        while True:
+            with self._lock:
+                ahora = monotonic()
+                self._tokens = min(
+                    self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa
+                )
+                self._ultimo = ahora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.tasa
+            sleep(espera)
+
+
+# Clave natural como texto "url|07:05|08:20|19:00|23:55|1234" a partir de las columnas CAMPOS_CLAVE ya exportadas
+def claves_naturales(df_exportado):
+    clave = df_exportado[CAMPOS_CLAVE[0]].fillna("").astype(str)
+    for campo in CAMPOS_CLAVE[1:]:
+        clave = clave + "|" + df_exportado[campo].fillna("").astype(str)
+    return clave
+
+
+# Registros de airtable a partir del df tipado, sin recorrer el df fila a fila.
+# Con upsert se anaden la clave natural y, si viene del delta, el estado
+def registros_airtable(df, upsert=False):
+    campos = list(CAMPOS_AIRTABLE)
+    if upsert and CAMPO_ESTADO in df.columns:
+        campos.append(CAMPO_ESTADO)
+    df1 = df_exportable(df[campos])
+    df1 = df1.replace({"": None})
+    if upsert:
+        df1[CAMPO_CLAVE] = claves_naturales(df1)
+    return [{"fields": campos} for campos in df1.to_dict("records")]
+
+
+class SubidorAirtable:
+    """
+    Sube registros a una tabla de airtable con upsert sobre la clave natural del vuelo, varios lotes en vuelo a la vez
+    y un limitador de peticiones por segundo. Reintenta con backoff exponencial los 429 y 5xx.
+    :param base_url: Url de la api de airtable (p.ej. https://api.airtable.com/v0 o un servidor simulado).
+    :param base_id: Id de la base.
+    :param table_id: Id de la tabla.
+    :param api_key: Token de airtable.
+    :param en_vuelo: Numero maximo de peticiones simultaneas.
+    :param tasa: Peticiones por segundo. Por defecto un 10% por debajo del limite de airtable.
+    :param reintentos: Reintentos de cada lote antes de darlo por perdido.
+    :param espera_base: Segundos de la primera espera del backoff.
+    :param upsert: Si es True (por defecto) hace upsert sobre el campo CAMPO_CLAVE (que tiene que existir en la
+        tabla) y una segunda subida de las mismas filas no las duplica. Si es False da de alta los registros, como
+        antes, para tablas sin el campo CAMPO_CLAVE.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        base_id,
+        table_id,
+        api_key,
+        en_vuelo=3,
+        tasa=PETICIONES_POR_SEGUNDO * 0.9,
+        reintentos=5,
+        espera_base=1.0,
+        timeout=30,
+        upsert=True,
+    ):
+        self.endpoint = f"{base_url}/{base_id}/{table_id}"
+        self.en_vuelo = en_vuelo
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.timeout = timeout
+        self.upsert = upsert
+        self.limitador = LimitadorTokens(tasa)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=en_vuelo)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        )
+
+        self._lock = threading.Lock()
+        self.stats = {
+            "registros": 0,
+            "creados": 0,
+            "actualizados": 0,
+            "peticiones": 0,
+            "reintentos": 0,
+            "fallidos": 0,
+            "segundos": 0.0,
+        }
+
+    # Subidor configurado con las variables de entorno AIRTABLE_* (las mismas que usaba subir_datos_airtable)
+    @classmethod
+    def desde_entorno(cls, **kwargs):
+        return cls(
+            base_url=os.getenv("AIRTABLE_BASE_URL"),
+            base_id=os.getenv("AIRTABLE_BASE_ID"),
+            table_id=os.getenv("AIRTABLE_TABLE_ID"),
+            api_key=os.getenv("AIRTABLE_API_KEY_SHARED"),
+            **kwargs,
+        )
+
+    def _contar(self, **cantidades):
+        with self._lock:
+            for clave, cantidad in cantidades.items():
+                self.stats[clave] += cantidad
+
+    # Espera antes del reintento: la que pida el servidor (Retry-After) o backoff exponencial con jitter
+    def _espera(self, intento, response=None):
+        if response is not None and response.headers.get("Retry-After"):
+            try:
+                return float(response.headers["Retry-After"])
+            except ValueError:
+                pass
+        return self.espera_base * 2**intento * (0.5 + random.random() / 2)
+
+    def _enviar(self, lote):
+        cuerpo = {"records": lote, "typecast": True}
+        metodo = self.session.post
+        if self.upsert:
+            cuerpo["performUpsert"] = {"fieldsToMergeOn": [CAMPO_CLAVE]}
+            metodo = self.session.patch
+        for intento in range(self.reintentos + 1):
+            self.limitador.esperar()
+            self._contar(peticiones=1)
+            try:
+                response = metodo(self.endpoint, json=cuerpo, timeout=self.timeout)
+            except requests.RequestException as exception:
+                response, error = None, exception
+            else:
+                if response.ok:
+                    datos = response.json()
+                    self._contar(
+                        registros=len(lote),
+                        # Sin upsert airtable no devuelve createdRecords: todo el lote son altas
+                        creados=(
+                            len(datos.get("createdRecords", []))
+                            if self.upsert
+                            else len(lote)
+                        ),
+                        actualizados=len(datos.get("updatedRecords", [])),
+                    )
+                    return True
+                # Los 4xx (salvo 429) no se arreglan reintentando
+                if response.status_code != 429 and response.status_code < 500:
+                    error = f"{response.status_code} {response.text[:200]}"
+                    break
+                error = response.status_code
+
+            if intento < self.reintentos:
+                self._contar(reintentos=1)
+                METRICAS.contar("reintentos", componente="airtable")
+                sleep(self._espera(intento, response))
+
+        print(f"Error subiendo un lote de {len(lote)} registros a airtable... {error}")
+        self._contar(fallidos=len(lote))
+        return False
+
+    def subir(self, df):
+        """
+        Sube el df tipado a airtable en lotes de 10 registros.
+        :param df: DataFrame tipado (normalizar_df).
+        :return: Numero de registros subidos.
+        """
+        return self.subir_registros(registros_airtable(df, upsert=self.upsert))
+
+    # Sube registros ya construidos ({"fields": {...}}, con el campo CAMPO_CLAVE si es upsert)
+    def subir_registros(self, registros):
+        lotes = [
+            registros[i : i + REGISTROS_POR_PETICION]
+            for i in range(0, len(registros), REGISTROS_POR_PETICION)
+        ]
+
+        inicio = monotonic()
+        with ThreadPoolExecutor(max_workers=self.en_vuelo) as executor:
+            subidos = sum(
+                len(lote)
+                for lote, ok in zip(lotes, executor.map(self._enviar, lotes))
+                if ok
+            )
+        self._contar(segundos=monotonic() - inicio)
+        return subidos
+
+    def informe(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats["registros_por_segundo"] = (
+            round(stats["registros"] / stats["segundos"], 1)
+            if stats["segundos"]
+            else 0.0
+        )
+        stats["segundos"] = round(stats["segundos"], 2)
+        return stats
+
+    def imprimir_informe(self):
+        datos = self.informe()
+        print(
+            f"Airtable: {datos['registros']} registros ({datos['creados']} nuevos, {datos['actualizados']} actualizados) "
+            f"en {datos['segundos']}s, {datos['registros_por_segundo']} registros/s, "
+            f"{datos['peticiones']} peticiones, {datos['reintentos']} reintentos, {datos['fallidos']} fallidos"
+        )
+
+    def cerrar(self):
+        self.session.close()
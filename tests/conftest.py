@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+# Los modulos del scraper estan en la raiz del repositorio (sin paquete)
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+# Paginas de resultados guardadas que usan los tests
+DIRECTORIO_FIXTURES = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "fixtures"
+)
+
+
+# Df tipado (normalizar_df) de la ruta MAD-BCN con un vuelo por cada (hora de salida, precio)
+@pytest.fixture
+def df_vuelos():
+    import pandas as pd
+
+    from normalizacion import COLUMNAS_DF, normalizar_df
+
+    def crear(vuelos):
+        filas = [
+            [
+                "https://www.edreams.es/x",
+                "MAD",
+                "BCN",
+                "2025-01-03",
+                "2025-01-10",
+                1,
+                salida,
+                "08:20",
+                "19:40",
+                "20:55",
+                "directo",
+                "directo",
+                "1 h 15 min",
+                "1 h 15 min",
+                "Iberia",
+                1,
+                0,
+                f"{precio} €",
+                "economy",
+            ]
+            for salida, precio in vuelos
+        ]
+        return normalizar_df(pd.DataFrame(filas, columns=COLUMNAS_DF))
+
+    return crear
@@ -0,0 +1,270 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import pytest
+
+import scraper_edreams
+from api_edreams import (
+    ClienteResultados,
+    RespuestaInesperada,
+    clave_peticion,
+    itinerarios_desde_json,
+    localizar_campos,
+    preparar_peticion,
+    ruta_url,
+)
+from registros import Itinerario
+from servidor_simulado import arrancar_servidor
+
+VALORES = {
+    "origen": "MAD",
+    "destino": "BCN",
+    "inicio": "2025-01-03",
+    "fin": "2025-01-10",
+}
+
+# Peticion de busqueda como la que captura el navegador (graphql con la ruta en el cuerpo)
+PLANTILLA = {
+    "url": "https://www.edreams.es/travel/service/graphql?lang=es",
+    "metodo": "POST",
+    "cabeceras": {"Content-Type": "application/json"},
+    "cuerpo": json.dumps(
+        {
+            "operationName": "search",
+            "variables": {
+                "segments": [
+                    {"from": "MAD", "to": "BCN", "date": "2025-01-03"},
+                    {"from": "BCN", "to": "MAD", "date": "2025-01-10"},
+                ],
+                "city": "MADRID",
+                "market": "ES",
+            },
+        }
+    ),
+}
+
+
+def _tramo(origen, destino, salida, llegada):
+    return {
+        "departure": {"airport": origen, "time": salida},
+        "arrival": {"airport": destino, "time": llegada},
+        "duration": 75,
+        "stops": 0,
+        "carriers": ["Iberia"],
+    }
+
+
+def _payload(origen, destino, precio):
+    return {
+        "itineraries": [
+            {
+                "legs": [
+                    _tramo(origen, destino, "07:05", "08:20"),
+                    _tramo(destino, origen, "19:40", "20:55"),
+                ],
+                "price": {"amount": precio, "currency": "EUR"},
+                "baggage": ["Equipaje de mano", "Bolso"],
+            }
+        ]
+    }
+
+
+# Graba en un directorio las respuestas que servira el servidor simulado para cada ruta
+def _grabar(directorio, respuestas):
+    campos = localizar_campos(PLANTILLA, VALORES)
+    for i, (valores, respuesta) in enumerate(respuestas):
+        peticion = preparar_peticion(PLANTILLA, campos, valores)
+        with open(os.path.join(directorio, f"{i}.json"), "w", encoding="utf-8") as f:
+            json.dump({"peticion": peticion, "respuesta": respuesta}, f)
+
+
+@pytest.fixture
+def servidor(tmp_path):
+    servidores = []
+
+    def arrancar(respuestas):
+        _grabar(tmp_path, respuestas)
+        servidores.append(arrancar_servidor(str(tmp_path)))
+        return f"http://127.0.0.1:{servidores[-1].server_port}"
+
+    yield arrancar
+    for srv in servidores:
+        srv.shutdown()
+
+
+def _cliente(base_url, tmp_path):
+    return ClienteResultados(
+        plantilla=PLANTILLA,
+        valores=VALORES,
+        base_url=base_url,
+        fichero=str(tmp_path / "plantilla.json"),
+    )
+
+
+def test_preparar_peticion_por_campo():
+    nuevos = {
+        "origen": "VLC",
+        "destino": "MAD",
+        "inicio": "2025-02-07",
+        "fin": "2025-02-07",
+    }
+    peticion = preparar_peticion(
+        PLANTILLA, localizar_campos(PLANTILLA, VALORES), nuevos
+    )
+    variables = json.loads(peticion["cuerpo"])["variables"]
+
+    assert variables["segments"] == [
+        {"from": "VLC", "to": "MAD", "date": "2025-02-07"},
+        {"from": "MAD", "to": "VLC", "date": "2025-02-07"},
+    ]
+    # Un valor que contiene el codigo del origen no se toca
+    assert variables["city"] == "MADRID"
+    assert peticion["url"] == PLANTILLA["url"]
+
+
+# Con la ida y la vuelta el mismo dia, cada fecha sigue en su campo (por orden de aparicion)
+def test_preparar_peticion_con_inicio_igual_a_fin():
+    capturada = dict(VALORES, fin=VALORES["inicio"])
+    plantilla = preparar_peticion(
+        PLANTILLA, localizar_campos(PLANTILLA, VALORES), capturada
+    )
+    nuevos = {
+        "origen": "MAD",
+        "destino": "BCN",
+        "inicio": "2025-03-01",
+        "fin": "2025-03-05",
+    }
+    peticion = preparar_peticion(
+        plantilla, localizar_campos(plantilla, capturada), nuevos
+    )
+    segmentos = json.loads(peticion["cuerpo"])["variables"]["segments"]
+
+    assert [s["date"] for s in segmentos] == ["2025-03-01", "2025-03-05"]
+
+
+def test_preparar_peticion_en_la_url():
+    plantilla = {
+        "url": "https://www.edreams.es/api/search/MAD/BCN?dep=2025-01-03&ret=2025-01-10&q=MADRID",
+        "metodo": "GET",
+        "cabeceras": {},
+        "cuerpo": "",
+    }
+    nuevos = {
+        "origen": "VLC",
+        "destino": "LIS",
+        "inicio": "2025-02-01",
+        "fin": "2025-02-02",
+    }
+    peticion = preparar_peticion(
+        plantilla, localizar_campos(plantilla, VALORES), nuevos
+    )
+
+    assert ruta_url(peticion["url"]) == (
+        "/api/search/VLC/LIS?dep=2025-02-01&ret=2025-02-02&q=MADRID"
+    )
+
+
+def test_respuesta_con_otro_formato():
+    with pytest.raises(RespuestaInesperada):
+        itinerarios_desde_json({"data": {"search": []}})
+    with pytest.raises(RespuestaInesperada):
+        itinerarios_desde_json({"itineraries": [{"segments": []}]})
+    assert itinerarios_desde_json({"itineraries": []}) == []
+
+
+def test_cliente_contra_el_servidor_simulado(servidor, tmp_path):
+    otra = dict(VALORES, destino="LIS")
+    base_url = servidor(
+        [(VALORES, _payload("MAD", "BCN", 80)), (otra, _payload("MAD", "LIS", 120))]
+    )
+    cliente = _cliente(base_url, tmp_path)
+
+    bcn = cliente.datos_destino(**VALORES)
+    lis = cliente.datos_destino(**otra)
+    cliente.cerrar()
+
+    assert [it.precio for it in bcn] == ["80"]
+    assert lis[0].aeropuertos == ("MAD", "LIS", "LIS", "MAD")
+    assert lis[0].equipaje_mano == 1
+    assert cliente.stats["errores"] == 0
+
+
+# Pool falso: scrapear_destino solo necesita una sesion para pasarsela a datos_destino()
+class _Pool:
+    @contextmanager
+    def sesion(self):
+        yield "navegador"
+
+
+@pytest.fixture
+def navegador(monkeypatch):
+    llamadas = []
+    itinerario = Itinerario(
+        ["MAD", "BCN", "BCN", "MAD"],
+        ["Vueling"],
+        ["10:00", "11:15", "18:00", "19:15"],
+        ["1 h 15 min", "1 h 15 min"],
+        ["directo", "directo"],
+        0,
+        "99",
+    )
+
+    def datos_destino(url, browser, **opciones):
+        llamadas.append(url)
+        return [itinerario]
+
+    monkeypatch.setattr(scraper_edreams, "datos_destino", datos_destino)
+    return llamadas
+
+
+@pytest.mark.parametrize(
+    "respuesta",
+    [{"data": {"search": {"results": []}}}, None],
+    ids=["otro_formato", "no_grabada"],
+)
+def test_vuelve_al_navegador(servidor, tmp_path, navegador, respuesta):
+    respuestas = [] if respuesta is None else [(VALORES, respuesta)]
+    cliente = _cliente(servidor(respuestas), tmp_path)
+    cliente.guardar()
+
+    itinerarios = scraper_edreams.scrapear_destino(
+        url="https://www.edreams.es/travel/#results",
+        pool=_Pool(),
+        cliente=cliente,
+        ruta=VALORES,
+    )
+    cliente.cerrar()
+
+    # La ruta sale del navegador (no vacia) y la plantilla se descarta para capturarla de nuevo
+    assert [it.precio for it in itinerarios] == ["99"]
+    assert len(navegador) == 1
+    assert not cliente.preparado
+    assert not os.path.exists(cliente.fichero)
+
+
+def test_plantilla_caducada(tmp_path):
+    fichero = str(tmp_path / "plantilla.json")
+    ClienteResultados(plantilla=PLANTILLA, valores=VALORES, fichero=fichero).guardar()
+
+    assert ClienteResultados.cargar(fichero, ttl=3600).preparado
+
+    with open(fichero, encoding="utf-8") as f:
+        datos = json.load(f)
+    datos["capturada"] = time.time() - 7200
+    with open(fichero, "w", encoding="utf-8") as f:
+        json.dump(datos, f)
+
+    assert not ClienteResultados.cargar(fichero, ttl=3600).preparado
+    assert ClienteResultados.cargar(fichero, ttl=0).preparado
+
+
+def test_clave_de_la_peticion_preparada():
+    peticion = preparar_peticion(
+        PLANTILLA, localizar_campos(PLANTILLA, VALORES), VALORES
+    )
+
+    assert clave_peticion("POST", ruta_url(peticion["url"]), peticion["cuerpo"]) == (
+        clave_peticion("POST", ruta_url(PLANTILLA["url"]), PLANTILLA["cuerpo"])
+    )
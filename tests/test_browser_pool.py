@@ -0,0 +1,119 @@
+import threading
+
+import pytest
+
+import browser_pool
+from browser_pool import BrowserPool
+
+
+class _Navegador:
+    def __init__(self, falla_get=False):
+        self.falla_get = falla_get
+        self.cerrado = False
+        self.liberado = False
+        self.colgado = threading.Event()
+        self.colgar = False
+        self.al_cerrar = self._liberar
+
+    def _liberar(self):
+        self.liberado = True
+
+    def get(self, url):
+        if self.falla_get:
+            raise RuntimeError("no carga")
+
+    @property
+    def current_url(self):
+        # Simula un driver colgado hasta que el test lo suelte
+        if self.colgar:
+            self.colgado.wait(5)
+            raise RuntimeError("driver caido")
+        return "about:blank"
+
+    def get_cookies(self):
+        return []
+
+    def quit(self):
+        self.cerrado = True
+
+
+@pytest.fixture(autouse=True)
+def sin_banner(monkeypatch):
+    monkeypatch.setattr(browser_pool, "aceptar_cookies", lambda browser: False)
+
+
+# Si falla la carga inicial, el navegador recien creado se cierra y libera su cache
+def test_lanzamiento_fallido_cierra_el_navegador():
+    creados = []
+
+    def crear():
+        creados.append(_Navegador(falla_get=True))
+        return creados[-1]
+
+    pool = BrowserPool(tamano=1, crear_navegador=crear)
+    with pytest.raises(RuntimeError):
+        pool.obtener()
+
+    assert creados[0].cerrado and creados[0].liberado
+    assert pool._abiertos == 0
+
+
+def test_reutiliza_y_recicla():
+    pool = BrowserPool(tamano=1, max_paginas=2, crear_navegador=_Navegador)
+    with pool.sesion() as primero:
+        pass
+    with pool.sesion() as segundo:
+        pass
+    with pool.sesion() as tercero:
+        pass
+    pool.cerrar()
+
+    assert primero is segundo and tercero is not primero
+    assert primero.cerrado and primero.liberado
+    assert pool.stats["hits"] == 1 and pool.stats["reciclados"] == 1
+
+
+# Un driver colgado al comprobarlo no bloquea a los demas workers
+def test_driver_colgado_no_bloquea_el_pool():
+    pool = BrowserPool(tamano=2, crear_navegador=_Navegador)
+    colgado = pool.obtener()
+    pool.devolver(colgado)
+    colgado.colgar = True
+
+    hilo = threading.Thread(target=lambda: pool.devolver(pool.obtener()))
+    hilo.start()
+    # Mientras el primer worker espera al driver colgado, otro puede lanzar un navegador nuevo
+    otro = {}
+    lanzador = threading.Thread(target=lambda: otro.setdefault("b", pool.obtener()))
+    lanzador.start()
+    lanzador.join(2)
+    try:
+        assert not lanzador.is_alive()
+        assert otro["b"] is not colgado
+    finally:
+        colgado.colgado.set()
+        hilo.join(5)
+        pool.devolver(otro["b"])
+        pool.cerrar()
+
+    assert colgado.cerrado and pool.stats["descartados"] == 1
+
+
+# Un error del codigo que usa la sesion devuelve el navegador al pool; uno del driver lo descarta
+def test_sesion_solo_descarta_por_errores_del_navegador():
+    from selenium.common.exceptions import InvalidSessionIdException
+
+    pool = BrowserPool(tamano=1, crear_navegador=_Navegador)
+    with pytest.raises(ValueError):
+        with pool.sesion() as primero:
+            raise ValueError("fila mal parseada")
+    with pytest.raises(InvalidSessionIdException):
+        with pool.sesion() as segundo:
+            raise InvalidSessionIdException("sesion caducada")
+    with pool.sesion() as tercero:
+        pass
+    pool.cerrar()
+
+    assert segundo is primero and primero.cerrado
+    assert tercero is not primero
+    assert pool.stats["hits"] == 1 and pool.stats["descartados"] == 1
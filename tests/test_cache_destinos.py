@@ -0,0 +1,23 @@
+import json
+
+import cache_destinos
+from cache_destinos import CacheDestinos
+
+
+# Al guardar se descartan del fichero las entradas caducadas
+def test_poda_al_guardar(tmp_path, monkeypatch):
+    fichero = str(tmp_path / "destinos.json")
+    ahora = [1000.0]
+    monkeypatch.setattr(cache_destinos, "time", lambda: ahora[0])
+
+    cache = CacheDestinos(fichero, ttl=60)
+    cache.guardar("MAD", "2025-01-03", "2025-01-10", ["BCN", "LIS"])
+    ahora[0] += 120
+    assert cache.obtener("MAD", "2025-01-03", "2025-01-10") is None
+    cache.guardar("BIO", "2025-01-03", "2025-01-10", ["PAR"])
+
+    with open(fichero, encoding="utf-8") as f:
+        assert list(json.load(f)) == ["BIO|2025-01-03|2025-01-10"]
+    assert CacheDestinos(fichero, ttl=60).obtener(
+        "BIO", "2025-01-03", "2025-01-10"
+    ) == ["PAR"]
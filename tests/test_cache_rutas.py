@@ -0,0 +1,84 @@
+from cache_rutas import CacheRutas, ItinerariosCacheados
+from dataset_vuelos import leer_dataset
+from historico_precios import HistoricoPrecios
+from registros import Itinerario, Ruta
+from scraper_edreams import crear_df
+
+ITINERARIO = Itinerario(
+    ["MAD", "BCN", "BCN", "MAD"],
+    ["Iberia"],
+    ["07:05", "08:20", "19:40", "20:55"],
+    ["1 h 15 min", "1 h 15 min"],
+    ["directo", "directo"],
+    1,
+    "123",
+)
+
+
+def test_aciertos_marcados(tmp_path):
+    cache = CacheRutas(str(tmp_path / "rutas.sqlite"))
+    clave = CacheRutas.clave("MAD", "BCN", "2025-01-03", "2025-01-10")
+    scrapeado = cache.obtener_o_scrapear(clave, lambda: [ITINERARIO])
+    assert not isinstance(scrapeado, ItinerariosCacheados)
+    cacheado = cache.obtener_o_scrapear(clave, lambda: [])
+    assert isinstance(cacheado, ItinerariosCacheados)
+    assert [i.a_lista() for i in cacheado] == [ITINERARIO.a_lista()]
+
+    acertadas = []
+    assert (
+        len(list(cache.iterar_o_scrapear(clave, list, lambda: acertadas.append(1))))
+        == 1
+    )
+    assert acertadas == [1]
+    cache.cerrar()
+
+
+# Las rutas servidas por la cache salen en el df pero no se vuelven a escribir en el dataset ni en el historico
+def test_crear_df_no_escribe_aciertos(tmp_path):
+    datos = str(tmp_path / "datos")
+    historico = HistoricoPrecios(str(tmp_path / "historico.sqlite"))
+    rutas = [
+        Ruta(
+            "u1",
+            "MAD",
+            "BCN",
+            "2025-01-03",
+            "2025-01-10",
+            [ITINERARIO, Itinerario.desde_lista(ITINERARIO.a_lista()[:-1] + ["99"])],
+        ),
+        Ruta(
+            "u2",
+            "MAD",
+            "LIS",
+            "2025-01-03",
+            "2025-01-10",
+            [ITINERARIO] * 3,
+            cacheada=True,
+        ),
+    ]
+    df = crear_df(rutas, directorio=datos, historico=historico)
+    assert len(df) == 5
+    assert list(leer_dataset(datos)["destino"].astype(str)) == ["BCN", "BCN"]
+    assert historico.informe()["tarifas"] == 2
+    historico.cerrar()
+
+
+# Un refresco en segundo plano se guarda sin escribir: la primera vez que se sirve sale como lista normal (para que
+# se escriba en el dataset) y a partir de ahi como acierto
+def test_refresco_pendiente_de_escribir(tmp_path):
+    fichero = str(tmp_path / "rutas.sqlite")
+    clave = CacheRutas.clave("MAD", "BCN", "2025-01-03", "2025-01-10")
+    refrescado = Itinerario.desde_lista(ITINERARIO.a_lista()[:-1] + ["99"])
+
+    cache = CacheRutas(fichero, ttl=0, stale=3600)
+    cache.guardar(clave, [ITINERARIO])
+    viejo = cache.obtener_o_scrapear(clave, lambda: [refrescado])
+    assert isinstance(viejo, ItinerariosCacheados)
+    cache.cerrar()
+
+    cache = CacheRutas(fichero, ttl=3600)
+    nuevo = cache.obtener_o_scrapear(clave, list)
+    assert not isinstance(nuevo, ItinerariosCacheados)
+    assert [i.precio for i in nuevo] == ["99"]
+    assert isinstance(cache.obtener_o_scrapear(clave, list), ItinerariosCacheados)
+    cache.cerrar()
@@ -0,0 +1,61 @@
+import random
+import re
+
+import pytest
+
+import scraper_edreams
+from captura import Cosechador
+from servidor_simulado import html_itinerario
+
+
+def _con_precio(html, precio):
+    return re.sub(r'money-integer">\d+<', f'money-integer">{precio}<', html)
+
+
+# Navegador falso: devuelve las tarjetas pintadas a partir de `desde`, como SCRIPT_ITINERARIOS
+class NavegadorFalso:
+    def __init__(self, tarjetas):
+        self.tarjetas = tarjetas
+
+    def execute_script(self, script, desde):
+        return len(self.tarjetas), "".join(self.tarjetas[desde:])
+
+
+# El mismo vuelo con dos tarifas son dos resultados; una tarjeta repintada igual se descarta
+def test_misma_identidad_otra_tarifa():
+    tarjeta = html_itinerario(random.Random(1), "MAD", "BCN")
+    navegador = NavegadorFalso([_con_precio(tarjeta, 120)])
+    cosechador = Cosechador()
+    assert [i.precio for i in cosechador.cosechar(navegador)] == ["120"]
+
+    navegador.tarjetas += [_con_precio(tarjeta, 95), _con_precio(tarjeta, 120)]
+    cosechador.desde = 0
+    assert [i.precio for i in cosechador.cosechar(navegador)] == ["95"]
+    assert cosechador.mejor_precio == 95
+
+
+def _cosecha_fallida(tarjetas):
+    def cosechar_destino(url, browser, **opciones):
+        yield from tarjetas
+        raise TimeoutError("pagina colgada")
+
+    return cosechar_destino
+
+
+# Cosecha incremental que falla a mitad: datos_destino() devuelve lo ya cosechado
+def test_cosecha_parcial(monkeypatch):
+    monkeypatch.setattr(
+        scraper_edreams, "cosechar_destino", _cosecha_fallida(["a", "b", "c"])
+    )
+    assert scraper_edreams.datos_destino("url", None, incremental=True) == [
+        "a",
+        "b",
+        "c",
+    ]
+
+
+# Si no se llega a cosechar nada, el fallo sube para que la ruta cuente como fallida
+def test_cosecha_fallida_sin_itinerarios(monkeypatch):
+    monkeypatch.setattr(scraper_edreams, "cosechar_destino", _cosecha_fallida([]))
+    with pytest.raises(TimeoutError):
+        scraper_edreams.datos_destino("url", None, incremental=True)
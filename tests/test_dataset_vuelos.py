@@ -0,0 +1,60 @@
+import os
+
+from dataset_vuelos import (
+    borrar_lote,
+    escribir_dataset,
+    ficheros_dataset,
+    leer_dataset,
+)
+
+
+# Particiones por dia de scrapeo, origen y mes de salida: los filtros solo leen los ficheros que les tocan
+def test_poda_de_particiones(df_vuelos, tmp_path):
+    datos = str(tmp_path / "datos")
+    df = df_vuelos([("07:05", 95), ("09:30", 120)])
+    escribir_dataset(df, datos, fecha_scrapeo="2025-01-01")
+    escribir_dataset(df.assign(origen="BCN"), datos, fecha_scrapeo="2025-01-01")
+    escribir_dataset(df, datos, fecha_scrapeo="2025-01-02")
+
+    assert os.path.isdir(
+        os.path.join(
+            datos, "fecha_scrapeo=2025-01-01", "origen=MAD", "mes_salida=2025-01"
+        )
+    )
+    assert len(ficheros_dataset(datos)) == 3
+    assert len(ficheros_dataset(datos, origenes=["BCN"])) == 1
+    assert len(ficheros_dataset(datos, desde="2025-01-02")) == 1
+    assert ficheros_dataset(datos, meses=["2025-02"]) == []
+
+    df_mad = leer_dataset(datos, origenes=["MAD"], hasta="2025-01-01")
+    assert len(df_mad) == 2
+    assert set(df_mad["origen"].astype(str)) == {"MAD"}
+    assert list(leer_dataset(datos, columnas=["precio"]).columns) == ["precio"]
+
+
+# Los ficheros antiguos sin una columna nueva se leen con esa columna nula, y los tipos se amplian
+def test_evolucion_de_esquema(df_vuelos, tmp_path):
+    datos = str(tmp_path / "datos")
+    df = df_vuelos([("07:05", 95)])
+    escribir_dataset(
+        df.drop(columns=["moneda"]).assign(precio=df["precio"].astype("Int16")),
+        datos,
+        fecha_scrapeo="2025-01-01",
+    )
+    escribir_dataset(df.assign(precio=70000), datos, fecha_scrapeo="2025-01-02")
+
+    leido = leer_dataset(datos).sort_values("fecha_scrapeo")
+    assert leido["moneda"].isna().tolist() == [True, False]
+    assert leido["precio"].tolist() == [95, 70000]
+
+
+# Borrar un lote quita solo sus ficheros
+def test_borrar_lote(df_vuelos, tmp_path):
+    datos = str(tmp_path / "datos")
+    df = df_vuelos([("07:05", 95)])
+    escribir_dataset(df, datos, lote="a")
+    escribir_dataset(df.assign(origen="BCN"), datos, lote="b")
+
+    assert borrar_lote(datos, "a") == 1
+    assert borrar_lote(datos, "a") == 0
+    assert list(leer_dataset(datos)["origen"].astype(str)) == ["BCN"]
@@ -0,0 +1,231 @@
+from contextlib import contextmanager
+
+import pytest
+
+import scraper_edreams
+from dataset_vuelos import leer_dataset
+from diario_trabajo import DiarioTrabajo
+from historico_precios import HistoricoPrecios
+from registros import Itinerario, Ruta, unidades_rutas
+from scraper_edreams import deshacer_volcados, volcar_lote
+
+UNIDAD = ("MAD", "2025-01-03", "2025-01-10", "BCN")
+
+
+def _itinerarios(numero, destino="BCN"):
+    return [
+        Itinerario(
+            ["MAD", destino, destino, "MAD"],
+            ["Iberia"],
+            ["07:05", "08:20", "19:40", "20:55"],
+            ["1 h 15 min", "1 h 15 min"],
+            ["directo", "directo"],
+            1,
+            str(100 + i),
+        )
+        for i in range(numero)
+    ]
+
+
+def _ruta(itinerarios, destino="BCN"):
+    return Ruta(
+        f"https://edreams/{destino}", "MAD", destino, UNIDAD[1], UNIDAD[2], itinerarios
+    )
+
+
+@pytest.fixture
+def diario(tmp_path):
+    diario = DiarioTrabajo(str(tmp_path / "diario.sqlite"))
+    diario.planificar(*UNIDAD[:3], [UNIDAD[3]])
+    diario.completar(*UNIDAD, _itinerarios(5))
+    yield diario
+    diario.cerrar()
+
+
+def _reanudar(diario, historico=None):
+    diario.cerrar()
+    reanudado = DiarioTrabajo(diario.fichero, reanudar=True)
+    deshacer_volcados(reanudado, historico)
+    return reanudado
+
+
+def _precios(directorio):
+    return sorted(leer_dataset(str(directorio))["precio"].tolist())
+
+
+# Corte entre la escritura y el apunte: al reanudar se borra lo escrito y la unidad se vuelca entera una sola vez
+def test_corte_antes_de_apuntar_el_volcado(diario, tmp_path):
+    datos = tmp_path / "datos"
+    historico = HistoricoPrecios(str(tmp_path / "historico.sqlite"))
+    volcar_lote([_ruta(_itinerarios(5))], diario, str(datos), historico)
+    assert len(diario.volcados_pendientes()) == 1
+
+    diario = _reanudar(diario, historico)
+    estado, pendientes = diario.estado(*UNIDAD)
+    assert diario.volcados_pendientes() == []
+    assert historico.informe()["tarifas"] == 0
+    assert estado == "scrapeada" and len(pendientes) == 5
+
+    rutas = [_ruta(pendientes)]
+    _, lote = volcar_lote(rutas, diario, str(datos), historico)
+    diario.registrar_volcado(unidades_rutas(rutas), lote=lote)
+
+    assert _precios(datos) == [100, 101, 102, 103, 104]
+    assert historico.informe()["tarifas"] == 5
+    assert diario.estado(*UNIDAD)[0] == "volcada"
+    historico.cerrar()
+
+
+# Unidad repartida en varios lotes: al reanudar solo se vuelcan las filas que faltan
+def test_unidad_repartida_en_lotes(diario, tmp_path):
+    datos = tmp_path / "datos"
+    rutas = [_ruta(_itinerarios(5)[:2])]
+    _, lote = volcar_lote(rutas, diario, str(datos))
+    diario.registrar_volcado(unidades_rutas(rutas), lote=lote)
+    # El segundo lote se escribe pero el proceso se corta antes de apuntarlo
+    volcar_lote([_ruta(_itinerarios(5)[2:4])], diario, str(datos))
+
+    diario = _reanudar(diario)
+    estado, pendientes = diario.estado(*UNIDAD)
+    assert estado == "scrapeada"
+    assert [it.precio for it in pendientes] == ["102", "103", "104"]
+
+    rutas = [_ruta(pendientes)]
+    _, lote = volcar_lote(rutas, diario, str(datos))
+    diario.registrar_volcado(unidades_rutas(rutas), lote=lote)
+
+    assert _precios(datos) == [100, 101, 102, 103, 104]
+    assert diario.estado(*UNIDAD)[0] == "volcada"
+
+
+class _Pool:
+    @contextmanager
+    def sesion(self):
+        yield None
+
+
+# Pipeline con un lote del sumidero fallido a mitad de una unidad: al reanudar no falta ni se repite ninguna fila
+def test_streaming_con_lote_fallido(tmp_path, monkeypatch):
+    datos = str(tmp_path / "datos")
+    fichero = str(tmp_path / "diario.sqlite")
+    monkeypatch.setattr(
+        scraper_edreams,
+        "obtener_posibles_destinos",
+        lambda **kwargs: ["BCN", "LIS"],
+    )
+    monkeypatch.setattr(
+        scraper_edreams,
+        "datos_destino",
+        lambda url, browser, **opciones: _itinerarios(7, url.split("to=")[1][:3]),
+    )
+    crear_df = scraper_edreams.crear_df
+    llamadas = []
+
+    def crear_df_fallido(rutas, **kwargs):
+        llamadas.append(len(llamadas))
+        df = crear_df(rutas, **kwargs)
+        if len(llamadas) == 2:
+            raise OSError("disco lleno")
+        return df
+
+    argumentos = dict(
+        fechas=[{"from": UNIDAD[1], "to": UNIDAD[2]}],
+        origenes=["MAD"],
+        pool=_Pool(),
+        workers=1,
+        tam_lote=3,
+        directorio_datos=datos,
+    )
+    monkeypatch.setattr(scraper_edreams, "crear_df", crear_df_fallido)
+    diario = DiarioTrabajo(fichero)
+    scraper_edreams._scrap_streaming(diario=diario, **argumentos)
+    diario.cerrar()
+
+    monkeypatch.setattr(scraper_edreams, "crear_df", crear_df)
+    diario = DiarioTrabajo(fichero, reanudar=True)
+    deshacer_volcados(diario)
+    scraper_edreams._scrap_streaming(diario=diario, **argumentos)
+
+    df = leer_dataset(datos)
+    assert len(df) == 14
+    assert not df.duplicated(["destino", "precio"]).any()
+    assert diario.informe()["volcada"] == 2
+    diario.cerrar()
+
+
+# Ruta que falla a mitad en streaming: lo ya obtenido se escribe y al reanudar solo se escriben las filas que faltan
+def test_streaming_con_ruta_fallida_a_mitad(tmp_path, monkeypatch):
+    datos = str(tmp_path / "datos")
+    fichero = str(tmp_path / "diario.sqlite")
+    monkeypatch.setattr(
+        scraper_edreams, "obtener_posibles_destinos", lambda **kwargs: ["BCN"]
+    )
+    obtenidos = []
+
+    def cosechar_fallido(url, browser, **opciones):
+        for itinerario in _itinerarios(7):
+            if len(obtenidos) == 4:
+                raise TimeoutError("pagina colgada")
+            obtenidos.append(itinerario)
+            yield itinerario
+
+    argumentos = dict(
+        fechas=[{"from": UNIDAD[1], "to": UNIDAD[2]}],
+        origenes=["MAD"],
+        pool=_Pool(),
+        workers=1,
+        tam_lote=2,
+        directorio_datos=datos,
+        opciones_destino={"incremental": True},
+    )
+    monkeypatch.setattr(scraper_edreams, "cosechar_destino", cosechar_fallido)
+    diario = DiarioTrabajo(fichero)
+    scraper_edreams._scrap_streaming(diario=diario, **argumentos)
+    assert len(leer_dataset(datos)) == 4
+    assert diario.estado(*UNIDAD)[0] == "fallida"
+    diario.cerrar()
+
+    # El reintento obtiene la ruta entera (en otro orden): solo se mandan al dataset las 3 filas que faltaban
+    monkeypatch.setattr(
+        scraper_edreams,
+        "cosechar_destino",
+        lambda url, browser, **opciones: iter(_itinerarios(7)[::-1]),
+    )
+    diario = DiarioTrabajo(fichero, reanudar=True)
+    deshacer_volcados(diario)
+    scraper_edreams._scrap_streaming(diario=diario, **argumentos)
+
+    assert _precios(datos) == list(range(100, 107))
+    assert diario.informe()["volcada"] == 1
+    diario.cerrar()
+
+
+# Sin --journal ni --resume no se crea diario; con --resume se usa el fichero por defecto
+@pytest.mark.parametrize(
+    "opciones, con_diario",
+    [
+        ({}, False),
+        ({"reanudar": True}, True),
+        ({"fichero_diario": "otro.sqlite"}, True),
+    ],
+)
+def test_diario_solo_con_journal_o_resume(tmp_path, monkeypatch, opciones, con_diario):
+    monkeypatch.chdir(tmp_path)
+    recibidos = []
+    monkeypatch.setattr(
+        scraper_edreams,
+        "_scrap",
+        lambda diario, **argumentos: recibidos.append(diario),
+    )
+    scraper_edreams.scrap(
+        fechas=[{"from": UNIDAD[1], "to": UNIDAD[2]}],
+        origenes=["MAD"],
+        ttl_destinos=0,
+        ttl_rutas=0,
+        **opciones,
+    )
+
+    assert (recibidos[0] is not None) == con_diario
+    assert sorted(p.name for p in tmp_path.glob("*.sqlite")) == (
+        [opciones.get("fichero_diario", "diario_trabajo.sqlite")] if con_diario else []
+    )
@@ -0,0 +1,154 @@
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import distribuido
+import scraper_edreams
+from cola_tareas import ClienteCola, ColaTareas, arrancar_cola, es_loopback
+from dataset_vuelos import leer_dataset
+from registros import Itinerario
+from scraper_edreams import deshacer_volcados
+
+ITINERARIO = Itinerario(
+    ["MAD", "BCN", "BCN", "MAD"],
+    ["Iberia"],
+    ["07:05", "08:20", "19:40", "20:55"],
+    ["1 h 15 min", "1 h 15 min"],
+    ["directo", "directo"],
+    1,
+    "123",
+)
+
+
+# Cola con las rutas de MAD a BCN y LIS ya hechas (2 itinerarios cada una), pendientes de volcar
+def _cola_hecha(fichero):
+    cola = ColaTareas(fichero)
+    cola.encolar_pares([("MAD", "2025-01-03", "2025-01-10")])
+    descubrir = cola.arrendar("t1")
+    cola.completar(descubrir["id"], "t1", ["BCN", "LIS"])
+    for _ in range(2):
+        ruta = cola.arrendar("t1")
+        cola.completar(ruta["id"], "t1", [ITINERARIO.a_lista()] * 2)
+    return cola
+
+
+def test_volcar(tmp_path):
+    datos = str(tmp_path / "datos")
+    cola = _cola_hecha(str(tmp_path / "cola.sqlite"))
+
+    assert distribuido.volcar(cola, directorio_datos=datos) == 4
+    assert distribuido.volcar(cola, directorio_datos=datos) == 0
+    assert cola.informe()["ruta"]["volcada"] == 2
+    assert cola.volcados_pendientes() == []
+    assert len(leer_dataset(datos)) == 4
+    cola.cerrar()
+
+
+# Corte del coordinador entre la escritura y el marcado: al reanudar se borra lo escrito y se vuelca una sola vez
+def test_corte_antes_de_marcar_volcadas(tmp_path, monkeypatch):
+    datos = str(tmp_path / "datos")
+    fichero = str(tmp_path / "cola.sqlite")
+    cola = _cola_hecha(fichero)
+
+    def corte(ids, lote=None):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(cola, "marcar_volcadas", corte)
+    try:
+        distribuido.volcar(cola, directorio_datos=datos)
+    except KeyboardInterrupt:
+        pass
+    cola.cerrar()
+    assert len(leer_dataset(datos)) == 4
+
+    cola = ColaTareas(fichero, reanudar=True)
+    deshacer_volcados(cola)
+
+    assert distribuido.volcar(cola, directorio_datos=datos) == 4
+    assert len(leer_dataset(datos)) == 4
+    assert cola.volcados_pendientes() == []
+    cola.cerrar()
+
+
+# Un volcado que falla no tumba al coordinador: se deshace y las rutas se vuelcan en la siguiente vuelta
+def test_coordinador_reintenta_volcado(tmp_path, monkeypatch):
+    datos = str(tmp_path / "datos")
+    fichero = str(tmp_path / "cola.sqlite")
+    _cola_hecha(fichero).cerrar()
+    volcar_lote = scraper_edreams.volcar_lote
+    llamadas = []
+
+    def volcar_lote_fallido(rutas, registro, **kwargs):
+        llamadas.append(len(rutas))
+        if len(llamadas) == 1:
+            volcar_lote(rutas, registro, **kwargs)
+            raise OSError("disco lleno")
+        return volcar_lote(rutas, registro, **kwargs)
+
+    monkeypatch.setattr(scraper_edreams, "volcar_lote", volcar_lote_fallido)
+    informe = distribuido.coordinar(
+        fechas=[{"from": "2025-01-03", "to": "2025-01-10"}],
+        origenes=["MAD"],
+        fichero_cola=fichero,
+        puerto=0,
+        reanudar=True,
+        directorio_datos=datos,
+        intervalo=0,
+    )
+    assert llamadas == [2, 2]
+    assert informe["ruta"]["volcada"] == 2
+    assert len(leer_dataset(datos)) == 4
+
+
+def _post(servidor, operacion, cuerpo, token=None):
+    peticion = urllib.request.Request(
+        f"http://127.0.0.1:{servidor.server_port}/{operacion}", data=cuerpo
+    )
+    if token:
+        peticion.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(peticion) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+# Un cuerpo que no es json (o sin los argumentos de la operacion) es un 400, y sin token un 401
+def test_api_cola_peticiones_erroneas(tmp_path):
+    cola = ColaTareas(str(tmp_path / "cola.sqlite"))
+    servidor = arrancar_cola(cola, token="secreto")
+    try:
+        assert _post(servidor, "arrendar", b"{roto", "secreto") == 400
+        assert _post(servidor, "arrendar", b"[]", "secreto") == 400
+        assert _post(servidor, "latido", b"{}", "secreto") == 400
+        assert _post(servidor, "otra", b"{}", "secreto") == 404
+        assert _post(servidor, "estado", b"{}") == 401
+        assert _post(servidor, "estado", b"{}", "secreto") == 200
+    finally:
+        servidor.shutdown()
+        cola.cerrar()
+
+
+# Fuera de loopback la cola no se sirve sin token
+def test_api_cola_exige_token_fuera_de_loopback(tmp_path):
+    cola = ColaTareas(str(tmp_path / "cola.sqlite"))
+    with pytest.raises(ValueError):
+        arrancar_cola(cola, host="0.0.0.0")
+    assert es_loopback("localhost") and es_loopback("::1")
+    assert not es_loopback("10.0.0.5")
+    cola.cerrar()
+
+
+# Cada hilo del trabajador habla con el coordinador con su propia sesion http
+def test_cliente_cola_sesion_por_hilo():
+    cliente = ClienteCola("http://127.0.0.1:1", token="secreto")
+    sesiones = []
+    hilo = threading.Thread(target=lambda: sesiones.append(cliente._sesion()))
+    hilo.start()
+    hilo.join()
+    assert cliente._sesion() is cliente._sesion()
+    assert cliente._sesion() is not sesiones[0]
+    assert sesiones[0].headers["Authorization"] == "Bearer secreto"
+    cliente.cerrar()
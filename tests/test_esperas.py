@@ -0,0 +1,19 @@
+import pytest
+
+from esperas import MotorEsperas
+
+pytest.importorskip("selenium")
+
+
+# Una espera opcional que nunca se cumple cuesta cada vez la mitad hasta el minimo, y un acierto lo restablece
+def test_timeouts_seguidos_acortan_la_espera():
+    motor = MotorEsperas(timeout=0.8, intervalo=0.01, minimo=0.1)
+    limites = []
+    for _ in range(4):
+        limites.append(motor.timeout_paso("rejilla"))
+        assert motor.esperar(None, "rejilla", lambda b: False, opcional=True) is None
+    assert limites == [0.8, 0.4, 0.2, 0.1]
+
+    assert motor.esperar(None, "rejilla", lambda b: True, opcional=True)
+    assert motor.timeout_paso("rejilla") == 0.1
+    assert motor.informe()[0]["timeouts"] == 4
@@ -0,0 +1,71 @@
+import pandas as pd
+
+from fechas_flexibles import MatrizPrecios, celdas_flexibles, planificar_matrices
+
+
+# Primero las fechas pedidas y despues anillo a anillo hacia fuera, dentro de la estancia
+def test_celdas_por_anillos():
+    celdas = celdas_flexibles("2025-01-03", "2025-01-10", 1)
+    assert len(celdas) == 9
+    assert celdas[0] == ("2025-01-03", "2025-01-10")
+    assert set(celdas[1:5]) == {
+        ("2025-01-02", "2025-01-10"),
+        ("2025-01-04", "2025-01-10"),
+        ("2025-01-03", "2025-01-09"),
+        ("2025-01-03", "2025-01-11"),
+    }
+    assert ("2025-01-02", "2025-01-11") in celdas[5:]
+
+    cortas = celdas_flexibles("2025-01-03", "2025-01-05", 2, estancia_min=2)
+    assert all(
+        (pd.Timestamp(regreso) - pd.Timestamp(salida)).days >= 2
+        for salida, regreso in cortas
+    )
+    assert celdas_flexibles("2025-01-03", "2025-01-10", 1, estancia_max=6) == [
+        ("2025-01-03", "2025-01-09"),
+        ("2025-01-04", "2025-01-10"),
+        ("2025-01-04", "2025-01-09"),
+    ]
+
+
+# Dos rangos cercanos no scrapean dos veces las celdas que comparten
+def test_planificar_sin_repetir_celdas():
+    fechas = [
+        {"from": "2025-01-03", "to": "2025-01-10"},
+        {"from": "2025-01-04", "to": "2025-01-10"},
+    ]
+    (pedido, primeras), (_, segundas) = planificar_matrices(fechas, 1)
+    assert pedido == ("2025-01-03", "2025-01-10")
+    assert len(primeras) == 9 and len(segundas) == 3
+    assert not set(primeras) & set(segundas)
+
+
+# La matriz guarda el minimo de cada celda y el resumen compara la mas barata con las fechas pedidas
+def test_matriz_precios(df_vuelos, tmp_path):
+    matriz = MatrizPrecios(pedidas=[("2025-01-03", "2025-01-10")])
+    matriz.agregar(df_vuelos([("07:05", 95), ("09:30", 120)]))
+    matriz.agregar(df_vuelos([("07:05", 90)]))
+    matriz.agregar(
+        df_vuelos([("07:05", 60)]).assign(fecha_inicio=pd.Timestamp("2025-01-04"))
+    )
+    matriz.agregar(df_vuelos([("07:05", 200)]).assign(destino="LIS"))
+
+    assert matriz.rutas() == [("MAD", "BCN"), ("MAD", "LIS")]
+    tabla = matriz.matriz("MAD", "BCN")
+    assert list(tabla.index) == ["2025-01-03", "2025-01-04"]
+    assert tabla.loc["2025-01-03", "2025-01-10"] == 90
+    assert tabla.loc["2025-01-04", "2025-01-10"] == 60
+
+    resumen = matriz.resumen()
+    assert list(resumen["destino"]) == ["BCN", "LIS"]
+    assert resumen.iloc[0][["salida", "precio", "ahorro", "celdas"]].tolist() == [
+        "2025-01-04",
+        60,
+        30,
+        2,
+    ]
+    assert resumen.iloc[1]["ahorro"] == 0
+
+    assert matriz.guardar(str(tmp_path)) == 2
+    assert (tmp_path / "MAD-BCN.csv").exists()
+    assert MatrizPrecios().resumen().empty
@@ -0,0 +1,45 @@
+import gobernador
+from gobernador import Gobernador
+
+
+# Reloj falso: cada turno dura lo que se le diga, sin esperar de verdad, y carga `paginas` de resultados
+def _turno(gob, reloj, ruta, segundos, paginas=1):
+    with gob.turno(ruta):
+        for _ in range(paginas - 1):
+            gob.pagina()
+        reloj[0] += segundos
+
+
+def test_lentitud_por_ruta(monkeypatch):
+    reloj = [1000.0]
+    monkeypatch.setattr(gobernador, "monotonic", lambda: reloj[0])
+    gob = Gobernador(maximo=8, inicial=4)
+
+    # Una ruta con muchas paginas tarda mucho mas que la media, pero es su latencia normal
+    for _ in range(3):
+        _turno(gob, reloj, "MAD-BCN", 1.0)
+    _turno(gob, reloj, "MAD-NYC", 20.0, paginas=20)
+    _turno(gob, reloj, "MAD-NYC", 22.0, paginas=20)
+    assert gob.stats["lentas"] == 0
+    assert gob.stats["recortes"] == 0
+
+    # Solo es lenta si tarda mucho mas que su propio historial
+    _turno(gob, reloj, "MAD-BCN", 5.0)
+    assert gob.stats["lentas"] == 1
+    assert gob.stats["recortes"] == 1
+
+
+# En un trabajo normal cada ruta pasa una sola vez: se compara con la media por pagina de las demas
+def test_lentitud_sin_historial(monkeypatch):
+    reloj = [1000.0]
+    monkeypatch.setattr(gobernador, "monotonic", lambda: reloj[0])
+    gob = Gobernador(maximo=8, inicial=4)
+
+    for destino in ("BCN", "LIS", "OPO"):
+        _turno(gob, reloj, f"MAD-{destino}", 2.0, paginas=2)
+    _turno(gob, reloj, "MAD-NYC", 10.0, paginas=10)
+    assert gob.stats["lentas"] == 0
+
+    _turno(gob, reloj, "MAD-ROM", 8.0, paginas=2)
+    assert gob.stats["lentas"] == 1
+    assert gob.stats["recortes"] == 1
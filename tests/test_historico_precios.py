@@ -0,0 +1,78 @@
+from datetime import datetime
+from time import time
+
+import pytest
+
+from dataset_vuelos import escribir_dataset
+from historico_precios import HistoricoPrecios
+
+DIA = 24 * 3600
+
+
+@pytest.fixture
+def historico(tmp_path):
+    historico = HistoricoPrecios(str(tmp_path / "historico.sqlite"))
+    yield historico
+    historico.cerrar()
+
+
+# Volver a cargar los mismos dias del dataset (o el mismo volcado) no duplica tarifas
+def test_ingerir_dataset_idempotente(historico, df_vuelos, tmp_path):
+    datos = str(tmp_path / "datos")
+    df = df_vuelos([("07:05", 95), ("09:30", 120), ("18:00", 80)])
+    escribir_dataset(df, datos, fecha_scrapeo="2025-01-01")
+    escribir_dataset(df, datos, fecha_scrapeo="2025-01-02")
+
+    assert historico.ingerir_dataset(datos) == 6
+    assert historico.ingerir_dataset(datos) == 0
+    assert historico.ingerir(df, scrapeo=datetime(2025, 1, 2, 18).timestamp()) == 0
+    assert historico.informe()["tarifas"] == 6
+
+
+# Deshacer un volcado deja la primera vez de cada ruta como la de las tarifas que quedan
+def test_borrar_lote_restaura_primera_vez(historico, df_vuelos):
+    ahora = time()
+    bcn = df_vuelos([("07:05", 95)])
+    historico.ingerir(bcn, scrapeo=ahora - 2 * DIA)
+    historico.ingerir(bcn.assign(precio=90), scrapeo=ahora - 20 * DIA, lote="viejo")
+    historico.ingerir(bcn.assign(destino="LIS"), scrapeo=ahora, lote="nuevo")
+    assert set(historico.rutas_nuevas(dias=7)["destino"]) == {"LIS"}
+
+    assert historico.borrar_lote("viejo") == 1
+    assert historico.borrar_lote("nuevo") == 1
+    assert list(historico.rutas_nuevas(dias=7)["destino"]) == ["BCN"]
+    assert historico.informe()["tarifas"] == 1
+
+
+# Tarifa mas barata por ruta y fechas o por ruta, filtrada por dia de la semana de la salida
+def test_mas_baratas(historico, df_vuelos):
+    historico.ingerir(df_vuelos([("07:05", 95), ("09:30", 80)]))
+    historico.ingerir(df_vuelos([("07:05", 60)]).assign(destino="LIS"))
+
+    baratas = historico.mas_baratas(origen="MAD", agrupar="ruta")
+    assert list(baratas["destino"]) == ["LIS", "BCN"]
+    assert list(baratas["precio"]) == [60, 80]
+    assert list(baratas["observaciones"]) == [1, 2]
+    assert historico.mas_baratas(destino="BCN")["inicio_ida"].tolist() == ["09:30"]
+    # 2025-01-03 es viernes
+    assert len(historico.mas_baratas(dias_semana=[4])) == 2
+    assert historico.mas_baratas(dias_semana=[0]).empty
+    assert len(historico.mas_baratas(limite=1)) == 1
+
+
+# Precio minimo, medio y maximo de cada dia de scrapeo y el cambio del minimo frente al dia anterior
+def test_tendencia(historico, df_vuelos):
+    historico.ingerir(
+        df_vuelos([("07:05", 100), ("09:30", 120)]),
+        scrapeo=datetime(2025, 1, 1, 12).timestamp(),
+    )
+    historico.ingerir(
+        df_vuelos([("07:05", 90)]), scrapeo=datetime(2025, 1, 2, 12).timestamp()
+    )
+
+    tendencia = historico.tendencia("MAD", "BCN", salida="2025-01-03")
+    assert list(tendencia["dia"]) == ["2025-01-01", "2025-01-02"]
+    assert list(tendencia["minimo"]) == [100, 90]
+    assert list(tendencia["media"]) == [110, 90]
+    assert tendencia["cambio"].tolist()[1] == -10
+    assert historico.tendencia("MAD", "LIS").empty
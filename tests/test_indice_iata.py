@@ -0,0 +1,91 @@
+import pytest
+import requests
+
+import indice_iata
+from indice_iata import IndiceIata
+
+CSV = (
+    "country_code,region_name,iata,icao,airport,latitude,longitude\n"
+    "ES,Madrid,MAD,LEMD,Adolfo Suarez Madrid-Barajas Airport,40.47,-3.56\n"
+    "ES,Catalonia,BCN,LEBL,Josep Tarradellas Barcelona-El Prat Airport,41.29,2.07\n"
+)
+
+
+class Respuesta:
+    def __init__(self, status_code, text="", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(self.status_code)
+
+
+# Servidor falso: apunta las cabeceras de cada peticion y responde lo que haya en `respuestas`
+@pytest.fixture
+def servidor(monkeypatch):
+    peticiones = []
+    respuestas = []
+    reloj = [1000.0]
+
+    def get(url, headers=None, timeout=None):
+        peticiones.append(headers)
+        respuesta = respuestas.pop(0)
+        if isinstance(respuesta, Exception):
+            raise respuesta
+        return respuesta
+
+    monkeypatch.setattr(requests, "get", get)
+    monkeypatch.setattr(indice_iata, "time", lambda: reloj[0])
+    return peticiones, respuestas, reloj
+
+
+def test_descarga_y_revalidacion_condicional(servidor, tmp_path):
+    peticiones, respuestas, reloj = servidor
+    fichero = str(tmp_path / "iata.json")
+    indice = IndiceIata(fichero, url="http://iata", intervalo=100)
+    respuestas.append(Respuesta(200, CSV, {"ETag": '"v1"'}))
+
+    assert "mad" in indice and "XXX" not in indice
+    assert [fila[0] for fila in indice.buscar(nombre="barcelona")] == ["BCN"]
+    assert indice.buscar(prefijo="m")[0][1:3] == (
+        "Adolfo Suarez Madrid-Barajas Airport",
+        "ES",
+    )
+    assert peticiones == [{}]
+
+    # Dentro del intervalo no se pregunta; pasado, se revalida aunque el indice ya este en memoria
+    reloj[0] += 50
+    indice.codigos()
+    assert len(peticiones) == 1
+    reloj[0] += 100
+    respuestas.append(Respuesta(304))
+    assert indice.codigos() == {"MAD", "BCN"}
+    assert peticiones[1] == {"If-None-Match": '"v1"'}
+
+    # Otro proceso lee el indice del disco con la fecha de la ultima comprobacion
+    assert IndiceIata(fichero, url="http://iata", intervalo=100).codigos() == {
+        "MAD",
+        "BCN",
+    }
+    assert len(peticiones) == 2
+
+
+# Sin conexion se usa el indice local y no se reintenta en cada consulta; sin indice local es un error
+def test_sin_conexion(servidor, tmp_path):
+    peticiones, respuestas, reloj = servidor
+    fichero = str(tmp_path / "iata.json")
+    indice = IndiceIata(fichero, url="http://iata", intervalo=100)
+    respuestas.append(Respuesta(200, CSV))
+    indice.codigos()
+
+    reloj[0] += 150
+    respuestas.append(requests.ConnectionError("sin red"))
+    assert "BCN" in indice
+    assert "MAD" in indice
+    assert len(peticiones) == 2
+
+    respuestas.append(requests.ConnectionError("sin red"))
+    with pytest.raises(requests.ConnectionError):
+        IndiceIata(str(tmp_path / "otro.json"), url="http://iata").codigos()
@@ -0,0 +1,90 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+import metricas
+from metricas import Metricas, arrancar_servidor_metricas
+
+
+# Reloj falso: cada llamada a perf_counter avanza lo que toque en la lista
+@pytest.fixture
+def reloj(monkeypatch):
+    tiempos = []
+    monkeypatch.setattr(metricas, "perf_counter", lambda: tiempos.pop(0))
+    return tiempos
+
+
+# Tramos anidados en el log JSON, con su padre, sus etiquetas y los errores
+def test_tramos_y_log(reloj, tmp_path):
+    fichero = tmp_path / "metricas.jsonl"
+    m = Metricas()
+    m.configurar(str(fichero))
+    reloj.extend([0.0, 0.1, 0.4, 1.0, 2.0, 2.2])
+    with m.tramo("ruta", destino="BCN"):
+        with m.tramo("ruta.scroll"):
+            pass
+    with pytest.raises(ValueError):
+        with m.tramo("ruta"):
+            raise ValueError
+    m.configurar(None)
+
+    eventos = [json.loads(linea) for linea in fichero.read_text().splitlines()]
+    assert [(e["tramo"], e["padre"], e["ok"]) for e in eventos] == [
+        ("ruta.scroll", "ruta", True),
+        ("ruta", None, True),
+        ("ruta", None, False),
+    ]
+    assert eventos[1]["destino"] == "BCN"
+    ruta, scroll = m.informe()["tramos"]
+    assert (ruta["tramo"], ruta["veces"], ruta["errores"]) == ("ruta", 2, 1)
+    assert ruta["total"] == 1.2 and scroll["maximo"] == 0.3
+
+
+# Histograma acumulado por tramo, errores y contadores con etiquetas escapadas en el formato de Prometheus
+def test_prometheus(reloj):
+    m = Metricas()
+    reloj.extend([0.0, 0.07, 1.0, 4.0])
+    with m.tramo("ruta"):
+        pass
+    with pytest.raises(RuntimeError):
+        with m.tramo("ruta"):
+            raise RuntimeError
+    m.contar("itinerarios_parseados", 25, backend="lxml")
+    m.contar("itinerarios_parseados", 5, backend="lxml")
+    m.contar("avisos", motivo='fila "rara"')
+
+    lineas = m.prometheus().splitlines()
+    assert "# TYPE scraper_tramo_segundos histogram" in lineas
+    assert 'scraper_tramo_segundos_bucket{tramo="ruta",le="0.05"} 0' in lineas
+    assert 'scraper_tramo_segundos_bucket{tramo="ruta",le="0.1"} 1' in lineas
+    assert 'scraper_tramo_segundos_bucket{tramo="ruta",le="2.5"} 1' in lineas
+    assert 'scraper_tramo_segundos_bucket{tramo="ruta",le="5"} 2' in lineas
+    assert 'scraper_tramo_segundos_bucket{tramo="ruta",le="+Inf"} 2' in lineas
+    assert 'scraper_tramo_segundos_sum{tramo="ruta"} 3.070000' in lineas
+    assert 'scraper_tramo_segundos_count{tramo="ruta"} 2' in lineas
+    assert 'scraper_tramo_errores_total{tramo="ruta"} 1' in lineas
+    assert "# TYPE scraper_itinerarios_parseados_total counter" in lineas
+    assert 'scraper_itinerarios_parseados_total{backend="lxml"} 30' in lineas
+    assert 'scraper_avisos_total{motivo="fila \\"rara\\""} 1' in lineas
+
+    m.reiniciar()
+    assert m.informe() == {"tramos": [], "contadores": {}}
+
+
+# El endpoint sirve las metricas en /metrics y nada mas
+def test_servidor_metricas():
+    m = Metricas()
+    m.contar("rutas")
+    servidor = arrancar_servidor_metricas(metricas=m)
+    url = f"http://127.0.0.1:{servidor.server_port}"
+    try:
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert "scraper_rutas_total 1" in response.read().decode("utf-8")
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{url}/otra")
+        assert error.value.code == 404
+    finally:
+        servidor.shutdown()
@@ -0,0 +1,77 @@
+import glob
+import os
+
+import pytest
+
+from benchmarks import parsear_original
+from conftest import DIRECTORIO_FIXTURES
+from parser_itinerarios import BACKENDS, lxml, parsear_itinerarios
+from registros import Itinerario
+
+FICHEROS = sorted(glob.glob(os.path.join(DIRECTORIO_FIXTURES, "resultados_*.html")))
+
+
+def _leer(fichero):
+    with open(fichero, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_hay_paginas_guardadas():
+    assert FICHEROS
+
+
+# Cada backend tiene que devolver exactamente los mismos itinerarios que el parseo original con BeautifulSoup
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+@pytest.mark.parametrize("fichero", FICHEROS, ids=os.path.basename)
+def test_paridad_con_el_parseo_original(backend, fichero):
+    if backend == "lxml" and lxml is None:
+        pytest.skip("lxml no esta instalado")
+    html = _leer(fichero)
+    referencia = [Itinerario.desde_lista(datos) for datos in parsear_original(html)]
+
+    assert referencia
+    assert parsear_itinerarios(html, backend=backend) == referencia
+
+
+# Un itinerario sin precio se ignora (como en el original) y no corta el resto de la pagina
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+def test_itinerario_roto_se_ignora(backend):
+    if backend == "lxml" and lxml is None:
+        pytest.skip("lxml no esta instalado")
+    html = _leer(os.path.join(DIRECTORIO_FIXTURES, "resultados_casos_limite.html"))
+
+    itinerarios = parsear_itinerarios(html, backend=backend)
+
+    assert len(itinerarios) == 2
+    assert [it.precio for it in itinerarios] == [
+        datos[6] for datos in parsear_original(html)
+    ]
+
+
+# El contenedor o un fragmento de itinerarios se parsean igual que la pagina completa (modos de captura)
+def test_fragmento_igual_que_pagina():
+    html = _leer(FICHEROS[0])
+    inicio = html.index('<div id="results_list_container">')
+    fin = html.index("<footer>")
+
+    assert parsear_itinerarios(html[inicio:fin], backend="bs4") == parsear_itinerarios(
+        html, backend="bs4"
+    )
+
+
+# El bloque de duracion y escalas puede ser un span: cuentan sus spans de dentro, no el propio bloque
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+def test_bloque_de_escalas_en_un_span(backend):
+    if backend == "lxml" and lxml is None:
+        pytest.skip("lxml no esta instalado")
+    html = _leer(os.path.join(DIRECTORIO_FIXTURES, "resultados_casos_limite.html"))
+    html = html.replace(
+        "<div><span>2 h 35 min</span><span>1 escala</span></div>",
+        "<span><span>2 h 35 min</span><span>1 escala</span></span>",
+    )
+    referencia = [Itinerario.desde_lista(datos) for datos in parsear_original(html)]
+
+    itinerarios = parsear_itinerarios(html, backend=backend)
+
+    assert itinerarios == referencia
+    assert itinerarios[0].duracion_ida == "2 h 35 min"
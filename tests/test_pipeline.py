@@ -0,0 +1,69 @@
+from pipeline import Pipeline
+
+
+def _descubrir(origen, inicio, fin):
+    for destino in ("BCN", "LIS"):
+        yield {"origen": origen, "destino": destino}
+    # Fallo a mitad del generador: las rutas ya descubiertas se scrapean igual
+    if origen == "MAD":
+        raise RuntimeError("pagina de destinos rota")
+
+
+def _pipeline(sumidero):
+    return Pipeline(
+        descubrir=_descubrir,
+        obtener=lambda ruta: range(3),
+        normalizar=lambda ruta, itinerario: (ruta["destino"], itinerario),
+        sumidero=sumidero,
+        workers=2,
+        tam_lote=2,
+    )
+
+
+# Un descubrir que falla al iterarlo solo pierde ese origen, no el resto del trabajo
+def test_fallo_descubriendo():
+    filas = []
+    pipeline = _pipeline(filas.extend)
+    stats = pipeline.ejecutar([("MAD", "2025-01-03", "2025-01-10"), ("BIO", "a", "b")])
+    assert stats["descubrimientos_fallidos"] == 1
+    assert stats["rutas"] == 4
+    assert len(filas) == 12
+
+
+# Los lotes que falla el sumidero se cuentan y salen en el informe
+def test_fallo_sumidero(capsys):
+    def sumidero(lote):
+        if ("BCN", 0) in lote:
+            raise OSError("disco lleno")
+
+    pipeline = _pipeline(sumidero)
+    stats = pipeline.ejecutar([("BIO", "a", "b")])
+    assert stats["lotes_fallidos"] == 1
+    assert stats["filas_perdidas"] == 2
+    assert stats["filas"] == 4
+
+    pipeline.imprimir_informe()
+    assert "se han perdido 2 filas" in capsys.readouterr().out
+
+
+# Un itinerario que no se puede normalizar se pierde solo, sin parar el sumidero ni bloquear a los workers
+def test_fallo_normalizando():
+    def normalizar(ruta, itinerario):
+        if itinerario == 1:
+            raise ValueError("precio ilegible")
+        return ruta["destino"], itinerario
+
+    filas = []
+    pipeline = Pipeline(
+        descubrir=_descubrir,
+        obtener=lambda ruta: range(3),
+        normalizar=normalizar,
+        sumidero=filas.extend,
+        workers=2,
+        tam_cola=2,
+        tam_lote=2,
+    )
+    stats = pipeline.ejecutar([("BIO", "a", "b"), ("VLC", "a", "b")])
+    assert stats["filas_perdidas"] == 4
+    assert stats["filas"] == len(filas) == 8
+    assert stats["rutas"] == 4
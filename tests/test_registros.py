@@ -0,0 +1,106 @@
+import json
+
+import pandas as pd
+import pytest
+
+from normalizacion import COLUMNAS_DF, MONEDA, df_exportable, normalizar_df
+from registros import Itinerario, Ruta, deserializar, df_rutas, serializar
+
+
+def _itinerario(precio="123", aerolineas=("Iberia",)):
+    return Itinerario(
+        ["MAD", "BCN", "BCN", "MAD"],
+        list(aerolineas),
+        [" 07:05", "08:20", "19:40", "20:55"],
+        ["1 h 15 min", "1 h 15 min"],
+        ["directo", "1 escala"],
+        1,
+        precio,
+    )
+
+
+# Lo guardado con serializar (diario, caches, cola de tareas) vuelve como el mismo itinerario
+def test_serializar_ida_y_vuelta():
+    itinerarios = [_itinerario(), _itinerario("95", ("Vueling", "Iberia"))]
+    recuperados = deserializar(json.loads(json.dumps(itinerarios, default=serializar)))
+    assert recuperados == itinerarios
+    assert recuperados[0].inicio_ida == "07:05"
+    with pytest.raises(TypeError):
+        json.dumps([object()], default=serializar)
+
+
+# Formato antiguo de diarios y caches: la lista de equipajes en vez del 0/1 de equipaje de mano
+def test_deserializar_formato_antiguo():
+    antiguo = _itinerario().a_lista()
+    antiguo[5] = ["Equipaje de mano", "Mochila"]
+    (itinerario,) = deserializar([antiguo + [["123"]]])
+    assert itinerario == _itinerario()
+
+
+# Itinerarios y rutas con __slots__ (sin __dict__), y textos repetidos compartidos entre itinerarios
+def test_slots_y_textos_compartidos():
+    uno, otro = _itinerario(), _itinerario("95")
+    ruta = Ruta("u", "MAD", "BCN", "2025-01-03", "2025-01-10", [uno, otro])
+    for objeto in (uno, ruta):
+        assert not hasattr(objeto, "__dict__")
+        with pytest.raises(AttributeError):
+            objeto.otro_campo = 1
+    assert uno.aeropuertos is otro.aeropuertos
+    assert uno.duracion_ida is otro.duracion_ida
+    assert ruta.unidad == ("MAD", "2025-01-03", "2025-01-10", "BCN")
+
+
+# Una fila por itinerario, en el orden de las rutas, con las columnas de COLUMNAS_DF en su orden
+def test_df_rutas_columnas_y_orden():
+    rutas = [
+        Ruta("u1", "MAD", "BCN", "2025-01-03", "2025-01-10", [_itinerario("1")]),
+        Ruta("u2", "MAD", "LIS", "2025-01-03", "2025-01-10"),
+        Ruta(
+            "u3",
+            "MAD",
+            "OPO",
+            "2025-01-03",
+            "2025-01-10",
+            [_itinerario("2"), _itinerario("3")],
+        ),
+    ]
+    df = df_rutas(rutas)
+    assert list(df.columns) == COLUMNAS_DF
+    assert list(df["url"]) == ["u1", "u3", "u3"]
+    assert list(df["destino"]) == ["BCN", "OPO", "OPO"]
+    assert list(df["precio"]) == ["1", "2", "3"]
+    assert list(df["escala_vuelta"]) == ["1 escala"] * 3
+    assert df["pasajeros"].eq(1).all() and df["equipaje_bodega"].eq(0).all()
+    assert df["clase"].isna().all()
+    assert df_rutas([]).empty
+
+
+# Del registro al df tipado: horas como timedelta, escalas y duraciones numericas y la moneda junto al precio
+def test_df_rutas_normalizado():
+    raro = _itinerario("1.234")
+    raro.fin_vuelta = "--:--"
+    rutas = [Ruta("u", "MAD", "BCN", "2025-01-03", "2025-01-10", [_itinerario(), raro])]
+    df = normalizar_df(df_rutas(rutas))
+
+    assert list(df.columns) == COLUMNAS_DF[:18] + ["moneda", "clase"]
+    assert pd.api.types.is_timedelta64_dtype(df["inicio_ida"])
+    assert df["inicio_ida"].tolist() == [pd.Timedelta(hours=7, minutes=5)] * 2
+    assert df["fin_vuelta"].isna().tolist() == [False, True]
+    assert df["precio"].dtype == "Int32" and df["precio"].tolist() == [123, 1234]
+    assert isinstance(df["moneda"].dtype, pd.CategoricalDtype)
+    assert df["moneda"].tolist() == [MONEDA] * 2
+    assert df["escala_ida"].tolist() == [0, 0] and df["escala_vuelta"].tolist() == [
+        1,
+        1,
+    ]
+    assert df["duracion_ida"].dtype == "Int16" and df["duracion_ida"].tolist() == [
+        75,
+        75,
+    ]
+    assert pd.api.types.is_datetime64_dtype(df["fecha_inicio"])
+
+    exportado = df_exportable(df).iloc[1]
+    assert exportado["inicio_ida"] == "07:05" and exportado["fin_vuelta"] is None
+    assert exportado["duracion_ida"] == "1h 15m"
+    assert exportado["fecha_inicio"] == "2025-01-03"
+    assert exportado["aerolineas"] == ["Iberia"]
@@ -0,0 +1,62 @@
+import scraper_edreams
+from sincronizacion import SincronizadorDelta
+
+
+class SubidorFalso:
+    def __init__(self, fallar=False):
+        self.fallar = fallar
+        self.registros = []
+
+    def subir(self, df):
+        return 0 if self.fallar else len(df)
+
+    def subir_registros(self, registros):
+        self.registros.extend(registros)
+        return 0 if self.fallar else len(registros)
+
+
+# Mismo vuelo con dos tarifas en un scrapeo: se queda la mas barata y no hay cambios falsos en la siguiente ejecucion
+def test_tarifas_repetidas(tmp_path, df_vuelos):
+    fichero = str(tmp_path / "indice.json")
+    delta = SincronizadorDelta(fichero)
+    enviado = delta.filtrar(df_vuelos([("07:05", 120), ("07:05", 95), ("09:00", 80)]))
+    assert sorted(enviado["precio"]) == [80, 95]
+    assert delta.stats["duplicados"] == 1
+    assert delta.cerrar() == []
+    delta.guardar()
+
+    delta = SincronizadorDelta(fichero)
+    assert delta.filtrar(
+        df_vuelos([("07:05", 95), ("07:05", 120), ("09:00", 80)])
+    ).empty
+    # Repetido en otro lote del mismo scrapeo: solo cuenta si baja el precio
+    assert delta.filtrar(df_vuelos([("07:05", 130)])).empty
+    assert delta.stats["cambiados"] == 0
+    assert list(delta.filtrar(df_vuelos([("07:05", 90)]))["estado"]) == ["cambiado"]
+    assert [r["fields"]["estado"] for r in delta.cerrar()] == ["sustituido"]
+
+
+# Un fallo de airtable solo afecta a su lote: lo fallido se reenvia y el indice se sigue guardando
+def test_fallos_por_lote(tmp_path, df_vuelos):
+    fichero = str(tmp_path / "indice.json")
+    delta = SincronizadorDelta(fichero)
+    scraper_edreams.enviar_df(
+        df_vuelos([("07:05", 95)]), SubidorFalso(fallar=True), delta
+    )
+    scraper_edreams.cerrar_delta(SubidorFalso(), delta)
+
+    delta = SincronizadorDelta(fichero)
+    assert list(delta.filtrar(df_vuelos([("07:05", 95)]))["estado"]) == ["nuevo"]
+    scraper_edreams.cerrar_delta(SubidorFalso(), delta)
+
+    # Cierre fallido: el desaparecido vuelve al indice y se envia en el siguiente cierre
+    delta = SincronizadorDelta(fichero)
+    delta.filtrar(df_vuelos([("09:00", 80)]))
+    subidor = SubidorFalso(fallar=True)
+    scraper_edreams.cerrar_delta(subidor, delta)
+    assert [r["fields"]["estado"] for r in subidor.registros] == ["desaparecido"]
+    delta.filtrar(df_vuelos([("09:00", 80)]))
+    subidor = SubidorFalso()
+    scraper_edreams.cerrar_delta(subidor, delta)
+    assert [r["fields"]["estado"] for r in subidor.registros] == ["desaparecido"]
+    assert SincronizadorDelta(fichero).filtrar(df_vuelos([("09:00", 80)])).empty
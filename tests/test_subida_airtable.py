@@ -0,0 +1,89 @@
+import time
+
+import subida_airtable
+from servidor_simulado import arrancar_airtable
+from subida_airtable import (
+    CAMPO_CLAVE,
+    CAMPOS_AIRTABLE,
+    SubidorAirtable,
+    registros_airtable,
+)
+
+
+# Sin upsert solo van los campos de la tabla original; con upsert se anaden la clave y el estado del delta
+def test_campos_enviados(df_vuelos):
+    df = df_vuelos([("07:05", 95)])
+    (registro,) = registros_airtable(df)
+    assert list(registro["fields"]) == CAMPOS_AIRTABLE
+
+    (registro,) = registros_airtable(df.assign(estado="nuevo"), upsert=True)
+    assert list(registro["fields"]) == CAMPOS_AIRTABLE + ["estado", CAMPO_CLAVE]
+    assert registro["fields"][CAMPO_CLAVE] == (
+        "https://www.edreams.es/x|07:05|08:20|19:40|20:55|95"
+    )
+
+
+def _subidor(servidor, **kwargs):
+    base_url = f"http://127.0.0.1:{servidor.server_port}/v0"
+    return SubidorAirtable(base_url, "base", "tabla", "clave", **kwargs)
+
+
+def _tabla(servidor):
+    return servidor.RequestHandlerClass.tablas.get("/v0/base/tabla", {})
+
+
+# Por defecto se hace upsert: subir dos veces las mismas filas actualiza los registros en vez de duplicarlos
+def test_upsert_sin_duplicados(df_vuelos):
+    servidor = arrancar_airtable(limite=1000)
+    df = df_vuelos([(f"{h:02d}:05", 50 + h) for h in range(6, 21)])
+    subidor = _subidor(servidor, tasa=1000)
+    try:
+        assert subidor.subir(df) == 15
+        assert subidor.subir(df) == 15
+    finally:
+        subidor.cerrar()
+        servidor.shutdown()
+    assert len(_tabla(servidor)) == 15
+    assert subidor.stats["creados"] == 15
+    assert subidor.stats["actualizados"] == 15
+
+
+# Sin upsert (tablas sin el campo clave) se dan de alta registros sin la clave, y una segunda subida los duplica
+def test_sin_upsert(df_vuelos):
+    servidor = arrancar_airtable(limite=1000)
+    df = df_vuelos([(f"{h:02d}:05", 50 + h) for h in range(6, 11)])
+    subidor = _subidor(servidor, upsert=False, tasa=1000)
+    try:
+        assert subidor.subir(df) == 5
+        assert subidor.subir(df) == 5
+    finally:
+        subidor.cerrar()
+        servidor.shutdown()
+    registros = list(_tabla(servidor).values())
+    assert len(registros) == 10
+    assert all(CAMPO_CLAVE not in registro["fields"] for registro in registros)
+    assert subidor.stats["creados"] == 10
+
+
+# Por encima del limite airtable responde 429: se espera lo que pide Retry-After y no se pierde ningun lote
+def test_429_respeta_retry_after(df_vuelos, monkeypatch):
+    esperas = []
+
+    def sleep(segundos):
+        esperas.append(segundos)
+        time.sleep(segundos)
+
+    monkeypatch.setattr(subida_airtable, "sleep", sleep)
+    servidor = arrancar_airtable(limite=1, retry_after=1)
+    df = df_vuelos([(f"{h:02d}:05", 50 + h) for h in range(6, 21)] * 2)
+    subidor = _subidor(servidor, upsert=True, tasa=100, en_vuelo=2, espera_base=10)
+    try:
+        assert subidor.subir(df) == 30
+    finally:
+        subidor.cerrar()
+        servidor.shutdown()
+    assert servidor.RequestHandlerClass.contadores["rechazadas"] > 0
+    assert subidor.stats["reintentos"] > 0
+    assert subidor.stats["fallidos"] == 0
+    # Sin Retry-After el backoff habria esperado 5 segundos o mas
+    assert 1 in esperas and max(esperas) <= 1